@@ -8,13 +8,33 @@ import numpy as np
 import datetime
 import os
 import time
+import threading
+from functools import wraps
 from apsis.utilities.logging_utils import get_logger
-from apsis.utilities.plot_utils import plot_lists, write_plot_to_file
-import matplotlib.pyplot as plt
+from apsis.utilities import metrics
+from apsis.utilities import profiling
 import json
 
 AVAILABLE_STATUS = ["finished", "pausing", "working"]
 
+_write_seconds = metrics.histogram(
+    "apsis_state_write_seconds",
+    "Duration of writing the state of an assistant to file.", ["assistant"])
+_write_bytes_total = metrics.counter(
+    "apsis_state_write_bytes_total",
+    "Number of bytes written when persisting assistants.", ["assistant"])
+
+
+def synchronized(func):
+    """
+    Wraps a method of ExperimentAssistant to hold the assistant's lock.
+    """
+    @wraps(func)
+    def locked(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return locked
+
 
 class ExperimentAssistant(object):
     """
@@ -25,6 +45,11 @@ class ExperimentAssistant(object):
     minimized) and an optimizer for optimizing the experiment.
     It also contains functions for writing out results and for plotting.
 
+    All public functions are thread-safe. They are serialized by a lock per
+    experiment assistant, so different experiments can be worked on in
+    parallel. The optimizer only ever receives snapshots of the experiment,
+    so it never reads the candidate lists while they are being modified.
+
     Parameters
     ----------
     _optimizer : Optimizer
@@ -38,6 +63,15 @@ class ExperimentAssistant(object):
         Directory containing the checkpoints.
     _logger : logger
         The logger instance for this class.
+    _lock : threading.RLock
+        The lock serializing all accesses to this experiment assistant.
+    _profiler : Profiler or None
+        The profiler profiling the optimizer's and this assistant's expensive
+        calls, or None if profiling is disabled.
+    _profiling_hooks : list
+        The hooks installed for _profiler, see profiling.install_hooks.
+    _last_checkpoint : dict or None
+        The optimizer checkpoint last written to optimizer_checkpoint.json.
     """
 
     _optimizer = None
@@ -47,10 +81,16 @@ class ExperimentAssistant(object):
     _write_dir = None
 
     _logger = None
+    _lock = None
+
+    _profiler = None
+    _profiling_hooks = None
+
+    _last_checkpoint = None
 
     def __init__(self, optimizer_class, experiment,
                  optimizer_arguments=None,
-                 write_dir=None):
+                 write_dir=None, optimizer_checkpoint=None):
         """
         Initializes this experiment assistant.
 
@@ -69,30 +109,50 @@ class ExperimentAssistant(object):
             written to. If this is None (default), no state will be written.
         optimizer_arguments : dict, optional
             The dictionary of optimizer arguments. If None, default values will
-            be used.
+            be used. The argument "profiling" enables profiling (see
+            set_profiling) with the parameters "profiling_params".
+        optimizer_checkpoint : dict, optional
+            A checkpoint of the optimizer, as written to
+            optimizer_checkpoint.json. Restoring it avoids refitting the
+            optimizer's models after a restart.
         """
         self._logger = get_logger(self, extra_info="exp_id: " +
                                                    str(experiment.exp_id))
         self._logger.info("Initializing experiment assistant.")
+        self._lock = threading.RLock()
         self._optimizer = optimizer_class
         self._optimizer_arguments = optimizer_arguments
         self._write_dir = write_dir
         self._experiment = experiment
-        self._init_optimizer()
+        self._last_checkpoint = optimizer_checkpoint
+        self._init_optimizer(optimizer_checkpoint)
+        self._profiling_hooks = []
+        if optimizer_arguments:
+            self.set_profiling(optimizer_arguments.get("profiling", None),
+                               optimizer_arguments.get("profiling_params",
+                                                       None))
         self._write_state_to_file()
         self._logger.info("Experiment assistant successfully initialized.")
 
-    def _init_optimizer(self):
+    def _init_optimizer(self, checkpoint=None):
         """
         Initializes the optimizer if it does not exist.
+
+        Parameters
+        ----------
+        checkpoint : dict, optional
+            The checkpoint to restore the optimizer from.
         """
         self._logger.debug("Initializing optimizer. Current state is %s"
                            %self._optimizer)
-        self._optimizer= check_optimizer(self._optimizer, self._experiment,
-            optimizer_arguments=self._optimizer_arguments)
+        self._optimizer= check_optimizer(self._optimizer,
+            self._experiment.snapshot(),
+            optimizer_arguments=self._optimizer_arguments,
+            checkpoint=checkpoint)
         self._logger.debug("Initialized optimizer. State afterwards is %s"
                            %self._optimizer)
 
+    @synchronized
     def get_next_candidate(self):
         """
         Returns the Candidate next to evaluate.
@@ -128,23 +188,33 @@ class ExperimentAssistant(object):
         self._write_state_to_file()
         return to_return
 
-    def get_experiment_as_dict(self):
+    @synchronized
+    def get_experiment_as_dict(self, since=None, limit=None):
         """
         Returns the dictionary describing this EAss' experiment.
 
         Signature is equivalent to Experiment.to_dict()
 
+        Parameters
+        ----------
+        since : int or None, optional
+            If given, only candidates changed after this update sequence
+            number are returned.
+        limit : int or None, optional
+            The maximum number of candidates returned.
+
         Returns
         -------
             exp_dict : dict
                 The experiment dictionary.
         """
         self._logger.debug("Returning experiment as dict.")
-        exp_dict = self._experiment.to_dict()
+        exp_dict = self._experiment.to_dict(since=since, limit=limit)
         self._logger.log(5, "Exp_dict is %s" %exp_dict)
         return exp_dict
 
-    def update(self, candidate, status="finished"):
+    @synchronized
+    def update(self, candidate, status="finished", intermediate_results=None):
         """
         Updates the experiment_assistant with the status of an experiment
         evaluation.
@@ -159,7 +229,16 @@ class ExperimentAssistant(object):
             - pausing: The evaluation of Candidate has been paused and can be
                 resumed by another worker.
             - working: The Candidate is now being worked on by a worker.
+        intermediate_results : list of (step, value) tuples, optional
+            Intermediate results of the evaluation, for example one per
+            training epoch. See Experiment.add_intermediate_results.
 
+        Returns
+        -------
+        stop : bool
+            True iff the status is working and the optimizer decided that
+            the evaluation of candidate should be stopped early. The worker
+            should then report it as finished with its current result.
         """
         self._logger.debug("Updating experiment assistant with candidate %s,"
                            "status %s" %(candidate, status))
@@ -179,19 +258,28 @@ class ExperimentAssistant(object):
                          " and result %s", status, candidate, candidate.params,
                           candidate.result)
 
+        stop = False
         if status == "finished":
             if (candidate.result is None or not np.isfinite(candidate.result)):
                 candidate.failed = True
             self._experiment.add_finished(candidate)
-            self._logger.debug("Was finished, updating optimizer.")
-            # And we rebuild the new optimizer.
-            self._optimizer.update(self._experiment)
-            self._logger.debug("Optimizer updated.")
         elif status == "pausing":
             self._experiment.add_pausing(candidate)
         elif status == "working":
             self._experiment.add_working(candidate)
+        if intermediate_results:
+            self._experiment.add_intermediate_results(candidate,
+                                                      intermediate_results)
+        if status == "finished":
+            self._logger.debug("Was finished, updating optimizer.")
+            # And we rebuild the new optimizer.
+            self._optimizer.update(self._experiment.snapshot())
+            self._logger.debug("Optimizer updated.")
+        elif status == "working" and intermediate_results:
+            stop = self._optimizer.should_stop(candidate, self._experiment)
+            self._logger.debug("Optimizer decided to stop: %s", stop)
         self._write_state_to_file()
+        return stop
 
     def _write_state_to_file(self):
         """
@@ -200,16 +288,22 @@ class ExperimentAssistant(object):
         When this is called, it collects the state of this experiment assistant
         - that is, optimizer_class, optimizer_arguments and write_dir - and
         writes them to file. It also forces _experiment to write its state to
-        file.
+        file, and writes the optimizer's checkpoint to
+        optimizer_checkpoint.json if it has changed.
         All of this only happens if _write_dir is not None - if it is, we will
         do nothing.
+
+        Returns
+        -------
+        num_bytes : int
+            The number of bytes written.
         """
         self._logger.debug("Writing experiment assistant status to file %s",
                            self._write_dir)
         if self._write_dir is None:
             self._logger.debug("No write directory is set; not writing "
                                "anything.")
-            return
+            return 0
         state = {}
         opt = self._optimizer
         if not isinstance(opt, basestring):
@@ -217,11 +311,94 @@ class ExperimentAssistant(object):
         state["optimizer_class"] = opt
         state["optimizer_arguments"] = self._optimizer_arguments
         state["write_dir"] = self._write_dir
-        with open(self._write_dir + '/exp_assistant.json', 'w') as outfile:
-            json.dump(state, outfile)
-        self._logger.debug("Writing state %s", state)
-        self._experiment.write_state_to_file(self._write_dir)
+        with _write_seconds.time(assistant="experiment"):
+            with open(self._write_dir + '/exp_assistant.json', 'w') as outfile:
+                json.dump(state, outfile)
+                num_bytes = outfile.tell()
+            self._logger.debug("Writing state %s", state)
+            num_bytes += self._experiment.write_state_to_file(self._write_dir)
+            num_bytes += self._write_optimizer_checkpoint()
+        _write_bytes_total.inc(num_bytes, assistant="experiment")
+        return num_bytes
+
+    def _write_optimizer_checkpoint(self):
+        """
+        Writes the optimizer's checkpoint, unless it is unchanged.
+
+        Returns
+        -------
+        num_bytes : int
+            The number of bytes written.
+        """
+        checkpoint = self._optimizer.get_checkpoint()
+        if checkpoint is None or checkpoint == self._last_checkpoint:
+            return 0
+        self._logger.debug("Writing optimizer checkpoint.")
+        with open(self._write_dir + '/optimizer_checkpoint.json',
+                  'w') as outfile:
+            json.dump(checkpoint, outfile)
+            num_bytes = outfile.tell()
+        self._last_checkpoint = checkpoint
+        return num_bytes
+
+    @synchronized
+    def set_profiling(self, profiler, profiler_params=None):
+        """
+        Enables, replaces or disables profiling of this experiment.
+
+        Profiled are the calls of profiling.HOOK_POINTS, that is the
+        optimizer's update and get_next_candidates, the acquisition
+        function's compute_proposals and writing the state to file. The
+        profiles of the slowest calls are written to write_dir/profiles.
 
+        Parameters
+        ----------
+        profiler : string, Profiler or None
+            The profiler, for example "cprofile" or "sampling" (see
+            profiling.AVAILABLE_PROFILERS). If None, profiling is disabled.
+        profiler_params : dict, optional
+            The parameters of the profiler.
+
+        Raises
+        ------
+        ValueError
+            If profiler is no valid profiler.
+        """
+        self._logger.debug("Setting profiler to %s with params %s", profiler,
+                           profiler_params)
+        directory = None
+        if self._write_dir is not None:
+            directory = os.path.join(self._write_dir, "profiles")
+        new_profiler = profiling.check_profiler(profiler, profiler_params,
+                                                directory)
+        profiling.remove_hooks(self._profiling_hooks)
+        self._profiling_hooks = []
+        self._profiler = new_profiler
+        if self._profiler is not None:
+            self._profiling_hooks = profiling.install_hooks(self,
+                                                            self._profiler)
+        self._logger.debug("Installed %s profiling hooks.",
+                           len(self._profiling_hooks))
+
+    @synchronized
+    def get_profiling(self):
+        """
+        Returns the profiling state of this experiment.
+
+        Returns
+        -------
+        state : dict
+            A dict with the keys profiler (the profiler's class name, or None
+            if profiling is disabled), params and slowest_calls (see
+            Profiler.slowest_calls).
+        """
+        if self._profiler is None:
+            return {"profiler": None, "params": None, "slowest_calls": []}
+        return {"profiler": self._profiler.__class__.__name__,
+                "params": self._profiler.params,
+                "slowest_calls": self._profiler.slowest_calls()}
+
+    @synchronized
     def get_best_candidate(self):
         """
         Returns the best candidate to date.
@@ -237,6 +414,25 @@ class ExperimentAssistant(object):
         self._logger.debug("Best candidate is %s", best_candidate)
         return best_candidate
 
+    @synchronized
+    def get_version(self):
+        """
+        Returns the current version of the experiment.
+
+        The version changes whenever any candidate of the experiment changes,
+        so any view computed from the experiment can be reused as long as the
+        version stays the same.
+
+        Returns
+        -------
+        update_sequence : int
+            The update sequence number of the experiment.
+        last_update_time : float
+            The time of the last update of the experiment.
+        """
+        return (self._experiment.update_sequence,
+                self._experiment.last_update_time)
+
     def _best_result_per_step_dicts(self, color="b", plot_up_to=None,
                                     cutoff_percentage=1.,
                                     non_finished_color="g"):
@@ -313,7 +509,8 @@ class ExperimentAssistant(object):
             x.append(i)
             if not e.failed:
                 step_evaluation.append(e.result)
-                if self._experiment.better_cand(e, best_candidate):
+                if self._experiment.better_cand(e, best_candidate,
+                                                validate=False):
                     best_candidate = e
                     step_best.append(e.result)
                 else:
@@ -344,23 +541,45 @@ class ExperimentAssistant(object):
         return x, step_evaluation, step_best, \
                non_finished_xs, non_finished_evals
 
-    def get_candidates(self):
+    @synchronized
+    def get_candidates(self, since=None, limit=None):
         """
         Returns the candidates of this experiment in a dict.
 
+        Parameters
+        ----------
+        since : int or None, optional
+            If given, only candidates changed after this update sequence
+            number are returned. See Experiment.get_candidates_since.
+        limit : int or None, optional
+            The maximum number of candidates returned over all three lists.
+
         Returns
         -------
         result : dict
             A dictionary of three lists with the keys finished, pending and
             working, with the corresponding candidates.
+            If since or limit are given, it additionally contains the keys
+            cursor (the update sequence number to use as since for the next
+            call) and has_more (whether more changed candidates exist).
         """
-        self._logger.debug("Returning candidates of exp_ass.")
-        result = {"finished": self._experiment.candidates_finished,
-                  "pending": self._experiment.candidates_pending,
-                  "working": self._experiment.candidates_working}
+        self._logger.debug("Returning candidates of exp_ass. since %s, "
+                           "limit %s", since, limit)
+        if since is None and limit is None:
+            result = {"finished": list(self._experiment.candidates_finished),
+                      "pending": list(self._experiment.candidates_pending),
+                      "working": list(self._experiment.candidates_working)}
+        else:
+            changes, cursor, has_more = \
+                self._experiment.get_candidates_since(since, limit)
+            result = {"finished": [], "pending": [], "working": [],
+                      "cursor": cursor, "has_more": has_more}
+            for sequence, status, cand in changes:
+                result[status].append(cand)
         self._logger.debug("Candidates are %s", result)
         return result
 
+    @synchronized
     def plot_result_per_step(self, ax=None, color="b",
                              plot_min=None, plot_max=None):
         """
@@ -384,6 +603,40 @@ class ExperimentAssistant(object):
         self._logger.debug("Plotting result per step. ax %s, colors %s, "
                            "plot_min %s, plot_max %s", ax, color, plot_min,
                            plot_max)
+        # Imported here, since matplotlib takes long to import and is not
+        # needed unless plotting.
+        from apsis.utilities.plot_utils import plot_lists
+        plot_args = self.get_plot_args_result_per_step(color, plot_min,
+                                                       plot_max)
+        fig, ax = plot_lists(ax=ax, **plot_args)
+
+        return fig
+
+    @synchronized
+    def get_plot_args_result_per_step(self, color="b", plot_min=None,
+                                      plot_max=None):
+        """
+        Returns the arguments for plotting the results over the steps.
+
+        The arguments only consist of lists, strings and numbers. They can
+        therefore be passed to another process and plotted there, for example
+        via plot_utils.render_plot_png.
+
+        Parameters
+        ----------
+        color : string, optional
+            A string representing a pyplot color.
+        plot_min : float, optional
+            The smallest value to plot on the y axis.
+        plot_max : float, optional
+            The biggest value to plot on the y axis.
+
+        Returns
+        -------
+        plot_args : dict
+            The keyword arguments for plot_utils.plot_lists, that is
+            to_plot_list, fig_options, plot_min and plot_max.
+        """
         plots = self._best_result_per_step_dicts(color, cutoff_percentage=0.5)
         if self._experiment.minimization_problem:
             legend_loc = 'upper right'
@@ -399,11 +652,12 @@ class ExperimentAssistant(object):
             "minimizing": self._experiment.minimization_problem
         }
         self._logger.debug("Plot options are %s", plot_options)
-        fig, ax = plot_lists(plots, ax=ax, fig_options=plot_options,
-                             plot_min=plot_min, plot_max=plot_max)
-
-        return fig
+        return {"to_plot_list": plots,
+                "fig_options": plot_options,
+                "plot_min": plot_min,
+                "plot_max": plot_max}
 
+    @synchronized
     def set_exit(self):
         """
         Exits this assistant.
@@ -4,9 +4,12 @@ import json
 import os
 import time
 import uuid
+import threading
 
 import apsis.models.experiment as experiment
-from apsis.assistants.experiment_assistant import ExperimentAssistant
+from apsis_client.sharding import ConsistentHashRing
+from apsis.assistants.experiment_assistant import ExperimentAssistant, \
+    _write_seconds, _write_bytes_total
 from apsis.utilities.file_utils import ensure_directory_exists
 from apsis.utilities.logging_utils import get_logger
 
@@ -20,6 +23,18 @@ class LabAssistant(object):
 
     This is done by abstracting a dict of named experiment assistants.
 
+    The lab assistant is thread-safe. Its own lock is only held while the dict
+    of experiment assistants or the lab assistant's state file is changed;
+    everything concerning a single experiment is synchronized by that
+    experiment's assistant. Requests for different experiments therefore run
+    in parallel.
+
+    Several lab assistants, usually in different server processes, can share
+    the experiments as shards. Each experiment is owned by exactly one shard,
+    determined by consistent hashing of its exp_id (see
+    apsis_client.sharding). The shards can share the same write_dir; each
+    writes its state to its own lab_assistant_shard_<shard_index>.json.
+
     Attributes
     ----------
     _exp_assistants : dict of ExperimentAssistants.
@@ -28,6 +43,12 @@ class LabAssistant(object):
         The directory to write all the results and plots to.
     _logger : logging.logger
         The logger for this class.
+    _lock : threading.RLock
+        Synchronizes changes to _exp_assistants and the state file.
+    _shard_index : int or None
+        The index of this shard, or None if not sharded.
+    _num_shards : int or None
+        The total number of shards, or None if not sharded.
     """
     _exp_assistants = None
 
@@ -35,8 +56,13 @@ class LabAssistant(object):
 
     _global_start_date = None
     _logger = None
+    _lock = None
+
+    _shard_index = None
+    _num_shards = None
+    _shard_ring = None
 
-    def __init__(self, write_dir=None):
+    def __init__(self, write_dir=None, shard_index=None, num_shards=None):
         """
         Initializes the lab assistant.
 
@@ -45,42 +71,110 @@ class LabAssistant(object):
         write_dir: string, optional
             Sets the write directory for the lab assistant. If None (default),
             nothing will be written.
+        shard_index : int, optional
+            The index of this shard, between 0 and num_shards-1. If None
+            (default), this lab assistant owns all experiments.
+        num_shards : int, optional
+            The total number of shards. Has to be given iff shard_index is.
+
+        Raises
+        ------
+        ValueError :
+            Iff only one of shard_index and num_shards is given, or
+            shard_index is not between 0 and num_shards-1.
         """
         self._logger = get_logger(self)
         self._logger.info("Initializing lab assistant.")
         self._logger.info("\tWriting results to %s" %write_dir)
         self._write_dir = write_dir
+        self._lock = threading.RLock()
+
+        if (shard_index is None) != (num_shards is None):
+            raise ValueError("Either both or none of shard_index and "
+                             "num_shards have to be given. They are %s and %s"
+                             %(shard_index, num_shards))
+        if shard_index is not None:
+            if not 0 <= shard_index < num_shards:
+                raise ValueError("shard_index has to be between 0 and "
+                                 "num_shards-1, is %s (num_shards %s)."
+                                 %(shard_index, num_shards))
+            self._shard_ring = ConsistentHashRing(range(num_shards))
+            self._logger.info("\tRunning as shard %s of %s."
+                              %(shard_index, num_shards))
+        self._shard_index = shard_index
+        self._num_shards = num_shards
 
         self._exp_assistants = {}
 
-        reloading_possible = True
-        try:
-            if self._write_dir:
-                with open(self._write_dir + "/lab_assistant.json", "r"):
-                    pass
-            else:
-                self._logger.debug("\tReloading impossible due to no "
-                                   "_write_dir specified.")
-                reloading_possible = False
-        except IOError:
-            self._logger.debug("\tReloading impossible due to IOError - "
-                               "probably no lab_assistant existing.")
-            reloading_possible = False
-
-        if not reloading_possible:
+        lab_assistant_jsons = []
+        if self._write_dir and os.path.isdir(self._write_dir):
+            for f in sorted(os.listdir(self._write_dir)):
+                if not self._is_state_file(f):
+                    continue
+                with open(os.path.join(self._write_dir, f), 'r') as infile:
+                    lab_assistant_jsons.append(json.load(infile))
+        else:
+            self._logger.debug("\tReloading impossible due to no "
+                               "_write_dir specified.")
+
+        if not lab_assistant_jsons:
+            self._logger.debug("\tNo lab_assistant to reload existing.")
             self._global_start_date = time.time()
         else:
-            # set the correct path.
-            with open(self._write_dir + "/lab_assistant.json", 'r') as infile:
-                lab_assistant_json = json.load(infile)
-            self._global_start_date = lab_assistant_json["global_start_date"]
-            for p in lab_assistant_json["exp_assistants"].values():
-                self._load_exp_assistant_from_path(p)
+            self._global_start_date = min(
+                [l["global_start_date"] for l in lab_assistant_jsons])
+            for lab_assistant_json in lab_assistant_jsons:
+                for exp_id, p in lab_assistant_json["exp_assistants"].items():
+                    if self.owns(exp_id) and exp_id not in \
+                            self._exp_assistants:
+                        self._load_exp_assistant_from_path(p)
             self._logger.debug("\tReloaded all exp_assistants.")
 
         self._write_state_to_file()
         self._logger.info("lab assistant successfully initialized.")
 
+    def owns(self, exp_id):
+        """
+        Returns whether this lab assistant is the shard owning exp_id.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        owns : bool
+            True iff the experiment belongs to this shard. Always True if
+            this lab assistant is not sharded.
+        """
+        if self._shard_ring is None:
+            return True
+        return self._shard_ring.get_node(exp_id) == self._shard_index
+
+    def _is_state_file(self, filename):
+        """
+        Returns whether filename is a state file of a lab assistant.
+
+        If sharded, experiments can be moved between shards whenever the
+        number of shards changes. Every shard therefore reads the state files
+        of all shards and of a non-sharded lab assistant. A non-sharded lab
+        assistant only reads its own file.
+        """
+        if self._shard_ring is None:
+            return filename == "lab_assistant.json"
+        return filename == "lab_assistant.json" or (
+            filename.startswith("lab_assistant_shard_") and
+            filename.endswith(".json"))
+
+    def _state_filename(self):
+        """
+        Returns the name of the file this lab assistant writes its state to.
+        """
+        if self._shard_ring is None:
+            return "lab_assistant.json"
+        return "lab_assistant_shard_%i.json" %self._shard_index
+
     def init_experiment(self, name, optimizer, param_defs, exp_id=None,
                         notes=None, optimizer_arguments=None,
                         minimization=True):
@@ -119,7 +213,8 @@ class LabAssistant(object):
         ------
         ValueError :
             Iff there already is an experiment with the exp_id for this lab
-            assistant. Does not occur if no exp_id is given.
+            assistant, or the exp_id is owned by another shard. Does not
+            occur if no exp_id is given.
         """
         self._logger.debug("Initializing new experiment. Parameters: "
                            "name: %s, optimizer: %s, param_defs: %s, "
@@ -128,40 +223,45 @@ class LabAssistant(object):
                                                 exp_id, notes,
                                                 optimizer_arguments,
                                                 minimization))
-        if exp_id in self._exp_assistants.keys():
-            raise ValueError("Already an experiment with id %s registered."
-                             %exp_id)
-
-        if exp_id is None:
-            while True:
-                exp_id = uuid.uuid4().hex
-                if exp_id not in self._exp_assistants.keys():
-                    break
-            self._logger.debug("\tGenerated new exp_id: %s" %exp_id)
-
-        if not self._write_dir:
-            exp_assistant_write_directory = None
-        else:
-            exp_assistant_write_directory = os.path.join(self._write_dir +
-                                                     "/" + exp_id)
-            ensure_directory_exists(exp_assistant_write_directory)
-        self._logger.debug("\tExp_ass directory: %s"
-                           %exp_assistant_write_directory)
-
-        exp = experiment.Experiment(name,
-                                    param_defs,
-                                    exp_id,
-                                    notes,
-                                    minimization)
-
-        exp_ass = ExperimentAssistant(optimizer,
-                                      experiment=exp,
-                                      optimizer_arguments=optimizer_arguments,
-                                      write_dir=exp_assistant_write_directory)
-        self._exp_assistants[exp_id] = exp_ass
-        self._logger.info("Experiment initialized successfully with id %s."
-                          %exp_id)
-        self._write_state_to_file()
+        with self._lock:
+            if exp_id in self._exp_assistants.keys():
+                raise ValueError("Already an experiment with id %s registered."
+                                 %exp_id)
+            if exp_id is not None and not self.owns(exp_id):
+                raise ValueError("Experiment with id %s belongs to another "
+                                 "shard than %s." %(exp_id, self._shard_index))
+
+            if exp_id is None:
+                while True:
+                    exp_id = uuid.uuid4().hex
+                    if (exp_id not in self._exp_assistants.keys() and
+                            self.owns(exp_id)):
+                        break
+                self._logger.debug("\tGenerated new exp_id: %s" %exp_id)
+
+            if not self._write_dir:
+                exp_assistant_write_directory = None
+            else:
+                exp_assistant_write_directory = os.path.join(self._write_dir +
+                                                         "/" + exp_id)
+                ensure_directory_exists(exp_assistant_write_directory)
+            self._logger.debug("\tExp_ass directory: %s"
+                               %exp_assistant_write_directory)
+
+            exp = experiment.Experiment(name,
+                                        param_defs,
+                                        exp_id,
+                                        notes,
+                                        minimization)
+
+            exp_ass = ExperimentAssistant(optimizer,
+                                          experiment=exp,
+                                          optimizer_arguments=optimizer_arguments,
+                                          write_dir=exp_assistant_write_directory)
+            self._exp_assistants[exp_id] = exp_ass
+            self._logger.info("Experiment initialized successfully with id %s."
+                              %exp_id)
+            self._write_state_to_file()
         return exp_id
 
     def _load_exp_assistant_from_path(self, path):
@@ -171,7 +271,8 @@ class LabAssistant(object):
         Specifically, it looks for exp_assistant.json in the path and restores
         optimizer_class, optimizer_arguments and write_dir from this. It then
         loads the experiment from the write_dir/experiment.json, then
-        initializes both.
+        initializes both. If there is an optimizer_checkpoint.json, the
+        optimizer is restored from it.
 
         Parameters
         ----------
@@ -194,17 +295,19 @@ class LabAssistant(object):
                                              exp_ass_write_dir))
         exp = self._load_experiment(path)
         self._logger.debug("\tLoaded Experiment. %s" %exp.to_dict())
-
+        checkpoint = self._load_optimizer_checkpoint(path)
 
         exp_ass = ExperimentAssistant(optimizer_class=optimizer_class,
                                       experiment=exp,
                                       optimizer_arguments=optimizer_arguments,
-                                      write_dir=exp_ass_write_dir)
-
-        if exp_ass.exp_id in self._exp_assistants:
-            raise ValueError("Loaded exp_id is duplicated in experiment! id "
-                             "is %s" %exp_ass.exp_id)
-        self._exp_assistants[exp_ass.exp_id] = exp_ass
+                                      write_dir=exp_ass_write_dir,
+                                      optimizer_checkpoint=checkpoint)
+
+        with self._lock:
+            if exp_ass.exp_id in self._exp_assistants:
+                raise ValueError("Loaded exp_id is duplicated in experiment! "
+                                 "id is %s" %exp_ass.exp_id)
+            self._exp_assistants[exp_ass.exp_id] = exp_ass
         self._logger.info("Successfully loaded experiment from %s." %path)
 
     def _load_experiment(self, path):
@@ -225,6 +328,35 @@ class LabAssistant(object):
         self._logger.debug("\tLoaded experiment, %s" %exp.to_dict())
         return exp
 
+    def _load_optimizer_checkpoint(self, path):
+        """
+        Loads the optimizer checkpoint from path.
+
+        Looks for optimizer_checkpoint.json in path. A missing or unreadable
+        checkpoint only means that the optimizer has to be refitted, so it
+        is not an error.
+
+        Parameters
+        ----------
+        path : string
+            The path where optimizer_checkpoint.json is located.
+
+        Returns
+        -------
+        checkpoint : dict or None
+            The checkpoint, or None if there is none.
+        """
+        filename = path + "/optimizer_checkpoint.json"
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'r') as infile:
+                return json.load(infile)
+        except (IOError, ValueError) as e:
+            self._logger.warning("Could not load optimizer checkpoint from "
+                                 "%s: %s", filename, e)
+            return None
+
 
     def _write_state_to_file(self):
         """
@@ -232,20 +364,27 @@ class LabAssistant(object):
 
         Iff _write_dir is not None, it will collate global_start_date and a
         dictionary of every experiment assistant, and dump this to
-        self._write_dir/lab_assistant.json.
+        self._write_dir/lab_assistant.json (or
+        lab_assistant_shard_<shard_index>.json if sharded).
         """
         self._logger.debug("Writing lab_assistant state to file %s"
                            %self._write_dir)
         if not self._write_dir:
             return
-        state = {"global_start_date": self._global_start_date,
-                "exp_assistants": {x.exp_id: x.write_dir for x
-                                    in self._exp_assistants.values()}}
-        self._logger.debug("\tState is %s" %state)
-        with open(self._write_dir + '/lab_assistant.json', 'w') as outfile:
-            json.dump(state, outfile)
-
-    def get_candidates(self, experiment_id):
+        with self._lock:
+            state = {"global_start_date": self._global_start_date,
+                    "exp_assistants": {x.exp_id: x.write_dir for x
+                                        in self._exp_assistants.values()}}
+            self._logger.debug("\tState is %s" %state)
+            with _write_seconds.time(assistant="lab"):
+                with open(os.path.join(self._write_dir,
+                                       self._state_filename()),
+                          'w') as outfile:
+                    json.dump(state, outfile)
+                    num_bytes = outfile.tell()
+            _write_bytes_total.inc(num_bytes, assistant="lab")
+
+    def get_candidates(self, experiment_id, since=None, limit=None):
         """
         Returns all candidates for a specific experiment.
 
@@ -253,15 +392,22 @@ class LabAssistant(object):
         ----------
         experiment_id : string
             The id of the experiment for which to return the candidates.
+        since : int or None, optional
+            If given, only candidates changed after this update sequence
+            number are returned.
+        limit : int or None, optional
+            The maximum number of candidates returned.
 
         Returns
         -------
         result : dict
             A dictionary of three lists with the keys finished, pending and
-            working, with the corresponding candidates.
+            working, with the corresponding candidates. See
+            ExperimentAssistant.get_candidates for the paginated format.
         """
         self._logger.debug("Returning candidates for exp %s" %experiment_id)
-        candidates = self._exp_assistants[experiment_id].get_candidates()
+        candidates = self._exp_assistants[experiment_id].get_candidates(
+            since=since, limit=limit)
         self._logger.debug("\tCandidates are %s" %candidates)
         return candidates
 
@@ -305,7 +451,27 @@ class LabAssistant(object):
         self._logger.debug("\tBest candidate is %s" %best_cand)
         return best_cand
 
-    def update(self, experiment_id, status, candidate):
+    def get_experiment_version(self, experiment_id):
+        """
+        Returns the version of a specific experiment.
+
+        Parameters
+        ----------
+        experiment_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        update_sequence : int
+            The update sequence number of the experiment. Changes whenever a
+            candidate of the experiment changes.
+        last_update_time : float
+            The time of the last update of the experiment.
+        """
+        return self._exp_assistants[experiment_id].get_version()
+
+    def update(self, experiment_id, status, candidate,
+               intermediate_results=None):
         """
         Updates the specicied experiment with the status of an experiment
         evaluation.
@@ -322,14 +488,50 @@ class LabAssistant(object):
             - pausing: The evaluation of Candidate has been paused and can be
                 resumed by another worker.
             - working: The Candidate is now being worked on by a worker.
+        intermediate_results : list of (step, value) tuples, optional
+            Intermediate results of the evaluation.
 
+        Returns
+        -------
+        stop : bool
+            True iff the evaluation of candidate should be stopped early. See
+            ExperimentAssistant.update.
         """
         self._logger.debug("Updating exp_id %s with candidate %s with status"
                            "%s." %(experiment_id, candidate, status))
-        self._exp_assistants[experiment_id].update(status=status,
-                                                         candidate=candidate)
+        return self._exp_assistants[experiment_id].update(
+            status=status, candidate=candidate,
+            intermediate_results=intermediate_results)
 
-    def get_experiment_as_dict(self, exp_id):
+    def set_profiling(self, experiment_id, profiler, profiler_params=None):
+        """
+        Enables, replaces or disables profiling of an experiment.
+
+        See ExperimentAssistant.set_profiling.
+
+        Parameters
+        ----------
+        experiment_id : string
+            The id of the experiment.
+        profiler : string, Profiler or None
+            The profiler. If None, profiling is disabled.
+        profiler_params : dict, optional
+            The parameters of the profiler.
+        """
+        self._logger.debug("Setting profiler of %s to %s, params %s",
+                           experiment_id, profiler, profiler_params)
+        self._exp_assistants[experiment_id].set_profiling(profiler,
+                                                          profiler_params)
+
+    def get_profiling(self, experiment_id):
+        """
+        Returns the profiling state of an experiment.
+
+        See ExperimentAssistant.get_profiling.
+        """
+        return self._exp_assistants[experiment_id].get_profiling()
+
+    def get_experiment_as_dict(self, exp_id, since=None, limit=None):
         """
         Returns the specified experiment as dictionary.
 
@@ -337,6 +539,11 @@ class LabAssistant(object):
         ----------
         exp_id : string
             The id of the experiment.
+        since : int or None, optional
+            If given, only candidates changed after this update sequence
+            number are contained.
+        limit : int or None, optional
+            The maximum number of candidates contained.
 
         Returns
         -------
@@ -344,7 +551,8 @@ class LabAssistant(object):
             The experiment dictionary as defined by Experiment.to_dict().
         """
         self._logger.debug("Returning experiment %s as dict." %exp_id)
-        exp_dict = self._exp_assistants[exp_id].get_experiment_as_dict()
+        exp_dict = self._exp_assistants[exp_id].get_experiment_as_dict(
+            since=since, limit=limit)
         self._logger.debug("\tDict is %s" %exp_dict)
         return exp_dict
 
@@ -368,6 +576,25 @@ class LabAssistant(object):
         self._logger.debug("Figure is %s" %fig)
         return fig
 
+    def get_plot_args_result_per_step(self, exp_id):
+        """
+        Returns the arguments for plotting the result of each step.
+
+        Parameters
+        ----------
+        exp_id : string
+            The id of the experiment.
+
+        Returns
+        -------
+        plot_args : dict
+            The keyword arguments for plot_utils.plot_lists or
+            plot_utils.render_plot_png.
+        """
+        self._logger.debug("Returning plot arguments of results per step for "
+                           "%s." %exp_id)
+        return self._exp_assistants[exp_id].get_plot_args_result_per_step()
+
 
     def contains_id(self, exp_id):
         """
@@ -0,0 +1,167 @@
+"""
+Import-time benchmark for the apsis entry points.
+
+Starting the server or a client should not wait for GPy, scipy or
+matplotlib, which together take more than a second to import and are only
+needed once a model-based optimizer is used or a plot is rendered. This
+benchmark imports each entry point in a fresh interpreter, measures the
+wall time of the import and checks which of the heavy modules it loaded
+against IMPORT_BUDGETS.
+
+Usage:
+    python -m apsis.benchmarks.import_benchmark --repeats 5
+"""
+__author__ = 'Frederik Diehl'
+
+import json
+import os
+import subprocess
+import sys
+
+# Modules that are slow to import, and should only be loaded on first use.
+HEAVY_MODULES = ["GPy", "matplotlib", "scipy"]
+
+# For each entry point, the modules (and their submodules) it must not load,
+# and the maximum import time in seconds.
+IMPORT_BUDGETS = {
+    "apsis_client": {"forbidden": ["apsis", "numpy"] + HEAVY_MODULES,
+                     "seconds": 0.5},
+    "apsis.utilities.optimizer_utils": {"forbidden": HEAVY_MODULES,
+                                        "seconds": 1.},
+    "apsis.assistants.lab_assistant": {"forbidden": HEAVY_MODULES,
+                                       "seconds": 1.},
+    "apsis.webservice.REST_interface": {"forbidden": HEAVY_MODULES,
+                                        "seconds": 1.5},
+}
+
+_MEASURE_SCRIPT = """
+import json, sys, time
+start = time.time()
+__import__(%r)
+duration = time.time() - start
+print(json.dumps({"seconds": duration, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure_import(module_name, python=None):
+    """
+    Imports module_name in a fresh interpreter and measures it.
+
+    Parameters
+    ----------
+    module_name : string
+        The module to import.
+    python : string, optional
+        The interpreter to use. Default is the current one.
+
+    Returns
+    -------
+    measurement : dict
+        A dict with the keys
+            "seconds" : The wall time of the import.
+            "modules" : The sorted names of all modules loaded afterwards.
+
+    Raises
+    ------
+    ValueError
+        If the module could not be imported.
+    """
+    if python is None:
+        python = sys.executable
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in [env.get("PYTHONPATH")] if p])
+    process = subprocess.Popen([python, "-c", _MEASURE_SCRIPT %module_name],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        raise ValueError("Could not import %s: %s" %(module_name, err))
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def loaded_modules(modules, prefixes):
+    """
+    Returns the modules which are one of prefixes or one of their submodules.
+
+    Parameters
+    ----------
+    modules : list of strings
+        The loaded module names.
+    prefixes : list of strings
+        The top-level module names to look for.
+
+    Returns
+    -------
+    found : list of strings
+        The sorted names in prefixes which are loaded.
+    """
+    found = set()
+    for name in modules:
+        top_level = name.split(".")[0]
+        if top_level in prefixes:
+            found.add(top_level)
+    return sorted(found)
+
+
+def run_benchmark(budgets=None, repeats=3, python=None):
+    """
+    Measures the import of each entry point and checks it against its budget.
+
+    Parameters
+    ----------
+    budgets : dict, optional
+        The budgets, in the format of IMPORT_BUDGETS (the default).
+    repeats : int, optional
+        How often each import is measured. The fastest time is reported.
+        Default is 3.
+    python : string, optional
+        The interpreter to use. Default is the current one.
+
+    Returns
+    -------
+    results : list of dicts
+        For each entry point, a dict with the keys module, seconds,
+        num_modules, forbidden_loaded (the forbidden modules which were
+        loaded) and too_slow.
+    """
+    if budgets is None:
+        budgets = IMPORT_BUDGETS
+    results = []
+    for module_name in sorted(budgets):
+        budget = budgets[module_name]
+        measurements = [measure_import(module_name, python)
+                        for i in range(repeats)]
+        seconds = min(m["seconds"] for m in measurements)
+        modules = measurements[0]["modules"]
+        results.append({
+            "module": module_name,
+            "seconds": seconds,
+            "num_modules": len(modules),
+            "forbidden_loaded": loaded_modules(
+                modules, budget.get("forbidden", [])),
+            "too_slow": seconds > budget.get("seconds", float("inf"))})
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Measures the import time of the apsis entry points.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="How often each import is measured.")
+    parser.add_argument("--python", default=None,
+                        help="The interpreter to use.")
+    args = parser.parse_args()
+
+    failed = False
+    for r in run_benchmark(repeats=args.repeats, python=args.python):
+        print("%-35s %6.3fs %5i modules%s%s" %(
+            r["module"], r["seconds"], r["num_modules"],
+            "  loads %s" %", ".join(r["forbidden_loaded"])
+            if r["forbidden_loaded"] else "",
+            "  over budget" if r["too_slow"] else ""))
+        failed = failed or bool(r["forbidden_loaded"]) or r["too_slow"]
+    sys.exit(1 if failed else 0)
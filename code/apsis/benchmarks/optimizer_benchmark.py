@@ -0,0 +1,499 @@
+"""
+Offline benchmark of the optimizers on standard test functions.
+
+The optimizers are run in-process, without the REST interface, so that only
+the optimizers themselves are measured. For every run, the wall time of
+each get_next_candidates and update call, the peak memory and the regret
+(the distance of the best result so far to the known optimum) per
+evaluation are recorded and written to CSV and JSON files. These can be
+compared between versions to detect regressions.
+
+The peak memory is the high-water mark of the whole process. run_benchmarks
+therefore runs each benchmark in a fresh interpreter, so that a run does not
+inherit the peak of the runs before it.
+
+Run it for example as
+    python -m apsis.benchmarks.optimizer_benchmark --out_dir /tmp/bench \
+        --optimizers RandomSearch BayOpt --problems branin hartmann3 \
+        --steps 30 --repeats 3
+"""
+
+__author__ = 'Frederik Diehl'
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from apsis.utilities import benchmark_functions
+from apsis.utilities.file_utils import ensure_directory_exists
+from apsis.utilities.logging_utils import get_logger
+from apsis.utilities.optimizer_utils import check_optimizer, \
+    AVAILABLE_OPTIMIZERS
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then not reported.
+    resource = None
+
+
+class BenchmarkProblem(object):
+    """
+    A test function together with its parameter space and known optimum.
+
+    Attributes
+    ----------
+    name : string
+        The name of the problem.
+    param_defs : dict of ParamDefs
+        The parameter space of the problem.
+    optimum : float
+        The known global minimum of the function.
+    noise_variance : float or None
+        If not None, the function is disturbed by smoothed noise of this
+        variance, generated by benchmark_functions.gen_noise.
+    noise_scale : float
+        The magnitude of the noise.
+    """
+    name = None
+    param_defs = None
+    optimum = None
+    noise_variance = None
+    noise_scale = None
+
+    _func = None
+    _param_names = None
+    _noise_gen = None
+
+    def __init__(self, name, func, bounds, optimum, noise_variance=None,
+                 noise_scale=1., noise_seed=0, noise_points=20):
+        """
+        Initializes the problem.
+
+        Parameters
+        ----------
+        name : string
+            The name of the problem.
+        func : callable
+            Called with the list of parameter values, returns the result.
+        bounds : list of (lower, upper) tuples
+            The bounds of each dimension.
+        optimum : float
+            The known global minimum of func.
+        noise_variance : float, optional
+            If given, the result is disturbed by smoothed noise of this
+            variance. The noise is generated once from noise_seed, so
+            evaluating the same point twice returns the same result.
+        noise_scale : float, optional
+            The noise is between -noise_scale/2 and noise_scale/2.
+        noise_seed : int, optional
+            The seed for generating the noise.
+        noise_points : int, optional
+            The number of noise points per dimension.
+        """
+        self.name = name
+        self._func = func
+        self._param_names = ["x%i" %i for i in range(len(bounds))]
+        self.param_defs = {}
+        for n, (lower, upper) in zip(self._param_names, bounds):
+            self.param_defs[n] = MinMaxNumericParamDef(lower, upper)
+        self.optimum = optimum
+        self.noise_variance = noise_variance
+        self.noise_scale = noise_scale
+        if noise_variance is not None:
+            self._noise_gen = benchmark_functions.gen_noise(
+                len(bounds), noise_points,
+                random_state=np.random.RandomState(noise_seed))
+
+    def evaluate(self, params):
+        """
+        Evaluates the problem for a parameter dict.
+
+        Parameters
+        ----------
+        params : dict
+            The parameters of a candidate.
+
+        Returns
+        -------
+        result : float
+            The function value, possibly including noise.
+        """
+        x = [params[n] for n in self._param_names]
+        result = self._func(x)
+        if self._noise_gen is not None:
+            x_warped = []
+            for n in self._param_names:
+                x_warped.extend(self.param_defs[n].warp_in(params[n]))
+            noise = benchmark_functions.get_noise_value_at(
+                x_warped, self.noise_variance, self._noise_gen)
+            result += self.noise_scale * (noise - 0.5)
+        return result
+
+
+def _branin(x):
+    return benchmark_functions.branin_func(x[0], x[1])
+
+
+# The catalog of problems, as keyword arguments of BenchmarkProblem.
+BENCHMARK_PROBLEMS = {
+    "branin": {"func": _branin, "bounds": [(-5, 10), (0, 15)],
+               "optimum": 0.397887},
+    "hartmann3": {"func": benchmark_functions.hartmann3_func,
+                  "bounds": [(0, 1)]*3, "optimum": -3.86278},
+    "hartmann6": {"func": benchmark_functions.hartmann6_func,
+                  "bounds": [(0, 1)]*6, "optimum": -3.32237},
+    "rosenbrock": {"func": benchmark_functions.rosenbrock_func,
+                   "bounds": [(-5, 10)]*4, "optimum": 0},
+    "ackley": {"func": benchmark_functions.ackley_func,
+               "bounds": [(-32.768, 32.768)]*5, "optimum": 0},
+    "noisy_branin": {"func": _branin, "bounds": [(-5, 10), (0, 15)],
+                     "optimum": 0.397887, "noise_variance": 0.05,
+                     "noise_scale": 5},
+    "noisy_hartmann3": {"func": benchmark_functions.hartmann3_func,
+                        "bounds": [(0, 1)]*3, "optimum": -3.86278,
+                        "noise_variance": 0.05, "noise_scale": 0.5},
+}
+
+
+def get_problem(name):
+    """
+    Returns the BenchmarkProblem called name from BENCHMARK_PROBLEMS.
+    """
+    if name not in BENCHMARK_PROBLEMS:
+        raise ValueError("No benchmark problem %s. Available are %s."
+                         %(name, sorted(BENCHMARK_PROBLEMS.keys())))
+    return BenchmarkProblem(name, **BENCHMARK_PROBLEMS[name])
+
+
+DEFAULT_OPTIMIZER_ARGUMENTS = {
+    "BayOpt": {"initial_random_runs": 5}
+}
+
+
+def get_peak_memory():
+    """
+    Returns the peak memory of this process in bytes, or None if unknown.
+
+    This is the high-water mark over the lifetime of the process, not of a
+    single run.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    # Linux reports kilobytes.
+    return peak * 1024
+
+
+def run_benchmark(optimizer, problem, steps=30, optimizer_arguments=None,
+                  seed=0):
+    """
+    Runs a single optimizer on a single problem.
+
+    Parameters
+    ----------
+    optimizer : string or Optimizer subclass
+        The optimizer, as accepted by optimizer_utils.check_optimizer.
+    problem : string or BenchmarkProblem
+        The problem, or its name in BENCHMARK_PROBLEMS.
+    steps : int, optional
+        The number of evaluations.
+    optimizer_arguments : dict, optional
+        The optimizer arguments. If None, DEFAULT_OPTIMIZER_ARGUMENTS are
+        used. The optimizer is always run without multiprocessing, and
+        random_state is set from seed unless given.
+    seed : int, optional
+        Seeds the optimizer and the global random states.
+
+    Returns
+    -------
+    run : dict
+        Describes the run. Contains "optimizer", "problem", "seed",
+        "steps" and "peak_memory", and the list "trace" with one dict per
+        evaluation, containing "step", "get_next_candidates_time",
+        "update_time", "result", "best_result" and "regret".
+        peak_memory is the peak of the whole process, and only describes
+        this run if it is the only one in the process. Use
+        run_isolated_benchmark for that.
+    """
+    logger = get_logger("apsis.benchmarks.optimizer_benchmark")
+    if not isinstance(problem, BenchmarkProblem):
+        problem = get_problem(problem)
+    optimizer_name = optimizer
+    if not isinstance(optimizer, basestring):
+        optimizer_name = optimizer.__name__
+    if optimizer_arguments is None:
+        optimizer_arguments = DEFAULT_OPTIMIZER_ARGUMENTS.get(optimizer_name,
+                                                              {})
+    optimizer_arguments = dict(optimizer_arguments)
+    optimizer_arguments["multiprocessing"] = "none"
+    optimizer_arguments.setdefault("random_state", seed)
+    random.seed(seed)
+    np.random.seed(seed)
+    logger.info("Benchmarking %s on %s with seed %s.", optimizer_name,
+                problem.name, seed)
+
+    exp = Experiment(problem.name, problem.param_defs)
+    opt = check_optimizer(optimizer, exp,
+                          optimizer_arguments=optimizer_arguments)
+    trace = []
+    best_result = None
+    try:
+        for step in range(steps):
+            start = time.time()
+            candidates = opt.get_next_candidates(num_candidates=1)
+            get_time = time.time() - start
+
+            cand = candidates[0]
+            cand.result = problem.evaluate(cand.params)
+            exp.add_finished(cand)
+
+            start = time.time()
+            opt.update(exp)
+            update_time = time.time() - start
+
+            if best_result is None or cand.result < best_result:
+                best_result = cand.result
+            trace.append({"step": step,
+                          "get_next_candidates_time": get_time,
+                          "update_time": update_time,
+                          "result": cand.result,
+                          "best_result": best_result,
+                          "regret": best_result - problem.optimum})
+    finally:
+        opt.exit()
+    return {"optimizer": optimizer_name,
+            "problem": problem.name,
+            "seed": seed,
+            "steps": steps,
+            "peak_memory": get_peak_memory(),
+            "trace": trace}
+
+
+_RUN_SCRIPT = """
+import json, sys
+from apsis.benchmarks.optimizer_benchmark import run_benchmark
+from apsis.utilities.import_utils import import_object
+from apsis.utilities import logging_utils
+args = json.loads(sys.argv[1])
+if args["log_dir"] is None:
+    logging_utils.logging_tests()
+else:
+    logging_utils.get_logger("apsis.benchmarks.optimizer_benchmark",
+                             save_path=args["log_dir"])
+optimizer = args["optimizer"]
+if ":" in optimizer:
+    optimizer = import_object(optimizer)
+run = run_benchmark(optimizer, args["problem"], steps=args["steps"],
+                    optimizer_arguments=args["optimizer_arguments"],
+                    seed=args["seed"])
+sys.stdout.write("\\n" + json.dumps(run) + "\\n")
+"""
+
+
+def run_isolated_benchmark(optimizer, problem, steps=30,
+                           optimizer_arguments=None, seed=0, python=None,
+                           log_dir=None):
+    """
+    Runs run_benchmark in a fresh interpreter.
+
+    This makes the peak memory of the run independent of anything run
+    before it in this process.
+
+    Parameters
+    ----------
+    optimizer : string or Optimizer subclass
+        The optimizer, as accepted by optimizer_utils.check_optimizer. A
+        class has to be importable by its module and name.
+    problem : string
+        The name of the problem in BENCHMARK_PROBLEMS.
+    steps, optimizer_arguments, seed
+        See run_benchmark. optimizer_arguments have to be serializable to
+        JSON.
+    python : string, optional
+        The interpreter to use. Default is the current one.
+    log_dir : string, optional
+        The directory the run logs to, as save_path of
+        logging_utils.get_logger. If None, the run does not log.
+
+    Returns
+    -------
+    run : dict
+        The run as returned by run_benchmark.
+
+    Raises
+    ------
+    ValueError
+        If problem is not a name, or the run failed.
+    """
+    if not isinstance(problem, basestring):
+        raise ValueError("Isolated benchmarks need the name of a problem, "
+                         "not %s." %problem)
+    if not isinstance(optimizer, basestring):
+        optimizer = "%s:%s" %(optimizer.__module__, optimizer.__name__)
+    if python is None:
+        python = sys.executable
+    args = json.dumps({"optimizer": optimizer, "problem": problem,
+                       "steps": steps,
+                       "optimizer_arguments": optimizer_arguments,
+                       "seed": seed, "log_dir": log_dir})
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in [env.get("PYTHONPATH")] if p])
+    process = subprocess.Popen([python, "-c", _RUN_SCRIPT, args],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        raise ValueError("Benchmark of %s on %s failed: %s"
+                         %(optimizer, problem, err))
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize_run(run):
+    """
+    Summarizes a run as returned by run_benchmark.
+
+    Returns
+    -------
+    summary : dict
+        Contains optimizer, problem, seed, steps and peak_memory of the run,
+        the final regret, and the total, mean and maximum times of
+        get_next_candidates and update.
+    """
+    summary = {k: run[k] for k in ["optimizer", "problem", "seed", "steps",
+                                   "peak_memory"]}
+    trace = run["trace"]
+    summary["final_regret"] = trace[-1]["regret"] if trace else None
+    for t in ["get_next_candidates_time", "update_time"]:
+        times = [e[t] for e in trace]
+        summary["total_" + t] = float(np.sum(times))
+        summary["mean_" + t] = float(np.mean(times)) if times else None
+        summary["max_" + t] = float(np.max(times)) if times else None
+    return summary
+
+
+def write_results(runs, out_dir):
+    """
+    Writes the results of several runs to out_dir.
+
+    Writes traces.csv, with one row per evaluation of each run, and
+    summary.json, containing a summary of each run and information about
+    the environment.
+
+    Parameters
+    ----------
+    runs : list of dicts
+        The runs as returned by run_benchmark.
+    out_dir : string
+        The directory to write to. Is created if necessary.
+    """
+    ensure_directory_exists(out_dir)
+    columns = ["optimizer", "problem", "seed", "step",
+               "get_next_candidates_time", "update_time", "result",
+               "best_result", "regret"]
+    with open(os.path.join(out_dir, "traces.csv"), "w") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(columns)
+        for run in runs:
+            for entry in run["trace"]:
+                row = dict(entry, optimizer=run["optimizer"],
+                           problem=run["problem"], seed=run["seed"])
+                writer.writerow([row[c] for c in columns])
+    summary = {"time": time.time(),
+               "python_version": platform.python_version(),
+               "numpy_version": np.__version__,
+               "platform": platform.platform(),
+               "runs": [summarize_run(r) for r in runs]}
+    with open(os.path.join(out_dir, "summary.json"), "w") as outfile:
+        json.dump(summary, outfile, indent=2, sort_keys=True)
+
+
+def run_benchmarks(optimizers=None, problems=None, steps=30, repeats=1,
+                   out_dir=None, isolated=True):
+    """
+    Runs every optimizer on every problem repeats times.
+
+    Parameters
+    ----------
+    optimizers : list, optional
+        The optimizers. Default is all of AVAILABLE_OPTIMIZERS.
+    problems : list, optional
+        The problem names. Default is all of BENCHMARK_PROBLEMS.
+    steps : int, optional
+        The number of evaluations per run.
+    repeats : int, optional
+        The number of runs per optimizer and problem, with seeds 0 to
+        repeats-1.
+    out_dir : string, optional
+        If given, the results are written there via write_results.
+    isolated : bool, optional
+        If True, the default, each run is done in a fresh interpreter via
+        run_isolated_benchmark, so that its peak memory is its own. If
+        False, all runs are done in this process, and peak_memory is not
+        reported for them.
+
+    Returns
+    -------
+    runs : list of dicts
+        The runs as returned by run_benchmark.
+    """
+    if optimizers is None:
+        optimizers = sorted(AVAILABLE_OPTIMIZERS.keys())
+    if problems is None:
+        problems = sorted(BENCHMARK_PROBLEMS.keys())
+    runs = []
+    for problem in problems:
+        for optimizer in optimizers:
+            for seed in range(repeats):
+                if isolated:
+                    run = run_isolated_benchmark(optimizer, problem,
+                                                 steps=steps, seed=seed,
+                                                 log_dir=out_dir)
+                else:
+                    run = run_benchmark(optimizer, problem, steps=steps,
+                                        seed=seed)
+                    run["peak_memory"] = None
+                runs.append(run)
+    if out_dir is not None:
+        write_results(runs, out_dir)
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the apsis "
+                                                 "optimizers offline.")
+    parser.add_argument("--out_dir", required=True,
+                        help="Directory to write the results and logs to.")
+    parser.add_argument("--optimizers", nargs="+", default=None,
+                        help="The optimizers to run. Default is all.")
+    parser.add_argument("--problems", nargs="+", default=None,
+                        help="The problems to run. Default is all of %s."
+                             %sorted(BENCHMARK_PROBLEMS.keys()))
+    parser.add_argument("--steps", type=int, default=30,
+                        help="The number of evaluations per run.")
+    parser.add_argument("--repeats", type=int, default=1,
+                        help="The number of runs per optimizer and problem.")
+    args = parser.parse_args()
+    get_logger("apsis.benchmarks.optimizer_benchmark", save_path=args.out_dir)
+    runs = run_benchmarks(args.optimizers, args.problems, args.steps,
+                          args.repeats, args.out_dir)
+    for s in [summarize_run(r) for r in runs]:
+        print("%s on %s (seed %s): final regret %.4g, mean "
+              "get_next_candidates %.4gs, mean update %.4gs"
+              %(s["optimizer"], s["problem"], s["seed"], s["final_regret"],
+                s["mean_get_next_candidates_time"], s["mean_update_time"]))
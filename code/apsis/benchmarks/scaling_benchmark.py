@@ -0,0 +1,691 @@
+"""
+Scaling benchmarks for the apsis server components.
+
+These benchmarks measure how apsis degrades as an experiment grows, as the
+parameter space becomes higher-dimensional (including wide NominalParamDefs,
+which are one-hot encoded by the optimizers) and as more workers access the
+same server concurrently. Each sweep is run against a LabAssistant directly
+(driver "lab") and through a local, threaded REST_interface server (driver
+"rest").
+
+For every point of a sweep, the latencies of get_next_candidate and update,
+the bytes the persistence writes per update and the optimizer queue lag are
+measured. The queue lag consists of the time a worker has to wait until the
+optimizer offers a candidate, and of the number of experiment snapshots
+still waiting to be consumed by a queue-based optimizer after an update.
+
+Results are written to results.json and results.csv, and report.txt lists
+for every curve its local scaling exponents and the point where it bends.
+
+Usage:
+    python -m apsis.benchmarks.scaling_benchmark --out_dir /tmp/scaling
+"""
+__author__ = 'Frederik Diehl'
+
+import copy
+import csv
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from apsis.assistants.lab_assistant import LabAssistant
+from apsis.models.candidate import Candidate
+from apsis.utilities.param_def_utilities import dict_to_param_defs
+from apsis.utilities.logging_utils import get_logger
+
+DEFAULT_SIZES = [100, 300, 1000, 3000, 10000]
+DEFAULT_DIMENSIONS = [2, 5, 10, 20, 50]
+DEFAULT_WORKERS = [1, 4, 16, 64, 256]
+DEFAULT_DRIVERS = ["lab", "rest"]
+
+# The metrics for which curves are reported.
+REPORTED_METRICS = ["get_next_candidate_p50", "get_next_candidate_p99",
+                    "update_p50", "update_p99", "bytes_per_update",
+                    "candidate_wait_p99"]
+
+
+def make_param_def_dicts(dims, nominal_width=None):
+    """
+    Returns the parameter definition dicts for a space with dims dimensions.
+
+    Parameters
+    ----------
+    dims : int
+        The number of parameters.
+    nominal_width : int or None, optional
+        If given, every other parameter is a NominalParamDef with that many
+        values, which the optimizers encode as nominal_width one-hot
+        dimensions. Otherwise, all parameters are MinMaxNumericParamDefs.
+
+    Returns
+    -------
+    param_defs : dict
+        The parameter definitions, in the dict format of the REST interface.
+    """
+    param_defs = {}
+    for i in range(dims):
+        if nominal_width is not None and i % 2 == 1:
+            param_defs["x%i" %i] = {
+                "type": "NominalParamDef",
+                "values": ["v%i" %v for v in range(nominal_width)]}
+        else:
+            param_defs["x%i" %i] = {"type": "MinMaxNumericParamDef",
+                                    "lower_bound": 0, "upper_bound": 1}
+    return param_defs
+
+
+def percentiles(values):
+    """
+    Summarizes a list of values by their percentiles.
+
+    Parameters
+    ----------
+    values : list of floats
+        The values.
+
+    Returns
+    -------
+    summary : dict
+        The keys "p50", "p90", "p99", "max" and "mean". All are None if
+        values is empty.
+    """
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None,
+                "mean": None}
+    return {"p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)),
+            "max": float(np.max(values)),
+            "mean": float(np.mean(values))}
+
+
+def find_knee(xs, ys):
+    """
+    Finds the point where a curve bends upwards most strongly.
+
+    Both axes are log-scaled, and the knee is the point with the largest
+    distance below the line connecting the first and the last point; after
+    it, the curve grows faster than before. A curve which scales with a
+    constant exponent therefore has no knee.
+
+    Parameters
+    ----------
+    xs, ys : list of floats
+        The curve. xs has to be increasing.
+
+    Returns
+    -------
+    knee : float or None
+        The x value of the knee, or None if the curve has less than three
+        points, non-positive values or does not bend upwards.
+    """
+    points = [(x, y) for x, y in zip(xs, ys) if y is not None]
+    if len(points) < 3 or min(min(p) for p in points) <= 0:
+        return None
+    log_x = [math.log(p[0]) for p in points]
+    log_y = [math.log(p[1]) for p in points]
+    slope = (log_y[-1] - log_y[0]) / (log_x[-1] - log_x[0])
+    best_x = None
+    best_distance = 0
+    for i in range(1, len(points) - 1):
+        distance = log_y[0] + slope * (log_x[i] - log_x[0]) - log_y[i]
+        if distance > best_distance:
+            best_distance = distance
+            best_x = points[i][0]
+    # Small deviations are measuring noise, not a bend.
+    if best_distance < 0.1:
+        return None
+    return best_x
+
+
+def scaling_exponents(xs, ys):
+    """
+    Returns the local scaling exponents of a curve.
+
+    The exponent between two neighbouring points is the slope of the curve
+    on log-log scale, so 1 means linear and 2 quadratic growth.
+
+    Parameters
+    ----------
+    xs, ys : list of floats
+        The curve.
+
+    Returns
+    -------
+    exponents : list of floats or None
+        One exponent for each pair of neighbouring points. None if one of
+        the values is not positive.
+    """
+    exponents = []
+    for i in range(len(xs) - 1):
+        if (ys[i] is None or ys[i+1] is None or ys[i] <= 0 or ys[i+1] <= 0
+                or xs[i] <= 0 or xs[i+1] <= xs[i]):
+            exponents.append(None)
+            continue
+        exponents.append(math.log(ys[i+1] / ys[i]) /
+                         math.log(float(xs[i+1]) / xs[i]))
+    return exponents
+
+
+class LabDriver(object):
+    """
+    Drives a LabAssistant directly.
+
+    Attributes
+    ----------
+    lab_assistant : LabAssistant
+        The lab assistant all calls go to.
+    """
+    lab_assistant = None
+
+    def __init__(self, write_dir=None):
+        """
+        Initializes the driver with a new LabAssistant writing to write_dir.
+        """
+        self.lab_assistant = LabAssistant(write_dir=write_dir)
+
+    def init_experiment(self, name, optimizer, param_defs,
+                        optimizer_arguments=None):
+        return self.lab_assistant.init_experiment(
+            name, optimizer, dict_to_param_defs(copy.deepcopy(param_defs)),
+            optimizer_arguments=optimizer_arguments)
+
+    def get_next_candidate(self, exp_id):
+        return self.lab_assistant.get_next_candidate(exp_id)
+
+    def update(self, exp_id, candidate, result):
+        candidate.result = result
+        self.lab_assistant.update(exp_id, "finished", candidate)
+
+    def get_params(self, candidate):
+        return candidate.params
+
+    def close(self):
+        self.lab_assistant.set_exit()
+
+
+class RESTDriver(LabDriver):
+    """
+    Drives a LabAssistant through a local, threaded REST_interface server.
+
+    The server runs in a thread of this process, so the LabAssistant behind
+    it can still be inspected.
+    """
+    _server = None
+    _connection = None
+
+    def __init__(self, write_dir=None):
+        """
+        Starts the server on a free port, with a new LabAssistant writing to
+        write_dir.
+        """
+        from werkzeug.serving import make_server
+        from apsis.webservice import REST_interface
+        from apsis_client.apsis_connection import Connection
+        super(RESTDriver, self).__init__(write_dir=write_dir)
+        REST_interface._logger = get_logger("webservice.REST_interface")
+        REST_interface.lAss = self.lab_assistant
+        self._server = make_server("127.0.0.1", 0, REST_interface.app,
+                                   threaded=True)
+        server_thread = threading.Thread(target=self._server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self._connection = Connection(
+            "http://127.0.0.1:%s" %self._server.server_port,
+            repeat_time=0.01)
+
+    def init_experiment(self, name, optimizer, param_defs,
+                        optimizer_arguments=None):
+        return self._connection.init_experiment(
+            name, optimizer, param_defs,
+            optimizer_arguments=optimizer_arguments, blocking=True)
+
+    def get_next_candidate(self, exp_id):
+        return self._connection.get_next_candidate(exp_id)
+
+    def update(self, exp_id, candidate, result):
+        candidate["result"] = result
+        self._connection.update(exp_id, candidate)
+
+    def get_params(self, candidate):
+        return candidate["params"]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        super(RESTDriver, self).close()
+
+
+DRIVERS = {"lab": LabDriver, "rest": RESTDriver}
+
+
+def _objective(params):
+    """
+    A cheap objective for all parameter spaces of make_param_def_dicts.
+    """
+    result = 0
+    for name in sorted(params.keys()):
+        value = params[name]
+        if isinstance(value, (int, float)):
+            result += (value - 0.3)**2
+        else:
+            result += 0.1 * int(value[1:])
+    return result
+
+
+def prefill(lab_assistant, exp_id, num_candidates, random_state=None):
+    """
+    Adds num_candidates random, finished candidates to an experiment.
+
+    The candidates are added to the experiment directly, so that the
+    optimizer is only updated and the state only written once. This makes
+    it possible to benchmark experiments with many candidates.
+
+    Parameters
+    ----------
+    lab_assistant : LabAssistant
+        The lab assistant containing the experiment.
+    exp_id : string
+        The id of the experiment.
+    num_candidates : int
+        The number of candidates to add.
+    random_state : numpy RandomState, optional
+        The random state for the parameters. A new one is used if None.
+    """
+    if random_state is None:
+        random_state = np.random.RandomState()
+    exp_assistant = lab_assistant._exp_assistants[exp_id]
+    with exp_assistant._lock:
+        experiment = exp_assistant._experiment
+        param_defs = experiment.parameter_definitions
+        cands = []
+        for i in range(num_candidates):
+            params = {}
+            for name, param_def in param_defs.items():
+                params[name] = param_def.warp_out(
+                    list(random_state.rand(param_def.warped_size())))
+            cand = Candidate(params)
+            cand.result = _objective(params)
+            cands.append(cand)
+        experiment.add_finished_candidates(cands)
+        exp_assistant._optimizer.update(experiment.snapshot())
+        exp_assistant._write_state_to_file()
+
+
+def optimizer_backlog(lab_assistant, exp_id):
+    """
+    Returns the number of experiment snapshots the optimizer has not yet
+    consumed.
+
+    Returns
+    -------
+    backlog : int or None
+        The backlog, or None if the optimizer is not queue-based.
+    """
+    optimizer = lab_assistant._exp_assistants[exp_id]._optimizer
+    in_queue = getattr(optimizer, "_optimizer_in_queue", None)
+    if in_queue is None:
+        return None
+    return in_queue.qsize()
+
+
+def _record_update_bytes(exp_assistant, bytes_per_update):
+    """
+    Makes exp_assistant append the bytes each update writes to
+    bytes_per_update.
+
+    update and _write_state_to_file are wrapped on the instance only. The
+    bytes of an update are those returned by the _write_state_to_file calls
+    it makes, which run in the thread calling update, so concurrent updates
+    and the writes of get_next_candidate are not counted.
+    """
+    local = threading.local()
+    write_state = exp_assistant._write_state_to_file
+    update = exp_assistant.update
+
+    def counted_write_state():
+        num_bytes = write_state()
+        local.num_bytes = getattr(local, "num_bytes", 0) + num_bytes
+        return num_bytes
+
+    def counted_update(*args, **kwargs):
+        local.num_bytes = 0
+        try:
+            return update(*args, **kwargs)
+        finally:
+            bytes_per_update.append(local.num_bytes)
+
+    exp_assistant._write_state_to_file = counted_write_state
+    exp_assistant.update = counted_update
+
+
+def _work(driver, exp_id, steps, timings, errors, candidate_timeout=30):
+    """
+    Evaluates steps candidates of an experiment, as one worker would.
+
+    timings is a dict of lists, to which the measurements are appended.
+    Errors are appended to errors instead of being raised.
+    """
+    try:
+        for i in range(steps):
+            wait_start = time.time()
+            while True:
+                start = time.time()
+                candidate = driver.get_next_candidate(exp_id)
+                timings["get_next_candidate"].append(time.time() - start)
+                if candidate is not None:
+                    break
+                if time.time() - wait_start > candidate_timeout:
+                    raise ValueError("No candidate was generated within %s "
+                                     "seconds." %candidate_timeout)
+                time.sleep(0.01)
+            timings["candidate_wait"].append(time.time() - wait_start)
+            result = _objective(driver.get_params(candidate))
+            start = time.time()
+            driver.update(exp_id, candidate, result)
+            timings["update"].append(time.time() - start)
+            backlog = optimizer_backlog(driver.lab_assistant, exp_id)
+            if backlog is not None:
+                timings["optimizer_backlog"].append(backlog)
+    except Exception as e:
+        errors.append(e)
+
+
+def measure(driver_name, param_defs, optimizer="RandomSearch",
+            optimizer_arguments=None, prefilled=0, workers=1, steps=20,
+            seed=0):
+    """
+    Measures one point of a sweep.
+
+    A new LabAssistant (writing to a temporary directory) with a single
+    experiment is created, the experiment is prefilled, and workers threads
+    each evaluate steps candidates.
+
+    Parameters
+    ----------
+    driver_name : string
+        One of DRIVERS.
+    param_defs : dict
+        The parameter definitions, as returned by make_param_def_dicts.
+    optimizer : string, optional
+        The optimizer. Default is RandomSearch.
+    optimizer_arguments : dict, optional
+        The optimizer arguments.
+    prefilled : int, optional
+        The number of finished candidates added before measuring.
+    workers : int, optional
+        The number of concurrent workers.
+    steps : int, optional
+        The number of candidates each worker evaluates.
+    seed : int, optional
+        The seed for the prefilled candidates.
+
+    Returns
+    -------
+    measurement : dict
+        Contains the latency percentiles ("get_next_candidate_p50" etc.) of
+        get_next_candidate, update and candidate_wait, the mean and maximum
+        of bytes_per_update and optimizer_backlog, the throughput in
+        evaluations per second and the number of errors.
+
+    Raises
+    ------
+    ValueError :
+        Iff driver_name is unknown.
+    """
+    if driver_name not in DRIVERS:
+        raise ValueError("Unknown driver %s, has to be one of %s."
+                         %(driver_name, sorted(DRIVERS.keys())))
+    write_dir = tempfile.mkdtemp()
+    driver = DRIVERS[driver_name](write_dir=write_dir)
+    try:
+        exp_id = driver.init_experiment("scaling", optimizer, param_defs,
+                                        optimizer_arguments=
+                                        optimizer_arguments)
+        if prefilled:
+            prefill(driver.lab_assistant, exp_id, prefilled,
+                    np.random.RandomState(seed))
+        timings = {"get_next_candidate": [], "candidate_wait": [],
+                   "update": [], "bytes_per_update": [],
+                   "optimizer_backlog": []}
+        _record_update_bytes(driver.lab_assistant._exp_assistants[exp_id],
+                             timings["bytes_per_update"])
+        errors = []
+        threads = [threading.Thread(target=_work,
+                                    args=(driver, exp_id, steps, timings,
+                                          errors))
+                   for i in range(workers)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duration = time.time() - start
+    finally:
+        driver.close()
+        shutil.rmtree(write_dir, ignore_errors=True)
+
+    measurement = {"errors": len(errors),
+                   "evaluations": len(timings["update"]),
+                   "throughput": len(timings["update"]) / duration}
+    for name in ["get_next_candidate", "candidate_wait", "update"]:
+        for key, value in percentiles(timings[name]).items():
+            measurement["%s_%s" %(name, key)] = value
+    for name in ["bytes_per_update", "optimizer_backlog"]:
+        values = timings[name]
+        measurement[name] = float(np.mean(values)) if values else None
+        measurement["%s_max" %name] = max(values) if values else None
+    return measurement
+
+
+def sweep_experiment_size(sizes=None, drivers=None, optimizer="RandomSearch",
+                          optimizer_arguments=None, dims=2, steps=20):
+    """
+    Measures the scaling with the number of finished candidates.
+
+    Returns
+    -------
+    results : list of dicts
+        One measurement per driver and size, with the additional keys
+        "sweep", "driver" and "x".
+    """
+    results = []
+    param_defs = make_param_def_dicts(dims)
+    for driver in drivers or DEFAULT_DRIVERS:
+        for size in sizes or DEFAULT_SIZES:
+            m = measure(driver, param_defs, optimizer, optimizer_arguments,
+                        prefilled=size, steps=steps)
+            m.update({"sweep": "experiment_size", "driver": driver,
+                      "x": size})
+            results.append(m)
+    return results
+
+
+def sweep_dimensions(dimensions=None, drivers=None, optimizer="RandomSearch",
+                     optimizer_arguments=None, nominal_width=None,
+                     prefilled=100, steps=20):
+    """
+    Measures the scaling with the number of parameters.
+
+    If nominal_width is given, every other parameter is a NominalParamDef
+    with nominal_width values. See make_param_def_dicts.
+
+    Returns
+    -------
+    results : list of dicts
+        One measurement per driver and dimensionality, with the additional
+        keys "sweep", "driver" and "x".
+    """
+    results = []
+    sweep = "dimensions"
+    if nominal_width is not None:
+        sweep = "dimensions_nominal_%i" %nominal_width
+    for driver in drivers or DEFAULT_DRIVERS:
+        for dims in dimensions or DEFAULT_DIMENSIONS:
+            m = measure(driver, make_param_def_dicts(dims, nominal_width),
+                        optimizer, optimizer_arguments, prefilled=prefilled,
+                        steps=steps)
+            m.update({"sweep": sweep, "driver": driver, "x": dims})
+            results.append(m)
+    return results
+
+
+def sweep_workers(workers=None, drivers=None, optimizer="RandomSearch",
+                  optimizer_arguments=None, dims=2, prefilled=100, steps=5):
+    """
+    Measures the scaling with the number of concurrent workers.
+
+    Returns
+    -------
+    results : list of dicts
+        One measurement per driver and number of workers, with the
+        additional keys "sweep", "driver" and "x".
+    """
+    results = []
+    param_defs = make_param_def_dicts(dims)
+    for driver in drivers or DEFAULT_DRIVERS:
+        for num_workers in workers or DEFAULT_WORKERS:
+            m = measure(driver, param_defs, optimizer, optimizer_arguments,
+                        prefilled=prefilled, workers=num_workers, steps=steps)
+            m.update({"sweep": "workers", "driver": driver,
+                      "x": num_workers})
+            results.append(m)
+    return results
+
+
+def analyze(results):
+    """
+    Computes the scaling exponents and knees of all curves.
+
+    Parameters
+    ----------
+    results : list of dicts
+        The measurements of the sweeps.
+
+    Returns
+    -------
+    curves : list of dicts
+        One dict per sweep, driver and metric of REPORTED_METRICS, with the
+        keys "sweep", "driver", "metric", "x", "y", "exponents" and "knee".
+    """
+    curves = []
+    keys = []
+    for r in results:
+        if (r["sweep"], r["driver"]) not in keys:
+            keys.append((r["sweep"], r["driver"]))
+    for sweep, driver in keys:
+        points = sorted([r for r in results
+                         if r["sweep"] == sweep and r["driver"] == driver],
+                        key=lambda r: r["x"])
+        xs = [p["x"] for p in points]
+        for metric in REPORTED_METRICS:
+            ys = [p.get(metric) for p in points]
+            curves.append({"sweep": sweep, "driver": driver,
+                           "metric": metric, "x": xs, "y": ys,
+                           "exponents": scaling_exponents(xs, ys),
+                           "knee": find_knee(xs, ys)})
+    return curves
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    return "%.3g" %value
+
+
+def write_report(results, out_dir):
+    """
+    Writes results.json, results.csv and report.txt to out_dir.
+
+    Parameters
+    ----------
+    results : list of dicts
+        The measurements of the sweeps.
+    out_dir : string
+        The directory to write to. Is created if it does not exist.
+
+    Returns
+    -------
+    curves : list of dicts
+        The curves, as returned by analyze.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    curves = analyze(results)
+    with open(os.path.join(out_dir, "results.json"), "w") as outfile:
+        json.dump({"results": results, "curves": curves}, outfile,
+                  indent=2, sort_keys=True)
+    fields = sorted(set(k for r in results for k in r.keys()))
+    with open(os.path.join(out_dir, "results.csv"), "w") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fields)
+        writer.writeheader()
+        for r in results:
+            writer.writerow(r)
+    with open(os.path.join(out_dir, "report.txt"), "w") as outfile:
+        for c in curves:
+            outfile.write("%s / %s / %s\n" %(c["sweep"], c["driver"],
+                                            c["metric"]))
+            outfile.write("    x:         %s\n" %"  ".join(
+                _format_value(x) for x in c["x"]))
+            outfile.write("    y:         %s\n" %"  ".join(
+                _format_value(y) for y in c["y"]))
+            outfile.write("    exponents: %s\n" %"  ".join(
+                _format_value(e) for e in c["exponents"]))
+            outfile.write("    knee:      %s\n\n" %_format_value(c["knee"]))
+    return curves
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Runs the apsis scaling benchmarks.")
+    parser.add_argument("--out_dir", required=True,
+                        help="The directory to write the results to.")
+    parser.add_argument("--sweeps", nargs="+",
+                        default=["experiment_size", "dimensions", "workers"],
+                        help="The sweeps to run.")
+    parser.add_argument("--drivers", nargs="+", default=DEFAULT_DRIVERS,
+                        help="The drivers to use, lab and/or rest.")
+    parser.add_argument("--optimizer", default="RandomSearch",
+                        help="The optimizer of the experiments.")
+    parser.add_argument("--multiprocessing", default="none",
+                        help="The multiprocessing argument of the optimizer.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--dimensions", nargs="+", type=int,
+                        default=DEFAULT_DIMENSIONS)
+    parser.add_argument("--nominal_width", type=int, default=20,
+                        help="The number of values of the nominal parameters "
+                             "in the nominal dimensions sweep.")
+    parser.add_argument("--workers", nargs="+", type=int,
+                        default=DEFAULT_WORKERS)
+    parser.add_argument("--steps", type=int, default=20,
+                        help="The candidates evaluated per measurement "
+                             "(per worker in the workers sweep).")
+    args = parser.parse_args()
+
+    get_logger("scaling_benchmark", save_path=args.out_dir)
+    optimizer_arguments = {"multiprocessing": args.multiprocessing}
+    results = []
+    if "experiment_size" in args.sweeps:
+        results.extend(sweep_experiment_size(
+            args.sizes, args.drivers, args.optimizer, optimizer_arguments,
+            steps=args.steps))
+    if "dimensions" in args.sweeps:
+        results.extend(sweep_dimensions(
+            args.dimensions, args.drivers, args.optimizer, optimizer_arguments,
+            steps=args.steps))
+        results.extend(sweep_dimensions(
+            args.dimensions, args.drivers, args.optimizer, optimizer_arguments,
+            nominal_width=args.nominal_width, steps=args.steps))
+    if "workers" in args.sweeps:
+        results.extend(sweep_workers(
+            args.workers, args.drivers, args.optimizer, optimizer_arguments,
+            steps=max(1, args.steps // 4)))
+    for c in write_report(results, args.out_dir):
+        if c["knee"] is not None:
+            print("%s / %s / %s bends at %s" %(c["sweep"], c["driver"],
+                                               c["metric"], c["knee"]))
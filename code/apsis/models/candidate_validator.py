@@ -0,0 +1,95 @@
+__author__ = 'Frederik Diehl'
+
+
+class CandidateValidator(object):
+    """
+    Validates parameter dicts against a fixed set of parameter definitions.
+
+    The validator is compiled once from the parameter definitions, using the
+    validators returned by each ParamDef's compile_validator. It does not log,
+    and does not notice later changes to the parameter definitions; an
+    experiment compiles a new one when its parameter_definitions are replaced.
+
+    Attributes
+    ----------
+    parameter_definitions : dict of ParamDef
+        The parameter definitions this validator was compiled from.
+    keys : frozenset
+        The names of all parameters.
+    """
+    parameter_definitions = None
+    keys = None
+
+    _validators = None
+
+    def __init__(self, parameter_definitions):
+        """
+        Compiles the validator.
+
+        Parameters
+        ----------
+        parameter_definitions : dict of ParamDef
+            The parameter definitions to validate against.
+        """
+        self.parameter_definitions = parameter_definitions
+        self.keys = frozenset(parameter_definitions)
+        self._validators = tuple(
+            (name, parameter_definitions[name].compile_validator())
+            for name in sorted(parameter_definitions))
+
+    def is_valid(self, params):
+        """
+        Returns whether params is a valid parameter dict.
+
+        Parameters
+        ----------
+        params : dict
+            The parameter dict, for example the params of a Candidate.
+
+        Returns
+        -------
+        valid : bool
+            True iff params has exactly the keys of the parameter definitions,
+            and every value is in its parameter domain.
+        """
+        if len(params) != len(self.keys) or not self.keys.issuperset(params):
+            return False
+        for name, validator in self._validators:
+            if not validator(params[name]):
+                return False
+        return True
+
+    def invalid_indices(self, param_dicts):
+        """
+        Validates several parameter dicts at once.
+
+        The values are checked one parameter at a time, so each compiled
+        validator is applied to all dicts in turn.
+
+        Parameters
+        ----------
+        param_dicts : list of dicts
+            The parameter dicts to validate.
+
+        Returns
+        -------
+        invalid : list of ints
+            The sorted indices of the invalid parameter dicts.
+        """
+        invalid = set()
+        remaining = []
+        for i, params in enumerate(param_dicts):
+            if len(params) != len(self.keys) or \
+                    not self.keys.issuperset(params):
+                invalid.add(i)
+            else:
+                remaining.append(i)
+        for name, validator in self._validators:
+            still_valid = []
+            for i in remaining:
+                if validator(param_dicts[i][name]):
+                    still_valid.append(i)
+                else:
+                    invalid.add(i)
+            remaining = still_valid
+        return sorted(invalid)
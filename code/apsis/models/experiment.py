@@ -2,9 +2,13 @@ __author__ = 'Frederik Diehl'
 
 from apsis.models.candidate import Candidate
 from apsis.models.parameter_definition import ParamDef
+from apsis.models.candidate_validator import CandidateValidator
 import copy
 import uuid
+import math
+from array import array
 import time
+from collections import OrderedDict
 from apsis.utilities.param_def_utilities import dict_to_param_defs
 import json
 from apsis.models import candidate
@@ -38,11 +42,23 @@ class Experiment(object):
         These Candidate instances have finished evaluated.
     best_candidate : Candidate instance
         The as of yet best Candidate instance found, according to the result.
+    worst_candidate : Candidate instance
+        The as of yet worst Candidate instance found, not counting failed
+        ones. Both are kept up to date as candidates finish.
     note : string, optional
         The note can be used to add additional human-readable information to
         the experiment.
     last_update_time : float
         The time the last update happened.
+    update_sequence : int
+        A counter incremented on every candidate update. Every candidate
+        change is recorded with the sequence number it happened at, which
+        allows returning only the candidates changed since a known sequence
+        number.
+    intermediate_results : dict
+        The intermediate results reported for candidates, for example one
+        per training epoch. Maps each cand_id to a tuple of two arrays of
+        doubles, the steps and the values. Steps are strictly increasing.
     """
     name = None
 
@@ -57,8 +73,15 @@ class Experiment(object):
     candidates_finished = None
 
     best_candidate = None
+    worst_candidate = None
 
     last_update_time = None
+    update_sequence = None
+
+    intermediate_results = None
+
+    _candidate_changes = None
+    _validator = None
 
     _logger = None
 
@@ -123,8 +146,11 @@ class Experiment(object):
         self.candidates_finished = []
         self.candidates_pending = []
         self.candidates_working = []
+        self.intermediate_results = {}
 
         self.last_update_time = time.time()
+        self.update_sequence = 0
+        self._candidate_changes = OrderedDict()
 
         self.notes = notes
         self._logger.debug("Initialization of new experiment finished.")
@@ -134,7 +160,7 @@ class Experiment(object):
         Announces a Candidate instance to be finished evaluating.
 
         This moves the Candidate instance to the candidates_finished list and
-        updates the best_candidate.
+        updates the best_candidate and worst_candidate.
 
         Parameters
         ----------
@@ -148,19 +174,48 @@ class Experiment(object):
         """
         self._logger.debug("Adding finished candidate %s", candidate)
         self._check_candidate(candidate)
+        self._add_finished(candidate)
+        self._logger.debug("Added finished candidate %s", candidate)
+
+    def add_finished_candidates(self, candidates):
+        """
+        Announces several Candidate instances to be finished evaluating.
+
+        This is equivalent to calling add_finished for each candidate, but
+        validates all candidates in one batch before adding any of them.
+
+        Parameters
+        ----------
+        candidates : list of Candidates
+            The Candidates to be added to the finished list.
+
+        Raises
+        ------
+        ValueError :
+            Iff any candidate is not a Candidate object or not valid. In that
+            case, no candidate is added.
+        """
+        self._logger.debug("Adding %s finished candidates", len(candidates))
+        self._check_candidates(candidates)
+        for candidate in candidates:
+            self._add_finished(candidate)
+        self._logger.debug("Added %s finished candidates", len(candidates))
+
+    def _add_finished(self, candidate):
+        """
+        Moves an already validated candidate to candidates_finished.
+        """
         if candidate in self.candidates_pending:
             self.candidates_pending.remove(candidate)
         if candidate in self.candidates_working:
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._forget_best(candidate)
 
-        cur_time = time.time()
-        candidate.last_update_time = cur_time
-        self.last_update_time = cur_time
+        self._record_change(candidate, "finished")
         self.candidates_finished.append(candidate)
-        self._update_best()
-        self._logger.debug("Added finished candidate %s", candidate)
+        self._update_best_with(candidate)
 
     def add_pending(self, candidate):
         """
@@ -188,14 +243,11 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._forget_best(candidate)
 
-        cur_time = time.time()
-        candidate.last_update_time = cur_time
-        self.last_update_time = cur_time
+        self._record_change(candidate, "pending")
 
         self.candidates_pending.append(candidate)
-
-        self._update_best()
         self._logger.debug("Added pending candidate %s", candidate)
 
     def add_working(self, candidate):
@@ -223,13 +275,11 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._forget_best(candidate)
 
-        cur_time = time.time()
-        candidate.last_update_time = cur_time
-        self.last_update_time = cur_time
+        self._record_change(candidate, "working")
 
         self.candidates_working.append(candidate)
-        self._update_best()
         self._logger.debug("Added working candidate %s", candidate)
 
     def add_pausing(self, candidate):
@@ -260,16 +310,194 @@ class Experiment(object):
             self.candidates_working.remove(candidate)
         if candidate in self.candidates_finished:
             self.candidates_finished.remove(candidate)
+            self._forget_best(candidate)
+
+        self._record_change(candidate, "pending")
+
+        self.candidates_pending.append(candidate)
+        self._logger.debug("Pausing candidate %s", candidate)
+
+    def add_intermediate_results(self, candidate, results):
+        """
+        Adds intermediate results of candidate.
+
+        Only results with a step greater than the last known step of
+        candidate are added, so the full series can be sent repeatedly.
+
+        Parameters
+        ----------
+        candidate : Candidate
+            The candidate the results belong to. It has to be part of this
+            experiment.
+        results : list of (step, value) tuples
+            The intermediate results, ordered by step. Both step and value
+            are floats.
+
+        Raises
+        ------
+        ValueError :
+            Iff candidate is no Candidate object or not part of this
+            experiment, or results are not a list of (step, value) tuples.
+        """
+        self._logger.debug("Adding intermediate results %s for %s", results,
+                           candidate)
+        self._check_candidate(candidate)
+        change = self._candidate_changes.get(candidate.cand_id, None)
+        if change is None:
+            raise ValueError("Candidate %s is not part of this experiment."
+                             %candidate)
+        steps, values = self.intermediate_results.get(
+            candidate.cand_id, (array('d'), array('d')))
+        last_step = steps[-1] if steps else -float("inf")
+        new_steps, new_values = array('d'), array('d')
+        for r in results:
+            if len(r) != 2:
+                raise ValueError("Intermediate results have to be (step, "
+                                 "value) tuples, got %s." %(r,))
+            step, value = float(r[0]), float(r[1])
+            if step > last_step and not math.isnan(value):
+                new_steps.append(step)
+                new_values.append(value)
+                last_step = step
+        if not new_steps:
+            return
+        # New arrays are created, so snapshots sharing the old ones stay
+        # consistent.
+        self.intermediate_results[candidate.cand_id] = (steps + new_steps,
+                                                        values + new_values)
+        self._record_change(candidate, change[2])
+
+    def get_intermediate_results(self, cand_id):
+        """
+        Returns the intermediate results of a candidate.
+
+        Parameters
+        ----------
+        cand_id : string
+            The id of the candidate.
+
+        Returns
+        -------
+        results : list of (step, value) tuples
+            The intermediate results ordered by step. Empty if there are
+            none.
+        """
+        steps, values = self.intermediate_results.get(cand_id, ((), ()))
+        return zip(steps, values)
+
+    def get_candidates_since(self, since=0, limit=None, since_time=None):
+        """
+        Returns the candidates which have changed after a certain point.
+
+        Changes are kept ordered by their update sequence number, so this
+        only walks the changes newer than since (or since_time). The cost of
+        this therefore scales with the number of changes, not with the number
+        of candidates in the experiment.
+
+        Parameters
+        ----------
+        since : int, optional
+            Only candidates changed at a sequence number greater than since
+            are returned. The default of 0 returns all candidates.
+        limit : int or None, optional
+            The maximum number of candidates to return. If more have changed,
+            the oldest changes are returned first, and the next page can be
+            requested by using the returned cursor as since. None (default)
+            means no limit.
+        since_time : float or None, optional
+            If given, additionally only returns candidates whose last update
+            happened after since_time.
+
+        Returns
+        -------
+        changes : list of tuples
+            One (sequence, status, candidate) tuple per changed candidate,
+            ordered ascending by sequence. status is one of "finished",
+            "pending" and "working".
+        cursor : int
+            The sequence number of the last returned change. Use it as since
+            in the next call.
+        has_more : bool
+            True iff more changes exist than limit allowed to return.
+        """
+        self._logger.debug("Returning candidates since %s, limit %s, "
+                           "since_time %s", since, limit, since_time)
+        if since is None:
+            since = 0
+        changes = []
+        for cand_id in reversed(self._candidate_changes):
+            sequence, update_time, status, cand = \
+                self._candidate_changes[cand_id]
+            if sequence <= since:
+                break
+            if since_time is not None and update_time <= since_time:
+                break
+            changes.append((sequence, status, cand))
+        changes.reverse()
+
+        has_more = False
+        if limit is not None and len(changes) > limit:
+            changes = changes[:limit]
+            has_more = True
+        cursor = since
+        if changes:
+            cursor = changes[-1][0]
+        self._logger.debug("Found %s changes, cursor %s, has_more %s",
+                           len(changes), cursor, has_more)
+        return changes, cursor, has_more
+
+    def _record_change(self, candidate, status):
+        """
+        Records that candidate has changed to status.
+
+        Updates the update times of candidate and the experiment, increments
+        update_sequence and moves candidate to the newest end of the change
+        index.
 
+        Parameters
+        ----------
+        candidate : Candidate
+            The changed candidate.
+        status : {"finished", "pending", "working"}
+            The list the candidate is now part of.
+        """
         cur_time = time.time()
         candidate.last_update_time = cur_time
         self.last_update_time = cur_time
+        self.update_sequence += 1
+        self._candidate_changes.pop(candidate.cand_id, None)
+        self._candidate_changes[candidate.cand_id] = (self.update_sequence,
+                                                      cur_time, status,
+                                                      candidate)
 
-        self.candidates_pending.append(candidate)
-        self._update_best()
-        self._logger.debug("Pausing candidate %s", candidate)
+    def _rebuild_change_index(self, update_sequence=0):
+        """
+        Rebuilds the change index from the candidate lists.
+
+        Candidates are ordered by their last_update_time and get the
+        sequence numbers directly before update_sequence. This way, any
+        cursor handed out before the index was rebuilt at most returns a
+        superset of the real changes, never less.
 
-    def better_cand(self, candidateA, candidateB):
+        Parameters
+        ----------
+        update_sequence : int, optional
+            The last known update sequence. If smaller than the number of
+            candidates, the number of candidates is used instead.
+        """
+        status_cands = [("finished", c) for c in self.candidates_finished]
+        status_cands.extend([("pending", c) for c in self.candidates_pending])
+        status_cands.extend([("working", c) for c in self.candidates_working])
+        status_cands.sort(key=lambda x: x[1].last_update_time)
+
+        self.update_sequence = max(update_sequence, len(status_cands))
+        first_sequence = self.update_sequence - len(status_cands) + 1
+        self._candidate_changes = OrderedDict()
+        for i, (status, cand) in enumerate(status_cands):
+            self._candidate_changes[cand.cand_id] = (
+                first_sequence + i, cand.last_update_time, status, cand)
+
+    def better_cand(self, candidateA, candidateB, validate=True):
         """
         Determines whether CandidateA is better than candidateB in the context
         of this experiment.
@@ -286,6 +514,10 @@ class Experiment(object):
             The candidate which should be better.
         candidateB : Candidate
             The baseline candidate.
+        validate : bool, optional
+            Whether to check that both candidates are valid for this
+            experiment. Can be set to False for candidates which are already
+            part of it. Default is True.
 
         Returns
         -------
@@ -313,29 +545,11 @@ class Experiment(object):
             self._logger.debug("candidateB is None; returning True")
             return True
 
-        if not self._check_candidate(candidateA):
-            raise ValueError("candidateA is not valid.")
-        if not self._check_candidate(candidateB):
-            raise ValueError("candidateB is not valid.")
-
-        a_result = candidateA.result
-        b_result = candidateB.result
-
-        comparison = None
-        if a_result is None or candidateA.failed:
-            comparison = False
-        elif b_result is None or candidateB.failed:
-            comparison = True
-        elif self.minimization_problem:
-            if a_result < b_result:
-                comparison = True
-            else:
-                comparison = False
-        else:
-            if a_result > b_result:
-                comparison = True
-            else:
-                comparison = False
+        if validate:
+            self._check_candidate(candidateA)
+            self._check_candidate(candidateB)
+
+        comparison = self._result_better(candidateA, candidateB)
         self._logger.debug("Comparison result: %s", comparison)
         return comparison
 
@@ -395,6 +609,30 @@ class Experiment(object):
         self._logger.debug("Cloned experiment is %s", copied_experiment)
         return copied_experiment
 
+    def snapshot(self):
+        """
+        Creates a snapshot of this experiment and returns it.
+
+        In contrast to clone, this is a shallow copy: Only the candidate lists
+        and the change index are copied, while the candidates and parameter
+        definitions are shared. The snapshot can therefore be handed to
+        another thread, which can read the lists while this experiment keeps
+        being modified.
+
+        Returns
+        -------
+            snapshot : Experiment
+                A shallow copy of this experiment with copied candidate lists.
+        """
+        self._logger.debug("Creating experiment snapshot.")
+        snapshot = copy.copy(self)
+        snapshot.candidates_finished = list(self.candidates_finished)
+        snapshot.candidates_pending = list(self.candidates_pending)
+        snapshot.candidates_working = list(self.candidates_working)
+        snapshot._candidate_changes = OrderedDict(self._candidate_changes)
+        snapshot.intermediate_results = dict(self.intermediate_results)
+        return snapshot
+
     def _check_candidate(self, cand):
         """
         Checks whether cand is valid for this experiment.
@@ -413,17 +651,52 @@ class Experiment(object):
                              "%s", cand)
             raise ValueError("cand is not an instance of Candidate but is"
                              "%s" % cand)
-        if not set(cand.params.keys()) == set(self.parameter_definitions.keys()):
+        if not self._get_validator().is_valid(cand.params):
             self._logger.error("cand %s is not valid.", cand)
             raise ValueError("cand %s is not valid." % cand)
+        return True
+
+    def _check_candidates(self, cands):
+        """
+        Checks whether all of cands are valid for this experiment.
+
+        Parameter
+        ---------
+        cands : list of Candidates
+            Candidates to check
 
-        for k in cand.params:
-            if not self.parameter_definitions[k].\
-                    is_in_parameter_domain(cand.params[k]):
-                self._logger.error("cand %s is not valid.", cand)
-                raise ValueError("cand %s is not valid." % cand)
+        Raises
+        ------
+        ValueError :
+            If any of cands is not a Candidate or not valid.
+        """
+        for cand in cands:
+            if not isinstance(cand, Candidate):
+                self._logger.error("cand is not an instance of Candidate but "
+                                   "is %s", cand)
+                raise ValueError("cand is not an instance of Candidate but is"
+                                 "%s" % cand)
+        invalid = self._get_validator().invalid_indices(
+            [cand.params for cand in cands])
+        if invalid:
+            invalid = [cands[i] for i in invalid]
+            self._logger.error("cands %s are not valid.", invalid)
+            raise ValueError("cands %s are not valid." % invalid)
         return True
 
+    def _get_validator(self):
+        """
+        Returns the CandidateValidator for the parameter definitions.
+
+        It is compiled on first use, and again whenever parameter_definitions
+        has been replaced.
+        """
+        if self._validator is None or self._validator.parameter_definitions \
+                is not self.parameter_definitions:
+            self._logger.debug("Compiling candidate validator.")
+            self._validator = CandidateValidator(self.parameter_definitions)
+        return self._validator
+
     def _check_param_dict(self, param_dict):
         """
         Checks whether parameter dictionary is valid for this experiment.
@@ -441,22 +714,12 @@ class Experiment(object):
         acceptable : bool
             True iff the dictionary is valid
         """
-        self._logger.debug("Checking parameter dictionary %s", param_dict)
-        if not set(param_dict.keys()) == set(self.parameter_definitions.keys()):
-            self._logger.debug("Returned false due to keys not being "
-                               "identical.")
-            return False
-
-        for k in param_dict:
-            if not self.parameter_definitions[k].is_in_parameter_domain(param_dict[k]):
-                self._logger.debug("Returned false due to param_def %s not"
-                                   "being in parameter domain %s", k,
-                                   self.parameter_definitions[k])
-                return False
-        self._logger.debug("Returning True; dict acceptable.")
-        return True
+        acceptable = self._get_validator().is_valid(param_dict)
+        self._logger.debug("Parameter dictionary %s acceptable: %s",
+                           param_dict, acceptable)
+        return acceptable
 
-    def to_dict(self):
+    def to_dict(self, since=None, limit=None):
         """
         Generates a dictionary describing the current state of the experiment.
 
@@ -473,6 +736,21 @@ class Experiment(object):
                 Contains, for each candidate in the respective list, a
                 dictionary as defined by Candidate.to_dict().
             - "best_candidate": The best candidate or None.
+            - "update_sequence": The current update sequence number.
+            - "intermediate_results": For each contained candidate with
+                intermediate results, a key/value pair of its cand_id and a
+                list of two lists, the steps and the values.
+        If since or limit are given, the candidate lists only contain the
+        candidates changed since then (see get_candidates_since), and the
+        dictionary additionally contains "cursor" and "has_more".
+
+        Parameters
+        ----------
+        since : int or None, optional
+            If given, only candidates changed after this update sequence
+            number are contained in the candidate lists.
+        limit : int or None, optional
+            The maximum number of candidates in all candidate lists combined.
 
         Returns
         -------
@@ -484,20 +762,40 @@ class Experiment(object):
         param_defs = {}
         for k in self.parameter_definitions:
             param_defs[k] = self.parameter_definitions[k].to_dict()
-        cand_dict_finished = [c.to_dict() for c in self.candidates_finished]
-        cand_dict_pending = [c.to_dict() for c in self.candidates_pending]
-        cand_dict_working = [c.to_dict() for c in self.candidates_working]
 
         result_dict = {"name": self.name,
                 "parameter_definitions": param_defs,
                 "minimization_problem": self.minimization_problem,
                 "notes": self.notes,
                 "exp_id": self.exp_id,
-                "candidates_finished": cand_dict_finished,
-                "candidates_pending": cand_dict_pending,
-                "candidates_working": cand_dict_working,
-                "last_update_time": self.last_update_time
+                "last_update_time": self.last_update_time,
+                "update_sequence": self.update_sequence
                 }
+        if since is None and limit is None:
+            result_dict["candidates_finished"] = [
+                c.to_dict() for c in self.candidates_finished]
+            result_dict["candidates_pending"] = [
+                c.to_dict() for c in self.candidates_pending]
+            result_dict["candidates_working"] = [
+                c.to_dict() for c in self.candidates_working]
+        else:
+            changes, cursor, has_more = self.get_candidates_since(since, limit)
+            for status in ["finished", "pending", "working"]:
+                result_dict["candidates_" + status] = []
+            for sequence, status, cand in changes:
+                result_dict["candidates_" + status].append(cand.to_dict())
+            result_dict["cursor"] = cursor
+            result_dict["has_more"] = has_more
+
+        intermediate_results = {}
+        for status in ["finished", "pending", "working"]:
+            for c in result_dict["candidates_" + status]:
+                series = self.intermediate_results.get(c["cand_id"], None)
+                if series is not None:
+                    intermediate_results[c["cand_id"]] = [series[0].tolist(),
+                                                          series[1].tolist()]
+        result_dict["intermediate_results"] = intermediate_results
+
         if self.best_candidate is not None:
             result_dict["best_candidate"] = self.best_candidate.to_dict()
         else:
@@ -505,26 +803,79 @@ class Experiment(object):
         self._logger.debug("Final dictionary: %s", result_dict)
         return result_dict
 
+    def _result_better(self, candidateA, candidateB):
+        """
+        Returns whether candidateA is better than candidateB.
+
+        This is better_cand without checking the candidates, for candidates
+        already known to be valid.
+        """
+        if candidateA is None or candidateA.result is None or \
+                candidateA.failed:
+            return False
+        if candidateB is None or candidateB.result is None or \
+                candidateB.failed:
+            return True
+        if self.minimization_problem:
+            return candidateA.result < candidateB.result
+        return candidateA.result > candidateB.result
+
     def _update_best(self):
+        """
+        Recomputes best_candidate and worst_candidate from all finished
+        candidates.
+        """
         self._logger.debug("Updating best candidate.")
-        best_candidate = None
+        self.best_candidate = None
+        self.worst_candidate = None
         for c in self.candidates_finished:
-            if self.better_cand(c, best_candidate):
-                best_candidate = c
-                self._logger.debug("Found new better candidate: %s", c)
-        self._logger.debug("Best candidate now %s", best_candidate)
-        self.best_candidate = best_candidate
+            self._update_best_with(c)
+        self._logger.debug("Best candidate now %s", self.best_candidate)
+
+    def _update_best_with(self, candidate):
+        """
+        Updates best_candidate and worst_candidate with a finished candidate.
+        """
+        if candidate.failed or candidate.result is None:
+            return
+        if self._result_better(candidate, self.best_candidate):
+            self.best_candidate = candidate
+            self._logger.debug("Found new better candidate: %s", candidate)
+        if self.worst_candidate is None or \
+                self._result_better(self.worst_candidate, candidate):
+            self.worst_candidate = candidate
+
+    def _forget_best(self, candidate):
+        """
+        Updates best_candidate and worst_candidate after candidate has been
+        removed from candidates_finished.
+
+        This only needs to look at all finished candidates if candidate was
+        the best or the worst one.
+        """
+        if candidate == self.best_candidate or \
+                candidate == self.worst_candidate:
+            self._update_best()
 
     def write_state_to_file(self, path):
+        """
+        Writes the experiment to experiment.json in path.
+
+        Returns
+        -------
+        num_bytes : int
+            The number of bytes written.
+        """
         self._logger.debug("Writing stats to %s", path)
         with open(path + '/experiment.json', 'w') as outfile:
             json.dump(self.to_dict(), outfile)
+            return outfile.tell()
 
 
 
 def from_dict(d):
     experiment_logger = logging_utils.get_logger("models.Experiment")
-    experiment_logger.log(5, "Reconstructing experiment from dict %d", d)
+    experiment_logger.log(5, "Reconstructing experiment from dict %s", d)
     name = d["name"]
     param_defs = dict_to_param_defs(d["parameter_definitions"])
     minimization_problem = d["minimization_problem"]
@@ -550,9 +901,14 @@ def from_dict(d):
 
     exp.candidates_finished = cands_finished
     exp.candidates_pending = cands_pending
-    exp.candidates_working = exp.candidates_working
+    exp.candidates_working = cands_working
+    for cand_id, (steps, values) in d.get("intermediate_results",
+                                          {}).items():
+        exp.intermediate_results[cand_id] = (array('d', steps),
+                                             array('d', values))
     exp._update_best()
     exp.last_update_time = d.get("last_update_time", time.time())
+    exp._rebuild_change_index(d.get("update_sequence", 0))
 
     experiment_logger.log(5, "Finished reconstruction. Exp is %s.", exp)
 
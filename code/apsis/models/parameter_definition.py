@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
 import math
 import sys
+import numpy as np
 from apsis.utilities import logging_utils
 
 class ParamDef(object):
@@ -40,6 +41,33 @@ class ParamDef(object):
         """
         pass
 
+    def compile_validator(self):
+        """
+        Returns a function testing whether a value is in the parameter domain.
+
+        The function is equivalent to is_in_parameter_domain, but does not log
+        and may precompute whatever the test needs. It is meant to be compiled
+        once and called often, so later changes to this definition are not
+        reflected in it.
+
+        Returns
+        -------
+        validator : callable
+            Called with a value, returns True iff the value is in the
+            parameter domain.
+        """
+        return self.is_in_parameter_domain
+
+    def _overrides_domain_test(self, cls):
+        """
+        Returns whether is_in_parameter_domain is overridden below cls.
+
+        Subclasses of cls with their own domain test cannot use the validator
+        compiled by cls.
+        """
+        return (type(self).is_in_parameter_domain.__func__ is not
+                cls.is_in_parameter_domain.__func__)
+
     def distance(self, valueA, valueB):
         """
         Returns the distance between `valueA` and `valueB`.
@@ -113,6 +141,25 @@ class ParamDef(object):
         """
         pass
 
+    def warp_out_batch(self, warped_values):
+        """
+        Warps many [0, 1] hypercube positions out at once.
+
+        This is equivalent to calling warp_out for each row of warped_values.
+        Subclasses override it with a vectorized version where possible.
+
+        Parameters
+        ----------
+        warped_values : array-like of floats in [0, 1]
+            The warped values, in the shape (n, warped_size()).
+
+        Returns
+        -------
+        unwarped_values : list
+            The n unwarped values.
+        """
+        return [self.warp_out(list(v)) for v in np.asarray(warped_values)]
+
 
 class ComparableParamDef(object):
     """
@@ -202,6 +249,28 @@ class NominalParamDef(ParamDef):
         self._logger.debug("In param domain: %s", is_in_param_domain)
         return is_in_param_domain
 
+    def compile_validator(self):
+        """
+        Tests membership in a hash set of the values instead of the list.
+
+        Unhashable values, or values unhashable as a whole, fall back to the
+        list.
+        """
+        if self._overrides_domain_test(NominalParamDef):
+            return super(NominalParamDef, self).compile_validator()
+        values = list(self.values)
+        try:
+            value_set = frozenset(values)
+        except TypeError:
+            return values.__contains__
+
+        def validator(value):
+            try:
+                return value in value_set
+            except TypeError:
+                return value in values
+        return validator
+
     def warp_in(self, unwarped_value):
         self._logger.debug("Warping in %s", unwarped_value)
         warped_value = [0]*len(self.values)
@@ -216,6 +285,11 @@ class NominalParamDef(ParamDef):
         self._logger.debug("Results in %s", unwarped_value)
         return unwarped_value
 
+    def warp_out_batch(self, warped_values):
+        self._logger.debug("Warping out %s values", len(warped_values))
+        indices = np.argmax(np.asarray(warped_values), axis=1)
+        return [self.values[i] for i in indices]
+
     def warped_size(self):
         warped_size = len(self.values)
         self._logger.debug("Warped size: %s", warped_size)
@@ -442,6 +516,14 @@ class MinMaxNumericParamDef(NumericParamDef):
         self._logger.debug("Warped out to %s", result)
         return result
 
+    def warp_out_batch(self, warped_values):
+        self._logger.debug("Warping out %s values", len(warped_values))
+        modifed_lower = self.lower_bound + (0 if self.include_lower else self.epsilon )
+        modifed_upper = self.upper_bound - (0 if self.include_upper else self.epsilon )
+        warped_values = np.asarray(warped_values, dtype=float)[:, 0]
+        result = warped_values*(modifed_upper - modifed_lower) + modifed_lower
+        return result.tolist()
+
     def warped_size(self):
         self._logger.debug("Warped size is always 1.")
         return 1
@@ -459,6 +541,22 @@ class MinMaxNumericParamDef(NumericParamDef):
         self._logger.debug("Seems to fit.")
         return True
 
+    def compile_validator(self):
+        """
+        Compares against the bounds as fixed when compiling.
+        """
+        if self._overrides_domain_test(MinMaxNumericParamDef):
+            return super(MinMaxNumericParamDef, self).compile_validator()
+        lower_bound, upper_bound = self.lower_bound, self.upper_bound
+        include_lower, include_upper = self.include_lower, self.include_upper
+
+        def validator(value):
+            return ((lower_bound < value or
+                     (include_lower and lower_bound <= value)) and
+                    (upper_bound > value or
+                     (include_upper and upper_bound >= value)))
+        return validator
+
 
 class PositionParamDef(OrdinalParamDef):
     """
@@ -507,6 +605,17 @@ class PositionParamDef(OrdinalParamDef):
         self._logger.debug("Warped out to %s", result)
         return result
 
+    def warp_out_batch(self, warped_values):
+        self._logger.debug("Warping out %s values", len(warped_values))
+        warped_values = np.asarray(warped_values, dtype=float)[:, 0]
+        positions = np.asarray(self.positions, dtype=float)
+        pos = (warped_values * (positions.max() - positions.min()) +
+               positions.min())
+        indices = np.argmin(np.abs(positions[None, :] - pos[:, None]), axis=1)
+        indices[warped_values < 0] = 0
+        indices[warped_values > 1] = len(self.values) - 1
+        return [self.values[i] for i in indices]
+
     def warped_size(self):
         self._logger.debug("Warped size is always 1.")
         return 1
@@ -758,6 +867,18 @@ class AsymptoticNumericParamDef(NumericParamDef):
         self._logger.debug("Normal case. Warped out is %s", unwarped_value)
         return unwarped_value
 
+    def warp_out_batch(self, warped_values):
+        self._logger.debug("Warping out %s values", len(warped_values))
+        warped_values = np.clip(np.asarray(warped_values, dtype=float)[:, 0],
+                                0, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = 10**(np.log(1-(warped_values-self.asymptotic_border)/
+                                (self.border-self.asymptotic_border)) /
+                          math.log(2))
+        result[warped_values == 0] = self.border
+        result[warped_values == 1] = self.asymptotic_border
+        return result.tolist()
+
     def warped_size(self):
         self._logger.debug("Warped size is always 1.")
         return 1
@@ -1,9 +1,29 @@
 from abc import ABCMeta, abstractmethod
 import numpy as np
+import scipy.linalg
 import scipy.optimize
 from scipy.stats import multivariate_normal
+from scipy.special import ndtr
 import random
+import threading
+import time
 from apsis.utilities.logging_utils import get_logger
+from apsis.utilities import metrics
+from apsis.utilities.space_filling import check_design, design_dimensions, \
+    warp_design
+
+_search_seconds = metrics.histogram(
+    "apsis_acquisition_search_seconds",
+    "Duration of computing proposals from an acquisition function.",
+    ["acquisition"])
+_evaluations_total = metrics.counter(
+    "apsis_acquisition_evaluations_total",
+    "Number of points the acquisition function has been evaluated on.",
+    ["acquisition"])
+_interrupted_total = metrics.counter(
+    "apsis_acquisition_searches_interrupted_total",
+    "Number of time-budgeted searches that were asked to return early.",
+    ["acquisition"])
 
 
 class AcquisitionFunction(object):
@@ -37,12 +57,29 @@ class AcquisitionFunction(object):
 
     * ``max_searcher_random`` randomly draws several proposals and returns the
         best one.
+    * ``max_searcher_local_search`` improves the best random proposals by
+        local search, without using gradients.
     * ``multi_searcher_random_best`` randomly draws several proposals and
         returns the n best.
     * ``multi_searcher_random_weighted`` randomly draws several proposals, and
         returns a list of n proposals such that the probability of each
         proposal getting returned is proportional to the quality of its result.
 
+    The random proposals of these searchers (and the starting points of the
+    LBFGSB max_searcher) are independent uniform draws by default. Setting
+    the parameter ``random_design`` to one of
+    ``space_filling.AVAILABLE_DESIGNS`` (for example ``'sobol'``) draws them
+    from a space-filling design instead.
+
+    By default, the searchers do a fixed number of steps. Setting the
+    parameter ``time_budget`` turns on the anytime mode, in which a search
+    runs until a deadline (see search_deadline) or until interrupt is
+    called, for example because a worker is waiting for a candidate. The
+    ``max_searcher_anytime`` refines its best proposals in rounds and
+    returns the best found so far when stopped, and ``max_searcher_LBFGSB``
+    keeps doing restarts until then. The random steps of the multi
+    searchers stop at the deadline, too, once they have enough proposals.
+
     Attributes
     ----------
     _logger : logger instance
@@ -57,11 +94,22 @@ class AcquisitionFunction(object):
         Which max_searcher to use if it is not defined in params.
     default_multi_searcher : string
         Which multi_searcher to use if it is not defined in params.
+    requires_cost_model : bool
+        Whether the acquisition function uses a model of the evaluation
+        cost. If True, the optimizer sets cost_gp before computing
+        proposals.
     """
 
     _logger = None
     params = None
     minimizes = True
+    requires_cost_model = False
+
+    _num_evaluations = None
+    _interrupted = None
+    _deadline = None
+    _random_design = None
+    _random_design_name = None
 
     default_max_searcher = "random"
     default_multi_searcher = "random_weighted"
@@ -83,6 +131,8 @@ class AcquisitionFunction(object):
         if params is None:
             params = {}
         self.params = params
+        self._num_evaluations = 0
+        self._interrupted = threading.Event()
 
     @abstractmethod
     def evaluate(self, x, gp, experiment):
@@ -121,6 +171,7 @@ class AcquisitionFunction(object):
         # Warning: Logs very often if activated.
         self._logger.log(5, "Computing minimizing evaluate. x is %s, gp is %s,"
                            "experiment is %s", x, gp, experiment)
+        self._num_evaluations += 1
         value = self.evaluate(x, gp, experiment)
         if self.minimizes:
             # Warning: Logs very often if activated.
@@ -131,6 +182,44 @@ class AcquisitionFunction(object):
             self._logger.log(5, "Is maximizing, returning %s", -value)
             return -value
 
+    def evaluate_batch(self, x_matrix, gp, experiment):
+        """
+        Evaluates the gp on every row of x_matrix.
+
+        The default implementation calls evaluate for each row. Subclasses
+        can override it with a vectorized version.
+
+        Parameters
+        ----------
+        x_matrix : np.array
+            The (m, D) matrix of points, each row being the warped parameter
+            values in order of key.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        evals : np.array
+            The m values of the acquisition function.
+        """
+        return np.array([
+            self.evaluate(self._translate_vector_dict(x, experiment), gp,
+                          experiment) for x in x_matrix], dtype=float).ravel()
+
+    def _compute_minimizing_evaluate_batch(self, x_matrix, gp, experiment):
+        """
+        Batch version of _compute_minimizing_evaluate.
+
+        Function signature is as evaluate_batch.
+        """
+        self._num_evaluations += len(x_matrix)
+        values = self.evaluate_batch(x_matrix, gp, experiment)
+        if self.minimizes:
+            return values
+        return -values
+
     def compute_proposals(self, gp, experiment, number_proposals=1,
                           return_max=True):
         """
@@ -167,6 +256,155 @@ class AcquisitionFunction(object):
         self._logger.debug("Computing proposals. gp is %s, experiment is %s, "
                            "number_proposals %s, return_max %s",
                            gp, experiment, number_proposals, return_max)
+        name = self.__class__.__name__
+        num_evaluations = self._num_evaluations
+        self._deadline = self.search_deadline(experiment)
+        self._logger.debug("Search deadline is %s", self._deadline)
+        try:
+            with _search_seconds.time(acquisition=name):
+                proposals = self._compute_proposals(gp, experiment,
+                                                    number_proposals,
+                                                    return_max)
+        finally:
+            if self._deadline is not None and self._interrupted.is_set():
+                _interrupted_total.inc(acquisition=name)
+            self._interrupted.clear()
+            self._deadline = None
+        _evaluations_total.inc(self._num_evaluations - num_evaluations,
+                               acquisition=name)
+        return proposals
+
+    def interrupt(self):
+        """
+        Makes a running anytime search return its best proposals so far.
+
+        May be called from any thread. Searches without a time_budget are not
+        affected. If no search is running, the next one returns after its
+        first round.
+        """
+        self._interrupted.set()
+
+    def search_deadline(self, experiment):
+        """
+        Returns the time at which an anytime search has to return.
+
+        Supported parameters are
+            "time_budget" : float, "adaptive" or None, optional
+                The seconds a search may take. If "adaptive", they are
+                computed by adaptive_time_budget. Default is None, which
+                does a fixed number of steps instead.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        deadline : float or None
+            The deadline in seconds since the epoch, or None if the search is
+            not time-budgeted.
+
+        Raises
+        ------
+        ValueError
+            If time_budget is a string other than "adaptive".
+        """
+        time_budget = self.params.get("time_budget", None)
+        if time_budget is None:
+            return None
+        if isinstance(time_budget, basestring):
+            if time_budget != "adaptive":
+                raise ValueError("time_budget must be a number, None or "
+                                 "'adaptive', not %s." %time_budget)
+            time_budget = self.adaptive_time_budget(experiment)
+        return time.time() + time_budget
+
+    def adaptive_time_budget(self, experiment):
+        """
+        Returns a search time keeping the search a fixed share of trial time.
+
+        The duration of a trial is estimated as the median time between
+        generating and finishing the most recent finished candidates. This
+        includes the time a candidate waited to be handed out. The budget is
+        chosen such that the search takes overhead_fraction of the sum of
+        search and trial time.
+
+        Supported parameters are
+            "overhead_fraction" : float, optional
+                The share of the time spent searching. Has to be between 0
+                and 1. Default is 0.1.
+            "time_budget_window" : int, optional
+                The number of most recent finished candidates used. Default
+                is 20.
+            "initial_time_budget" : float, optional
+                The budget while no finished candidate has timestamps.
+                Default is 1.
+            "min_time_budget", "max_time_budget" : float, optional
+                The budget is clipped to these. Defaults are 0.05 and 60.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment whose candidates are used.
+
+        Returns
+        -------
+        time_budget : float
+            The time budget in seconds.
+
+        Raises
+        ------
+        ValueError
+            If overhead_fraction is not between 0 and 1.
+        """
+        overhead_fraction = self.params.get("overhead_fraction", 0.1)
+        if not 0 < overhead_fraction < 1:
+            raise ValueError("overhead_fraction must be between 0 and 1, not "
+                             "%s." %overhead_fraction)
+        window = self.params.get("time_budget_window", 20)
+        durations = [c.last_update_time - c.generated_time
+                     for c in experiment.candidates_finished[-window:]
+                     if c.last_update_time is not None and
+                     c.generated_time is not None]
+        if durations:
+            time_budget = (overhead_fraction / (1 - overhead_fraction) *
+                           np.median(durations))
+        else:
+            time_budget = self.params.get("initial_time_budget", 1.)
+        time_budget = float(np.clip(time_budget,
+                                    self.params.get("min_time_budget", 0.05),
+                                    self.params.get("max_time_budget", 60.)))
+        self._logger.debug("Adaptive time budget is %s, from %s durations.",
+                           time_budget, len(durations))
+        return time_budget
+
+    def _search_stopped(self):
+        """
+        Returns whether an anytime search has to return now.
+
+        Searches without a deadline are never stopped.
+        """
+        if self._deadline is None:
+            return False
+        return self._interrupted.is_set() or time.time() >= self._deadline
+
+    def _more_rounds(self, rounds_done, num_rounds):
+        """
+        Returns whether a search should do another of its rounds.
+
+        Without a deadline, a search does num_rounds rounds. With one, it does
+        at least one round, and continues until it is stopped.
+        """
+        if self._deadline is None:
+            return rounds_done < num_rounds
+        return rounds_done == 0 or not self._search_stopped()
+
+    def _compute_proposals(self, gp, experiment, number_proposals,
+                           return_max):
+        """
+        Computes the proposals. See compute_proposals.
+        """
         max_searcher = "none"
         multi_searcher = "none"
         if return_max:
@@ -211,7 +449,8 @@ class AcquisitionFunction(object):
                                multi_searcher)
             multi_prop, good_results_cur = multi_searcher(gp, experiment,
                                           good_results=good_results,
-                                          number_proposals=number_proposals-1)
+                                          number_proposals=number_proposals -
+                                                           len(proposals))
             self._logger.debug("Finished multi search. Multi_prop is %s",
                                multi_prop)
             self._logger.log(5, "good_results_cur is %s", good_results_cur)
@@ -225,6 +464,52 @@ class AcquisitionFunction(object):
         self._logger.debug("Returning proposals %s", proposals)
         return proposals
 
+    def competitive_points(self, x_matrix, gp, experiment):
+        """
+        Returns which previously proposed points are still competitive.
+
+        The points are scored with the current gp, together with random
+        points, in a single batch evaluation. A point is competitive if it
+        scores at least as well as the rescore_quantile of the random points,
+        that is if it still lies in the most promising part of the space.
+
+        Supported parameters are
+            "rescore_quantile" : float, optional
+                The quantile of the random points' scores a point has to
+                reach. Default is 0.9.
+            "rescore_random_points" : int, optional
+                The number of random points. Default is 100.
+
+        Parameters
+        ----------
+        x_matrix : np.array
+            The (m, D) matrix of points, as in evaluate_batch.
+        gp : GPy gp
+            The gp on which to evaluate.
+        experiment : Experiment
+            The experiment for further information.
+
+        Returns
+        -------
+        indices : list of ints
+            The indices of the competitive points, best first.
+        """
+        if len(x_matrix) == 0:
+            return []
+        quantile = self.params.get("rescore_quantile", 0.9)
+        random_props = self._gen_random_props(
+            experiment, self.params.get("rescore_random_points", 100))
+        random_matrix = np.array([self._translate_dict_vector(p)
+                                  for p in random_props], dtype=float)
+        values = -self._compute_minimizing_evaluate_batch(
+            np.vstack((x_matrix, random_matrix)), gp, experiment)
+        threshold = np.percentile(values[len(x_matrix):], 100 * quantile)
+        values = values[:len(x_matrix)]
+        self._logger.debug("Rescored %s points, threshold is %s.",
+                           len(x_matrix), threshold)
+        return [i for i in np.argsort(-values, kind="mergesort")
+                if values[i] >= threshold]
+
     def max_searcher_random(self, gp, experiment, good_results=None):
         """
         Randomly searches the best result.
@@ -247,8 +532,9 @@ class AcquisitionFunction(object):
         best_param_idx = 0
         best_score = float("inf")
 
-        for i in range(optimization_random_steps):
-            param_dict_eval = self._gen_random_prop(experiment)
+        random_props = self._gen_random_props(experiment,
+                                              optimization_random_steps)
+        for i, param_dict_eval in enumerate(random_props):
             score = self._compute_minimizing_evaluate(param_dict_eval, gp,
                                                       experiment)
             if score < best_score:
@@ -262,6 +548,186 @@ class AcquisitionFunction(object):
         self._logger.log(5, "Will return %s and %s", max_prop, evaluated_params)
         return max_prop, evaluated_params
 
+    def max_searcher_local_search(self, gp, experiment, good_results=None):
+        """
+        Searches the best result by local search from the best random ones.
+
+        This first evaluates optimization_random_steps random proposals
+        (default 1000). The best local_search_starts of these (default 10)
+        and the best candidate so far are then improved by hill climbing.
+        Each step evaluates local_search_neighbours neighbours (default 20),
+        each of which changes a single parameter: numeric values are moved
+        by a gaussian step of local_search_step_size (default 0.1), nominal
+        values are set to a random value. A start is climbed for at most
+        local_search_max_steps steps (default 50), or until no neighbour is
+        better.
+
+        All proposals are evaluated in batches, and the searcher does not
+        need gradients. It is therefore the searcher to use for surrogates
+        without useful gradients, such as random forests.
+
+        For signature details see the introduction in the class docs.
+        """
+        self._logger.debug("Starting max_searcher_local_search. gp is %s, "
+                           "experiment %s, good_results %s", gp, experiment,
+                           good_results)
+        if good_results is None:
+            good_results = []
+        num_random = self.params.get("optimization_random_steps", 1000)
+        num_starts = self.params.get("local_search_starts", 10)
+        num_neighbours = self.params.get("local_search_neighbours", 20)
+        max_steps = self.params.get("local_search_max_steps", 50)
+        step_size = self.params.get("local_search_step_size", 0.1)
+
+        sizes, offsets = self._warped_layout(experiment)
+
+        points = [self._translate_dict_vector(p) for p in
+                  self._gen_random_props(experiment, num_random)]
+        if experiment.best_candidate is not None:
+            points.append(self._translate_dict_vector(
+                experiment.warp_pt_in(experiment.best_candidate.params)))
+        points = np.array(points, dtype=float).reshape(-1, offsets[-1])
+        scores = self._compute_minimizing_evaluate_batch(points, gp,
+                                                         experiment)
+        evaluated = [(points, scores)]
+
+        for start in np.argsort(scores, kind="mergesort")[:num_starts]:
+            current, current_score = points[start], scores[start]
+            for step in range(max_steps):
+                neighbours = self._gen_neighbours(current, num_neighbours,
+                                                  step_size, sizes, offsets)
+                neighbour_scores = self._compute_minimizing_evaluate_batch(
+                    neighbours, gp, experiment)
+                evaluated.append((neighbours, neighbour_scores))
+                best = np.argmin(neighbour_scores)
+                if neighbour_scores[best] >= current_score:
+                    break
+                current, current_score = neighbours[best], \
+                                         neighbour_scores[best]
+        self._logger.debug("Finished local search.")
+
+        all_points = np.concatenate([e[0] for e in evaluated])
+        all_scores = np.concatenate([e[1] for e in evaluated])
+        best_idx = np.argmin(all_scores)
+        evaluated_params = [
+            (self._translate_vector_dict(x, experiment), score)
+            for x, score in zip(all_points, all_scores)]
+        max_prop = evaluated_params[best_idx]
+        del evaluated_params[best_idx]
+        evaluated_params.extend(good_results)
+        self._logger.log(5, "Will return %s and %s", max_prop,
+                         evaluated_params)
+        return max_prop, evaluated_params
+
+    def max_searcher_anytime(self, gp, experiment, good_results=None):
+        """
+        Searches the best result in rounds until the search is stopped.
+
+        Each round evaluates anytime_batch_size random proposals (default
+        100), and anytime_neighbours neighbours (default 20, see
+        max_searcher_local_search) of each of the anytime_starts best
+        proposals so far (default 5). The step size of the neighbours starts
+        at local_search_step_size (default 0.1) and is halved whenever a
+        round does not improve the best proposal, so the best proposals are
+        refined progressively. Only the anytime_keep best proposals (default
+        1000) are kept between rounds.
+
+        With a time_budget, rounds are done until the deadline or until
+        interrupt is called, and the best proposal so far is returned.
+        Without one, anytime_rounds rounds (default 10) are done.
+
+        For signature details see the introduction in the class docs.
+        """
+        self._logger.debug("Starting max_searcher_anytime. gp is %s, "
+                           "experiment %s, good_results %s", gp, experiment,
+                           good_results)
+        if good_results is None:
+            good_results = []
+        batch_size = self.params.get("anytime_batch_size", 100)
+        num_starts = self.params.get("anytime_starts", 5)
+        num_neighbours = self.params.get("anytime_neighbours", 20)
+        num_keep = self.params.get("anytime_keep", 1000)
+        num_rounds = self.params.get("anytime_rounds", 10)
+        step_size = self.params.get("local_search_step_size", 0.1)
+
+        sizes, offsets = self._warped_layout(experiment)
+        points = np.zeros((0, offsets[-1]))
+        scores = np.zeros(0)
+        if experiment.best_candidate is not None:
+            points = np.array(self._translate_dict_vector(
+                experiment.warp_pt_in(experiment.best_candidate.params)),
+                dtype=float).reshape(1, offsets[-1])
+            scores = self._compute_minimizing_evaluate_batch(points, gp,
+                                                             experiment)
+
+        rounds_done = 0
+        while self._more_rounds(rounds_done, num_rounds):
+            new_points = [np.array(
+                [self._translate_dict_vector(p) for p in
+                 self._gen_random_props(experiment, batch_size)],
+                dtype=float).reshape(-1, offsets[-1])]
+            for start in points[:num_starts]:
+                new_points.append(self._gen_neighbours(
+                    start, num_neighbours, step_size, sizes, offsets))
+            new_points = np.concatenate(new_points)
+            new_scores = self._compute_minimizing_evaluate_batch(
+                new_points, gp, experiment)
+            if len(scores) and new_scores.min() >= scores[0]:
+                step_size /= 2.
+            points = np.concatenate((points, new_points))
+            scores = np.concatenate((scores, new_scores))
+            order = np.argsort(scores, kind="mergesort")[:num_keep]
+            points, scores = points[order], scores[order]
+            rounds_done += 1
+        self._logger.debug("Finished anytime search after %s rounds, best "
+                           "score is %s.", rounds_done, scores[0])
+
+        evaluated_params = [
+            (self._translate_vector_dict(x, experiment), score)
+            for x, score in zip(points, scores)]
+        max_prop = evaluated_params.pop(0)
+        evaluated_params.extend(good_results)
+        self._logger.log(5, "Will return %s and %s", max_prop,
+                         evaluated_params)
+        return max_prop, evaluated_params
+
+    def _warped_layout(self, experiment):
+        """
+        Returns the warped size and offset of each parameter in a vector.
+
+        Returns
+        -------
+        sizes : list of ints
+            The warped sizes of the parameters, in order of key.
+        offsets : np.array
+            The index each parameter starts at, followed by the dimension of
+            the vectors.
+        """
+        param_defs = experiment.parameter_definitions
+        sizes = [param_defs[pn].warped_size()
+                 for pn in sorted(param_defs.keys())]
+        return sizes, np.cumsum([0] + sizes)
+
+    def _gen_neighbours(self, current, num_neighbours, step_size, sizes,
+                        offsets):
+        """
+        Generates neighbours of current, each changing a single parameter.
+
+        Numeric values are moved by a gaussian step of step_size, nominal
+        values are set to a random value.
+        """
+        neighbours = np.repeat(current[None, :], num_neighbours, axis=0)
+        changed = np.random.randint(0, len(sizes), num_neighbours)
+        for i, p in enumerate(changed):
+            begin, end = offsets[p], offsets[p+1]
+            if sizes[p] == 1:
+                neighbours[i, begin] = np.clip(
+                    current[begin] + np.random.normal(0, step_size), 0, 1)
+            else:
+                neighbours[i, begin:end] = 0
+                neighbours[i, begin + np.random.randint(sizes[p])] = 1
+        return neighbours
+
     def multi_searcher_random_best(self, gp, experiment, good_results=None,
                                    number_proposals=1):
         """
@@ -305,15 +771,20 @@ class AcquisitionFunction(object):
         self._logger.log(5, "Total acquisition function values are %s",
                          acq_sum)
         props = []
-        for i in range(number_proposals):
+        for i in range(min(number_proposals, len(evaluated_params))):
             rand_acq = random.random() * acq_sum
             cur_sum = 0
+            # Falls back to the last one if rounding leaves rand_acq
+            # uncovered.
+            chosen = len(evaluated_params) - 1
             for j, p in enumerate(evaluated_params):
                 if cur_sum + p[1] > rand_acq:
-                    props.append(p)
-                    del evaluated_params[j]
+                    chosen = j
                     break
                 cur_sum += p[1]
+            # The chosen proposal no longer takes part in the next draw.
+            acq_sum -= evaluated_params[chosen][1]
+            props.append(evaluated_params.pop(chosen))
         self._logger.log(5, "Got final results. Props: %s, evaluated_params: "
                            "%s", props, evaluated_params)
         return props, evaluated_params
@@ -345,8 +816,13 @@ class AcquisitionFunction(object):
                        len(good_results)
         self._logger.debug("Requires %s random_steps", random_steps)
         if random_steps > 0:
-            for i in range(optimization_random_steps):
-                param_dict_eval = self._gen_random_prop(experiment)
+            for param_dict_eval in self._gen_random_props(
+                    experiment, optimization_random_steps):
+                if self._search_stopped() and len(evaluated_params) + \
+                        len(good_results) >= number_proposals:
+                    self._logger.debug("Search stopped after %s random "
+                                       "steps.", len(evaluated_params))
+                    break
                 score = self._compute_minimizing_evaluate(param_dict_eval, gp,
                                                           experiment)
                 evaluated_params.append((param_dict_eval, score))
@@ -383,6 +859,59 @@ class AcquisitionFunction(object):
         self._logger.log(5, "Randomly generated %s", param_dict_eval)
         return param_dict_eval
 
+    def _gen_random_props(self, experiment, number_proposals):
+        """
+        Generates several random proposals in accordance to experiment.
+
+        If the parameter random_design is "random" (the default), these are
+        independent draws as of _gen_random_prop. Otherwise, they are the
+        points of the space-filling design random_design.
+
+        Parameters
+        ----------
+        experiment : experiment
+            The experiment representing the current state.
+        number_proposals : int
+            The number of proposals to generate.
+
+        Returns
+        -------
+        param_dicts_eval : list of dicts
+            The proposals, each in the format of _gen_random_prop.
+        """
+        random_design = self.params.get("random_design", "random")
+        self._logger.log(5, "Generating %s random props with design %s",
+                         number_proposals, random_design)
+        if random_design == "random":
+            return [self._gen_random_prop(experiment)
+                    for i in range(number_proposals)]
+        param_defs = experiment.parameter_definitions
+        design = self._get_random_design(random_design,
+                                         design_dimensions(param_defs))
+        warped = warp_design(design.draw(number_proposals), param_defs)
+        return [dict((pn, warped[pn][i]) for pn in warped)
+                for i in range(number_proposals)]
+
+    def _get_random_design(self, random_design, dims):
+        """
+        Returns the space-filling design for the random proposals.
+
+        The design is created once and continued by later calls, so that
+        the proposals of several rounds together stay space-filling. Its
+        random state is seeded from numpy's global random state, like the
+        uniform random proposals.
+        """
+        design = self._random_design
+        if design is None or design.dims != dims or \
+                random_design != self._random_design_name:
+            self._logger.debug("Creating random design %s with %s "
+                               "dimensions.", random_design, dims)
+            design = check_design(random_design, dims,
+                                  random_state=np.random.randint(2**31 - 1))
+            self._random_design = design
+            self._random_design_name = random_design
+        return design
+
     def _translate_dict_vector(self, x):
         """
         We translate from a dictionary to a list format for a point's params.
@@ -518,6 +1047,9 @@ class GradientAcquisitionFunction(AcquisitionFunction):
         """
         Searches the maximum proposal via L-BFGS-B.
 
+        Does num_restarts restarts from random points (default 10). With a
+        time_budget, it instead does restarts until the search is stopped.
+
         For signature see the class docs.
         """
         self._logger.debug("Searching maximum via LBFGSB. gp is %s, "
@@ -528,7 +1060,9 @@ class GradientAcquisitionFunction(AcquisitionFunction):
             bounds.extend([(0.0, 1.0) for x in range(pd.warped_size())])
         if good_results is None:
             good_results = []
-        random_prop = self._gen_random_prop(experiment)
+        random_restarts = self.params.get("num_restarts", 10)
+        random_props = self._gen_random_props(experiment, random_restarts + 1)
+        random_prop = random_props[0]
         random_prop_result = self._compute_minimizing_evaluate(random_prop,
                                                                gp, experiment)
         good_results.append((random_prop, random_prop_result))
@@ -536,12 +1070,15 @@ class GradientAcquisitionFunction(AcquisitionFunction):
                            good_results)
         scipy_optimizer_results = []
 
-        random_restarts = self.params.get("num_restarts", 10)
         self._logger.debug("Doing %s restarts", random_restarts)
-        for i in range(random_restarts):
+        i = 0
+        while self._more_rounds(i, random_restarts):
             self._logger.log(5, "New restart.")
-            initial_guess = self._translate_dict_vector(
-                self._gen_random_prop(experiment))
+            if i + 1 >= len(random_props):
+                # An anytime search may do more restarts than planned.
+                random_props.extend(self._gen_random_props(
+                    experiment, max(random_restarts, 1)))
+            initial_guess = self._translate_dict_vector(random_props[i + 1])
             self._logger.log(5, "Initial guess is %s", initial_guess)
             result = scipy.optimize.minimize(
                 self._compute_minimizing_evaluate, x0=initial_guess,
@@ -560,6 +1097,7 @@ class GradientAcquisitionFunction(AcquisitionFunction):
                     scipy_optimizer_results.append((x_min_dict, f_min))
                 else:
                     self._logger.log(5, "Is not in hypercube. Ignoring.")
+            i += 1
 
         scipy_optimizer_results.extend(good_results)
         best_idx = [x[1] for x in scipy_optimizer_results].index(
@@ -701,6 +1239,31 @@ class ExpectedImprovement(GradientAcquisitionFunction):
         self._logger.log(5, "Evaluated. Returning %s", gradient)
         return gradient
 
+    def evaluate_batch(self, x_matrix, gp, experiment):
+        """
+        Evaluates the expected improvement on all rows of x_matrix at once.
+
+        Uses a single gp prediction; the values are the same as those of
+        evaluate.
+        """
+        self._logger.log(5, "Evaluating ExpectedImprovement on %s points",
+                         len(x_matrix))
+        mean, variance = gp.predict(np.asarray(x_matrix, dtype=float))
+        mean = mean[:, 0]
+        std_dev = variance[:, 0] ** 0.5
+        sign = 1
+        if not experiment.minimization_problem:
+            sign = -1
+        z_numerator = sign * (experiment.best_candidate.result - mean +
+                              self.params.get(
+                                  "exploitation_exploration_tradeoff", 0))
+        ei_values = np.zeros(len(mean))
+        nonzero = std_dev != 0
+        z = z_numerator[nonzero] / std_dev[nonzero]
+        ei_values[nonzero] = (z_numerator[nonzero] * scipy.stats.norm.cdf(z) +
+                              std_dev[nonzero] * scipy.stats.norm.pdf(z))
+        return ei_values
+
     def evaluate(self, x, gp, experiment):
         self._logger.log(5, "Evaluating %s. gp is %s, experiment %s", x, gp,
                            experiment)
@@ -714,39 +1277,507 @@ class ExpectedImprovement(GradientAcquisitionFunction):
         return value
 
 
-class ProbabilityOfImprovement(AcquisitionFunction):
+class ExpectedImprovementPerCost(ExpectedImprovement):
+    """
+    Implements expected improvement per unit of cost [1].
+
+    The expected improvement at x is divided by the expected cost of
+    evaluating x, which is predicted as exp(mu(x)) by a second gp fitted on
+    the logarithms of the candidates' costs. Proposals therefore maximize the
+    improvement per unit of compute, preferring cheap regions unless
+    expensive ones promise proportionally more.
+
+    The cost gp is fitted by the optimizer and set as cost_gp. While it is
+    None, for example because no candidate has reported a cost yet, this is
+    the same as ExpectedImprovement.
+
+    [1] Snoek, J., Larochelle, H. and Adams, R. P. Practical Bayesian
+    Optimization of Machine Learning Algorithms. NIPS 2012.
+
+    Attributes
+    ----------
+    cost_gp : GPy gp or None
+        The gp modelling the logarithm of the cost.
+    """
+    requires_cost_model = True
+    cost_gp = None
+
+    def cost_exponent(self, experiment):
+        """
+        Returns the exponent alpha in EI(x) / cost(x)**alpha.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The current experiment.
+
+        Returns
+        -------
+        alpha : float
+            The exponent of the cost. It is always 1 here.
+        """
+        return 1.
+
+    def _evaluate_vector(self, x_vec, gp, experiment):
+        ei_value, ei_gradient = super(ExpectedImprovementPerCost,
+                                      self)._evaluate_vector(x_vec, gp,
+                                                             experiment)
+        alpha = self.cost_exponent(experiment)
+        if self.cost_gp is None or alpha == 0:
+            return ei_value, ei_gradient
+        x_value = self._translate_vector_nd_array(x_vec)
+        log_cost, _ = self.cost_gp.predict(x_value)
+        gradient_log_cost, _ = self.cost_gp.predictive_gradients(x_value)
+        scale = np.exp(-alpha * log_cost[0][0])
+        # The derivative of EI * exp(-alpha * mu) is
+        # (dEI - alpha * EI * dmu) * exp(-alpha * mu).
+        value = ei_value * scale
+        gradient = (ei_gradient - alpha * ei_value *
+                    gradient_log_cost[0][:, 0]) * scale
+        self._logger.log(5, "Predicted log cost %s. Value and gradient per "
+                            "cost are %s, %s", log_cost, value, gradient)
+        return value, gradient
+
+    def evaluate_batch(self, x_matrix, gp, experiment):
+        ei_values = super(ExpectedImprovementPerCost, self).evaluate_batch(
+            x_matrix, gp, experiment)
+        alpha = self.cost_exponent(experiment)
+        if self.cost_gp is None or alpha == 0:
+            return ei_values
+        log_cost, _ = self.cost_gp.predict(np.asarray(x_matrix, dtype=float))
+        return ei_values * np.exp(-alpha * log_cost[:, 0])
+
+
+class CostCooledExpectedImprovement(ExpectedImprovementPerCost):
+    """
+    Implements cost-cooled expected improvement, EI(x) / cost(x)**alpha [1].
+
+    alpha decreases linearly from 1 to 0 while the cost budget is spent.
+    The search therefore starts like ExpectedImprovementPerCost, exploring
+    the cheap regions first, and ends like ExpectedImprovement, so it does
+    not stay stuck in cheap but poor regions.
+
+    Supported parameters, in addition to those of ExpectedImprovement:
+        "cost_budget" : float, optional
+            The total cost budget of the experiment. alpha is
+            1 - spent / cost_budget, where spent is the summed cost of all
+            finished candidates. If not given, alpha is always 1.
+
+    [1] Lee, E. H., Perrone, V., Archambeau, C. and Seeger, M. Cost-aware
+    Bayesian Optimization. ICML AutoML Workshop 2020.
+    """
+
+    def cost_exponent(self, experiment):
+        budget = self.params.get("cost_budget", None)
+        if not budget:
+            return 1.
+        spent = sum(c.cost for c in experiment.candidates_finished
+                    if c.cost is not None)
+        return min(1., max(0., 1 - float(spent) / budget))
+
+
+class ProbabilityOfImprovement(GradientAcquisitionFunction):
     """
     Implements the probability of improvement function.
 
     See page 12 of "A Tutorial on Bayesian Optimization of Expensive Cost
     Functions, with Application to Active User Modeling and Hierarchical
     Reinforcement Learning", Brochu et. al., 2010.
+
+    Values and gradients are computed for whole matrices of points from a
+    single gp prediction, so the function can be used with the L-BFGS-B
+    searcher as well as with the batched searchers.
+
+    Supported parameters, in addition to those of AcquisitionFunction:
+        "exploitation_exploration_tradeoff" : float, optional
+            The improvement over the best result required, xi in Brochu et.
+            al. Default is 0.
     """
     minimizes = False
 
+    def _evaluate_matrix(self, x_matrix, gp, experiment, gradient=False):
+        """
+        Evaluates the probability of improvement on all rows of x_matrix.
+
+        Parameters
+        ----------
+        x_matrix : np.array
+            The (m, D) matrix of points.
+        gp : GPy gp
+            The gp on which to evaluate
+        experiment : experiment
+            The experiment, defining the best result so far.
+        gradient : bool, optional
+            Whether to also compute the gradients. Default is False.
+
+        Returns
+        -------
+        values : np.array
+            The m values.
+        gradients : np.array or None
+            The (m, D) gradients, or None if gradient is False.
+        """
+        x_matrix = np.asarray(x_matrix, dtype=float)
+        mean, variance = gp.predict(x_matrix)
+        mean = mean[:, 0]
+        variance = variance[:, 0]
+        std_dev = variance ** 0.5
+        sign = 1
+        if not experiment.minimization_problem:
+            sign = -1
+        z_numerator = sign * (experiment.best_candidate.result - mean) - \
+                      self.params.get("exploitation_exploration_tradeoff", 0)
+        nonzero = std_dev != 0
+        # Without uncertainty, improvement is either certain or impossible.
+        values = (z_numerator > 0).astype(float)
+        z = z_numerator[nonzero] / std_dev[nonzero]
+        values[nonzero] = ndtr(z)
+        self._logger.log(5, "Probability of improvement on %s points is %s",
+                         len(x_matrix), values)
+        if not gradient:
+            return values, None
+        gradient_mean, gradient_variance = gp.predictive_gradients(x_matrix)
+        gradient_mean = gradient_mean[:, :, 0]
+        gradients = np.zeros(x_matrix.shape)
+        # dPI = pdf(z) * dz, with z = (sign * (x_best - mu) - xi) / sigma.
+        gradient_z = (-sign * gradient_mean[nonzero] /
+                      std_dev[nonzero][:, None] -
+                      (z / (2 * variance[nonzero]))[:, None] *
+                      gradient_variance[nonzero])
+        pdf_z = np.exp(-0.5 * z**2) / np.sqrt(2 * np.pi)
+        gradients[nonzero] = pdf_z[:, None] * gradient_z
+        return values, gradients
+
     def evaluate(self, x, gp, experiment):
         """
         Evaluates the function.
         """
         self._logger.log(5, "Evaluating probability of improvement. x is %s,"
                            " gp is %s, experiment %s", x, gp, experiment)
-        dimensions = len(experiment.parameter_definitions)
-        x_value_vector = self._translate_dict_vector(x)
-        x_value = self._translate_vector_nd_array(x_value_vector)
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        values, _ = self._evaluate_matrix(
+            self._translate_vector_nd_array(x), gp, experiment)
+        return values[0]
 
-        mean, variance = gp.predict(x_value)
-        self._logger.log(5, "Mean and variance are %s, %s", mean, variance)
-        # do not standardize on our own, but use the mean, and covariance
-        # we get from the gp
-        stdv = variance ** 0.5
-        x_best = experiment.best_candidate.result
-        z = (x_best - mean)/stdv
+    def gradient(self, x, gp, experiment):
+        self._logger.log(5, "Computing gradient for %s. gp is %s, experiment "
+                           "%s", x, gp, experiment)
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        _, gradients = self._evaluate_matrix(
+            self._translate_vector_nd_array(x), gp, experiment, gradient=True)
+        return gradients[0]
 
-        cdf = scipy.stats.norm().cdf(z)
-        result = cdf
-        self._logger.log(5, "Got cdf from scipy.stats. Result is %s", result)
+    def evaluate_batch(self, x_matrix, gp, experiment):
+        values, _ = self._evaluate_matrix(x_matrix, gp, experiment)
+        return values
+
+
+class UpperConfidenceBound(GradientAcquisitionFunction):
+    """
+    Implements the GP-UCB acquisition function [1].
+
+    For maximization problems, this is mu(x) + sqrt(beta) * sigma(x). For
+    minimization problems, it is the negative lower confidence bound,
+    -mu(x) + sqrt(beta) * sigma(x). Larger beta explore more.
+
+    Supported parameters, in addition to those of AcquisitionFunction:
+        "beta" : float or None, optional
+            The fixed value of beta. If None (the default), beta grows with
+            the number t of finished candidates as
+            2 * log(D * t**2 * pi**2 / (6 * delta)), with D the dimension of
+            the warped parameter space, following [1].
+        "delta" : float, optional
+            The confidence parameter of the beta schedule. Default is 0.1.
+
+    [1] Srinivas, N., Krause, A., Kakade, S. and Seeger, M. Gaussian Process
+    Optimization in the Bandit Setting: No Regret and Experimental Design.
+    ICML 2010.
+    """
+    minimizes = False
+
+    def beta(self, experiment, dimension):
+        """
+        Returns the exploration weight beta.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The current experiment.
+        dimension : int
+            The dimension of the warped parameter space.
+
+        Returns
+        -------
+        beta : float
+            The weight of the variance.
+        """
+        beta = self.params.get("beta", None)
+        if beta is not None:
+            return beta
+        t = len(experiment.candidates_finished) + 1
+        delta = self.params.get("delta", 0.1)
+        return 2 * np.log(dimension * t**2 * np.pi**2 / (6 * delta))
+
+    def _evaluate_matrix(self, x_matrix, gp, experiment, gradient=False):
+        """
+        Evaluates the upper confidence bound on all rows of x_matrix.
+
+        Signature is as ProbabilityOfImprovement._evaluate_matrix.
+        """
+        x_matrix = np.asarray(x_matrix, dtype=float)
+        mean, variance = gp.predict(x_matrix)
+        mean = mean[:, 0]
+        std_dev = np.maximum(variance[:, 0], 1e-20) ** 0.5
+        sign = 1
         if not experiment.minimization_problem:
-            result = 1 - cdf
-            self._logger.log(5, "We're changing because we're maximizing. New "
-                               "result is %s", result)
-        return result
\ No newline at end of file
+            sign = -1
+        root_beta = self.beta(experiment, x_matrix.shape[1]) ** 0.5
+        values = -sign * mean + root_beta * std_dev
+        if not gradient:
+            return values, None
+        gradient_mean, gradient_variance = gp.predictive_gradients(x_matrix)
+        gradients = (-sign * gradient_mean[:, :, 0] + root_beta *
+                     gradient_variance / (2 * std_dev[:, None]))
+        return values, gradients
+
+    def evaluate(self, x, gp, experiment):
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        values, _ = self._evaluate_matrix(
+            self._translate_vector_nd_array(x), gp, experiment)
+        return values[0]
+
+    def gradient(self, x, gp, experiment):
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        _, gradients = self._evaluate_matrix(
+            self._translate_vector_nd_array(x), gp, experiment, gradient=True)
+        return gradients[0]
+
+    def evaluate_batch(self, x_matrix, gp, experiment):
+        values, _ = self._evaluate_matrix(x_matrix, gp, experiment)
+        return values
+
+
+class ThompsonSampling(AcquisitionFunction):
+    """
+    Implements Thompson sampling with random Fourier features [1, 2].
+
+    Each proposal maximizes its own function drawn from the gp posterior,
+    so the proposals of a batch are independent and diverse. Drawing these
+    functions exactly is cubic in the number of points they are evaluated
+    on. Instead, the kernel is approximated by num_features random Fourier
+    features, and the posterior of their weights computed once per fitted
+    gp. Drawing a function is then drawing a weight vector, and evaluating
+    it on many points a single matrix product.
+
+    A proposal is found by evaluating all sampled functions on the same
+    optimization_random_steps random points, then improving the best point
+    of each with L-BFGS-B on the sampled function. compute_proposals
+    therefore returns number_proposals proposals for one model fit, and
+    ignores the max_searcher and multi_searcher parameters. evaluate and
+    evaluate_batch evaluate a function drawn for that call.
+
+    Only gps with an rbf or matern52 kernel are supported.
+
+    Supported parameters, in addition to those of AcquisitionFunction:
+        "num_features" : int, optional
+            The number of random Fourier features. Default is 500.
+        "optimization_random_steps" : int, optional
+            The number of random points each function is evaluated on.
+            Default is 1000.
+        "local_optimization" : bool, optional
+            Whether to improve the best random point by L-BFGS-B. Default is
+            True.
+
+    [1] Rahimi, A. and Recht, B. Random Features for Large-Scale Kernel
+    Machines. NIPS 2007.
+    [2] Hernandez-Lobato, J. M., Hoffman, M. W. and Ghahramani, Z.
+    Predictive Entropy Search for Efficient Global Optimization of Black-box
+    Functions. NIPS 2014.
+    """
+    minimizes = False
+
+    _posterior = None
+    _posterior_key = None
+
+    def _compute_proposals(self, gp, experiment, number_proposals,
+                           return_max):
+        basis, weights = self._sample_weights(gp, number_proposals)
+        param_defs = experiment.parameter_definitions
+        dimension = sum(param_defs[pn].warped_size() for pn in param_defs)
+        random_matrix = np.array(
+            [self._translate_dict_vector(p) for p in self._gen_random_props(
+                experiment, self.params.get("optimization_random_steps",
+                                            1000))],
+            dtype=float).reshape(-1, dimension)
+        sign = self._sign(experiment)
+        values = sign * _fourier_features(random_matrix, basis).dot(weights)
+        self._num_evaluations += values.size
+        proposals = []
+        for i in range(number_proposals):
+            best = np.argmax(values[:, i])
+            x, value = random_matrix[best], values[best, i]
+            if self.params.get("local_optimization", True):
+                x, value = self._maximize_sample(x, value, basis,
+                                                 sign * weights[:, i])
+            proposals.append((self._translate_vector_dict(x, experiment),
+                              value))
+        self._logger.debug("Returning %s Thompson samples.", len(proposals))
+        return proposals
+
+    def _maximize_sample(self, x, value, basis, weights):
+        """
+        Improves x by L-BFGS-B on the function with the given weights.
+
+        Returns x and value unchanged if they cannot be improved.
+        """
+        def negative_sample(x_vec):
+            features, gradients = _fourier_features(
+                x_vec[None, :], basis, gradient=True)
+            self._num_evaluations += 1
+            return -features.dot(weights)[0], -weights.dot(gradients[0])
+        result = scipy.optimize.minimize(
+            negative_sample, x0=x, method="L-BFGS-B", jac=True,
+            bounds=[(0., 1.)] * len(x), options={"disp": False})
+        if result.success and -result.fun > value and \
+                self.in_hypercube(result.x):
+            return result.x, -result.fun
+        return x, value
+
+    def _sign(self, experiment):
+        if experiment.minimization_problem:
+            return -1
+        return 1
+
+    def _sample_weights(self, gp, number_samples):
+        """
+        Draws weights of the features from their posterior given gp.
+
+        Parameters
+        ----------
+        gp : GPy gp
+            The fitted gp.
+        number_samples : int
+            The number of functions to draw.
+
+        Returns
+        -------
+        basis : tuple
+            The random Fourier basis, see _draw_fourier_basis.
+        weights : np.array
+            The (num_features, number_samples) weights of the functions.
+        """
+        basis, mean, cholesky, noise_variance = self._weight_posterior(gp)
+        noise = np.random.normal(0, 1, (len(mean), number_samples))
+        # The covariance is noise_variance * precision^-1, and L^-T is a
+        # square root of precision^-1 for its cholesky factor L.
+        return basis, mean[:, None] + noise_variance**0.5 * \
+                      scipy.linalg.solve_triangular(cholesky.T, noise,
+                                                    lower=False)
+
+    def _weight_posterior(self, gp):
+        """
+        Returns the basis and the posterior of the weights for gp.
+
+        The posterior is that of bayesian linear regression on the features,
+        N(mean, noise_variance * precision^-1), with precision given by its
+        cholesky factor. It is only recomputed if gp, or its parameters,
+        changed since the last call.
+        """
+        key = (id(gp), gp.param_array.tostring(), gp.X.shape)
+        if self._posterior_key == key:
+            return self._posterior
+        x_train = np.asarray(gp.X, dtype=float)
+        y_train = np.asarray(gp.Y_normalized, dtype=float)[:, 0]
+        if gp.mean_function is not None:
+            y_train = y_train - gp.mean_function.f(x_train)[:, 0]
+        basis = _draw_fourier_basis(gp.kern, x_train.shape[1],
+                                    self.params.get("num_features", 500))
+        features = _fourier_features(x_train, basis)
+        noise_variance = float(gp.likelihood.variance)
+        precision = features.T.dot(features) + noise_variance * np.eye(
+            features.shape[1])
+        cholesky = scipy.linalg.cholesky(precision, lower=True)
+        mean = scipy.linalg.cho_solve((cholesky, True),
+                                      features.T.dot(y_train))
+        self._posterior = (basis, mean, cholesky, noise_variance)
+        self._posterior_key = key
+        self._logger.debug("Computed the weight posterior of %s features.",
+                           len(mean))
+        return self._posterior
+
+    def evaluate(self, x, gp, experiment):
+        if isinstance(x, dict):
+            x = self._translate_dict_vector(x)
+        return self.evaluate_batch(self._translate_vector_nd_array(x), gp,
+                                   experiment)[0]
+
+    def evaluate_batch(self, x_matrix, gp, experiment):
+        x_matrix = np.asarray(x_matrix, dtype=float)
+        basis, weights = self._sample_weights(gp, 1)
+        return self._sign(experiment) * _fourier_features(
+            x_matrix, basis).dot(weights)[:, 0]
+
+
+def _draw_fourier_basis(kern, dimension, num_features):
+    """
+    Draws random Fourier features approximating a stationary kernel.
+
+    The frequencies are drawn from the spectral density of the kernel:
+    a gaussian for rbf, a student-t with 5 degrees of freedom for matern52.
+
+    Parameters
+    ----------
+    kern : GPy kernel
+        An rbf or matern52 kernel.
+    dimension : int
+        The input dimension.
+    num_features : int
+        The number of features.
+
+    Returns
+    -------
+    basis : tuple
+        The frequencies (num_features, dimension), the phases (num_features)
+        and the scale of the features.
+
+    Raises
+    ------
+    ValueError
+        If the kernel is not supported.
+    """
+    kernel_type = type(kern).__name__
+    if kernel_type not in ["RBF", "Matern52"]:
+        raise ValueError("Thompson sampling supports rbf and matern52 "
+                         "kernels, not %s." %kernel_type)
+    lengthscale = np.asarray(kern.lengthscale, dtype=float) * np.ones(
+        dimension)
+    frequencies = np.random.normal(0, 1, (num_features, dimension)) / \
+                  lengthscale
+    if kernel_type == "Matern52":
+        degrees = 5.
+        frequencies *= np.sqrt(degrees / np.random.chisquare(
+            degrees, (num_features, 1)))
+    phases = np.random.uniform(0, 2 * np.pi, num_features)
+    scale = np.sqrt(2 * float(kern.variance) / num_features)
+    return frequencies, phases, scale
+
+
+def _fourier_features(x_matrix, basis, gradient=False):
+    """
+    Returns the random Fourier features of the rows of x_matrix.
+
+    If gradient, also returns their gradients as an (m, num_features,
+    dimension) array.
+    """
+    frequencies, phases, scale = basis
+    projection = x_matrix.dot(frequencies.T) + phases
+    features = scale * np.cos(projection)
+    if not gradient:
+        return features
+    gradients = -scale * np.sin(projection)[:, :, None] * \
+                frequencies[None, :, :]
+    return features, gradients
@@ -0,0 +1,347 @@
+__author__ = 'Frederik Diehl'
+
+import math
+import numpy as np
+from apsis.utilities.logging_utils import get_logger
+from apsis.utilities.randomization import check_random_state
+
+
+class RegressionTree(object):
+    """
+    A binary regression tree, split to minimize the squared error.
+
+    The tree only stores its structure. Leaf statistics are kept by the
+    RandomForest, so that they can be recomputed for new training points
+    without changing the structure.
+
+    Attributes
+    ----------
+    feature : np.array of ints
+        The split feature of each node, or -1 for leaves.
+    threshold : np.array of floats
+        The split threshold of each node. Values <= threshold go left.
+    left : np.array of ints
+        The index of the left child of each node.
+    right : np.array of ints
+        The index of the right child of each node.
+    min_samples_split : int
+        The minimum number of samples required to split a node.
+    max_features : int
+        The number of features considered for each split.
+    """
+    feature = None
+    threshold = None
+    left = None
+    right = None
+
+    min_samples_split = None
+    max_features = None
+    _random_state = None
+
+    def __init__(self, min_samples_split=3, max_features=None,
+                 random_state=None):
+        """
+        Initializes the tree.
+
+        Parameters
+        ----------
+        min_samples_split : int, optional
+            The minimum number of samples required to split a node. Default
+            is 3.
+        max_features : int, optional
+            The number of features considered for each split. If None, all
+            features are considered.
+        random_state : randomstate, optional
+            The random state used to choose the features.
+        """
+        self.min_samples_split = min_samples_split
+        self.max_features = max_features
+        self._random_state = check_random_state(random_state)
+
+    def fit(self, X, y):
+        """
+        Grows the tree on X and y.
+
+        Parameters
+        ----------
+        X : np.array
+            The (n, d) matrix of training points.
+        y : np.array
+            The n results.
+        """
+        num_features = X.shape[1]
+        max_features = self.max_features or num_features
+        feature, threshold, left, right = [-1], [0.], [-1], [-1]
+        stack = [(0, np.arange(len(y)))]
+        while stack:
+            node, idx = stack.pop()
+            if (len(idx) < self.min_samples_split or
+                    np.all(y[idx] == y[idx[0]])):
+                continue
+            features = self._random_state.permutation(num_features)[
+                :max_features]
+            split = self._best_split(X[idx], y[idx], features)
+            if split is None:
+                continue
+            f, t = split
+            go_left = X[idx, f] <= t
+            feature[node], threshold[node] = f, t
+            for child, child_idx in ((left, idx[go_left]),
+                                     (right, idx[~go_left])):
+                child[node] = len(feature)
+                stack.append((len(feature), child_idx))
+                feature.append(-1)
+                threshold.append(0.)
+                left.append(-1)
+                right.append(-1)
+        self.feature = np.array(feature)
+        self.threshold = np.array(threshold)
+        self.left = np.array(left)
+        self.right = np.array(right)
+
+    def _best_split(self, X, y, features):
+        """
+        Finds the split of X among features minimizing the squared error.
+
+        All split positions of all features are scored at once from
+        cumulative sums over the sorted values.
+
+        Returns
+        -------
+        split : tuple or None
+            The feature and threshold of the best split, or None if no split
+            reduces the error.
+        """
+        n = len(y)
+        x_features = X[:, features]
+        order = np.argsort(x_features, axis=0, kind="mergesort")
+        x_sorted = x_features[order, np.arange(len(features))]
+        y_sorted = y[order]
+        sums = np.cumsum(y_sorted, axis=0)
+        squares = np.cumsum(y_sorted**2, axis=0)
+        counts_left = np.arange(1, n, dtype=float)[:, None]
+        errors = (squares[:-1] - sums[:-1]**2 / counts_left +
+                  (squares[-1] - squares[:-1]) -
+                  (sums[-1] - sums[:-1])**2 / (n - counts_left))
+        errors[x_sorted[1:] <= x_sorted[:-1]] = np.inf
+        i, f = np.unravel_index(np.argmin(errors), errors.shape)
+        if not errors[i, f] < np.sum((y - y.mean())**2) * (1 - 1e-12):
+            return None
+        return features[f], (x_sorted[i, f] + x_sorted[i+1, f]) / 2.
+
+    def apply(self, X):
+        """
+        Returns the index of the leaf each point of X falls into.
+
+        Parameters
+        ----------
+        X : np.array
+            The (m, d) matrix of points.
+
+        Returns
+        -------
+        leaves : np.array of ints
+            The m leaf indices.
+        """
+        nodes = np.zeros(len(X), dtype=int)
+        active = np.nonzero(self.feature[nodes] >= 0)[0]
+        while len(active):
+            current = nodes[active]
+            go_left = X[active, self.feature[current]] <= \
+                      self.threshold[current]
+            nodes[active] = np.where(go_left, self.left[current],
+                                     self.right[current])
+            active = active[self.feature[nodes[active]] >= 0]
+        return nodes
+
+
+class RandomForest(object):
+    """
+    A random forest regression model used as surrogate instead of a gp.
+
+    Each tree is grown on a bootstrap sample, considering a random subset
+    of features for each split. Its prediction follows the interface of
+    GPy's predict, and the variance is the variance of the mixture of the
+    trees' leaf distributions [1].
+
+    The forest can be updated incrementally. New training points are routed
+    to the existing leaves, whose statistics are then recomputed from all
+    points. The trees are only grown again once the number of points
+    exceeds refit_factor times the number they were grown on, which keeps
+    the amortized update cost near-linear in the number of points.
+
+    [1] Hutter, F., Hoos, H. H. and Leyton-Brown, K. Sequential Model-Based
+    Optimization for General Algorithm Configuration. LION 2011.
+
+    Attributes
+    ----------
+    num_trees : int
+        The number of trees.
+    min_samples_split : int
+        The minimum number of samples required to split a node.
+    max_features_ratio : float
+        The fraction of features considered for each split.
+    refit_factor : float
+        The growth of the training set after which the trees are grown again.
+    trees : list of RegressionTree
+        The trees of the forest.
+    """
+    num_trees = None
+    min_samples_split = None
+    max_features_ratio = None
+    refit_factor = None
+    trees = None
+
+    _random_state = None
+    _logger = None
+    _X = None
+    _y = None
+    _leaves = None
+    _num_grown = None
+    _leaf_means = None
+    _leaf_vars = None
+
+    def __init__(self, num_trees=10, min_samples_split=3,
+                 max_features_ratio=5/6., refit_factor=1.5,
+                 random_state=None):
+        """
+        Initializes the forest.
+
+        Parameters
+        ----------
+        num_trees : int, optional
+            The number of trees. Default is 10.
+        min_samples_split : int, optional
+            The minimum number of samples required to split a node. Default
+            is 3.
+        max_features_ratio : float, optional
+            The fraction of features considered for each split. Default is
+            5/6.
+        refit_factor : float, optional
+            The growth of the training set after which the trees are grown
+            again. Default is 1.5.
+        random_state : randomstate, optional
+            The random state to use. See numpy random states.
+        """
+        self._logger = get_logger(self)
+        self.num_trees = num_trees
+        self.min_samples_split = min_samples_split
+        self.max_features_ratio = max_features_ratio
+        self.refit_factor = refit_factor
+        self._random_state = check_random_state(random_state)
+
+    def fit(self, X, y):
+        """
+        Grows all trees on X and y.
+
+        Parameters
+        ----------
+        X : np.array
+            The (n, d) matrix of training points.
+        y : np.array
+            The results, of shape (n,) or (n, 1).
+        """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float).ravel()
+        self._logger.debug("Growing %s trees on %s points.", self.num_trees,
+                           len(y))
+        max_features = max(1, int(math.ceil(self.max_features_ratio *
+                                            X.shape[1])))
+        self.trees = []
+        for i in range(self.num_trees):
+            sample = self._random_state.randint(0, len(y), len(y))
+            tree = RegressionTree(self.min_samples_split, max_features,
+                                  self._random_state)
+            tree.fit(X[sample], y[sample])
+            self.trees.append(tree)
+        self._X, self._y = X, y
+        self._leaves = np.array([tree.apply(X) for tree in self.trees]).T
+        self._num_grown = len(y)
+        self._compute_leaf_statistics()
+
+    def update(self, X, y):
+        """
+        Updates the forest to the training set X and y.
+
+        If X extends the previous training points, the new points are only
+        routed to the existing leaves, unless the training set has grown by
+        more than refit_factor. Otherwise, the trees are grown again.
+
+        Parameters
+        ----------
+        X : np.array
+            The (n, d) matrix of training points.
+        y : np.array
+            The results, of shape (n,) or (n, 1).
+        """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float).ravel()
+        num_known = 0 if self._X is None else len(self._X)
+        if (self.trees is None or len(y) < num_known or
+                len(y) > self.refit_factor * self._num_grown or
+                X.shape[1] != self._X.shape[1] or
+                not np.array_equal(X[:num_known], self._X)):
+            self.fit(X, y)
+            return
+        self._logger.debug("Adding %s points to the forest.",
+                           len(y) - num_known)
+        new_leaves = np.array([tree.apply(X[num_known:])
+                               for tree in self.trees]).T
+        self._leaves = np.concatenate((self._leaves, new_leaves))
+        self._X, self._y = X, y
+        self._compute_leaf_statistics()
+
+    def _compute_leaf_statistics(self):
+        """
+        Computes the mean and variance of the results in each leaf.
+        """
+        self._leaf_means, self._leaf_vars = [], []
+        for t, tree in enumerate(self.trees):
+            num_nodes = len(tree.feature)
+            counts = np.maximum(np.bincount(self._leaves[:, t],
+                                            minlength=num_nodes), 1)
+            means = np.bincount(self._leaves[:, t], self._y,
+                                minlength=num_nodes) / counts
+            squares = np.bincount(self._leaves[:, t], self._y**2,
+                                  minlength=num_nodes) / counts
+            self._leaf_means.append(means)
+            self._leaf_vars.append(np.maximum(squares - means**2, 0))
+
+    def predict(self, X):
+        """
+        Predicts mean and variance at each point of X.
+
+        Parameters
+        ----------
+        X : np.array
+            The (m, d) matrix of points.
+
+        Returns
+        -------
+        mean : np.array
+            The (m, 1) predicted means.
+        variance : np.array
+            The (m, 1) predicted variances.
+        """
+        X = np.asarray(X, dtype=float)
+        means = np.empty((len(X), len(self.trees)))
+        second_moments = np.empty((len(X), len(self.trees)))
+        for t, tree in enumerate(self.trees):
+            leaves = tree.apply(X)
+            means[:, t] = self._leaf_means[t][leaves]
+            second_moments[:, t] = (self._leaf_vars[t][leaves] +
+                                    means[:, t]**2)
+        mean = means.mean(axis=1)
+        variance = np.maximum(second_moments.mean(axis=1) - mean**2, 0)
+        return mean[:, None], variance[:, None]
+
+    def predictive_gradients(self, X):
+        """
+        Returns the gradients of mean and variance, in GPy's format.
+
+        The predictions of a forest are piecewise constant, so both
+        gradients are zero almost everywhere. Acquisition functions should
+        be maximized by gradient-free searchers such as local_search.
+        """
+        X = np.asarray(X, dtype=float)
+        return np.zeros(X.shape + (1,)), np.zeros(X.shape)
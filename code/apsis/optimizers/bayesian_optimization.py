@@ -2,13 +2,28 @@ __author__ = 'Frederik Diehl'
 
 from apsis.optimizers.optimizer import Optimizer
 from apsis.optimizers.random_search import RandomSearch
+from apsis.optimizers.quasi_random import QuasiRandom
 from apsis.models.parameter_definition import *
-from apsis.utilities.randomization import check_random_state
+from apsis.utilities.randomization import check_random_state, \
+    dump_random_state, load_random_state
 from apsis.models.candidate import Candidate
 from apsis.optimizers.bayesian.acquisition_functions import *
 from apsis.utilities.acquisition_utils import check_acquisition
 import GPy
+import hashlib
+import numpy as np
 import apsis.utilities.acquisition_utils as acq_utils
+from apsis.utilities import metrics
+
+_fit_seconds = metrics.histogram(
+    "apsis_gp_fit_seconds", "Duration of fitting a gp, including restarts.",
+    ["model"])
+_restarts_total = metrics.counter(
+    "apsis_gp_restarts_total", "Number of gp optimization restarts.",
+    ["model"])
+
+# Incremented whenever the format of checkpoints changes.
+CHECKPOINT_VERSION = 1
 
 
 class BayesianOptimizer(Optimizer):
@@ -31,11 +46,19 @@ class BayesianOptimizer(Optimizer):
         The acquisition hyperparameters.
     random_state : scipy random_state or int.
         The scipy random state or object to initialize one. For reproduction.
-    random_searcher : RandomSearch
+    random_searcher : RandomSearch or QuasiRandom
         The random search instance used to generate the first
         initial_random_runs candidates.
+    initial_design : string
+        The design of the first initial_random_runs candidates. "random"
+        (the default) for independent random draws, or one of
+        space_filling.AVAILABLE_DESIGNS for a space-filling design.
     gp : GPy gaussian process
         The gaussian process used here.
+    cost_gp : GPy gaussian process or None
+        The gaussian process modelling the logarithm of the candidates'
+        costs. It is only fitted if the acquisition function requires a cost
+        model, and only once at least two finished candidates have a cost.
     initial_random_runs : int
         The number of initial random runs before using the GP. Default is 10.
     num_gp_restarts : int
@@ -55,7 +78,10 @@ class BayesianOptimizer(Optimizer):
     random_searcher = None
 
     gp = None
+    cost_gp = None
+    cost_kernel = None
     initial_random_runs = 10
+    initial_design = "random"
     num_gp_restarts = 10
 
     name = "BayOpt"
@@ -73,6 +99,11 @@ class BayesianOptimizer(Optimizer):
             "initial_random_runs" : int, optional
                 The number of initial random runs before using the GP. Default
                 is 10.
+            "initial_design" : string, optional
+                The design of the initial random runs. Either "random"
+                (default) or one of space_filling.AVAILABLE_DESIGNS, for
+                example "sobol" or "lhs". An "lhs" design is a single Latin
+                hypercube of initial_random_runs points.
             "random_state" : scipy random state, optional
                 The scipy random state or object to initialize one. Default is
                 None.
@@ -83,7 +114,8 @@ class BayesianOptimizer(Optimizer):
                 This parameter controls this. Default is 10.
             "acquisition" : AcquisitionFunction
                 The acquisition function to use. Default is
-                ExpectedImprovement.
+                ExpectedImprovement. Cost-aware acquisition functions like
+                ExpectedImprovementPerCost use the candidates' costs.
             "num_precomputed" : int
                 The number of points that should be kept precomputed for faster
                 multiple workers.
@@ -131,7 +163,15 @@ class BayesianOptimizer(Optimizer):
         self._logger.debug("Kernel details: Kernel is %s, kernel_params %s",
                            self.kernel, self.kernel_params)
 
-        self.random_searcher = RandomSearch(experiment, optimizer_params)
+        self.initial_design = optimizer_params.get("initial_design",
+                                                   self.initial_design)
+        if self.initial_design == "random":
+            self.random_searcher = RandomSearch(experiment, optimizer_params)
+        else:
+            design_params = dict(optimizer_params)
+            design_params["design"] = self.initial_design
+            design_params.setdefault("design_size", self.initial_random_runs)
+            self.random_searcher = QuasiRandom(experiment, design_params)
         self._logger.debug("Initialized required RandomSearcher; is %s",
                            self.random_searcher)
         Optimizer.__init__(self, experiment, optimizer_params)
@@ -168,6 +208,32 @@ class BayesianOptimizer(Optimizer):
         self._logger.debug("Candidates extracted. Returning %s", candidates)
         return candidates
 
+    def rescore_candidates(self, candidates):
+        """
+        Keeps the candidates the acquisition function still finds competitive.
+
+        All candidates are scored with the updated model in one batch, see
+        AcquisitionFunction.competitive_points. Before the model is first
+        fitted, the random searcher decides.
+        """
+        if self.gp is None:
+            return self.random_searcher.rescore_candidates(candidates)
+        candidate_matrix = acq_utils.create_param_matrix(self._experiment,
+                                                         candidates)
+        indices = self.acquisition_function.competitive_points(
+            candidate_matrix, self.gp, self._experiment)
+        self._logger.debug("Keeping %s of %s candidates.", len(indices),
+                           len(candidates))
+        return [candidates[i] for i in indices]
+
+    def interrupt_search(self):
+        """
+        Makes a running search of the acquisition function return early.
+
+        See AcquisitionFunction.interrupt.
+        """
+        self.acquisition_function.interrupt()
+
     def update(self, experiment):
         self._logger.debug("Updating bayOpt with %s", experiment)
         self._experiment = experiment
@@ -188,14 +254,183 @@ class BayesianOptimizer(Optimizer):
 
         self._logger.log(5, "Refitting gp with cand %s and results %s"
                           %(candidate_matrix, results_vector))
-        self.gp = GPy.models.GPRegression(candidate_matrix, results_vector,
-                                          self.kernel)
-        self.gp.constrain_positive("*")
-        self.gp.constrain_bounded(0.1, 1, warning=False)
+        # The gp is only set once fitted, so that checkpoints taken by
+        # another thread never contain a half-optimized gp.
+        gp = self._build_gp(candidate_matrix, results_vector)
         self._logger.debug("Starting gp optimize.")
-        self.gp.optimize_restarts(num_restarts=self.num_gp_restarts,
-                                  verbose=False)
+        with _fit_seconds.time(model="objective"):
+            gp.optimize_restarts(num_restarts=self.num_gp_restarts,
+                                 verbose=False)
+        _restarts_total.inc(self.num_gp_restarts, model="objective")
+        self.gp = gp
         self._logger.debug("gp optimize finished.")
+        if self.acquisition_function.requires_cost_model:
+            self._fit_cost_gp(experiment)
+
+    def _fit_cost_gp(self, experiment):
+        """
+        Fits cost_gp on the log costs and sets it on the acquisition function.
+
+        The gp uses a copy of the objective's kernel and a constant mean,
+        so that far away from known candidates the typical cost is predicted.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment whose finished candidates' costs are used.
+        """
+        candidate_matrix, log_cost_vector = \
+            acq_utils.create_cost_matrix_vector(experiment)
+        if len(log_cost_vector) < 2:
+            self._logger.debug("Only %s costs known. Not using a cost gp.",
+                               len(log_cost_vector))
+            self.cost_gp = None
+        else:
+            cost_gp = self._build_cost_gp(candidate_matrix, log_cost_vector)
+            self._logger.debug("Starting cost gp optimize.")
+            with _fit_seconds.time(model="cost"):
+                cost_gp.optimize_restarts(
+                    num_restarts=self.num_gp_restarts, verbose=False)
+            _restarts_total.inc(self.num_gp_restarts, model="cost")
+            self.cost_gp = cost_gp
+            self._logger.debug("cost gp optimize finished.")
+        self.acquisition_function.cost_gp = self.cost_gp
+
+    def _build_gp(self, candidate_matrix, results_vector):
+        """
+        Returns the (not yet optimized) gp on the candidates' results.
+        """
+        gp = GPy.models.GPRegression(candidate_matrix, results_vector,
+                                     self.kernel)
+        gp.constrain_positive("*")
+        gp.constrain_bounded(0.1, 1, warning=False)
+        return gp
+
+    def _build_cost_gp(self, candidate_matrix, log_cost_vector):
+        """
+        Returns the (not yet optimized) gp on the candidates' log costs.
+        """
+        if self.cost_kernel is None:
+            self.cost_kernel = self.kernel.copy()
+        mean_function = GPy.mappings.Constant(
+            candidate_matrix.shape[1], 1, value=log_cost_vector.mean())
+        cost_gp = GPy.models.GPRegression(
+            candidate_matrix, log_cost_vector, self.cost_kernel,
+            mean_function=mean_function)
+        cost_gp.kern.constrain_positive(warning=False)
+        return cost_gp
+
+    def get_checkpoint(self):
+        """
+        Returns a checkpoint of the fitted gps.
+
+        The checkpoint contains the gps' hyperparameters and a digest of the
+        training data they were fitted on. The training data itself is not
+        stored, since it is recomputed from the experiment in milliseconds.
+        It also contains return_max and the states of the random states
+        seeded via the "random_state" parameter.
+
+        Returns
+        -------
+        checkpoint : dict or None
+            The checkpoint, or None if no gp has been fitted yet.
+        """
+        gp, cost_gp = self.gp, self.cost_gp
+        if gp is None:
+            return None
+        random_states = {}
+        for name, random_state in self._random_states().items():
+            state = dump_random_state(random_state)
+            if state is not None:
+                random_states[name] = state
+        return {
+            "version": CHECKPOINT_VERSION,
+            "optimizer": self.name,
+            "gp": _gp_checkpoint(gp),
+            "cost_gp": None if cost_gp is None else _gp_checkpoint(cost_gp),
+            "return_max": self.return_max,
+            "random_states": random_states
+        }
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Restores the gps from a checkpoint returned by get_checkpoint.
+
+        The gps are rebuilt on the current experiment and given the stored
+        hyperparameters, which avoids optimizing them again. This is also
+        done if the experiment has changed since the checkpoint was taken,
+        which is usual for queue-based optimizers: Their checkpoint is
+        written right after an update, before the backend has refitted the
+        gp. The stale hyperparameters are then kept until the next update
+        refits the gp.
+
+        Parameters
+        ----------
+        checkpoint : dict
+            The checkpoint.
+
+        Returns
+        -------
+        restored : bool
+            True iff the objective gp has been restored.
+        """
+        if (checkpoint.get("version") != CHECKPOINT_VERSION or
+                checkpoint.get("optimizer") != self.name):
+            self._logger.warning("Ignoring incompatible checkpoint %s.",
+                                 checkpoint)
+            return False
+        random_states = self._random_states()
+        for name, state in checkpoint.get("random_states", {}).items():
+            if name in random_states:
+                load_random_state(random_states[name], state)
+        if (len(self._experiment.candidates_finished) <
+                self.initial_random_runs):
+            return False
+        candidate_matrix, results_vector = acq_utils.create_cand_matrix_vector(
+            self._experiment, self.treat_failed)
+        if not _is_current(checkpoint["gp"], candidate_matrix,
+                           results_vector):
+            self._logger.info("Checkpoint is stale. Using its "
+                              "hyperparameters until the next update.")
+        self.kernel = self._check_kernel(self.kernel, candidate_matrix.shape[1],
+                                         kernel_params=self.kernel_params)
+        gp = self._build_gp(candidate_matrix, results_vector)
+        if not _set_parameters(gp, checkpoint["gp"]):
+            self._logger.warning("Checkpoint does not fit the gp. Refitting "
+                                 "the gp.")
+            return False
+        self.gp = gp
+        self.return_max = checkpoint.get("return_max", True)
+        if self.acquisition_function.requires_cost_model:
+            self._restore_cost_gp(checkpoint.get("cost_gp", None))
+        self._logger.info("Restored gp from checkpoint.")
+        return True
+
+    def _restore_cost_gp(self, cost_checkpoint):
+        """
+        Restores cost_gp from its checkpoint, or fits it if there is none.
+        """
+        candidate_matrix, log_cost_vector = \
+            acq_utils.create_cost_matrix_vector(self._experiment)
+        if cost_checkpoint is None or len(log_cost_vector) < 2:
+            self._fit_cost_gp(self._experiment)
+            return
+        cost_gp = self._build_cost_gp(candidate_matrix, log_cost_vector)
+        if not _set_parameters(cost_gp, cost_checkpoint):
+            self._fit_cost_gp(self._experiment)
+            return
+        self.cost_gp = cost_gp
+        self.acquisition_function.cost_gp = cost_gp
+
+    def _random_states(self):
+        """
+        Returns the random states whose state is kept in checkpoints.
+        """
+        random_states = {"optimizer": self.random_state}
+        searcher_state = getattr(self.random_searcher, "random_state", None)
+        if isinstance(searcher_state, np.random.RandomState):
+            random_states["random_searcher"] = searcher_state
+        return random_states
 
     def _check_kernel(self, kernel, dimension, kernel_params):
         """
@@ -246,4 +481,48 @@ class BayesianOptimizer(Optimizer):
             return constructed_kernel
 
         raise ValueError("%s is not a kernel or string representing one!"
-                         %kernel)
\ No newline at end of file
+                         %kernel)
+
+
+def _training_digest(candidate_matrix, results_vector):
+    """
+    Returns a digest identifying the training data of a gp.
+    """
+    digest = hashlib.sha1()
+    for a in (candidate_matrix, results_vector):
+        a = np.ascontiguousarray(a, dtype=float)
+        digest.update(str(a.shape))
+        digest.update(a.tobytes())
+    return digest.hexdigest()
+
+
+def _gp_checkpoint(gp):
+    """
+    Returns the checkpoint of a single gp.
+    """
+    return {"training_digest": _training_digest(gp.X, gp.Y),
+            "parameter_names": list(gp.parameter_names_flat()),
+            "parameters": gp.param_array.tolist()}
+
+
+def _is_current(gp_checkpoint, candidate_matrix, results_vector):
+    """
+    Returns whether gp_checkpoint has been fitted on exactly this data.
+    """
+    return (gp_checkpoint["training_digest"] ==
+            _training_digest(candidate_matrix, results_vector))
+
+
+def _set_parameters(gp, gp_checkpoint):
+    """
+    Sets the parameters of gp from gp_checkpoint.
+
+    Returns
+    -------
+    success : bool
+        False iff the checkpoint's parameters do not match the gp's.
+    """
+    if list(gp.parameter_names_flat()) != gp_checkpoint["parameter_names"]:
+        return False
+    gp[:] = np.array(gp_checkpoint["parameters"])
+    return True
@@ -0,0 +1,166 @@
+__author__ = 'Frederik Diehl'
+
+from abc import ABCMeta, abstractmethod
+import numpy as np
+from apsis.utilities.logging_utils import get_logger
+
+
+class StoppingRule(object):
+    """
+    A stopping rule decides whether to stop evaluating a candidate early.
+
+    It bases this decision on the intermediate results (see
+    Experiment.add_intermediate_results) of the candidate and of the
+    finished candidates of the experiment.
+
+    Attributes
+    ----------
+    params : dict
+        The parameters of the stopping rule.
+    """
+    __metaclass__ = ABCMeta
+
+    params = None
+    _logger = None
+
+    def __init__(self, params=None):
+        """
+        Initializes the stopping rule.
+
+        Parameters
+        ----------
+        params : dict, optional
+            The parameters of the stopping rule.
+        """
+        self._logger = get_logger(self)
+        if params is None:
+            params = {}
+        self.params = params
+
+    @abstractmethod
+    def should_stop(self, candidate, experiment):
+        """
+        Decides whether the evaluation of candidate should be stopped.
+
+        Parameters
+        ----------
+        candidate : Candidate
+            The candidate currently evaluated.
+        experiment : Experiment
+            The experiment containing candidate.
+
+        Returns
+        -------
+        stop : bool
+            True iff the evaluation of candidate should be stopped.
+        """
+        pass
+
+
+class MedianStoppingRule(StoppingRule):
+    """
+    The median stopping rule [1].
+
+    A candidate is stopped at step s if its best intermediate result so far
+    is worse than the median of the running averages of the intermediate
+    results of the finished candidates up to step s.
+
+    Supported parameters are
+        "min_steps" : float, optional
+            Candidates are never stopped before reaching this step. Default
+            is 0.
+        "min_candidates" : int, optional
+            The minimum number of finished candidates with intermediate
+            results up to step s required to stop a candidate. Default is 3.
+
+    [1] Golovin, D., Solnik, B., Moitra, S., Kochanski, G., Karro, J. and
+    Sculley, D. Google Vizier: A Service for Black-Box Optimization. KDD
+    2017.
+    """
+    _running_sums = None
+
+    def __init__(self, params=None):
+        super(MedianStoppingRule, self).__init__(params)
+        self._running_sums = {}
+
+    def should_stop(self, candidate, experiment):
+        steps, values = experiment.intermediate_results.get(
+            candidate.cand_id, ((), ()))
+        if not steps or steps[-1] < self.params.get("min_steps", 0):
+            return False
+        step = steps[-1]
+        averages = []
+        for c in experiment.candidates_finished:
+            if c.failed or c.cand_id not in experiment.intermediate_results:
+                continue
+            finished_steps, running_sums = self._get_running_sums(
+                c.cand_id, experiment)
+            num_known = np.searchsorted(finished_steps, step, side="right")
+            if num_known > 0:
+                averages.append(running_sums[num_known - 1] / num_known)
+        if len(averages) < self.params.get("min_candidates", 3):
+            return False
+        median = np.median(averages)
+        if experiment.minimization_problem:
+            stop = min(values) > median
+        else:
+            stop = max(values) < median
+        self._logger.debug("Best intermediate result of %s is %s, median is "
+                           "%s. Stopping: %s", candidate.cand_id,
+                           min(values) if experiment.minimization_problem
+                           else max(values), median, stop)
+        return stop
+
+    def _get_running_sums(self, cand_id, experiment):
+        """
+        Returns the steps and running sums of the results of a candidate.
+
+        These are cached, since the intermediate results of a finished
+        candidate usually do not change anymore.
+        """
+        steps, values = experiment.intermediate_results[cand_id]
+        cached = self._running_sums.get(cand_id, None)
+        if cached is None or len(cached[0]) != len(steps):
+            cached = (np.frombuffer(steps), np.cumsum(np.frombuffer(values)))
+            self._running_sums[cand_id] = cached
+        return cached
+
+
+AVAILABLE_STOPPING_RULES = {"median": MedianStoppingRule}
+
+
+def check_stopping_rule(stopping_rule, stopping_params=None):
+    """
+    Checks whether stopping_rule is a StoppingRule or builds one.
+
+    Parameters
+    ----------
+    stopping_rule : string, StoppingRule instance or class, or None
+        The stopping rule. If an instance or None, it is returned unchanged.
+        If a string, it is translated via AVAILABLE_STOPPING_RULES.
+    stopping_params : dict, optional
+        The parameters of the stopping rule, if it has to be initialized.
+
+    Returns
+    -------
+    stopping_rule : StoppingRule instance or None
+        The initialized stopping rule.
+
+    Raises
+    ------
+    ValueError
+        If stopping_rule is a string not in AVAILABLE_STOPPING_RULES, or not
+        a StoppingRule.
+    """
+    if stopping_rule is None or isinstance(stopping_rule, StoppingRule):
+        return stopping_rule
+    if isinstance(stopping_rule, basestring):
+        if stopping_rule not in AVAILABLE_STOPPING_RULES:
+            raise ValueError("No stopping rule found for %s. Stopping rule "
+                             "must be in %s" %(stopping_rule,
+                                               AVAILABLE_STOPPING_RULES.keys()))
+        stopping_rule = AVAILABLE_STOPPING_RULES[stopping_rule]
+    if not (isinstance(stopping_rule, type) and
+            issubclass(stopping_rule, StoppingRule)):
+        raise ValueError("%s is not a StoppingRule." %stopping_rule)
+    return stopping_rule(stopping_params)
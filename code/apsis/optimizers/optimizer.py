@@ -3,9 +3,32 @@ __author__ = 'Frederik Diehl'
 from abc import ABCMeta, abstractmethod
 from time import sleep
 from apsis.utilities import logging_utils
+from apsis.optimizers.early_stopping import check_stopping_rule
+from apsis.utilities import metrics
 import threading
+import time
 import Queue
 
+_queue_depth = metrics.gauge(
+    "apsis_precomputed_candidates",
+    "Number of precomputed candidates waiting in the queue of a "
+    "QueueBasedOptimizer.", ["experiment"])
+_candidate_age_seconds = metrics.histogram(
+    "apsis_precomputed_candidate_age_seconds",
+    "Time between generating a precomputed candidate and handing it out.")
+_discarded_total = metrics.counter(
+    "apsis_precomputed_candidates_discarded_total",
+    "Number of precomputed candidates discarded because of an update.")
+_kept_total = metrics.counter(
+    "apsis_precomputed_candidates_kept_total",
+    "Number of precomputed candidates kept after rescoring them on an "
+    "update.")
+_requests_total = metrics.counter(
+    "apsis_precomputed_candidate_requests_total",
+    "Number of candidates requested from a QueueBasedOptimizer, by whether "
+    "a precomputed candidate was available (hit) or not (miss).",
+    ["outcome"])
+
 class Optimizer(object):
     """
     This defines a basic Optimizer interface.
@@ -26,6 +49,9 @@ class Optimizer(object):
     _experiment : Experiment
         The current state of the experiment. Is used as a base for the the
         optimization.
+    stopping_rule : StoppingRule or None
+        The rule deciding whether to stop evaluating a candidate early. None
+        if candidates are never stopped.
     """
     __metaclass__ = ABCMeta
 
@@ -36,6 +62,7 @@ class Optimizer(object):
     _logger = None
 
     treat_failed = None
+    stopping_rule = None
 
     def __init__(self, experiment, optimizer_params):
         """
@@ -60,6 +87,10 @@ class Optimizer(object):
             All of these can either be specified as strings (and use a
             standard value) or as tuples, in which case the first entry is
             treated as the string and the second as the value for the parameter.
+            Another is 'early_stopping', the StoppingRule (or its name in
+            early_stopping.AVAILABLE_STOPPING_RULES) used by should_stop.
+            Default is None, which never stops candidates. Its parameters
+            can be given as 'early_stopping_params'.
 
         Raises
         ------
@@ -89,6 +120,9 @@ class Optimizer(object):
             elif self.treat_failed == "worst_mult":
                 second_value = 2
             self.treat_failed = (self.treat_failed, second_value)
+        self.stopping_rule = check_stopping_rule(
+            optimizer_params.get("early_stopping", None),
+            optimizer_params.get("early_stopping_params", None))
 
     def update(self, experiment):
         """
@@ -137,6 +171,115 @@ class Optimizer(object):
         """
         pass
 
+    def should_stop(self, candidate, experiment):
+        """
+        Decides whether the evaluation of a candidate should be stopped.
+
+        This is called whenever intermediate results of a working candidate
+        are reported. It is called on the current experiment, which may be
+        more recent than the one the optimizer has been updated with.
+
+        Implementation note: This function (for the base class) uses the
+        stopping_rule, if any. Subclasses can override it.
+
+        Parameters
+        ----------
+        candidate : Candidate
+            The working candidate.
+        experiment : Experiment
+            The experiment containing the candidate and its intermediate
+            results.
+
+        Returns
+        -------
+        stop : bool
+            True iff the evaluation of candidate should be stopped.
+        """
+        if self.stopping_rule is None:
+            return False
+        return self.stopping_rule.should_stop(candidate, experiment)
+
+    def rescore_candidates(self, candidates):
+        """
+        Decides which candidates generated before an update to keep.
+
+        This is called after update with the candidates generated, but not
+        yet handed out, before it. Candidates kept are handed out before any
+        new ones, so only candidates still competitive with what the updated
+        optimizer would generate should be kept.
+
+        Implementation note: This function (for the base class) keeps none,
+        which is always correct. Optimizers whose candidates do not depend
+        on the results, or which can cheaply score them, can override it.
+
+        Parameters
+        ----------
+        candidates : list of Candidates
+            The candidates generated before the update.
+
+        Returns
+        -------
+        kept : list of Candidates
+            The candidates to keep, in the order they should be handed out.
+        """
+        return []
+
+    def interrupt_search(self):
+        """
+        Asks a running get_next_candidates to return as soon as possible.
+
+        This may be called from another thread while get_next_candidates is
+        running, for example when a worker is waiting for a candidate.
+        Optimizers with an anytime search should then return the best
+        candidates found so far.
+
+        Implementation note: This function (for the base class) does
+        nothing.
+        """
+        pass
+
+    def get_checkpoint(self):
+        """
+        Returns a checkpoint of the optimizer's expensive internal state.
+
+        The checkpoint is written next to the experiment assistant's state,
+        and passed to restore_checkpoint when the experiment is loaded again,
+        so that models do not have to be refitted after a restart.
+
+        Implementation note: This function (for the base class) returns None,
+        since most optimizers are cheap to recreate from the experiment.
+
+        Returns
+        -------
+        checkpoint : dict or None
+            A json-serializable dict, or None if there is nothing to save.
+        """
+        return None
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Restores the state saved by get_checkpoint.
+
+        The checkpoint has to be checked against the optimizer's current
+        experiment. If it is stale, for example because it was taken before
+        a queue-based optimizer processed the last update, it has to be
+        either ignored or brought up to date with the experiment.
+
+        Implementation note: This function (for the base class) ignores the
+        checkpoint.
+
+        Parameters
+        ----------
+        checkpoint : dict
+            A checkpoint returned by get_checkpoint.
+
+        Returns
+        -------
+        restored : bool
+            True iff the checkpoint has been restored.
+        """
+        return False
+
     def exit(self):
         """
         Cleanly exits this optimizer.
@@ -212,9 +355,12 @@ class QueueBasedOptimizer(Optimizer):
      deployability without having to change code.
 
     Internally, the QueueBackend puts new candidates onto the
-    optimizer_out_queue, keeping it at min_candidates, until it receives a
-    new update. In that case, all current candidates in the out_queue are
-    deleted.
+    optimizer_out_queue, keeping it at min_candidates. When it receives a
+    new update, it updates the optimizer, which then rescores the candidates
+    in the out_queue (see Optimizer.rescore_candidates). Only those still
+    competitive are kept, and the queue is refilled afterwards. If a
+    candidate is requested while the queue is empty, the running search of
+    the optimizer is interrupted (see Optimizer.interrupt_search).
 
     Parameters
     ----------
@@ -222,17 +368,28 @@ class QueueBasedOptimizer(Optimizer):
         The queue with which you can send data (experiments) to the optimizer.
     _optimizer_out_queue : Queue
         The queue on which you can receive data.
+    _backend : QueueBackend
+        The backend running the optimizer in its own thread.
+    _hits : int
+        The number of requested candidates which were precomputed.
+    _misses : int
+        The number of requested candidates which were not available.
     """
     _optimizer_in_queue = None
     _optimizer_out_queue = None
 
     _optimizer_process = None
+    _backend = None
+
+    _hits = None
+    _misses = None
 
     _manager = None
 
     _optimizer_class = None
 
-    def __init__(self, optimizer_class, experiment, optimizer_params=None):
+    def __init__(self, optimizer_class, experiment, optimizer_params=None,
+                 checkpoint=None):
         """
         Initializes a new QueueBasedOptimizer class.
 
@@ -250,6 +407,9 @@ class QueueBasedOptimizer(Optimizer):
             of candidates that should be kept ready. Default is 5.
             Supports the parameter "update_time", which sets the minimum time
             in seconds between checking for updates. Default is 0.1s
+        checkpoint : dict, optional
+            A checkpoint of the optimizer, see Optimizer.get_checkpoint. It
+            is restored before the optimizer starts generating candidates.
         """
         self._logger = logging_utils.get_logger(self)
         self._logger.debug("Initializing new QueueBasedLogger. "
@@ -259,16 +419,18 @@ class QueueBasedOptimizer(Optimizer):
         self._optimizer_in_queue = Queue.Queue()
         self._optimizer_out_queue = Queue.Queue()
         self._optimizer_class = optimizer_class
+        self._hits = 0
+        self._misses = 0
         self.SUPPORTED_PARAM_TYPES = optimizer_class.SUPPORTED_PARAM_TYPES
 
         self._logger.debug("Initialized queues. in_queue is %s, out_queue %s",
                            self._optimizer_in_queue, self._optimizer_out_queue)
 
-        p = threading.Thread(target=dispatch_queue_backend,
-                                    args=(optimizer_class, optimizer_params,
-                                          experiment,
-                                          self._optimizer_out_queue,
-                                          self._optimizer_in_queue))
+        self._backend = QueueBackend(optimizer_class, experiment,
+                                     self._optimizer_out_queue,
+                                     self._optimizer_in_queue,
+                                     optimizer_params, checkpoint)
+        p = threading.Thread(target=self._backend.run)
         p.start()
         self._logger.debug("Started thread.")
         super(QueueBasedOptimizer, self).__init__(experiment, optimizer_params)
@@ -280,12 +442,60 @@ class QueueBasedOptimizer(Optimizer):
             for i in range(num_candidates):
                 new_candidate = self._optimizer_out_queue.get_nowait()
                 next_candidates.append(new_candidate)
+                if new_candidate.generated_time is not None:
+                    _candidate_age_seconds.observe(
+                        time.time() - new_candidate.generated_time)
         except Queue.Empty:
-            self._logger.debug("Queue of new candidates is empty.")
-            pass
+            self._logger.debug("Queue of new candidates is empty. "
+                               "Interrupting the running search.")
+            # A worker is waiting, so a running anytime search should hand
+            # out what it has found so far.
+            self.interrupt_search()
+        self._hits += len(next_candidates)
+        self._misses += num_candidates - len(next_candidates)
+        _requests_total.inc(len(next_candidates), outcome="hit")
+        _requests_total.inc(num_candidates - len(next_candidates),
+                            outcome="miss")
         self._logger.debug("Generated next_candidates %s", next_candidates)
         return next_candidates
 
+    def get_pool_statistics(self):
+        """
+        Returns statistics of the precomputed candidates.
+
+        Returns
+        -------
+        statistics : dict
+            A dict with the keys
+            "hits", "misses" : The number of requested candidates that were
+                precomputed, and that were not available.
+            "hit_rate" : The fraction of requested candidates that were
+                precomputed, or None if none were requested.
+            "kept", "discarded" : The number of candidates kept and
+                discarded when rescoring them after an update.
+            "queued" : The number of candidates currently precomputed.
+        """
+        requests = self._hits + self._misses
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": float(self._hits) / requests if requests else None,
+                "kept": self._backend.num_kept,
+                "discarded": self._backend.num_discarded,
+                "queued": self._optimizer_out_queue.qsize()}
+
+    @property
+    def backend_optimizer(self):
+        """
+        The optimizer generating the candidates in the backend thread.
+        """
+        return self._backend._optimizer
+
+    def get_checkpoint(self):
+        return self.backend_optimizer.get_checkpoint()
+
+    def interrupt_search(self):
+        self.backend_optimizer.interrupt_search()
+
     @property
     def name(self):
         if isinstance(self._optimizer_class, basestring):
@@ -330,7 +540,14 @@ class QueueBackend(object):
         The minimum numbers of candidates to keep ready.
     _exited : bool
         Whether this process should exit (has seen the exit signal).
+    num_kept : int
+        The number of candidates kept after rescoring them on an update.
+    num_discarded : int
+        The number of candidates discarded after rescoring them on an update.
     """
+    num_kept = None
+    num_discarded = None
+
     _experiment = None
     _out_queue = None
     _in_queue = None
@@ -344,7 +561,7 @@ class QueueBackend(object):
     _logger = None
 
     def __init__(self, optimizer_class, experiment, out_queue, in_queue,
-                 optimizer_params=None):
+                 optimizer_params=None, checkpoint=None):
         """
         Initializes this backend.
 
@@ -364,6 +581,8 @@ class QueueBackend(object):
             The queue on which to put the candidates.
         in_queue : Queue
             The queue on which to receive the new experiments.
+        checkpoint : dict, optional
+            A checkpoint to restore the optimizer from.
         """
         self._logger = logging_utils.get_logger(self)
         self._logger.debug("Initializing queue backend. Parameters: "
@@ -379,8 +598,12 @@ class QueueBackend(object):
         self._min_candidates = optimizer_params.get("min_candidates", 5)
         self._update_time = optimizer_params.get("update_time", 0.1)
         self._optimizer = optimizer_class(experiment, optimizer_params)
+        if checkpoint is not None:
+            self._optimizer.restore_checkpoint(checkpoint)
         self._exited = False
         self._experiment = experiment
+        self.num_kept = 0
+        self.num_discarded = 0
         self._logger.debug("Had set the parameters to: out_queue is %s, "
                            "in_queue %s, optimizer_params %s, "
                            "min_candidates %s, update_time %s,"
@@ -417,8 +640,9 @@ class QueueBackend(object):
         one of the elements is "exit", it will exit instead.
         The latest experiment is then used to call the update function of the
         abstracted optimizer.
-        Additionally, it will empty the out_queue, since we assume it has more,
-        better information available.
+        Candidates in the out_queue stay available to workers while the
+        optimizer is updated. Afterwards, the optimizer rescores them, and
+        only those it keeps are put back into the out_queue.
         """
         new_update = None
         while not self._in_queue.empty():
@@ -432,16 +656,32 @@ class QueueBackend(object):
                 self._exited = True
                 return
         if new_update is not None:
-            # clear the out queue. We'll soon have new information.
-            try:
-                while not self._out_queue.empty():
-                    self._out_queue.get_nowait()
-                self._logger.debug("Cleared out the update queue.")
-            except Queue.Empty:
-                pass
             self._experiment = new_update
             self._optimizer.update(self._experiment)
             self._logger.debug("Finished updating.")
+            self._rescore_queue()
+
+    def _rescore_queue(self):
+        """
+        Replaces the candidates in the out_queue by those the optimizer keeps.
+        """
+        queued = []
+        try:
+            while True:
+                queued.append(self._out_queue.get_nowait())
+        except Queue.Empty:
+            pass
+        if not queued:
+            return
+        kept = self._optimizer.rescore_candidates(queued)
+        for c in kept:
+            self._out_queue.put_nowait(c)
+        self.num_kept += len(kept)
+        self.num_discarded += len(queued) - len(kept)
+        _kept_total.inc(len(kept))
+        _discarded_total.inc(len(queued) - len(kept))
+        self._logger.debug("Rescored %s queued candidates, kept %s.",
+                           len(queued), len(kept))
 
     def _check_generation(self):
         """
@@ -449,13 +689,13 @@ class QueueBackend(object):
 
         Specifically, it tests whether less than min_candidates are available
         in the out_queue. If so, it will (via optimizer.get_next_candidates)
-        try to add min_candidates candidates.
+        try to add the missing candidates.
         """
         try:
-            if (self._out_queue.empty() or
-                           self._out_queue.qsize < self._min_candidates):
+            num_missing = self._min_candidates - self._out_queue.qsize()
+            if num_missing > 0:
                 new_candidates = self._optimizer.get_next_candidates(
-                    num_candidates=self._min_candidates)
+                    num_candidates=num_missing)
                 self._logger.debug("Needed to generate new candidates. "
                                    "Generated %s", new_candidates)
                 if new_candidates is None:
@@ -464,6 +704,9 @@ class QueueBackend(object):
                     self._out_queue.put_nowait(c)
         except Queue.Full:
             return
+        finally:
+            _queue_depth.set(self._out_queue.qsize(),
+                             experiment=self._experiment.exp_id)
 
 
 def dispatch_queue_backend(optimizer_class, optimizer_params, experiment,
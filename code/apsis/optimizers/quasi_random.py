@@ -0,0 +1,97 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.optimizer import Optimizer
+from apsis.models.parameter_definition import *
+from apsis.models.candidate import Candidate
+from apsis.utilities.space_filling import check_design, design_dimensions, \
+    warp_design
+
+
+class QuasiRandom(Optimizer):
+    """
+    This is a quasi-random search, using space-filling designs.
+
+    Like random search, it allows highly parallel optimization and supports
+    every parameter type. However, its candidates cover the parameter space
+    more evenly than independent random draws; see
+    apsis.utilities.space_filling.
+
+    Attributes
+    ----------
+    design : SpaceFillingDesign
+        The design the candidates are taken from.
+    """
+    SUPPORTED_PARAM_TYPES = [NominalParamDef, NumericParamDef]
+
+    design = None
+    name = "QuasiRandom"
+
+    def __init__(self, experiment, optimizer_params=None):
+        """
+        Initializes the quasi-random search optimizer.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment representing the current state of the execution.
+        optimizer_params : dict, optional
+            Dictionary of the optimizer parameters. If None, some standard
+            parameters will be assumed.
+            Available parameters are
+            "design" : string, optional
+                The design to use, one of space_filling.AVAILABLE_DESIGNS.
+                Default is "sobol".
+            "design_size" : int, optional
+                The size of each Latin hypercube for the "lhs" design. By
+                default, each call to get_next_candidates uses its own.
+            "random_state" : randomstate, optional
+                The random state to use for scrambling the design. See numpy
+                random states.
+
+        Raises
+        ------
+        ValueError
+            Iff the experiment or the design is not supported.
+        """
+        self._logger = logging_utils.get_logger(self)
+        self._logger.debug("Initializing quasi-random search. experiment is "
+                           "%s, optimizer_params %s", experiment,
+                           optimizer_params)
+        if optimizer_params is None:
+            optimizer_params = {}
+        Optimizer.__init__(self, experiment, optimizer_params)
+        design_params = {}
+        design = optimizer_params.get("design", "sobol")
+        if design == "lhs" and optimizer_params.get("design_size"):
+            design_params["size"] = optimizer_params["design_size"]
+        self.design = check_design(
+            design, design_dimensions(experiment.parameter_definitions),
+            random_state=optimizer_params.get("random_state", None),
+            design_params=design_params)
+        # Continues the design after any candidates already generated, for
+        # example when the experiment has been loaded again.
+        self.design.skip(len(experiment.candidates_finished) +
+                         len(experiment.candidates_pending) +
+                         len(experiment.candidates_working))
+        self._logger.debug("Initialized design to %s", self.design)
+
+    def get_next_candidates(self, num_candidates=1):
+        self._logger.debug("Returning next %s candidates", num_candidates)
+        param_defs = self._experiment.parameter_definitions
+        warped = warp_design(self.design.draw(num_candidates), param_defs)
+        value_lists = {}
+        for key, param_def in param_defs.items():
+            value_lists[key] = param_def.warp_out_batch(warped[key])
+        candidate_list = []
+        for i in range(num_candidates):
+            value_dict = {}
+            for key in value_lists:
+                value_dict[key] = value_lists[key][i]
+            candidate_list.append(Candidate(value_dict))
+        self._logger.debug("Generated candidates: %s", candidate_list)
+        return candidate_list
+
+    def rescore_candidates(self, candidates):
+        # The candidates do not depend on the results, so they are as good
+        # as new ones.
+        return candidates
@@ -0,0 +1,222 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.optimizer import Optimizer
+from apsis.optimizers.random_search import RandomSearch
+from apsis.models.parameter_definition import *
+from apsis.utilities.randomization import check_random_state
+from apsis.models.candidate import Candidate
+from apsis.optimizers.bayesian.acquisition_functions import *
+from apsis.optimizers.bayesian.random_forest import RandomForest
+from apsis.utilities.acquisition_utils import check_acquisition
+import apsis.utilities.acquisition_utils as acq_utils
+
+
+class RandomForestOptimizer(Optimizer):
+    """
+    This is a model-based optimizer using a random forest surrogate.
+
+    It works like BayesianOptimizer, but replaces the gp by a RandomForest
+    (see apsis.optimizers.bayesian.random_forest), similar to SMAC. The
+    forest is trained on the same warped candidate matrix and used through
+    the same AcquisitionFunctions. Since its predictions have no useful
+    gradient, the acquisition function is maximized by local search.
+
+    Compared to a gp, the forest handles nominal parameters well, and its
+    incremental updates scale near-linearly with the number of finished
+    candidates. It is therefore suited for experiments with many hundreds
+    of candidates and mixed parameter types.
+
+    Attributes
+    ----------
+    acquisition_function : acquisition_function
+        The acquisition function to use.
+    acquisition_hyperparams : dict
+        The acquisition hyperparameters.
+    random_state : randomstate
+        The random state to use. See numpy random states.
+    random_searcher : RandomSearch
+        The random search instance used to generate the first
+        initial_random_runs candidates.
+    forest : RandomForest
+        The surrogate model.
+    cost_forest : RandomForest
+        The model of the logarithm of the candidates' costs, used if the
+        acquisition function requires a cost model.
+    initial_random_runs : int
+        The number of initial random runs before using the forest. Default
+        is 10.
+    """
+    SUPPORTED_PARAM_TYPES = [NumericParamDef, NominalParamDef]
+
+    acquisition_function = None
+    acquisition_hyperparams = None
+
+    random_state = None
+    random_searcher = None
+
+    forest = None
+    cost_forest = None
+    initial_random_runs = 10
+
+    name = "RandomForest"
+    return_max = True
+
+    def __init__(self, experiment, optimizer_params=None):
+        """
+        Initializes a random forest optimizer.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment for which to optimize.
+        optimizer_params : dict of string keys, optional
+            Sets the possible arguments for this optimizer. Available are:
+            "initial_random_runs" : int, optional
+                The number of initial random runs before using the forest.
+                Default is 10.
+            "random_state" : randomstate, optional
+                The random state to use. Default is None.
+            "acquisition_hyperparams" : dict, optional
+                Dictionary of acquisition-function hyperparameters. Unless
+                set there, the max_searcher is "local_search".
+            "acquisition" : AcquisitionFunction, optional
+                The acquisition function to use. Default is
+                ExpectedImprovement.
+            "num_trees" : int, optional
+                The number of trees. Default is 10.
+            "min_samples_split" : int, optional
+                The minimum number of samples to split a node. Default is 3.
+            "max_features_ratio" : float, optional
+                The fraction of parameters considered for each split. Default
+                is 5/6.
+            "refit_factor" : float, optional
+                The trees are grown again once the number of finished
+                candidates grew by this factor. In between, new candidates
+                only update the leaves. Default is 1.5.
+        """
+        self._logger = get_logger(self)
+        self._logger.debug("Initializing random forest optimizer. Experiment "
+                           "is %s, optimizer_params %s", experiment,
+                           optimizer_params)
+        if optimizer_params is None:
+            optimizer_params = {}
+
+        self.initial_random_runs = optimizer_params.get(
+            'initial_random_runs', self.initial_random_runs)
+        self.random_state = check_random_state(
+            optimizer_params.get('random_state', None))
+        self.acquisition_hyperparams = dict(
+            optimizer_params.get('acquisition_hyperparams', None) or {})
+        self.acquisition_hyperparams.setdefault("max_searcher",
+                                                "local_search")
+        self._logger.debug("Initialized relevant parameters. "
+                           "initial_random_runs is %s, random_state is %s, "
+                           "acquisition_hyperparams %s",
+                           self.initial_random_runs, self.random_state,
+                           self.acquisition_hyperparams)
+
+        if not isinstance(optimizer_params.get('acquisition'),
+                          AcquisitionFunction):
+            self.acquisition_function = check_acquisition(
+                acquisition=optimizer_params.get("acquisition",
+                                                 ExpectedImprovement),
+                acquisition_params=self.acquisition_hyperparams)
+        else:
+            self.acquisition_function = optimizer_params.get("acquisition")
+        self._logger.debug("Acquisition function is %s",
+                           self.acquisition_function)
+
+        forest_params = {
+            "num_trees": optimizer_params.get("num_trees", 10),
+            "min_samples_split": optimizer_params.get("min_samples_split", 3),
+            "max_features_ratio": optimizer_params.get("max_features_ratio",
+                                                       5/6.),
+            "refit_factor": optimizer_params.get("refit_factor", 1.5),
+            "random_state": self.random_state
+        }
+        self.forest = RandomForest(**forest_params)
+        self.cost_forest = RandomForest(**forest_params)
+        self.random_searcher = RandomSearch(experiment, optimizer_params)
+        Optimizer.__init__(self, experiment, optimizer_params)
+        self._logger.debug("Finished initializing the random forest "
+                           "optimizer.")
+
+    def get_next_candidates(self, num_candidates=1):
+        self._logger.debug("Returning next %s candidates", num_candidates)
+        if len(self._experiment.candidates_finished) < \
+                self.initial_random_runs:
+            random_candidates = self.random_searcher.get_next_candidates(
+                num_candidates)
+            self._logger.debug("Still in the random run phase. Returning %s",
+                               random_candidates)
+            return random_candidates
+        if self.forest.trees is None:
+            self._logger.debug("No forest available. Updating with %s",
+                               self._experiment)
+            self.update(self._experiment)
+
+        new_candidate_points = self.acquisition_function.compute_proposals(
+            self.forest, self._experiment, number_proposals=num_candidates,
+            return_max=self.return_max
+        )
+        self._logger.debug("Generated new candidate points. Are %s",
+                           new_candidate_points)
+        self.return_max = False
+
+        candidates = []
+        for point_and_value in new_candidate_points:
+            candidates.append(Candidate(self._experiment.warp_pt_out(
+                point_and_value[0])))
+        self._logger.debug("Candidates extracted. Returning %s", candidates)
+        return candidates
+
+    def rescore_candidates(self, candidates):
+        """
+        Keeps the candidates the acquisition function still finds competitive.
+
+        All candidates are scored with the updated model in one batch, see
+        AcquisitionFunction.competitive_points. Before the model is first
+        fitted, the random searcher decides.
+        """
+        if self.forest.trees is None:
+            return self.random_searcher.rescore_candidates(candidates)
+        candidate_matrix = acq_utils.create_param_matrix(self._experiment,
+                                                         candidates)
+        indices = self.acquisition_function.competitive_points(
+            candidate_matrix, self.forest, self._experiment)
+        self._logger.debug("Keeping %s of %s candidates.", len(indices),
+                           len(candidates))
+        return [candidates[i] for i in indices]
+
+    def interrupt_search(self):
+        """
+        Makes a running search of the acquisition function return early.
+
+        See AcquisitionFunction.interrupt.
+        """
+        self.acquisition_function.interrupt()
+
+    def update(self, experiment):
+        self._logger.debug("Updating the random forest optimizer with %s",
+                           experiment)
+        self._experiment = experiment
+        if (len(self._experiment.candidates_finished) <
+                self.initial_random_runs):
+            self._logger.debug("Less than initial_random_runs. No refit "
+                               "necessary.")
+            return
+
+        self.return_max = True
+        candidate_matrix, results_vector = acq_utils.create_cand_matrix_vector(
+            experiment, self.treat_failed)
+        self.forest.update(candidate_matrix, results_vector)
+        self._logger.debug("Updated the forest.")
+        if self.acquisition_function.requires_cost_model:
+            cost_matrix, log_cost_vector = \
+                acq_utils.create_cost_matrix_vector(experiment)
+            if len(log_cost_vector) < 2:
+                self.acquisition_function.cost_gp = None
+            else:
+                self.cost_forest.update(cost_matrix, log_cost_vector)
+                self.acquisition_function.cost_gp = self.cost_forest
+            self._logger.debug("Updated the cost model.")
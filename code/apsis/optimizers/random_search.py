@@ -56,48 +56,52 @@ class RandomSearch(Optimizer):
 
     def get_next_candidates(self, num_candidates=1):
         self._logger.debug("Returning next %s candidates", num_candidates)
-        candidate_list = []
-        for i in range(num_candidates):
-            candidate_list.append(self._gen_one_candidate())
+        candidate_list = self._gen_candidates(num_candidates)
         self._logger.debug("Generated candidates: %s", candidate_list)
         return candidate_list
 
-    def _gen_one_candidate(self):
-        """
-        Generates a single candidate.
-
-        This is done by generating parameter values for each of the
-        available parameters.
+    def rescore_candidates(self, candidates):
+        # The candidates do not depend on the results, so they are as good
+        # as new ones.
+        return candidates
 
-        Returns
-        -------
-        candidate : Candidate
-            The generated candidate
+    def _gen_candidates(self, num_candidates):
         """
-        self._logger.debug("Generating single candidate.")
-        self.random_state = check_random_state(self.random_state)
-        value_dict = {}
-        for key, param_def in self._experiment.parameter_definitions.iteritems():
-            value_dict[key] = self._gen_param_val(param_def)
-        generated_candidate = Candidate(value_dict)
-        self._logger.debug("Generated candidate: %s", generated_candidate)
-        return generated_candidate
-
-    def _gen_param_val(self, param_def):
-        """
-        Returns a random parameter value for param_def.
+        Generates num_candidates candidates at once.
+
+        All warped values are drawn as a single (num_candidates, D) matrix,
+        where D is the sum of the warped sizes of all parameters. Each
+        parameter then warps out its columns in one batch operation.
 
-        This is done by generating warped_size many different 0-1 values, which
-        are then warped out.
+        The random values are drawn in the same order as they would be for
+        candidates generated one at a time, so the candidates for a given
+        random state do not depend on the batch size.
 
         Parameters
         ----------
-        param_def : ParamDef
-            The parameter definition from which to choose one at random.
+        num_candidates : int
+            The number of candidates to generate.
+
         Returns
         -------
-        param_val:
-            The generated parameter value.
+        candidates : list of Candidates
+            The generated candidates.
         """
-        return param_def.warp_out(list(
-            self.random_state.uniform(0, 1, param_def.warped_size())))
+        self._logger.debug("Generating %s candidates.", num_candidates)
+        self.random_state = check_random_state(self.random_state)
+        param_defs = list(self._experiment.parameter_definitions.iteritems())
+        sizes = [param_def.warped_size() for _, param_def in param_defs]
+        warped = self.random_state.uniform(0, 1, (num_candidates, sum(sizes)))
+        value_lists = {}
+        start = 0
+        for (key, param_def), size in zip(param_defs, sizes):
+            value_lists[key] = param_def.warp_out_batch(
+                warped[:, start:start+size])
+            start += size
+        candidates = []
+        for i in range(num_candidates):
+            value_dict = {}
+            for key in value_lists:
+                value_dict[key] = value_lists[key][i]
+            candidates.append(Candidate(value_dict))
+        return candidates
@@ -0,0 +1,272 @@
+__author__ = 'Frederik Diehl'
+
+import math
+from apsis.optimizers.optimizer import Optimizer
+from apsis.optimizers.random_search import RandomSearch
+from apsis.models.parameter_definition import *
+from apsis.models.candidate import Candidate
+
+
+class AsyncSuccessiveHalving(Optimizer):
+    """
+    This is an asynchronous successive halving (ASHA) optimizer [1].
+
+    Every candidate is evaluated with a resource budget (for example a
+    number of epochs) given in its worker_information, which is a dict of
+        "resource" : The budget to evaluate the candidate with.
+        "rung" : The rung of the candidate, starting at 0.
+        "bracket" : The bracket of the candidate, starting at 0.
+        "resume_from" : The cand_id of the same parameters evaluated on the
+            rung below, or None. Workers can use it to continue from that
+            evaluation instead of starting from scratch.
+    Candidates of bracket s on rung k get the resource
+    min_resource * eta**(s+k), and those on the top rung get max_resource.
+
+    Whenever a candidate is requested, the best 1/eta of the finished
+    candidates of a rung which have not been promoted yet are evaluated
+    again on the next rung, higher rungs first. If no candidate can be
+    promoted, new random parameters are started on the lowest rung of a
+    bracket. The optimizer never waits for a rung to be complete, so all
+    workers are always busy.
+
+    Workers are expected to report each candidate as finished with the
+    result achieved at its resource, and should set its cost. They may add
+    their own keys to worker_information, but must keep the ones above. A
+    worker that is interrupted can report the candidate as pausing; it is
+    then returned to the next worker unchanged, including its
+    worker_information.
+
+    [1] Li, L., Jamieson, K., Rostamizadeh, A., Gonina, E., Hardt, M.,
+    Recht, B. and Talwalkar, A. A System for Massively Parallel
+    Hyperparameter Tuning. MLSys 2020.
+
+    Attributes
+    ----------
+    min_resource : float
+        The resource of the lowest rung.
+    max_resource : float
+        The resource of the top rung.
+    eta : int
+        The reduction factor between two rungs.
+    brackets : int
+        The number of brackets new candidates are distributed over.
+    random_searcher : RandomSearch
+        The random search used to generate new parameters.
+    """
+    SUPPORTED_PARAM_TYPES = [NominalParamDef, NumericParamDef]
+
+    min_resource = None
+    max_resource = None
+    eta = None
+    brackets = None
+    random_searcher = None
+
+    _max_rung = None
+    _promoted = None
+    _next_bracket = None
+    name = "ASHA"
+
+    def __init__(self, experiment, optimizer_params=None):
+        """
+        Initializes the successive halving optimizer.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment representing the current state of the execution.
+        optimizer_params : dict, optional
+            Dictionary of the optimizer parameters. If None, some standard
+            parameters will be assumed.
+            Available parameters are
+            "min_resource" : float, optional
+                The resource of the lowest rung. Default is 1.
+            "max_resource" : float, optional
+                The resource of the top rung. Default is 81.
+            "eta" : int, optional
+                The reduction factor between rungs. Default is 3.
+            "brackets" : int, optional
+                The number of brackets. Bracket s starts candidates with the
+                resource of rung s of bracket 0. Default is 1.
+            "random_state" : randomstate, optional
+                The random state to use for new parameters. See numpy random
+                states.
+
+        Raises
+        ------
+        ValueError
+            Iff the experiment is not supported, or the resources, eta or
+            brackets are invalid.
+        """
+        self._logger = logging_utils.get_logger(self)
+        self._logger.debug("Initializing successive halving. experiment is "
+                           "%s, optimizer_params %s", experiment,
+                           optimizer_params)
+        if optimizer_params is None:
+            optimizer_params = {}
+        self.min_resource = optimizer_params.get("min_resource", 1)
+        self.max_resource = optimizer_params.get("max_resource", 81)
+        self.eta = optimizer_params.get("eta", 3)
+        if not 0 < self.min_resource <= self.max_resource:
+            raise ValueError("Resources must fulfill 0 < min_resource <= "
+                             "max_resource, but are %s and %s."
+                             %(self.min_resource, self.max_resource))
+        if self.eta < 2:
+            raise ValueError("eta must be at least 2, but is %s." %self.eta)
+        self._max_rung = int(math.floor(
+            math.log(float(self.max_resource) / self.min_resource) /
+            math.log(self.eta) + 1e-9))
+        self.brackets = optimizer_params.get("brackets",
+                                             self._default_brackets())
+        if not 1 <= self.brackets <= self._max_rung + 1:
+            raise ValueError("brackets must be between 1 and %s, but is %s."
+                             %(self._max_rung + 1, self.brackets))
+        self._logger.debug("Initialized resources %s to %s, eta %s, max_rung "
+                           "%s, brackets %s", self.min_resource,
+                           self.max_resource, self.eta, self._max_rung,
+                           self.brackets)
+        self._promoted = set()
+        self._next_bracket = 0
+        self.random_searcher = RandomSearch(experiment, optimizer_params)
+        Optimizer.__init__(self, experiment, optimizer_params)
+
+    def _default_brackets(self):
+        """
+        Returns the number of brackets to use if not specified.
+        """
+        return 1
+
+    def update(self, experiment):
+        self._logger.debug("Updating successive halving with %s", experiment)
+        Optimizer.update(self, experiment)
+        self.random_searcher.update(experiment)
+        # Promotions handed out are now part of the experiment. Those that
+        # were not handed out are discarded and may be promoted again.
+        self._promoted = set()
+
+    def get_next_candidates(self, num_candidates=1):
+        self._logger.debug("Returning next %s candidates", num_candidates)
+        rungs = self._collect_rungs()
+        candidates = []
+        for i in range(num_candidates):
+            candidate = self._promote(rungs)
+            if candidate is None:
+                candidate = self._start_new()
+            candidates.append(candidate)
+        self._logger.debug("Generated candidates: %s", candidates)
+        return candidates
+
+    def get_resource(self, bracket, rung):
+        """
+        Returns the resource of the rung of the bracket.
+
+        Parameters
+        ----------
+        bracket : int
+            The bracket.
+        rung : int
+            The rung within the bracket.
+
+        Returns
+        -------
+        resource : float
+            The resource of candidates on that rung.
+        """
+        if bracket + rung >= self._max_rung:
+            return self.max_resource
+        return self.min_resource * self.eta**(bracket + rung)
+
+    def _collect_rungs(self):
+        """
+        Collects the finished candidates of each rung.
+
+        Also adds all candidates which have been resumed on a higher rung to
+        the promoted candidates.
+
+        Returns
+        -------
+        rungs : dict
+            For each (bracket, rung) tuple, the list of finished candidates,
+            sorted from best to worst. Failed candidates are last.
+        """
+        rungs = {}
+        all_candidates = (self._experiment.candidates_finished +
+                          self._experiment.candidates_pending +
+                          self._experiment.candidates_working)
+        for c in all_candidates:
+            info = c.worker_information
+            if not isinstance(info, dict) or "rung" not in info:
+                continue
+            if info.get("resume_from") is not None:
+                self._promoted.add(info["resume_from"])
+        for c in self._experiment.candidates_finished:
+            info = c.worker_information
+            if not isinstance(info, dict) or "rung" not in info:
+                continue
+            rungs.setdefault((info["bracket"], info["rung"]), []).append(c)
+        sign = 1 if self._experiment.minimization_problem else -1
+        for key in rungs:
+            rungs[key].sort(key=lambda c: (c.failed, sign * (c.result or 0)))
+        return rungs
+
+    def _promote(self, rungs):
+        """
+        Promotes the best unpromoted candidate to the next rung, if any.
+
+        Parameters
+        ----------
+        rungs : dict
+            The rungs as returned by _collect_rungs.
+
+        Returns
+        -------
+        candidate : Candidate or None
+            The candidate on the next rung, or None if no candidate can be
+            promoted.
+        """
+        for rung in reversed(range(self._max_rung)):
+            for bracket in range(self.brackets):
+                if bracket + rung >= self._max_rung:
+                    continue
+                finished = rungs.get((bracket, rung), [])
+                for c in finished[:len(finished) // self.eta]:
+                    if c.failed or c.cand_id in self._promoted:
+                        continue
+                    self._promoted.add(c.cand_id)
+                    self._logger.debug("Promoting %s to rung %s of bracket "
+                                       "%s.", c, rung + 1, bracket)
+                    return Candidate(dict(c.params), worker_information={
+                        "resource": self.get_resource(bracket, rung + 1),
+                        "rung": rung + 1,
+                        "bracket": bracket,
+                        "resume_from": c.cand_id})
+        return None
+
+    def _start_new(self):
+        """
+        Starts new random parameters on the lowest rung of the next bracket.
+        """
+        bracket = self._next_bracket
+        self._next_bracket = (self._next_bracket + 1) % self.brackets
+        candidate = self.random_searcher.get_next_candidates(1)[0]
+        candidate.worker_information = {
+            "resource": self.get_resource(bracket, 0),
+            "rung": 0,
+            "bracket": bracket,
+            "resume_from": None}
+        self._logger.debug("Starting new candidate %s", candidate)
+        return candidate
+
+
+class AsyncHyperband(AsyncSuccessiveHalving):
+    """
+    This is an asynchronous version of Hyperband.
+
+    It is AsyncSuccessiveHalving using all brackets by default, so new
+    candidates are started with every resource from min_resource to
+    max_resource in turn. This hedges against low resources being too
+    unreliable to compare candidates.
+    """
+    name = "Hyperband"
+
+    def _default_brackets(self):
+        return self._max_rung + 1
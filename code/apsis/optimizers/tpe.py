@@ -0,0 +1,461 @@
+__author__ = 'Frederik Diehl'
+
+import math
+import numpy as np
+from scipy.special import ndtr, ndtri
+from apsis.optimizers.optimizer import Optimizer
+from apsis.optimizers.random_search import RandomSearch
+from apsis.models.parameter_definition import *
+from apsis.utilities.randomization import check_random_state
+from apsis.models.candidate import Candidate
+
+
+# Maximum number of (point, component) pairs evaluated at once. This bounds
+# the memory used for density evaluation on large experiments.
+_MAX_BLOCK_SIZE = 2**20
+
+
+def _bandwidths(mus, prior_mu, prior_sigma):
+    """
+    Computes the Parzen bandwidths for sorted observations on [0, 1].
+
+    Each observation uses the larger of the distances to its neighbours,
+    with the prior mean inserted among the observations and the bounds 0
+    and 1 as outermost neighbours. Bandwidths are clipped to
+    [1/min(100, n+1), 1], where n is the number of observations.
+
+    Parameters
+    ----------
+    mus : np.array of floats
+        The sorted observations.
+    prior_mu : float
+        The prior mean.
+    prior_sigma : float
+        The prior bandwidth.
+
+    Returns
+    -------
+    all_mus : np.array of floats
+        The observations with the prior mean at index 0.
+    sigmas : np.array of floats
+        The corresponding bandwidths, the prior's at index 0.
+    """
+    prior_pos = np.searchsorted(mus, prior_mu)
+    points = np.insert(mus, prior_pos, prior_mu)
+    padded = np.concatenate(([0.], points, [1.]))
+    sigmas = np.maximum(padded[1:-1] - padded[:-2], padded[2:] - padded[1:-1])
+    min_sigma = 1. / min(100., len(mus) + 1.)
+    sigmas = np.clip(sigmas, min_sigma, 1.)
+    sigmas[prior_pos] = prior_sigma
+    order = np.concatenate(([prior_pos], np.arange(prior_pos),
+                            np.arange(prior_pos + 1, len(points))))
+    return points[order], sigmas[order]
+
+
+class NumericParzenEstimator(object):
+    """
+    A Parzen estimator for values on [0, 1].
+
+    This is a mixture of Gaussians truncated to [0, 1], one per observation
+    and one wide prior component.
+
+    Attributes
+    ----------
+    mus : np.array of floats
+        The means of the components.
+    sigmas : np.array of floats
+        The standard deviations of the components.
+    weights : np.array of floats
+        The mixture weights, summing up to one.
+    """
+    mus = None
+    sigmas = None
+    weights = None
+
+    _lower = None
+    _upper = None
+    _log_const = None
+
+    def __init__(self, observations, prior_weight=1.):
+        """
+        Initializes the estimator.
+
+        Parameters
+        ----------
+        observations : np.array of floats
+            The observed values, each in [0, 1].
+        prior_weight : float, optional
+            The weight of the prior component relative to that of each
+            observation. Default is 1.
+        """
+        observations = np.sort(np.asarray(observations, dtype=float))
+        self.mus, self.sigmas = _bandwidths(observations, 0.5, 1.)
+        self.weights = np.ones(len(self.mus))
+        self.weights[0] = prior_weight
+        self.weights /= self.weights.sum()
+        self._lower = ndtr(-self.mus / self.sigmas)
+        self._upper = ndtr((1 - self.mus) / self.sigmas)
+        self._log_const = (np.log(self.weights) - np.log(self.sigmas) -
+                           np.log(self._upper - self._lower) -
+                           0.5 * np.log(2 * np.pi))
+
+    def sample(self, size, random_state):
+        """
+        Draws size samples from the estimator.
+
+        Parameters
+        ----------
+        size : int
+            The number of samples to draw.
+        random_state : np.random.RandomState
+            The random state to use.
+
+        Returns
+        -------
+        samples : np.array of floats
+            The samples, each in [0, 1].
+        """
+        components = random_state.choice(len(self.mus), size=size,
+                                         p=self.weights)
+        lower = self._lower[components]
+        upper = self._upper[components]
+        u = lower + random_state.uniform(0, 1, size) * (upper - lower)
+        u = np.clip(u, 1e-300, 1 - 1e-16)
+        samples = self.mus[components] + \
+                  self.sigmas[components] * ndtri(u)
+        return np.clip(samples, 0, 1)
+
+    def log_pdf(self, x):
+        """
+        Evaluates the log density at every point of x.
+
+        Parameters
+        ----------
+        x : np.array of floats
+            The points to evaluate.
+
+        Returns
+        -------
+        log_pdf : np.array of floats
+            The log density at each point.
+        """
+        x = np.asarray(x, dtype=float)
+        result = np.empty(len(x))
+        block = max(1, _MAX_BLOCK_SIZE // len(self.mus))
+        for start in range(0, len(x), block):
+            z = ((x[start:start+block, None] - self.mus[None, :]) /
+                 self.sigmas[None, :])
+            log_terms = self._log_const[None, :] - 0.5 * z**2
+            max_terms = log_terms.max(axis=1)
+            result[start:start+block] = max_terms + np.log(
+                np.exp(log_terms - max_terms[:, None]).sum(axis=1))
+        return result
+
+
+class DiscreteParzenEstimator(object):
+    """
+    A Parzen estimator for a parameter with a finite number of values.
+
+    Without positions, this is the smoothed histogram of the observed
+    values. With positions, every distinct observed value also spreads
+    probability to its neighbours, using a Gaussian kernel over the
+    positions.
+
+    Attributes
+    ----------
+    probabilities : np.array of floats
+        The probability of each value.
+    """
+    probabilities = None
+
+    def __init__(self, observations, num_values, positions=None,
+                 prior_weight=1.):
+        """
+        Initializes the estimator.
+
+        Parameters
+        ----------
+        observations : np.array of ints
+            The indices of the observed values.
+        num_values : int
+            The number of possible values.
+        positions : np.array of floats, optional
+            The positions of the values on [0, 1]. If None, the values are
+            treated as unordered.
+        prior_weight : float, optional
+            The weight of the uniform prior relative to that of each
+            observation. Default is 1.
+        """
+        counts = np.bincount(np.asarray(observations, dtype=int),
+                             minlength=num_values).astype(float)
+        if positions is None or num_values < 2:
+            weights = counts
+        else:
+            positions = np.asarray(positions, dtype=float)
+            observed = np.nonzero(counts)[0]
+            order = np.argsort(positions[observed])
+            observed = observed[order]
+            mus, sigmas = _bandwidths(positions[observed], 0.5, 1.)
+            mus, sigmas = mus[1:], sigmas[1:]
+            kernels = np.exp(-0.5 * ((positions[None, :] - mus[:, None]) /
+                                     sigmas[:, None])**2)
+            kernels /= kernels.sum(axis=1)[:, None]
+            weights = counts[observed].dot(kernels)
+        self.probabilities = weights + float(prior_weight) / num_values
+        self.probabilities /= self.probabilities.sum()
+
+    def sample(self, size, random_state):
+        """
+        Draws size value indices from the estimator.
+
+        Parameters
+        ----------
+        size : int
+            The number of samples to draw.
+        random_state : np.random.RandomState
+            The random state to use.
+
+        Returns
+        -------
+        samples : np.array of ints
+            The sampled value indices.
+        """
+        return random_state.choice(len(self.probabilities), size=size,
+                                   p=self.probabilities)
+
+    def log_pdf(self, x):
+        """
+        Evaluates the log probability of every value index of x.
+
+        Parameters
+        ----------
+        x : np.array of ints
+            The value indices to evaluate.
+
+        Returns
+        -------
+        log_pdf : np.array of floats
+            The log probability of each value index.
+        """
+        return np.log(self.probabilities)[np.asarray(x, dtype=int)]
+
+
+class TPEOptimizer(Optimizer):
+    """
+    This is a Tree-structured Parzen Estimator (TPE) optimizer.
+
+    TPE splits the finished candidates into a small set of good ones and
+    the remaining bad ones. It models each parameter independently with two
+    Parzen estimators, l(x) on the good and g(x) on the bad candidates.
+    New candidates are chosen among samples from l(x) by maximizing
+    l(x)/g(x), which is equivalent to maximizing the expected improvement
+    [1].
+
+    Numeric parameters are modelled in their warped space. Nominal
+    parameters use a smoothed histogram; ordinal (and position) parameters
+    additionally smooth between neighbouring values. Refitting costs
+    O(n log n) for n finished candidates, and candidates are scored in
+    vectorized blocks. This makes it usable for experiments with many
+    thousands of candidates and mostly nominal parameters, where
+    BayesianOptimizer does not apply.
+
+    [1] Bergstra, J. S., Bardenet, R., Bengio, Y. and Kegl, B. Algorithms for
+    Hyper-Parameter Optimization. NIPS 2011.
+
+    Attributes
+    ----------
+    initial_random_runs : int
+        The number of candidates to evaluate randomly before using TPE.
+    gamma : float
+        Governs the number of good candidates, which is
+        ceil(gamma * sqrt(n)) for n finished candidates.
+    num_ei_candidates : int
+        The number of samples drawn from l(x) for each new candidate.
+    prior_weight : float
+        The weight of the prior relative to each observation.
+    random_state : randomstate
+        The random state to use. See numpy random states.
+    random_searcher : RandomSearch
+        The random searcher used for the initial random runs.
+    """
+    SUPPORTED_PARAM_TYPES = [NominalParamDef, NumericParamDef]
+
+    initial_random_runs = None
+    gamma = None
+    num_ei_candidates = None
+    prior_weight = None
+    random_state = None
+    random_searcher = None
+
+    _encoded = None
+    _estimators = None
+    name = "TPE"
+
+    def __init__(self, experiment, optimizer_params=None):
+        """
+        Initializes the TPE optimizer.
+
+        Parameters
+        ----------
+        experiment : Experiment
+            The experiment representing the current state of the execution.
+        optimizer_params : dict, optional
+            Dictionary of the optimizer parameters. If None, some standard
+            parameters will be assumed.
+            Available parameters are
+            "initial_random_runs" : int, optional
+                The number of initial random candidates. Default is 10.
+            "gamma" : float, optional
+                Governs the number of good candidates. Default is 0.25.
+            "num_ei_candidates" : int, optional
+                The number of samples from l(x) for each new candidate.
+                Default is 24.
+            "prior_weight" : float, optional
+                The weight of the prior. Default is 1.
+            "random_state" : randomstate, optional
+                The random state to use. See numpy random states.
+
+        Raises
+        ------
+        ValueError
+            Iff the experiment is not supported.
+        """
+        self._logger = logging_utils.get_logger(self)
+        self._logger.debug("Initializing TPE. experiment is %s, "
+                           "optimizer_params %s", experiment, optimizer_params)
+        if optimizer_params is None:
+            optimizer_params = {}
+        self.initial_random_runs = optimizer_params.get(
+            "initial_random_runs", 10)
+        self.gamma = optimizer_params.get("gamma", 0.25)
+        self.num_ei_candidates = optimizer_params.get("num_ei_candidates", 24)
+        self.prior_weight = optimizer_params.get("prior_weight", 1.)
+        self.random_state = check_random_state(
+            optimizer_params.get("random_state", None))
+        self._logger.debug("Initialized TPE parameters. initial_random_runs "
+                           "%s, gamma %s, num_ei_candidates %s, prior_weight "
+                           "%s", self.initial_random_runs, self.gamma,
+                           self.num_ei_candidates, self.prior_weight)
+        self._encoded = {}
+        self.random_searcher = RandomSearch(experiment, optimizer_params)
+        Optimizer.__init__(self, experiment, optimizer_params)
+        self._logger.debug("Finished initializing TPE.")
+
+    def update(self, experiment):
+        self._logger.debug("Updating TPE with %s", experiment)
+        Optimizer.update(self, experiment)
+        self.random_searcher.update(experiment)
+        self._estimators = None
+
+    def get_next_candidates(self, num_candidates=1):
+        self._logger.debug("Returning next %s candidates", num_candidates)
+        if len(self._experiment.candidates_finished) < \
+                self.initial_random_runs:
+            candidates = self.random_searcher.get_next_candidates(
+                num_candidates)
+            self._logger.debug("Still in the random run phase. Returning %s",
+                               candidates)
+            return candidates
+        if self._estimators is None:
+            self._fit()
+        param_names = sorted(self._experiment.parameter_definitions.keys())
+        pool_size = num_candidates * self.num_ei_candidates
+        scores = np.zeros(pool_size)
+        samples = []
+        for pn, (good, bad) in zip(param_names, self._estimators):
+            sample = good.sample(pool_size, self.random_state)
+            scores += good.log_pdf(sample) - bad.log_pdf(sample)
+            samples.append(sample)
+        best = np.argmax(scores.reshape(num_candidates,
+                                        self.num_ei_candidates), axis=1)
+        best += np.arange(num_candidates) * self.num_ei_candidates
+
+        value_lists = {}
+        for pn, sample in zip(param_names, samples):
+            param_def = self._experiment.parameter_definitions[pn]
+            if isinstance(param_def, NominalParamDef):
+                value_lists[pn] = [param_def.values[i] for i in sample[best]]
+            else:
+                value_lists[pn] = param_def.warp_out_batch(
+                    sample[best][:, None])
+        candidates = []
+        for i in range(num_candidates):
+            value_dict = {}
+            for pn in param_names:
+                value_dict[pn] = value_lists[pn][i]
+            candidates.append(Candidate(value_dict))
+        self._logger.debug("Generated candidates: %s", candidates)
+        return candidates
+
+    def _fit(self):
+        """
+        Fits the good and bad estimators to the finished candidates.
+
+        The parameter values of each candidate are encoded only once and
+        cached by the candidate id, so refitting is dominated by sorting
+        the results.
+        """
+        self._logger.debug("Fitting TPE estimators.")
+        param_names = sorted(self._experiment.parameter_definitions.keys())
+        candidates = self._experiment.candidates_finished
+        if self.treat_failed[0] == "ignore":
+            candidates = [c for c in candidates if not c.failed]
+        encoded = {}
+        for c in candidates:
+            values = self._encoded.get(c.cand_id)
+            if values is None:
+                values = self._encode(c, param_names)
+            encoded[c.cand_id] = values
+        self._encoded = encoded
+        points = np.array([encoded[c.cand_id] for c in candidates],
+                          dtype=float).reshape(len(candidates),
+                                               len(param_names))
+        # Failed candidates are always worse than any finished one.
+        results = np.array([np.inf if c.failed else c.result
+                            for c in candidates], dtype=float)
+        if not self._experiment.minimization_problem:
+            results[np.isfinite(results)] *= -1
+        order = np.argsort(results, kind="mergesort")
+        num_good = int(math.ceil(self.gamma * math.sqrt(len(candidates))))
+        num_good = max(1, min(num_good, len(candidates) - 1))
+        good_idx, bad_idx = order[:num_good], order[num_good:]
+        self._logger.debug("Using %s good and %s bad candidates.",
+                           len(good_idx), len(bad_idx))
+
+        self._estimators = []
+        for i, pn in enumerate(param_names):
+            param_def = self._experiment.parameter_definitions[pn]
+            self._estimators.append(
+                (self._build_estimator(param_def, points[good_idx, i]),
+                 self._build_estimator(param_def, points[bad_idx, i])))
+
+    def _encode(self, candidate, param_names):
+        """
+        Encodes the parameter values of candidate.
+
+        Numeric parameters are encoded as their warped value, all others as
+        the index of their value.
+        """
+        values = []
+        for pn in param_names:
+            param_def = self._experiment.parameter_definitions[pn]
+            value = candidate.params[pn]
+            if isinstance(param_def, NominalParamDef):
+                values.append(param_def.values.index(value))
+            else:
+                values.append(min(max(param_def.warp_in(value)[0], 0), 1))
+        return values
+
+    def _build_estimator(self, param_def, observations):
+        """
+        Builds the Parzen estimator for param_def from observations.
+        """
+        if not isinstance(param_def, NominalParamDef):
+            return NumericParzenEstimator(observations, self.prior_weight)
+        positions = None
+        if isinstance(param_def, PositionParamDef):
+            positions = [param_def.warp_in(v)[0] for v in param_def.values]
+        elif isinstance(param_def, OrdinalParamDef):
+            positions = np.linspace(0, 1, len(param_def.values))
+        return DiscreteParzenEstimator(observations, len(param_def.values),
+                                       positions, self.prior_weight)
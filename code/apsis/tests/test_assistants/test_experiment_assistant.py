@@ -136,9 +136,53 @@ class TestExperimentAssistant(object):
         cand.result = 2
         self.EAss.plot_result_per_step()
 
+    def test_plot_cache(self):
+        """
+        Tests rendering plots via the synchronous plot cache.
+        """
+        from apsis.webservice.plot_cache import PlotCache
+        cand = self.EAss.get_next_candidate()
+        cand.result = 1
+        self.EAss.update(cand)
+        plot_cache = PlotCache(processes=0)
+        png, version = plot_cache.get_plot(
+            "result", self.EAss.get_version(),
+            self.EAss.get_plot_args_result_per_step)
+        assert_true(png.startswith(b"\x89PNG"))
+        assert_equal(version, self.EAss.get_version())
+        png_cached, version = plot_cache.get_plot("result", version, None)
+        assert_equal(png, png_cached)
+        plot_cache.close()
+
     def test_get_candidates_dict(self):
         candidates_dict = self.EAss.get_candidates()
         assert_true(isinstance(candidates_dict, dict))
         for l in ["finished", "pending", "working"]:
             assert_in(l, candidates_dict)
             assert_true(isinstance(candidates_dict[l], list))
+
+    def test_intermediate_results(self):
+        """
+        Tests reporting intermediate results and stopping early.
+        """
+        exp = experiment.Experiment("test_stopping",
+                                    {"x": MinMaxNumericParamDef(0, 1)})
+        EAss = ExperimentAssistant("RandomSearch", exp, optimizer_arguments={
+            "multiprocessing": "none", "early_stopping": "median",
+            "early_stopping_params": {"min_candidates": 2,
+                                      "min_steps": 2}})
+        try:
+            for i in range(2):
+                cand = EAss.get_next_candidate()
+                assert_false(EAss.update(cand, "working",
+                                         intermediate_results=[(1, 1)]))
+                cand.result = 1
+                EAss.update(cand, intermediate_results=[(1, 1), (2, 1)])
+            cand = EAss.get_next_candidate()
+            assert_false(EAss.update(cand, "working",
+                                     intermediate_results=[(1, 2)]))
+            assert_true(EAss.update(cand, "working",
+                                    intermediate_results=[(1, 2), (2, 3)]))
+            assert_equal(len(exp.get_intermediate_results(cand.cand_id)), 2)
+        finally:
+            EAss.set_exit()
@@ -3,7 +3,7 @@ __author__ = 'Frederik Diehl'
 from apsis.assistants.lab_assistant import *
 from nose.tools import assert_equal, assert_items_equal, assert_dict_equal, \
     assert_is_none, assert_raises, raises, assert_greater_equal, \
-    assert_less_equal, assert_in
+    assert_less_equal, assert_in, assert_true, assert_false
 from apsis.utilities.logging_utils import get_logger
 from apsis.models.parameter_definition import *
 import matplotlib.pyplot as plt
@@ -116,3 +116,200 @@ class TestLabAssistant(object):
         self.LAss.update(exp_id, "finished", cand_two)
 
         assert_equal(cand_two, self.LAss.get_best_candidate(exp_id))
+
+    def test_get_experiment_version(self):
+        """
+        Tests whether the experiment version changes on each update.
+        """
+        exp_id = self.test_init_experiment()
+        version = self.LAss.get_experiment_version(exp_id)
+        assert_equal(version, self.LAss.get_experiment_version(exp_id))
+        cand = self.LAss.get_next_candidate(exp_id)
+        cand.result = 1
+        self.LAss.update(exp_id, "finished", cand)
+        new_version = self.LAss.get_experiment_version(exp_id)
+        assert_greater_equal(new_version[0], version[0] + 1)
+
+    def test_concurrent_workers(self):
+        """
+        Tests many concurrent workers on several experiments.
+            - No update is lost
+            - No candidate is in two lists at once
+        """
+        import threading
+        self.param_defs = {
+            "x": MinMaxNumericParamDef(0, 1),
+            "name": NominalParamDef(["A", "B", "C"])
+        }
+        exp_ids = [self.LAss.init_experiment(
+            "test_concurrent_%i" %i, "RandomSearch",
+            param_defs=self.param_defs,
+            optimizer_arguments={"multiprocessing": "none"})
+            for i in range(3)]
+        num_workers = 8
+        num_evaluations = 10
+        errors = []
+
+        def work(exp_id):
+            try:
+                for i in range(num_evaluations):
+                    cand = self.LAss.get_next_candidate(exp_id)
+                    cand.result = cand.params["x"]
+                    self.LAss.update(exp_id, "finished", cand)
+                    self.LAss.get_candidates(exp_id)
+                    self.LAss.get_experiment_as_dict(exp_id)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(exp_ids[i % 3],))
+                   for i in range(num_workers*3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_equal(errors, [])
+        for exp_id in exp_ids:
+            candidates = self.LAss.get_candidates(exp_id)
+            assert_equal(len(candidates["finished"]),
+                         num_workers*num_evaluations)
+            assert_equal(len(set(candidates["finished"])),
+                         num_workers*num_evaluations)
+            assert_equal(candidates["working"], [])
+            assert_equal(candidates["pending"], [])
+
+    def test_sharding(self):
+        """
+        Tests two sharded lab assistants sharing a write directory.
+            - Each only owns and creates its own experiments
+            - Reloading with a different number of shards redistributes them
+        """
+        import tempfile
+        import shutil
+        write_dir = tempfile.mkdtemp()
+        self.param_defs = {
+            "x": MinMaxNumericParamDef(0, 1)
+        }
+        optimizer_arguments = {
+            "multiprocessing": "none"
+        }
+        try:
+            with assert_raises(ValueError):
+                LabAssistant(write_dir, shard_index=0)
+            with assert_raises(ValueError):
+                LabAssistant(write_dir, shard_index=2, num_shards=2)
+            shards = [LabAssistant(write_dir, shard_index=i, num_shards=2)
+                      for i in range(2)]
+            exp_ids = []
+            for i in range(6):
+                shard = shards[i % 2]
+                exp_id = shard.init_experiment(
+                    "test_sharding_%i" %i, "RandomSearch", self.param_defs,
+                    optimizer_arguments=optimizer_arguments)
+                assert_true(shard.owns(exp_id))
+                assert_false(shards[(i + 1) % 2].owns(exp_id))
+                with assert_raises(ValueError):
+                    shards[(i + 1) % 2].init_experiment(
+                        "test_sharding_wrong", "RandomSearch",
+                        self.param_defs, exp_id=exp_id,
+                        optimizer_arguments=optimizer_arguments)
+                exp_ids.append(exp_id)
+            for shard in shards:
+                shard.set_exit()
+
+            single = LabAssistant(write_dir, shard_index=0, num_shards=1)
+            assert_items_equal(single.get_ids(), exp_ids)
+            single.set_exit()
+
+            shards = [LabAssistant(write_dir, shard_index=i, num_shards=2)
+                      for i in range(2)]
+            assert_items_equal(shards[0].get_ids() + shards[1].get_ids(),
+                               exp_ids)
+            for shard in shards:
+                shard.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
+    def test_optimizer_checkpoint(self):
+        """
+        Tests that a reloaded experiment does not refit its gp.
+        """
+        import tempfile
+        import shutil
+        write_dir = tempfile.mkdtemp()
+        optimizer_arguments = {"multiprocessing": "none",
+                               "initial_random_runs": 2,
+                               "num_gp_restarts": 2}
+        try:
+            lab = LabAssistant(write_dir)
+            exp_id = lab.init_experiment(
+                "test_checkpoint", "BayOpt",
+                {"x": MinMaxNumericParamDef(0, 1)},
+                optimizer_arguments=optimizer_arguments)
+            for i in range(4):
+                cand = lab.get_next_candidate(exp_id)
+                cand.result = cand.params["x"]
+                lab.update(exp_id, status="finished", candidate=cand)
+            lab.get_next_candidate(exp_id)
+            gp = lab._exp_assistants[exp_id]._optimizer.gp
+            lab.set_exit()
+            exp_dir = os.path.join(write_dir, exp_id)
+            assert_in("optimizer_checkpoint.json", os.listdir(exp_dir))
+
+            reloaded = LabAssistant(write_dir)
+            restored_gp = reloaded._exp_assistants[exp_id]._optimizer.gp
+            assert_true(restored_gp is not None)
+            assert_equal(list(restored_gp.param_array),
+                         list(gp.param_array))
+            reloaded.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
+    def test_optimizer_checkpoint_queue(self):
+        """
+        Tests reloading a queue-based optimizer right after an update.
+
+        The checkpoint is then written before the backend refitted the gp,
+        so its hyperparameters are used on all candidates.
+        """
+        import json
+        import tempfile
+        import shutil
+        import time
+        write_dir = tempfile.mkdtemp()
+        optimizer_arguments = {"initial_random_runs": 2,
+                               "num_gp_restarts": 2}
+        try:
+            lab = LabAssistant(write_dir)
+            exp_id = lab.init_experiment(
+                "test_checkpoint_queue", "BayOpt",
+                {"x": MinMaxNumericParamDef(0, 1)},
+                optimizer_arguments=optimizer_arguments)
+            backend = lab._exp_assistants[exp_id]._optimizer.backend_optimizer
+            for i in range(4):
+                cand = None
+                while cand is None:
+                    cand = lab.get_next_candidate(exp_id)
+                    time.sleep(0.01)
+                cand.result = cand.params["x"]
+                if i == 3:
+                    # Make sure a gp has been fitted and can be checkpointed.
+                    while backend.gp is None:
+                        time.sleep(0.01)
+                lab.update(exp_id, status="finished", candidate=cand)
+            lab.set_exit()
+            exp_dir = os.path.join(write_dir, exp_id)
+            with open(os.path.join(exp_dir, "optimizer_checkpoint.json"),
+                      "r") as infile:
+                checkpoint = json.load(infile)
+
+            reloaded = LabAssistant(write_dir)
+            optimizer = reloaded._exp_assistants[exp_id]._optimizer
+            restored_gp = optimizer.backend_optimizer.gp
+            assert_true(restored_gp is not None)
+            assert_equal(restored_gp.X.shape[0], 4)
+            assert_equal(list(restored_gp.param_array),
+                         checkpoint["gp"]["parameters"])
+            reloaded.set_exit()
+        finally:
+            shutil.rmtree(write_dir)
+
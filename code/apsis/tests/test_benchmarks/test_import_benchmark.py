@@ -0,0 +1,46 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.benchmarks.import_benchmark import *
+from apsis.utilities.import_utils import LazyRegistry, import_object
+from apsis.utilities.logging_utils import logging_tests
+from nose.tools import assert_equal, assert_true, assert_false, \
+    assert_raises, assert_in, assert_not_in
+
+
+class TestImportBenchmark(object):
+    """
+    Tests the import benchmark and guards the import time of apsis.
+    """
+
+    def setup(self):
+        logging_tests()
+
+    def test_loaded_modules(self):
+        modules = ["numpy", "numpy.linalg", "scipy.special", "apsis_client"]
+        assert_equal(loaded_modules(modules, ["numpy", "scipy", "GPy"]),
+                     ["numpy", "scipy"])
+        assert_equal(loaded_modules(modules, ["apsis"]), [])
+
+    def test_no_heavy_imports(self):
+        # Only the forbidden modules are checked, import times are too
+        # noisy to be tested here.
+        for r in run_benchmark(repeats=1):
+            assert_equal(r["forbidden_loaded"], [],
+                         "%s loads %s" %(r["module"], r["forbidden_loaded"]))
+
+    def test_measure_import_error(self):
+        assert_raises(ValueError, measure_import, "apsis.no_such_module")
+
+    def test_lazy_registry(self):
+        registry = LazyRegistry({"join": "os.path:join", "int": int})
+        assert_in("join", registry)
+        assert_false(registry.is_resolved("join"))
+        assert_equal(sorted(registry.keys()), ["int", "join"])
+        import os.path
+        assert_true(registry["join"] is os.path.join)
+        assert_true(registry.is_resolved("join"))
+        assert_true(registry["int"] is int)
+        registry["missing"] = "os.path:no_such_function"
+        assert_raises(ValueError, registry.__getitem__, "missing")
+        assert_raises(KeyError, registry.__getitem__, "not_registered")
+        assert_raises(ValueError, import_object, "os.path.join")
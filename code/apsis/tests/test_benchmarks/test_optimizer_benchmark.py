@@ -0,0 +1,73 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.benchmarks.optimizer_benchmark import *
+from apsis.utilities.logging_utils import logging_tests
+from nose.tools import assert_equal, assert_in, assert_raises, \
+    assert_greater_equal, assert_true
+import json
+import os
+import shutil
+import tempfile
+
+
+class TestOptimizerBenchmark(object):
+    """
+    Tests the offline optimizer benchmarks.
+    """
+
+    def setup(self):
+        logging_tests()
+
+    def test_run_benchmark(self):
+        run = run_benchmark("RandomSearch", "noisy_branin", steps=5, seed=1)
+        assert_equal(len(run["trace"]), 5)
+        for i, step in enumerate(run["trace"]):
+            assert_equal(step["step"], i)
+            assert_greater_equal(step["regret"], 0)
+            if i > 0:
+                assert_true(step["best_result"] <=
+                            run["trace"][i-1]["best_result"])
+        run_again = run_benchmark("RandomSearch", "noisy_branin", steps=5,
+                                  seed=1)
+        assert_equal([s["result"] for s in run["trace"]],
+                     [s["result"] for s in run_again["trace"]])
+        summary = summarize_run(run)
+        assert_equal(summary["final_regret"], run["trace"][-1]["regret"])
+
+    def test_run_isolated_benchmark(self):
+        run = run_benchmark("RandomSearch", "branin", steps=3, seed=2)
+        isolated = run_isolated_benchmark("RandomSearch", "branin", steps=3,
+                                          seed=2)
+        assert_equal([s["result"] for s in run["trace"]],
+                     [s["result"] for s in isolated["trace"]])
+        if resource is not None:
+            assert_true(isolated["peak_memory"] > 0)
+        from apsis.optimizers.random_search import RandomSearch
+        isolated = run_isolated_benchmark(RandomSearch, "branin", steps=3,
+                                          seed=2)
+        assert_equal(isolated["optimizer"], "RandomSearch")
+        assert_equal([s["result"] for s in run["trace"]],
+                     [s["result"] for s in isolated["trace"]])
+        assert_raises(ValueError, run_isolated_benchmark, "RandomSearch",
+                      get_problem("branin"))
+        assert_raises(ValueError, run_isolated_benchmark, "RandomSearch",
+                      "no_such_problem")
+
+    def test_unknown_problem(self):
+        assert_raises(ValueError, get_problem, "no_such_problem")
+
+    def test_write_results(self):
+        out_dir = tempfile.mkdtemp()
+        try:
+            runs = run_benchmarks(optimizers=["RandomSearch"],
+                                  problems=["branin", "hartmann3"], steps=3,
+                                  out_dir=out_dir)
+            assert_equal(len(runs), 2)
+            assert_in("traces.csv", os.listdir(out_dir))
+            with open(os.path.join(out_dir, "summary.json"), "r") as f:
+                summary = json.load(f)
+            assert_equal(len(summary["runs"]), 2)
+            with open(os.path.join(out_dir, "traces.csv"), "r") as f:
+                assert_equal(len(f.readlines()), 1 + 2*3)
+        finally:
+            shutil.rmtree(out_dir)
@@ -0,0 +1,78 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.benchmarks.scaling_benchmark import *
+from apsis.benchmarks.scaling_benchmark import _record_update_bytes
+from apsis.utilities.logging_utils import logging_tests
+from nose.tools import assert_equal, assert_in, assert_raises, \
+    assert_almost_equal, assert_is_none, assert_greater
+import os
+import shutil
+import tempfile
+
+
+class TestScalingBenchmark(object):
+    """
+    Tests the scaling benchmarks.
+    """
+
+    def setup(self):
+        logging_tests()
+
+    def test_scaling_exponents(self):
+        exponents = scaling_exponents([1, 10, 100], [2, 20, 2000])
+        assert_almost_equal(exponents[0], 1)
+        assert_almost_equal(exponents[1], 2)
+        assert_equal(scaling_exponents([1, 10], [0, 1]), [None])
+
+    def test_find_knee(self):
+        assert_equal(find_knee([1, 10, 100, 1000], [1, 10, 100, 100000]), 100)
+        assert_is_none(find_knee([1, 10, 100], [1, 10, 100]))
+        assert_is_none(find_knee([1, 10], [1, 1000]))
+
+    def test_make_param_def_dicts(self):
+        param_defs = make_param_def_dicts(4, nominal_width=3)
+        assert_equal(len(param_defs), 4)
+        assert_equal(param_defs["x1"]["type"], "NominalParamDef")
+        assert_equal(len(param_defs["x1"]["values"]), 3)
+        assert_equal(param_defs["x0"]["type"], "MinMaxNumericParamDef")
+
+    def test_measure(self):
+        m = measure("lab", make_param_def_dicts(3, nominal_width=4),
+                    prefilled=20, workers=2, steps=3)
+        assert_equal(m["errors"], 0)
+        assert_equal(m["evaluations"], 6)
+        assert_greater(m["bytes_per_update"], 0)
+        assert_raises(ValueError, measure, "no_driver", {})
+
+    def test_record_update_bytes(self):
+        write_dir = tempfile.mkdtemp()
+        driver = LabDriver(write_dir=write_dir)
+        try:
+            exp_id = driver.init_experiment(
+                "bytes", "RandomSearch", make_param_def_dicts(2),
+                optimizer_arguments={"multiprocessing": "none"})
+            exp_assistant = driver.lab_assistant._exp_assistants[exp_id]
+            bytes_per_update = []
+            _record_update_bytes(exp_assistant, bytes_per_update)
+            candidate = driver.get_next_candidate(exp_id)
+            assert_equal(bytes_per_update, [])
+            driver.update(exp_id, candidate, 1.)
+            exp_dir = exp_assistant.write_dir
+            written = sum(os.path.getsize(os.path.join(exp_dir, f))
+                          for f in ["exp_assistant.json", "experiment.json"])
+            assert_equal(bytes_per_update, [written])
+        finally:
+            driver.close()
+            shutil.rmtree(write_dir, ignore_errors=True)
+
+    def test_write_report(self):
+        results = [{"sweep": "workers", "driver": "lab", "x": x,
+                    "update_p50": x * 0.1} for x in [1, 2, 4]]
+        out_dir = tempfile.mkdtemp()
+        try:
+            curves = write_report(results, out_dir)
+            assert_equal(len(curves), len(REPORTED_METRICS))
+            for f in ["results.json", "results.csv", "report.txt"]:
+                assert_in(f, os.listdir(out_dir))
+        finally:
+            shutil.rmtree(out_dir)
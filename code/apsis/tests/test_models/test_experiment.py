@@ -99,6 +99,56 @@ class TestExperiment(object):
         with assert_raises(ValueError):
             self.exp.better_cand(cand, "fails")
 
+    def test_add_finished_candidates(self):
+        cands = [Candidate({"x": i / 10., "name": "B"}) for i in range(5)]
+        for i, cand in enumerate(cands):
+            cand.result = i
+        self.exp.add_pending(cands[0])
+        invalid = Candidate({"x": 0.5, "name": "D"})
+        with assert_raises(ValueError):
+            self.exp.add_finished_candidates(cands + [invalid])
+        with assert_raises(ValueError):
+            self.exp.add_finished_candidates(cands + [False])
+        assert_equal(self.exp.candidates_finished, [])
+
+        self.exp.add_finished_candidates(cands)
+        assert_equal(self.exp.candidates_finished, cands)
+        assert_equal(self.exp.candidates_pending, [])
+        assert_equal(self.exp.best_candidate, cands[0])
+        assert_equal(self.exp.worst_candidate, cands[4])
+
+        # Comparing already added candidates can skip the validation, and
+        # the validator follows replaced parameter definitions.
+        self.exp.parameter_definitions = {
+            "x": MinMaxNumericParamDef(0, 1),
+            "name": NominalParamDef(["C"])}
+        assert_true(self.exp.better_cand(cands[0], cands[1], validate=False))
+        with assert_raises(ValueError):
+            self.exp.better_cand(cands[0], cands[1])
+        assert_true(self.exp._check_param_dict({"x": 0, "name": "C"}))
+
+    def test_best_worst(self):
+        results = [0.5, 0.2, 0.9, None, 0.4]
+        cands = []
+        for i, r in enumerate(results):
+            cand = Candidate({"x": i / 10., "name": "A"})
+            cand.result = r
+            cand.failed = r is None
+            self.exp.add_finished(cand)
+            cands.append(cand)
+        assert_equal(self.exp.best_candidate, cands[1])
+        assert_equal(self.exp.worst_candidate, cands[2])
+        # Moving the worst one back to working rescans the finished ones.
+        self.exp.add_working(cands[2])
+        assert_equal(self.exp.worst_candidate, cands[0])
+        # A candidate finished again with a changed result.
+        cands[1].result = 1.
+        self.exp.add_finished(cands[1])
+        assert_equal(self.exp.best_candidate, cands[4])
+        assert_equal(self.exp.worst_candidate, cands[1])
+        self.exp.add_pausing(cands[4])
+        assert_equal(self.exp.best_candidate, cands[0])
+
     def test_warp(self):
         cand = Candidate({"x": 1})
         cand_out = self.exp.warp_pt_out(self.exp.warp_pt_in(cand.params))
@@ -119,4 +169,80 @@ class TestExperiment(object):
 
         param_dict = {"x": 1,
                       "name": "A"}
-        assert_true(self.exp._check_param_dict(param_dict))
\ No newline at end of file
+        assert_true(self.exp._check_param_dict(param_dict))
+
+    def test_get_candidates_since(self):
+        cands = [Candidate({"x": i/10., "name": "A"}) for i in range(5)]
+        for c in cands:
+            self.exp.add_pending(c)
+        changes, cursor, has_more = self.exp.get_candidates_since()
+        assert_equal(len(changes), 5)
+        assert_equal(cursor, 5)
+        assert_false(has_more)
+
+        self.exp.add_working(cands[1])
+        self.exp.add_finished(cands[3])
+        changes, new_cursor, has_more = self.exp.get_candidates_since(cursor)
+        assert_equal([(s, c) for _, s, c in changes],
+                     [("working", cands[1]), ("finished", cands[3])])
+        assert_equal(new_cursor, 7)
+
+        changes, cursor, has_more = self.exp.get_candidates_since(0, limit=2)
+        assert_equal(len(changes), 2)
+        assert_true(has_more)
+        changes, cursor, has_more = self.exp.get_candidates_since(cursor,
+                                                                  limit=2)
+        assert_equal(len(changes), 2)
+        assert_true(has_more)
+        changes, cursor, has_more = self.exp.get_candidates_since(cursor,
+                                                                  limit=2)
+        assert_equal(len(changes), 1)
+        assert_false(has_more)
+        assert_equal(cursor, 7)
+
+    def test_to_dict_since(self):
+        cand = Candidate({"x": 1, "name": "A"})
+        self.exp.add_finished(cand)
+        cand2 = Candidate({"x": 0.5, "name": "B"})
+        self.exp.add_pending(cand2)
+        exp_dict = self.exp.to_dict(since=1)
+        assert_equal(exp_dict["update_sequence"], 2)
+        assert_equal(len(exp_dict["candidates_finished"]), 0)
+        assert_equal(len(exp_dict["candidates_pending"]), 1)
+        assert_equal(exp_dict["cursor"], 2)
+        assert_false(exp_dict["has_more"])
+
+        from apsis.models.experiment import from_dict
+        restored = from_dict(self.exp.to_dict())
+        assert_equal(restored.update_sequence, 2)
+        assert_equal(len(restored.candidates_pending), 1)
+        changes, cursor, has_more = restored.get_candidates_since(1)
+        assert_equal(len(changes), 1)
+
+    def test_intermediate_results(self):
+        cand = Candidate({"x": 1, "name": "A"})
+        with assert_raises(ValueError):
+            self.exp.add_intermediate_results(cand, [(1, 0.5)])
+        self.exp.add_working(cand)
+        self.exp.add_intermediate_results(cand, [(1, 0.5), (2, 0.4)])
+        assert_equal(self.exp.update_sequence, 2)
+        # Known steps are ignored, so the whole series can be resent.
+        self.exp.add_intermediate_results(cand, [(1, 0.5), (2, 0.4),
+                                                 (3, 0.3)])
+        assert_equal(self.exp.get_intermediate_results(cand.cand_id),
+                     [(1, 0.5), (2, 0.4), (3, 0.3)])
+        assert_equal(self.exp.update_sequence, 3)
+        self.exp.add_intermediate_results(cand, [(3, 0.3)])
+        assert_equal(self.exp.update_sequence, 3)
+        with assert_raises(ValueError):
+            self.exp.add_intermediate_results(cand, [(4, 0.2, 1)])
+        assert_equal(self.exp.get_intermediate_results("unknown"), [])
+
+        from apsis.models.experiment import from_dict
+        exp_dict = self.exp.to_dict()
+        assert_equal(exp_dict["intermediate_results"],
+                     {cand.cand_id: [[1, 2, 3], [0.5, 0.4, 0.3]]})
+        assert_equal(self.exp.to_dict(since=3)["intermediate_results"], {})
+        restored = from_dict(exp_dict)
+        assert_equal(restored.get_intermediate_results(cand.cand_id),
+                     [(1, 0.5), (2, 0.4), (3, 0.3)])
@@ -5,6 +5,7 @@ from nose.tools import assert_equal, assert_raises, assert_items_equal, \
     assert_true, assert_false, assert_almost_equal, assert_less_equal, \
     assert_greater_equal
 import random
+import numpy as np
 
 class TestParameterDefinitions(object):
 
@@ -80,6 +81,25 @@ class TestParameterDefinitions(object):
 
 
 
+    def test_compile_validator(self):
+        values = ["A", "B", ("C", 1)]
+        validator = NominalParamDef(values).compile_validator()
+        for v in values + ["D", 1, None, ["A"], {"a": 1}]:
+            assert_equal(validator(v), v in values)
+        unhashable = NominalParamDef([["A"], "B"]).compile_validator()
+        assert_true(unhashable(["A"]))
+        assert_false(unhashable("A"))
+
+        for include_lower, include_upper in [(True, True), (False, False),
+                                             (True, False)]:
+            pd = MinMaxNumericParamDef(-1, 10, include_lower, include_upper)
+            validator = pd.compile_validator()
+            for v in [-2, -1, 0.5, 10, 11]:
+                assert_equal(validator(v), pd.is_in_parameter_domain(v))
+
+        pd = AsymptoticNumericParamDef(0, 1)
+        assert_equal(pd.compile_validator(), pd.is_in_parameter_domain)
+
     def test_numeric_def(self):
         f_in = lambda x: float(x)/10
         f_out = lambda x: float(x)*10
@@ -198,4 +218,18 @@ class TestParameterDefinitions(object):
         assert_equal(pd.warp_in(-1), [1])
         assert_equal(pd.warp_in(2), [0])
         assert_equal(pd.warp_out([-1]), border)
-        assert_equal(pd.warp_out([1.5]), asymptotic)
\ No newline at end of file
+        assert_equal(pd.warp_out([1.5]), asymptotic)
+
+    def test_warp_out_batch(self):
+        param_defs = [NominalParamDef(["A", "B", "C"]),
+                      MinMaxNumericParamDef(-1, 3, include_lower=False),
+                      EquidistantPositionParamDef([1, 5, 7]),
+                      PositionParamDef(["a", "b"], [0.3, 0.1]),
+                      AsymptoticNumericParamDef(0, 1),
+                      NumericParamDef(lambda x: x, lambda x: x)]
+        for pd in param_defs:
+            warped = np.random.uniform(-0.2, 1.2, (20, pd.warped_size()))
+            warped[0] = 0
+            warped[1] = 1
+            assert_equal(pd.warp_out_batch(warped),
+                         [pd.warp_out(list(w)) for w in warped])
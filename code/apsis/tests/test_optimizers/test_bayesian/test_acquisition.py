@@ -2,11 +2,17 @@ __author__ = 'Frederik Diehl'
 
 from apsis.optimizers.bayesian_optimization import BayesianOptimizer
 from nose.tools import assert_is_none, assert_equal, assert_dict_equal, \
-    assert_true, assert_false
-from apsis.optimizers.bayesian.acquisition_functions import ExpectedImprovement, ProbabilityOfImprovement
+    assert_true, assert_false, assert_raises
+from apsis.optimizers.bayesian.acquisition_functions import ExpectedImprovement, ProbabilityOfImprovement, \
+    ExpectedImprovementPerCost, CostCooledExpectedImprovement, \
+    UpperConfidenceBound, ThompsonSampling, _draw_fourier_basis, \
+    _fourier_features
+from apsis.utilities.acquisition_utils import AVAILABLE_ACQUISITIONS
 from apsis.models.experiment import Experiment
 from apsis.models.parameter_definition import MinMaxNumericParamDef
 from apsis.models.candidate import Candidate
+import numpy as np
+import time
 
 class testAcquisitionFunction(object):
 
@@ -51,4 +57,229 @@ class testAcquisitionFunction(object):
             exp.add_finished(cand_two)
             opt.update(exp)
         cands = opt.get_next_candidates(num_candidates=3)
-        assert_equal(len(cands), 3)
\ No newline at end of file
+        assert_equal(len(cands), 3)
+
+    def test_PoI_gradient(self):
+        for minimization in [True, False]:
+            exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                      "y": MinMaxNumericParamDef(0, 1)},
+                             minimization_problem=minimization)
+            opt = BayesianOptimizer(exp, {
+                "initial_random_runs": 5, "num_gp_restarts": 2,
+                "acquisition": ProbabilityOfImprovement,
+                "acquisition_hyperparams": {
+                    "exploitation_exploration_tradeoff": 0.01}})
+            for i in range(6):
+                cand = opt.get_next_candidates()[0]
+                cand.result = (cand.params["x"] - 0.3)**2 + cand.params["y"]
+                exp.add_finished(cand)
+                opt.update(exp)
+            acq = opt.acquisition_function
+            assert_equal(acq.default_max_searcher, "LBFGSB")
+            for x in [np.array([0.35, 0.2]), np.array([0.8, 0.6])]:
+                gradient = acq.gradient(x, opt.gp, exp)
+                step = 1e-5
+                numeric = [(acq.evaluate(x + step * e, opt.gp, exp) -
+                            acq.evaluate(x - step * e, opt.gp, exp)) /
+                           (2 * step) for e in np.eye(2)]
+                assert_true(np.allclose(gradient, numeric, rtol=1e-2,
+                                        atol=1e-5))
+            max_prop, _ = acq.max_searcher_LBFGSB(opt.gp, exp)
+            x_matrix = np.random.uniform(0, 1, (50, 2))
+            assert_true(-max_prop[1] >= acq.evaluate_batch(
+                x_matrix, opt.gp, exp).max() - 1e-6)
+
+    def test_UCB(self):
+        for minimization in [True, False]:
+            exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                      "y": MinMaxNumericParamDef(0, 1)},
+                             minimization_problem=minimization)
+            opt = BayesianOptimizer(exp, {
+                "initial_random_runs": 5, "num_gp_restarts": 2,
+                "acquisition": "UpperConfidenceBound"})
+            for i in range(6):
+                cand = opt.get_next_candidates()[0]
+                cand.result = (cand.params["x"] - 0.3)**2 + cand.params["y"]
+                exp.add_finished(cand)
+                opt.update(exp)
+            acq = opt.acquisition_function
+            assert_true(isinstance(acq, UpperConfidenceBound))
+            x_matrix = np.random.uniform(0, 1, (7, 2))
+            mean, variance = opt.gp.predict(x_matrix)
+            sign = 1 if minimization else -1
+            beta = 2 * np.log(2 * 7**2 * np.pi**2 / (6 * 0.1))
+            assert_true(np.allclose(acq.evaluate_batch(x_matrix, opt.gp, exp),
+                                    -sign * mean[:, 0] +
+                                    (beta * variance[:, 0])**0.5))
+            x = np.array([0.35, 0.2])
+            gradient = acq.gradient(x, opt.gp, exp)
+            step = 1e-5
+            numeric = [(acq.evaluate(x + step * e, opt.gp, exp) -
+                        acq.evaluate(x - step * e, opt.gp, exp)) / (2 * step)
+                       for e in np.eye(2)]
+            assert_true(np.allclose(gradient, numeric, rtol=1e-2, atol=1e-5))
+            acq.params["beta"] = 0
+            assert_true(np.allclose(acq.evaluate_batch(x_matrix, opt.gp, exp),
+                                    -sign * mean[:, 0]))
+
+    def test_thompson_sampling(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {
+            "initial_random_runs": 5, "num_gp_restarts": 2,
+            "kernel": "rbf", "acquisition": "ThompsonSampling",
+            "acquisition_hyperparams": {"num_features": 1000}})
+        for i in range(8):
+            cand = opt.get_next_candidates()[0]
+            cand.result = (cand.params["x"] - 0.3)**2 + cand.params["y"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        acq = opt.acquisition_function
+        assert_true(isinstance(acq, ThompsonSampling))
+        x_matrix = np.random.uniform(0, 1, (20, 2))
+
+        # The features approximate the kernel.
+        basis = _draw_fourier_basis(opt.gp.kern, 2, 20000)
+        features = _fourier_features(x_matrix, basis)
+        assert_true(np.allclose(features.dot(features.T),
+                                opt.gp.kern.K(x_matrix), atol=0.1))
+        # The mean of the sampled functions approximates the posterior mean.
+        basis, weights = acq._sample_weights(opt.gp, 500)
+        sampled = _fourier_features(x_matrix, basis).dot(weights)
+        mean, variance = opt.gp.predict(x_matrix)
+        assert_true(np.allclose(sampled.mean(axis=1), mean[:, 0],
+                                atol=0.1 + 3 * variance.max()**0.5 / 500**0.5))
+        # The weight posterior is only computed once per fit.
+        posterior = acq._posterior
+        acq._sample_weights(opt.gp, 1)
+        assert_true(acq._posterior is posterior)
+
+        proposals = acq.compute_proposals(opt.gp, exp, number_proposals=4)
+        assert_equal(len(proposals), 4)
+        for prop, value in proposals:
+            assert_true(all(0 <= v <= 1 for v in
+                            np.concatenate(prop.values())))
+        # Each proposal maximizes its own sampled function.
+        assert_equal(len(set(v for p, v in proposals)), 4)
+        cands = opt.get_next_candidates(3)
+        assert_equal(len(cands), 3)
+        assert_equal(len(acq.evaluate_batch(x_matrix, opt.gp, exp)), 20)
+
+    def test_evaluate_batch(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 3})
+        for i in range(4):
+            cand = opt.get_next_candidates()[0]
+            cand.result = cand.params["x"]**2
+            exp.add_finished(cand)
+            opt.update(exp)
+        x_matrix = np.linspace(0, 1, 7)[:, None]
+        for acq in [ExpectedImprovement(), ProbabilityOfImprovement()]:
+            batch = acq.evaluate_batch(x_matrix, opt.gp, exp)
+            single = [acq.evaluate({"x": x}, opt.gp, exp) for x in x_matrix]
+            assert_true(np.allclose(batch, np.ravel(single)))
+
+    def test_local_search(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {
+            "initial_random_runs": 3,
+            "acquisition_hyperparams": {"max_searcher": "local_search",
+                                        "optimization_random_steps": 50}})
+        for i in range(4):
+            cand = opt.get_next_candidates()[0]
+            cand.result = (cand.params["x"] - 0.3)**2
+            exp.add_finished(cand)
+            opt.update(exp)
+        max_prop, evaluated = opt.acquisition_function.max_searcher_local_search(
+            opt.gp, exp)
+        assert_true(0 <= max_prop[0]["x"][0] <= 1)
+        assert_true(len(evaluated) >= 50)
+        assert_true(all(max_prop[1] <= e[1] for e in evaluated))
+
+    def test_cost_aware(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {
+            "initial_random_runs": 4, "num_gp_restarts": 2,
+            "acquisition": "ExpectedImprovementPerCost",
+            "acquisition_hyperparams": {"max_searcher": "LBFGSB"}})
+        assert_true(AVAILABLE_ACQUISITIONS["ExpectedImprovementPerCost"] is
+                    ExpectedImprovementPerCost)
+        for i in range(6):
+            cand = opt.get_next_candidates()[0]
+            cand.result = (cand.params["x"] - 0.5)**2
+            cand.cost = np.exp(3 * cand.params["x"])
+            exp.add_finished(cand)
+            opt.update(exp)
+        acq = opt.acquisition_function
+        assert_true(acq.cost_gp is opt.cost_gp is not None)
+        x_matrix = np.linspace(0, 1, 7)[:, None]
+        ei = ExpectedImprovement().evaluate_batch(x_matrix, opt.gp, exp)
+        cost = np.exp(opt.cost_gp.predict(x_matrix)[0][:, 0])
+        batch = acq.evaluate_batch(x_matrix, opt.gp, exp)
+        assert_true(np.allclose(batch, ei / cost))
+        single = [acq.evaluate({"x": x}, opt.gp, exp) for x in x_matrix]
+        assert_true(np.allclose(batch, single))
+        # The gradient matches finite differences of the value.
+        x = np.array([0.35])
+        gradient = acq.gradient(x, opt.gp, exp)
+        step = 1e-4
+        numeric = (acq.evaluate(x + step, opt.gp, exp) -
+                   acq.evaluate(x - step, opt.gp, exp)) / (2 * step)
+        assert_true(np.allclose(gradient, numeric, rtol=1e-2, atol=1e-5))
+
+        cooled = CostCooledExpectedImprovement({"cost_budget": 100})
+        cooled.cost_gp = opt.cost_gp
+        spent = sum(c.cost for c in exp.candidates_finished)
+        assert_true(np.allclose(cooled.cost_exponent(exp), 1 - spent / 100))
+        assert_true(np.allclose(cooled.evaluate_batch(x_matrix, opt.gp, exp),
+                                ei / cost**(1 - spent / 100)))
+        cooled.params["cost_budget"] = spent / 2
+        assert_equal(cooled.cost_exponent(exp), 0)
+        assert_true(np.allclose(cooled.evaluate_batch(x_matrix, opt.gp, exp),
+                                ei))
+
+    def test_anytime(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {
+            "initial_random_runs": 3,
+            "acquisition_hyperparams": {"max_searcher": "anytime",
+                                        "anytime_rounds": 3}})
+        for i in range(4):
+            cand = opt.get_next_candidates()[0]
+            cand.result = (cand.params["x"] - 0.3)**2
+            exp.add_finished(cand)
+            opt.update(exp)
+        acq = opt.acquisition_function
+        max_prop, evaluated = acq.max_searcher_anytime(opt.gp, exp)
+        assert_true(0 <= max_prop[0]["x"][0] <= 1)
+        assert_true(all(max_prop[1] <= e[1] for e in evaluated))
+
+        # With a time budget, the search runs until the deadline.
+        acq.params["time_budget"] = 0.3
+        start = time.time()
+        proposals = acq.compute_proposals(opt.gp, exp, number_proposals=3)
+        duration = time.time() - start
+        assert_equal(len(proposals), 3)
+        assert_true(0.3 <= duration < 2)
+        # An interrupt makes it return after its first round.
+        acq.params["time_budget"] = 60
+        acq.interrupt()
+        start = time.time()
+        acq.compute_proposals(opt.gp, exp, number_proposals=3)
+        assert_true(time.time() - start < 5)
+        assert_false(acq._interrupted.is_set())
+
+        # The adaptive budget keeps the search at overhead_fraction.
+        acq.params["time_budget"] = "adaptive"
+        assert_equal(acq.adaptive_time_budget(
+            Experiment("empty", {"x": MinMaxNumericParamDef(0, 1)})), 1.)
+        for c in exp.candidates_finished:
+            c.generated_time, c.last_update_time = 100., 109.
+        acq.params["overhead_fraction"] = 0.1
+        assert_true(np.allclose(acq.adaptive_time_budget(exp), 1.))
+        acq.params["max_time_budget"] = 0.5
+        assert_equal(acq.adaptive_time_budget(exp), 0.5)
+        acq.params["overhead_fraction"] = 1
+        assert_raises(ValueError, acq.adaptive_time_budget, exp)
+        acq.params["time_budget"] = "fast"
+        assert_raises(ValueError, acq.search_deadline, exp)
@@ -8,6 +8,7 @@ from apsis.models.experiment import Experiment
 from apsis.models.parameter_definition import MinMaxNumericParamDef, NominalParamDef
 from apsis.models.candidate import Candidate
 from apsis.utilities.import_utils import import_if_exists
+from apsis.optimizers.quasi_random import QuasiRandom
 
 class testBayesianOptimization(object):
 
@@ -53,4 +54,93 @@ class testBayesianOptimization(object):
             exp.add_finished(cand)
             opt.update(exp)
         cands = opt.get_next_candidates(num_candidates=3)
-        assert_less_equal(len(cands), 3)
\ No newline at end of file
+        assert_less_equal(len(cands), 3)
+
+    def test_initial_design(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": NominalParamDef(["A", "B", "C"])})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 4,
+                                      "initial_design": "lhs",
+                                      "acquisition_hyperparams":
+                                          {"random_design": "sobol"}})
+        assert_true(isinstance(opt.random_searcher, QuasiRandom))
+        for i in range(6):
+            cand = opt.get_next_candidates()[0]
+            assert_true(isinstance(cand, Candidate))
+            cand.result = cand.params["x"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        xs = sorted(int(c.params["x"] * 4)
+                    for c in exp.candidates_finished[:4])
+        assert_equal(xs, [0, 1, 2, 3])
+        # The acquisition's design is kept and continued between searches.
+        design = opt.acquisition_function._random_design
+        assert_true(design is not None)
+        cands = opt.get_next_candidates(num_candidates=3)
+        assert_less_equal(len(cands), 3)
+        assert_true(opt.acquisition_function._random_design is design)
+
+    def test_checkpoint(self):
+        import json
+        import numpy as np
+        from apsis.models.experiment import from_dict
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": NominalParamDef(["A", "B", "C"])})
+        opt_arguments = {"initial_random_runs": 3, "random_state": 1,
+                         "num_gp_restarts": 2,
+                         "acquisition": "ExpectedImprovementPerCost"}
+        opt = BayesianOptimizer(exp, opt_arguments)
+        assert_is_none(opt.get_checkpoint())
+        for i in range(5):
+            cand = opt.get_next_candidates()[0]
+            cand.result = cand.params["x"]**2
+            cand.cost = 1 + cand.params["x"]
+            exp.add_finished(cand)
+            opt.update(exp)
+        checkpoint = json.loads(json.dumps(opt.get_checkpoint()))
+
+        reloaded = from_dict(json.loads(json.dumps(exp.to_dict())))
+        restored = BayesianOptimizer(reloaded, opt_arguments)
+        assert_true(restored.restore_checkpoint(checkpoint))
+        points = np.random.rand(4, 4)
+        assert_true(np.allclose(opt.gp.predict(points)[0],
+                                restored.gp.predict(points)[0]))
+        assert_true(np.allclose(opt.cost_gp.predict(points)[0],
+                                restored.cost_gp.predict(points)[0]))
+        assert_true(restored.acquisition_function.cost_gp is
+                    restored.cost_gp)
+        assert_equal(opt.random_state.rand(), restored.random_state.rand())
+
+        # A stale checkpoint's hyperparameters are used on the current
+        # experiment.
+        cand = Candidate({"x": 0.5, "y": "B"})
+        cand.result = 0.25
+        cand.cost = 1.5
+        reloaded.add_finished(cand)
+        stale = BayesianOptimizer(reloaded, opt_arguments)
+        assert_true(stale.restore_checkpoint(checkpoint))
+        assert_equal(stale.gp.X.shape[0], 6)
+        assert_equal(list(stale.gp.param_array), list(opt.gp.param_array))
+        assert_equal(stale.cost_gp.X.shape[0], 6)
+        assert_equal(list(stale.cost_gp.param_array),
+                     list(opt.cost_gp.param_array))
+        checkpoint["optimizer"] = "TPE"
+        assert_false(restored.restore_checkpoint(checkpoint))
+
+    def test_rescore_candidates(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = BayesianOptimizer(exp, {"initial_random_runs": 4,
+                                      "num_gp_restarts": 2})
+        candidates = opt.get_next_candidates(3)
+        # Before the gp is fitted, random candidates are kept.
+        assert_equal(opt.rescore_candidates(candidates), candidates)
+        for x in [0.1, 0.4, 0.6, 0.9]:
+            cand = Candidate({"x": x})
+            cand.result = (x - 0.3)**2
+            exp.add_finished(cand)
+        opt.update(exp)
+        best = Candidate(opt.get_next_candidates()[0].params)
+        evaluated = Candidate({"x": 0.9})
+        kept = opt.rescore_candidates([evaluated, best])
+        assert_equal(kept, [best])
+
@@ -0,0 +1,56 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.early_stopping import MedianStoppingRule, \
+    check_stopping_rule
+from nose.tools import assert_equal, assert_true, assert_false, \
+    assert_raises, assert_is_none
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from apsis.models.candidate import Candidate
+from apsis.optimizers.random_search import RandomSearch
+
+
+class TestMedianStoppingRule(object):
+
+    def test_should_stop(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        for curve in [[3, 2, 1], [4, 3, 2], [5, 4, 3], [1, 1, 1]]:
+            c = Candidate({"x": 0.5})
+            exp.add_working(c)
+            exp.add_intermediate_results(c, enumerate(curve))
+            c.result = curve[-1]
+            exp.add_finished(c)
+        failed = exp.candidates_finished[-1]
+        failed.failed = True
+
+        rule = MedianStoppingRule({"min_steps": 1})
+        cand = Candidate({"x": 0.5})
+        exp.add_working(cand)
+        assert_false(rule.should_stop(cand, exp))
+        # Before min_steps.
+        exp.add_intermediate_results(cand, [(0, 10)])
+        assert_false(rule.should_stop(cand, exp))
+        # The running averages up to step 1 are 2.5, 3.5 and 4.5.
+        exp.add_intermediate_results(cand, [(1, 3.4)])
+        assert_false(rule.should_stop(cand, exp))
+        exp.add_intermediate_results(cand, [(2, 3.6)])
+        assert_true(rule.should_stop(cand, exp))
+
+        exp.minimization_problem = False
+        assert_false(rule.should_stop(cand, exp))
+        assert_false(MedianStoppingRule({"min_candidates": 4}).should_stop(
+            cand, exp))
+
+    def test_check_stopping_rule(self):
+        assert_is_none(check_stopping_rule(None))
+        rule = check_stopping_rule("median", {"min_steps": 5})
+        assert_true(isinstance(rule, MedianStoppingRule))
+        assert_equal(rule.params, {"min_steps": 5})
+        assert_true(check_stopping_rule(rule) is rule)
+        assert_raises(ValueError, check_stopping_rule, "no_rule")
+        assert_raises(ValueError, check_stopping_rule, RandomSearch)
+
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = RandomSearch(exp, {"early_stopping": "median"})
+        assert_true(isinstance(opt.stopping_rule, MedianStoppingRule))
+        assert_false(RandomSearch(exp).should_stop(Candidate({"x": 0}), exp))
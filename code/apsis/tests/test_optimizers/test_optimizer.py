@@ -4,9 +4,10 @@ from apsis.optimizers.optimizer import Optimizer, QueueBasedOptimizer, \
     QueueBackend
 from apsis.models.experiment import Experiment
 from apsis.models.parameter_definition import *
-from nose.tools import assert_raises
+from nose.tools import assert_raises, assert_equal
 from apsis.optimizers.random_search import RandomSearch
 from multiprocessing import Queue
+import Queue as queue
 import time
 
 class TestOptimizer(object):
@@ -69,6 +70,25 @@ class TestQueueOptimizer(object):
                                 parameter_definitions=param_def)
         self.optimizer.update(experiment)
 
+    def test_pool_statistics(self):
+        self.optimizer.exit()
+        param_def = {
+            "x": MinMaxNumericParamDef(0, 1)
+        }
+        experiment = Experiment(name="test_optimizer_experiment",
+                                parameter_definitions=param_def)
+        self.optimizer = QueueBasedOptimizer(RandomSearch, experiment,
+                                             {"min_candidates": 2})
+        for i in range(100):
+            if self.optimizer.get_pool_statistics()["queued"] == 2:
+                break
+            time.sleep(0.05)
+        assert_equal(len(self.optimizer.get_next_candidates(3)), 2)
+        statistics = self.optimizer.get_pool_statistics()
+        assert_equal(statistics["hits"], 2)
+        assert_equal(statistics["misses"], 1)
+        assert_equal(statistics["hit_rate"], 2 / 3.)
+
     def teardown(self):
         self.optimizer.exit()
 
@@ -105,4 +125,23 @@ class TestQueueBackend(object):
         self.backend._check_update()
 
     def test_check_generation(self):
-        self.backend._check_generation()
\ No newline at end of file
+        self.backend._check_generation()
+
+    def test_rescore_queue(self):
+        backend = QueueBackend(RandomSearch, self.experiment, queue.Queue(),
+                               queue.Queue())
+        backend._check_generation()
+        backend._check_generation()
+        assert_equal(backend._out_queue.qsize(), 5)
+        backend._out_queue.get_nowait()
+        backend._check_generation()
+        assert_equal(backend._out_queue.qsize(), 5)
+
+        # Random search keeps all candidates after an update.
+        queued = list(backend._out_queue.queue)
+        backend._in_queue.put(self.experiment)
+        backend._check_update()
+        assert_equal(list(backend._out_queue.queue), queued)
+        assert_equal(backend.num_kept, 5)
+        assert_equal(backend.num_discarded, 0)
+
@@ -0,0 +1,38 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.quasi_random import QuasiRandom
+from nose.tools import assert_equal, assert_true, assert_raises
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef, \
+    NominalParamDef
+from apsis.models.candidate import Candidate
+from apsis.utilities.optimizer_utils import AVAILABLE_OPTIMIZERS
+
+
+class TestQuasiRandom(object):
+
+    def test_get_next_candidates(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": NominalParamDef(["A", "B"])})
+        for design in ["sobol", "halton", "lhs"]:
+            opt = QuasiRandom(exp, {"design": design, "random_state": 1})
+            cands = opt.get_next_candidates(num_candidates=8)
+            assert_equal(len(cands), 8)
+            for c in cands:
+                assert_true(isinstance(c, Candidate))
+                assert_true(0 <= c.params["x"] <= 1)
+            # Stratified: each nominal value is chosen equally often.
+            assert_equal(sum(c.params["y"] == "A" for c in cands), 4)
+        assert_raises(ValueError, QuasiRandom, exp, {"design": "no_design"})
+        assert_true(AVAILABLE_OPTIMIZERS["QuasiRandom"] is QuasiRandom)
+
+    def test_continues_design(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = QuasiRandom(exp, {"random_state": 3})
+        cands = opt.get_next_candidates(num_candidates=4)
+        for c in cands[:2]:
+            c.result = 1
+            exp.add_finished(c)
+        opt = QuasiRandom(exp, {"random_state": 3})
+        assert_equal(opt.get_next_candidates(num_candidates=2)[0].params,
+                     cands[2].params)
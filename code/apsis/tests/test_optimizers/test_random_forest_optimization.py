@@ -0,0 +1,56 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.random_forest_optimization import RandomForestOptimizer
+from apsis.optimizers.bayesian.random_forest import RandomForest
+from nose.tools import assert_equal, assert_true, assert_is_not
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef, \
+    NominalParamDef
+from apsis.models.candidate import Candidate
+from apsis.utilities.optimizer_utils import AVAILABLE_OPTIMIZERS
+import numpy as np
+
+
+class TestRandomForestOptimizer(object):
+
+    def test_optimize(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(-5, 5),
+                                  "c": NominalParamDef(["a", "b", "c"])})
+        opt = RandomForestOptimizer(exp, {
+            "random_state": 1, "initial_random_runs": 5,
+            "acquisition_hyperparams": {"optimization_random_steps": 100}})
+        for i in range(20):
+            cands = opt.get_next_candidates(num_candidates=2)
+            assert_equal(len(cands), 2)
+            for c in cands:
+                assert_true(isinstance(c, Candidate))
+                c.result = (c.params["x"]**2 +
+                            (0 if c.params["c"] == "b" else 5))
+                exp.add_finished(c)
+            opt.update(exp)
+        assert_true(exp.best_candidate.result < 1)
+        assert_true(AVAILABLE_OPTIMIZERS["RandomForest"] is
+                    RandomForestOptimizer)
+
+    def test_forest(self):
+        random_state = np.random.RandomState(1)
+        X = random_state.rand(200, 3)
+        y = np.where(X[:, 0] > 0.5, 1., 0.)
+        forest = RandomForest(random_state=1)
+        forest.fit(X, y)
+        mean, variance = forest.predict(np.array([[0.9, 0.5, 0.5],
+                                                  [0.1, 0.5, 0.5]]))
+        assert_equal(mean.shape, (2, 1))
+        assert_equal(variance.shape, (2, 1))
+        assert_true(mean[0, 0] > 0.8 and mean[1, 0] < 0.2)
+        assert_true(np.all(variance >= 0))
+
+        # Adding few points only updates the leaves.
+        trees = forest.trees
+        X_new = np.vstack((X, [[0.9, 0.5, 0.5]]))
+        forest.update(X_new, np.append(y, 0.))
+        assert_true(forest.trees is trees)
+        assert_true(forest.predict(X_new[-1:])[0][0, 0] < mean[0, 0])
+        # Changing known points grows the trees again.
+        forest.update(X_new[1:], y)
+        assert_is_not(forest.trees, trees)
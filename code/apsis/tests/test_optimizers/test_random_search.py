@@ -6,6 +6,7 @@ from nose.tools import assert_is_none, assert_equal, assert_dict_equal, \
 from apsis.models.experiment import Experiment
 from apsis.models.parameter_definition import MinMaxNumericParamDef, NominalParamDef
 from apsis.models.candidate import Candidate
+import numpy as np
 
 
 class test_RandomSearch(object):
@@ -25,3 +26,15 @@ class test_RandomSearch(object):
             exp.add_finished(cand)
         cands = opt.get_next_candidates(num_candidates=3)
         assert_equal(len(cands), 3)
+
+    def test_batch_independence(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1),
+                                  "y": NominalParamDef(["A", "B", "C"])})
+        opt = RandomSearch(exp, {"random_state": np.random.RandomState(1)})
+        batch = opt.get_next_candidates(num_candidates=10)
+        opt = RandomSearch(exp, {"random_state": np.random.RandomState(1)})
+        single = [opt.get_next_candidates()[0] for i in range(10)]
+        assert_equal([c.params for c in batch], [c.params for c in single])
+        for c in batch:
+            assert_true(0 <= c.params["x"] <= 1)
+            assert_true(c.params["y"] in ["A", "B", "C"])
@@ -0,0 +1,76 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.successive_halving import AsyncSuccessiveHalving, \
+    AsyncHyperband
+from nose.tools import assert_equal, assert_true, assert_raises
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from apsis.utilities.optimizer_utils import AVAILABLE_OPTIMIZERS
+
+
+class TestAsyncSuccessiveHalving(object):
+
+    def test_promotion(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = AsyncSuccessiveHalving(exp, {"min_resource": 1,
+                                           "max_resource": 9, "eta": 3,
+                                           "random_state": 1})
+        cands = opt.get_next_candidates(num_candidates=3)
+        for c in cands:
+            assert_equal(c.worker_information,
+                         {"resource": 1, "rung": 0, "bracket": 0,
+                          "resume_from": None})
+            exp.add_working(c)
+        for c in cands:
+            c.result = c.params["x"]
+            exp.add_finished(c)
+        opt.update(exp)
+        best = min(cands, key=lambda c: c.result)
+
+        promoted = opt.get_next_candidates()[0]
+        assert_equal(promoted.params, best.params)
+        assert_equal(promoted.worker_information,
+                     {"resource": 3, "rung": 1, "bracket": 0,
+                      "resume_from": best.cand_id})
+        # A promotion is not handed out twice, and survives a reload.
+        assert_equal(opt.get_next_candidates()[0].worker_information["rung"],
+                     0)
+        exp.add_working(promoted)
+        opt = AsyncSuccessiveHalving(exp, {"min_resource": 1,
+                                           "max_resource": 9, "eta": 3})
+        assert_equal(opt.get_next_candidates()[0].worker_information["rung"],
+                     0)
+
+        # A paused candidate keeps its worker_information.
+        exp.add_pausing(promoted)
+        assert_equal(exp.candidates_pending[0].worker_information["rung"], 1)
+
+    def test_failed_and_parameters(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = AsyncSuccessiveHalving(exp, {"max_resource": 4, "eta": 2})
+        cands = opt.get_next_candidates(num_candidates=2)
+        cands[0].failed = True
+        cands[1].result = 5
+        for c in cands:
+            exp.add_finished(c)
+        opt.update(exp)
+        assert_equal(opt.get_next_candidates()[0].worker_information["rung"],
+                     1)
+        assert_equal(opt.get_next_candidates()[0].worker_information["rung"],
+                     0)
+        assert_raises(ValueError, AsyncSuccessiveHalving, exp, {"eta": 1})
+        assert_raises(ValueError, AsyncSuccessiveHalving, exp,
+                      {"min_resource": 10, "max_resource": 1})
+        assert_raises(ValueError, AsyncSuccessiveHalving, exp,
+                      {"brackets": 10})
+
+    def test_hyperband(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        opt = AsyncHyperband(exp, {"min_resource": 1, "max_resource": 9,
+                                   "eta": 3})
+        assert_equal(opt.brackets, 3)
+        resources = [c.worker_information["resource"]
+                     for c in opt.get_next_candidates(num_candidates=3)]
+        assert_equal(resources, [1, 3, 9])
+        assert_true(AVAILABLE_OPTIMIZERS["ASHA"] is AsyncSuccessiveHalving)
+        assert_true(AVAILABLE_OPTIMIZERS["Hyperband"] is AsyncHyperband)
@@ -0,0 +1,76 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.optimizers.tpe import TPEOptimizer, NumericParzenEstimator, \
+    DiscreteParzenEstimator
+from nose.tools import assert_equal, assert_true, assert_almost_equal
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef, \
+    NominalParamDef, OrdinalParamDef, PositionParamDef
+from apsis.models.candidate import Candidate
+from apsis.utilities.optimizer_utils import AVAILABLE_OPTIMIZERS
+import numpy as np
+
+
+class TestTPEOptimizer(object):
+
+    def test_optimize(self):
+        param_defs = {
+            "x": MinMaxNumericParamDef(-5, 5),
+            "c": NominalParamDef(["a", "b", "c", "d"]),
+            "o": OrdinalParamDef([1, 2, 3, 4, 5]),
+            "p": PositionParamDef(["s", "m", "l"], [1, 2, 10])
+        }
+        exp = Experiment("test", param_defs)
+        opt = TPEOptimizer(exp, {"random_state": 1,
+                                 "initial_random_runs": 5})
+        for i in range(60):
+            cands = opt.get_next_candidates(num_candidates=2)
+            assert_equal(len(cands), 2)
+            for c in cands:
+                assert_true(isinstance(c, Candidate))
+                assert_true(-5 <= c.params["x"] <= 5)
+                c.result = (c.params["x"]**2 +
+                            (0 if c.params["c"] == "c" else 1) +
+                            abs(c.params["o"] - 4) +
+                            (0 if c.params["p"] == "m" else 1))
+                exp.add_finished(c)
+            opt.update(exp)
+        assert_true(exp.best_candidate.result < 1)
+        assert_true(AVAILABLE_OPTIMIZERS["TPE"] is TPEOptimizer)
+
+    def test_failed_and_maximization(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)},
+                         minimization_problem=False)
+        opt = TPEOptimizer(exp, {"random_state": 1,
+                                 "initial_random_runs": 2})
+        for i in range(20):
+            c = opt.get_next_candidates()[0]
+            if i % 5 == 0:
+                c.failed = True
+            else:
+                c.result = c.params["x"]
+            exp.add_finished(c)
+            opt.update(exp)
+        assert_true(exp.best_candidate.result > 0.8)
+
+    def test_numeric_parzen_estimator(self):
+        est = NumericParzenEstimator(np.array([0.2, 0.25, 0.9]))
+        assert_almost_equal(est.weights.sum(), 1)
+        samples = est.sample(1000, np.random.RandomState(1))
+        assert_true(np.all((samples >= 0) & (samples <= 1)))
+        # The truncated density integrates to one on [0, 1].
+        grid = np.linspace(0, 1, 10001)
+        assert_almost_equal(np.trapz(np.exp(est.log_pdf(grid)), grid), 1,
+                            places=3)
+        assert_true(est.log_pdf([0.22])[0] > est.log_pdf([0.6])[0])
+
+    def test_discrete_parzen_estimator(self):
+        est = DiscreteParzenEstimator([0, 0, 2], 4)
+        assert_almost_equal(est.probabilities.sum(), 1)
+        assert_almost_equal(est.probabilities[1], est.probabilities[3])
+        assert_true(est.probabilities[0] > est.probabilities[2])
+        ordered = DiscreteParzenEstimator([0, 0, 2], 4,
+                                          positions=[0, 1/3., 2/3., 1])
+        assert_true(ordered.probabilities[1] > ordered.probabilities[3])
+        samples = ordered.sample(100, np.random.RandomState(1))
+        assert_true(np.all((samples >= 0) & (samples < 4)))
@@ -0,0 +1,47 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities.acquisition_utils import create_cand_matrix_vector
+from apsis.models.experiment import Experiment
+from apsis.models.candidate import Candidate
+from apsis.models.parameter_definition import *
+from apsis.utilities.logging_utils import logging_tests
+from nose.tools import assert_equal, assert_raises, assert_true
+import numpy as np
+
+
+class TestAcquisitionUtils(object):
+
+    def setup(self):
+        logging_tests()
+
+    def test_create_cand_matrix_vector(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        for x, result in [(0.1, 3.), (0.2, None), (0.3, 1.), (0.4, 2.)]:
+            cand = Candidate({"x": x})
+            cand.result = result
+            cand.failed = result is None
+            exp.add_finished(cand)
+
+        matrix, results = create_cand_matrix_vector(exp, ("worst_mult", 2))
+        assert_equal(matrix.shape, (4, 1))
+        assert_true(np.allclose(matrix[:, 0], [0.1, 0.2, 0.3, 0.4]))
+        assert_true(np.allclose(results[:, 0], [3., 7., 1., 2.]))
+
+        matrix, results = create_cand_matrix_vector(exp, ("fixed_value", 1e6))
+        assert_true(np.allclose(results[:, 0], [3., 1e6, 1., 2.]))
+
+        matrix, results = create_cand_matrix_vector(exp, ("ignore", False))
+        assert_true(np.allclose(matrix[:, 0], [0.1, 0.3, 0.4]))
+        assert_true(np.allclose(results[:, 0], [3., 1., 2.]))
+
+        assert_raises(ValueError, create_cand_matrix_vector, exp,
+                      ("unknown", 1))
+
+        # Without any successful candidate, failed ones are 0.
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        cand = Candidate({"x": 0.5})
+        cand.failed = True
+        exp.add_finished(cand)
+        matrix, results = create_cand_matrix_vector(exp, ("worst_mult", 2))
+        assert_equal(results.shape, (1, 1))
+        assert_equal(results[0, 0], 0)
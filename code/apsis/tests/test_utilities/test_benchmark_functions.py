@@ -2,6 +2,9 @@ __author__ = 'Frederik Diehl'
 
 from apsis.utilities.benchmark_functions import *
 import random
+from nose.tools import assert_almost_equal, assert_greater, assert_equal, \
+    assert_raises
+import numpy as np
 
 class testBenchmarkFunctions(object):
 
@@ -16,3 +19,44 @@ class testBenchmarkFunctions(object):
         noise_gen = gen_noise(dims, points)
         x = [0.5, 0.5, 0.5, 0.5, 0.5]
         val = get_noise_value_at(x, 0.5, noise_gen)
+
+    def test_known_minima(self):
+        assert_almost_equal(hartmann3_func([0.114614, 0.555649, 0.852547]),
+                            -3.86278, places=4)
+        assert_almost_equal(hartmann6_func([0.20169, 0.150011, 0.476874,
+                                            0.275332, 0.311652, 0.6573]),
+                            -3.32237, places=4)
+        assert_almost_equal(rosenbrock_func([1, 1, 1, 1]), 0)
+        assert_almost_equal(ackley_func([0, 0, 0]), 0)
+        assert_greater(rosenbrock_func([0, 0]), 0)
+        assert_greater(ackley_func([1, 1]), 0)
+
+    def test_noise_value_reference(self):
+        # Compares against the direct sum over all grid points within 3 sigma.
+        noise_gen = gen_noise(2, 10, random_state=np.random.RandomState(0))
+        variance = 0.1
+        x = [0.33, 0.71]
+        value = 0
+        prob_sum = 0
+        for i in range(10):
+            for j in range(10):
+                if abs(i - 3) > 3 or abs(j - 7) > 3:
+                    continue
+                dist = ((x[0] - i/10.)**2 + (x[1] - j/10.)**2)**0.5
+                prob = np.exp(-0.5 * (dist/variance)**2)
+                value += prob * noise_gen[i, j]
+                prob_sum += prob
+        assert_almost_equal(get_noise_value_at(x, variance, noise_gen),
+                            value / prob_sum)
+
+    def test_noise_values_batch(self):
+        noise_gen = gen_noise(3, 8, random_state=np.random.RandomState(0))
+        grid = np.random.RandomState(1).randint(0, 8, size=(10, 3)) / 8.
+        values = get_noise_values_at(grid, 0.2, noise_gen)
+        assert_equal(values.shape, (10,))
+        for x, v in zip(grid, values):
+            assert_almost_equal(get_noise_value_at(list(x), 0.2, noise_gen), v)
+        assert_almost_equal(get_noise_values_at(grid[0], 0.2, noise_gen),
+                            values[0])
+        assert_raises(ValueError, get_noise_values_at, [[0.5, 0.5]], 0.2,
+                      noise_gen)
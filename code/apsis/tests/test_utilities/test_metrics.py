@@ -0,0 +1,77 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities.metrics import MetricsRegistry
+import math
+from nose.tools import assert_equal, assert_true, assert_raises, \
+    assert_is_none, assert_almost_equal, assert_in
+
+
+class TestMetrics(object):
+
+    def test_disabled(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("c_total", "A counter.")
+        histogram = registry.histogram("h_seconds", "A histogram.")
+        counter.inc()
+        histogram.observe(1.)
+        with histogram.time():
+            pass
+        assert_equal(counter.value(), 0)
+        assert_equal(histogram.count(), 0)
+        assert_equal(registry.expose(),
+                     "# HELP c_total A counter.\n# TYPE c_total counter\n"
+                     "# HELP h_seconds A histogram.\n"
+                     "# TYPE h_seconds histogram\n")
+
+    def test_counter_gauge(self):
+        registry = MetricsRegistry(enabled=True)
+        counter = registry.counter("c_total", "A counter.", ["route"])
+        assert_true(registry.counter("c_total", "A counter.", ["route"])
+                    is counter)
+        assert_raises(ValueError, registry.gauge, "c_total", "A gauge.")
+        counter.inc(route="/a")
+        counter.inc(2, route="/a")
+        counter.inc(route='/"b"')
+        assert_equal(counter.value(route="/a"), 3)
+        assert_raises(ValueError, counter.inc, other="x")
+        gauge = registry.gauge("g", "A gauge.")
+        assert_is_none(gauge.value())
+        gauge.set(4)
+        gauge.set(2)
+        assert_equal(gauge.value(), 2)
+        text = registry.expose()
+        assert_in('c_total{route="/a"} 3\n', text)
+        assert_in('c_total{route="/\\"b\\""} 1\n', text)
+        assert_in("# TYPE g gauge\ng 2\n", text)
+        registry.reset()
+        assert_equal(counter.value(route="/a"), 0)
+
+    def test_histogram(self):
+        registry = MetricsRegistry(enabled=True)
+        histogram = registry.histogram("h_seconds", "A histogram.",
+                                       ["model"], sub_buckets=16)
+        values = [1e-5 * 1.07**i for i in range(300)]
+        for v in values:
+            histogram.observe(v, model="gp")
+        histogram.observe(0, model="gp")
+        assert_equal(histogram.count(model="gp"), 301)
+        assert_almost_equal(histogram.sum(model="gp"), sum(values))
+        # Quantiles are upper bounds with a relative error below 1/16.
+        for q in [0.1, 0.5, 0.99]:
+            exact = sorted(values + [0])[int(math.ceil(q * 301)) - 1]
+            bound = histogram.quantile(q, model="gp")
+            assert_true(exact <= bound <= exact * (1 + 1 / 16.))
+        assert_is_none(histogram.quantile(0.5, model="forest"))
+        lines = registry.expose().splitlines()
+        buckets = [l for l in lines if l.startswith("h_seconds_bucket")]
+        assert_equal(buckets[0], 'h_seconds_bucket{model="gp",le="0.0"} 1')
+        assert_equal(buckets[-1], 'h_seconds_bucket{model="gp",le="+Inf"} 301')
+        counts = [int(l.split()[-1]) for l in buckets]
+        assert_equal(counts, sorted(counts))
+        bounds = [float(l.split('le="')[1].split('"')[0])
+                  for l in buckets[:-1]]
+        assert_equal(bounds, sorted(bounds))
+        assert_in('h_seconds_count{model="gp"} 301', lines)
+        with histogram.time(model="timed"):
+            pass
+        assert_equal(histogram.count(model="timed"), 1)
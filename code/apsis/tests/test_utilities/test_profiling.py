@@ -0,0 +1,109 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities import logging_utils
+logging_utils.logging_tests()
+
+from apsis.utilities.profiling import Profiler, CProfiler, \
+    SamplingProfiler, check_profiler
+from apsis.assistants.experiment_assistant import ExperimentAssistant
+from apsis.models.experiment import Experiment
+from apsis.models.parameter_definition import MinMaxNumericParamDef
+from nose.tools import assert_equal, assert_true, assert_raises, \
+    assert_is_none, assert_in
+import pstats
+import shutil
+import tempfile
+import time
+import os
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+class TestProfiling(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_slowest_calls(self):
+        profiler = CProfiler({"slowest": 2}, self.directory)
+        for seconds in [0.02, 0.001, 0.03, 0.01]:
+            assert_equal(profiler.call("sleep", _sleep, seconds), seconds)
+        calls = profiler.slowest_calls()
+        assert_equal(len(calls), 2)
+        assert_true(calls[0]["duration"] >= 0.03 > calls[1]["duration"] >=
+                    0.02)
+        assert_equal(sorted(os.listdir(self.directory)),
+                     sorted(c["file"] for c in calls))
+        stats = pstats.Stats(os.path.join(self.directory, calls[0]["file"]))
+        assert_true(any(f[2] == "_sleep" for f in stats.stats))
+        assert_raises(ZeroDivisionError, profiler.call, "div", lambda: 1 / 0)
+
+    def test_nested_and_sampling(self):
+        profiler = SamplingProfiler({"interval": 0.001}, self.directory)
+        profiler.call("outer", profiler.call, "inner", _sleep, 0.05)
+        calls = profiler.slowest_calls()
+        assert_equal([c["hook"] for c in calls], ["outer", "inner"])
+        assert_equal([c["profiled"] for c in calls], [True, False])
+        assert_is_none(calls[1]["file"])
+        assert_equal(os.listdir(self.directory), [calls[0]["file"]])
+        with open(os.path.join(self.directory, calls[0]["file"])) as infile:
+            lines = infile.read().splitlines()
+        assert_true(sum(int(l.rsplit(" ", 1)[1]) for l in lines) > 5)
+        assert_true(any("_sleep" in l for l in lines))
+
+    def test_check_profiler(self):
+        assert_is_none(check_profiler(None))
+        assert_true(isinstance(check_profiler("cprofile"), CProfiler))
+        assert_true(isinstance(check_profiler(SamplingProfiler),
+                               SamplingProfiler))
+        assert_raises(ValueError, check_profiler, "unknown")
+        assert_raises(ValueError, check_profiler, dict)
+
+        class StartOnlyProfiler(Profiler):
+            def _start(self):
+                return None
+        assert_raises(TypeError, check_profiler, StartOnlyProfiler)
+
+    def test_experiment_assistant(self):
+        exp = Experiment("test", {"x": MinMaxNumericParamDef(0, 1)})
+        eass = ExperimentAssistant(
+            "BayOpt", exp, write_dir=self.directory,
+            optimizer_arguments={"multiprocessing": "none",
+                                 "initial_random_runs": 2,
+                                 "num_gp_restarts": 1,
+                                 "profiling": "cprofile",
+                                 "profiling_params": {"slowest": 20}})
+        try:
+            for i in range(3):
+                cand = eass.get_next_candidate()
+                cand.result = cand.params["x"]
+                eass.update(cand)
+            state = eass.get_profiling()
+            assert_equal(state["profiler"], "CProfiler")
+            hooks = set(c["hook"] for c in state["slowest_calls"])
+            assert_equal(hooks, set(["optimizer.update",
+                                     "optimizer.get_next_candidates",
+                                     "acquisition.compute_proposals",
+                                     "experiment_assistant.write_state"]))
+            # compute_proposals is nested in get_next_candidates, so it is
+            # only timed.
+            for c in state["slowest_calls"]:
+                assert_equal(c["profiled"],
+                             c["hook"] != "acquisition.compute_proposals")
+                assert_equal(c["file"] is not None, c["profiled"])
+            assert_equal(len(os.listdir(os.path.join(self.directory,
+                                                     "profiles"))),
+                         len([c for c in state["slowest_calls"]
+                              if c["profiled"]]))
+            optimizer = eass._optimizer
+            eass.set_profiling(None)
+            assert_equal(eass.get_profiling()["profiler"], None)
+            assert_true("update" not in vars(optimizer))
+        finally:
+            eass.set_exit()
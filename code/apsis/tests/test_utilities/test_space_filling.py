@@ -0,0 +1,65 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities.space_filling import *
+from apsis.models.parameter_definition import MinMaxNumericParamDef, \
+    NominalParamDef
+from nose.tools import assert_equal, assert_raises, assert_true, \
+    assert_greater_equal
+from numpy.testing import assert_array_almost_equal
+from scipy.spatial.distance import pdist
+import numpy as np
+
+
+class TestSpaceFilling(object):
+
+    def test_sobol(self):
+        points = SobolDesign(3, scramble=False).draw(4)
+        assert_array_almost_equal(points, [[0, 0, 0], [0.5, 0.5, 0.5],
+                                           [0.25, 0.75, 0.75],
+                                           [0.75, 0.25, 0.25]])
+        for dims in [2, 40]:
+            points = SobolDesign(dims, random_state=1).draw(64)
+            for d in range(dims):
+                # Exactly one point per interval of length 1/64.
+                assert_equal(sorted((points[:, d] * 64).astype(int)),
+                             list(range(64)))
+        design = SobolDesign(5, random_state=2)
+        first = np.concatenate([design.draw(3), design.draw(5)])
+        assert_array_almost_equal(first,
+                                  SobolDesign(5, random_state=2).draw(8))
+
+    def test_halton(self):
+        points = HaltonDesign(2, scramble=False).draw(3)
+        assert_array_almost_equal(points, [[0.5, 1/3.], [0.25, 2/3.],
+                                           [0.75, 1/9.]])
+        points = HaltonDesign(10, random_state=1).draw(100)
+        assert_true(np.all(points >= 0) and np.all(points < 1))
+
+    def test_latin_hypercube(self):
+        design = LatinHypercubeDesign(3, random_state=1, size=10)
+        points = design.draw(20)
+        for block in [points[:10], points[10:]]:
+            for d in range(3):
+                assert_equal(sorted((block[:, d] * 10).astype(int)),
+                             list(range(10)))
+        assert_greater_equal(np.min(pdist(latin_hypercube(20, 3, 0, 200))),
+                             np.min(pdist(latin_hypercube(20, 3, 0, 0))))
+
+    def test_check_design(self):
+        assert_true(isinstance(check_design("halton", 2), HaltonDesign))
+        design = SobolDesign(2)
+        assert_true(check_design(design, 2) is design)
+        assert_raises(ValueError, check_design, "no_design", 2)
+
+        class NoDrawDesign(SpaceFillingDesign):
+            pass
+        assert_raises(TypeError, NoDrawDesign, 2)
+
+    def test_warp_design(self):
+        param_defs = {"a": MinMaxNumericParamDef(0, 10),
+                      "b": NominalParamDef(["x", "y", "z", "w"])}
+        assert_equal(design_dimensions(param_defs), 2)
+        warped = warp_design(np.array([[0.3, 0.1], [0.6, 0.99]]), param_defs)
+        assert_array_almost_equal(warped["a"], [[0.3], [0.6]])
+        assert_array_almost_equal(warped["b"], [[1, 0, 0, 0], [0, 0, 0, 1]])
+        assert_raises(ValueError, warp_design, np.zeros((2, 5)), param_defs)
@@ -0,0 +1,208 @@
+__author__ = 'Frederik Diehl'
+
+from apsis.utilities import logging_utils
+logging_utils.logging_tests()
+
+from apsis.webservice import REST_interface
+from apsis.assistants.lab_assistant import LabAssistant
+from apsis_client.apsis_connection import Connection
+from apsis.utilities import metrics
+from nose.tools import assert_equal, assert_not_equal, assert_in, \
+    assert_not_in
+from werkzeug.serving import make_server
+import threading
+import requests
+import time
+
+
+class TestRESTInterface(object):
+    """
+    Tests the REST interface on a threaded server.
+    """
+    server = None
+    conn = None
+
+    def setup(self):
+        REST_interface._logger = logging_utils.get_logger(
+            "webservice.REST_interface")
+        REST_interface.lAss = LabAssistant()
+        self.server = make_server("127.0.0.1", 0, REST_interface.app,
+                                  threaded=True)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.conn = Connection("http://127.0.0.1:%s" %self.server.server_port,
+                               repeat_time=0.01)
+
+    def teardown(self):
+        self.server.shutdown()
+        REST_interface.lAss.set_exit()
+
+    def test_concurrent_workers(self):
+        """
+        Tests many concurrent workers against one threaded server.
+        """
+        param_defs = {
+            "x": {"type": "MinMaxNumericParamDef",
+                  "lower_bound": 0, "upper_bound": 1}
+        }
+        exp_ids = [self.conn.init_experiment(
+            "test_%i" %i, "RandomSearch", param_defs,
+            optimizer_arguments={"multiprocessing": "none"})
+            for i in range(2)]
+        num_workers = 8
+        num_evaluations = 5
+        errors = []
+
+        def work(exp_id):
+            try:
+                for i in range(num_evaluations):
+                    cand = self.conn.get_next_candidate(exp_id, timeout=10)
+                    cand["result"] = cand["params"]["x"]
+                    assert_equal(self.conn.update(exp_id, cand, timeout=10),
+                                 "success")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(exp_ids[i % 2],))
+                   for i in range(num_workers*2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_equal(errors, [])
+        for exp_id in exp_ids:
+            candidates = self.conn.get_all_candidates(exp_id)
+            assert_equal(len(candidates["finished"]),
+                         num_workers*num_evaluations)
+            assert_equal(candidates["working"], [])
+        assert_not_equal(self.conn.get_best_candidate(exp_ids[0]), "failed")
+
+    def test_intermediate_results(self):
+        """
+        Tests streaming intermediate results and receiving a stop signal.
+        """
+        param_defs = {
+            "x": {"type": "MinMaxNumericParamDef",
+                  "lower_bound": 0, "upper_bound": 1}
+        }
+        exp_id = self.conn.init_experiment(
+            "test_stop", "RandomSearch", param_defs,
+            optimizer_arguments={"multiprocessing": "none",
+                                 "early_stopping": "median",
+                                 "early_stopping_params": {
+                                     "min_candidates": 1,
+                                     "min_steps": 2}})
+        cand = self.conn.get_next_candidate(exp_id, timeout=10)
+        cand["result"] = 1
+        assert_equal(self.conn.update(exp_id, cand, timeout=10,
+                                      intermediate_results=[(1, 1)]),
+                     "success")
+        cand = self.conn.get_next_candidate(exp_id, timeout=10)
+        assert_equal(self.conn.update(exp_id, cand, status="working",
+                                      timeout=10,
+                                      intermediate_results=[(1, 2)]),
+                     "success")
+        assert_equal(self.conn.update(exp_id, cand, status="working",
+                                      timeout=10,
+                                      intermediate_results=[(1, 2), (2, 3)]),
+                     "stop")
+        exp_dict = REST_interface.lAss.get_experiment_as_dict(exp_id)
+        assert_equal(exp_dict["intermediate_results"][cand["cand_id"]],
+                     [[1, 2], [2, 3]])
+
+    def test_metrics(self):
+        """
+        Tests recording metrics and serving them on /metrics.
+        """
+        param_defs = {
+            "x": {"type": "MinMaxNumericParamDef",
+                  "lower_bound": 0, "upper_bound": 1}
+        }
+        metrics.REGISTRY.reset()
+        metrics.REGISTRY.enabled = True
+        try:
+            exp_id = self.conn.init_experiment(
+                "test_metrics", "RandomSearch", param_defs,
+                optimizer_arguments={"multiprocessing": "none"})
+            cand = self.conn.get_next_candidate(exp_id, timeout=10)
+            cand["result"] = 1
+            self.conn.update(exp_id, cand, timeout=10)
+            response = requests.get("http://127.0.0.1:%s/metrics"
+                                    %self.server.server_port)
+        finally:
+            metrics.REGISTRY.enabled = False
+            metrics.REGISTRY.reset()
+        assert_equal(response.status_code, 200)
+        assert_in("text/plain", response.headers["Content-Type"])
+        assert_in('apsis_requests_total{route="/c/experiments",'
+                  'method="POST",status="200"} 1', response.text)
+        assert_in('apsis_request_seconds_count{route="/c/experiments/'
+                  '<experiment_id>/update",method="POST"} 1', response.text)
+        assert_in("# TYPE apsis_gp_fit_seconds histogram", response.text)
+
+    def test_profiling(self):
+        """
+        Tests toggling profiling via the admin endpoint.
+        """
+        param_defs = {
+            "x": {"type": "MinMaxNumericParamDef",
+                  "lower_bound": 0, "upper_bound": 1}
+        }
+        exp_id = self.conn.init_experiment("test_profiling", "RandomSearch",
+                                           param_defs)
+        url = "http://127.0.0.1:%s/admin/experiments/%s/profiling" %(
+            self.server.server_port, exp_id)
+        assert_equal(requests.get(url).json()["result"]["profiler"], None)
+        result = requests.post(url, json={
+            "profiler": "sampling",
+            "profiler_params": {"slowest": 3}}).json()["result"]
+        assert_equal(result["profiler"], "SamplingProfiler")
+        # The candidates are generated by the optimizer's backend thread,
+        # which refills its queue once we took candidates from it.
+        for i in range(50):
+            self.conn.get_next_candidate(exp_id, timeout=10)
+            hooks = [c["hook"] for c in
+                     requests.get(url).json()["result"]["slowest_calls"]]
+            if "optimizer.get_next_candidates" in hooks:
+                break
+            time.sleep(0.1)
+        assert_in("optimizer.get_next_candidates", hooks)
+        assert_equal(requests.post(url, json={}).json()["result"][
+            "profiler"], None)
+        assert_equal(requests.post(url, json={"profiler": "unknown"}).json()[
+            "result"], "failed")
+
+    def test_cached_view(self):
+        """
+        Tests that only the ETag decides 304s, and failures are not cached.
+        """
+        param_defs = {
+            "x": {"type": "MinMaxNumericParamDef",
+                  "lower_bound": 0, "upper_bound": 1}
+        }
+        exp_id = self.conn.init_experiment(
+            "test_cached", "RandomSearch", param_defs,
+            optimizer_arguments={"multiprocessing": "none"})
+        url = "http://127.0.0.1:%s/c/experiments/%s" %(
+            self.server.server_port, exp_id)
+        response = requests.get(url)
+        etag = response.headers["ETag"]
+        assert_equal(requests.get(url, headers={
+            "If-None-Match": etag}).status_code, 304)
+        # Changed within the same second as Last-Modified.
+        self.conn.get_next_candidate(exp_id, timeout=10)
+        assert_equal(requests.get(url, headers={
+            "If-Modified-Since": response.headers["Last-Modified"]}
+        ).status_code, 200)
+
+        lAss = REST_interface.lAss
+        def fail(*args, **kwargs):
+            raise ValueError("Failing on purpose.")
+        lAss.get_experiment_as_dict = fail
+        try:
+            self.conn.get_next_candidate(exp_id, timeout=10)
+            response = requests.get(url)
+        finally:
+            del lAss.get_experiment_as_dict
+        assert_equal(response.json()["result"], "failed")
+        assert_not_in("ETag", response.headers)
+        assert_equal(requests.get(url).json()["result"]["exp_id"], exp_id)
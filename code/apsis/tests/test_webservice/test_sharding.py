@@ -0,0 +1,119 @@
+__author__ = 'Frederik Diehl'
+
+from apsis_client.sharding import ConsistentHashRing, ShardedConnection
+from nose.tools import assert_equal, assert_items_equal, assert_greater, \
+    assert_raises
+import os
+import sys
+import time
+import signal
+import socket
+import shutil
+import tempfile
+import subprocess
+import requests
+
+
+def test_consistent_hash_ring():
+    """
+    Tests the distribution and stability of the hash ring.
+    """
+    with assert_raises(ValueError):
+        ConsistentHashRing([])
+    keys = ["%i" %i for i in range(1000)]
+    ring = ConsistentHashRing(range(4))
+    owners = [ring.get_node(k) for k in keys]
+    for node in range(4):
+        assert_greater(owners.count(node), 100)
+    assert_equal(owners, [ConsistentHashRing(range(4)).get_node(k)
+                          for k in keys])
+
+    # Adding a node only moves keys to the new node.
+    bigger_ring = ConsistentHashRing(range(5))
+    for k, owner in zip(keys, owners):
+        assert bigger_ring.get_node(k) in [owner, 4]
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class TestShardedServers(object):
+    """
+    Tests several local server processes sharing the experiments.
+    """
+    save_path = None
+    processes = None
+    conn = None
+
+    def setup(self):
+        self.save_path = tempfile.mkdtemp()
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))), "webservice", "REST_start_script.py")
+        code_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = code_dir + os.pathsep + env.get("PYTHONPATH", "")
+        addresses = []
+        self.processes = []
+        with open(os.devnull, "w") as devnull:
+            for i in range(2):
+                port = _free_port()
+                addresses.append("http://127.0.0.1:%i" %port)
+                self.processes.append(subprocess.Popen(
+                    [sys.executable, script, "--port", str(port),
+                     "--save_path", self.save_path, "--plot_processes", "0",
+                     "--shard_index", str(i), "--num_shards", "2"],
+                    env=env, stdout=devnull, stderr=devnull))
+        for a in addresses:
+            start = time.time()
+            while True:
+                try:
+                    requests.get(a + "/c/experiments", timeout=1)
+                    break
+                except requests.ConnectionError:
+                    if time.time() - start > 30:
+                        raise
+                    time.sleep(0.1)
+        self.conn = ShardedConnection(addresses, repeat_time=0.01)
+
+    def teardown(self):
+        for p in self.processes:
+            p.send_signal(signal.SIGINT)
+        for p in self.processes:
+            for i in range(50):
+                if p.poll() is not None:
+                    break
+                time.sleep(0.1)
+            if p.poll() is None:
+                p.kill()
+        shutil.rmtree(self.save_path)
+
+    def test_sharded_experiments(self):
+        """
+        Tests experiments being distributed across and used on two shards.
+        """
+        param_defs = {
+            "x": {"type": "MinMaxNumericParamDef",
+                  "lower_bound": 0, "upper_bound": 1}
+        }
+        exp_ids = [self.conn.init_experiment(
+            "test_%i" %i, "RandomSearch", param_defs,
+            optimizer_arguments={"multiprocessing": "none"})
+            for i in range(6)]
+        assert_items_equal(self.conn.get_all_experiment_ids(), exp_ids)
+        for i, c in enumerate(self.conn._connections):
+            for exp_id in c.get_all_experiment_ids():
+                assert_equal(self.conn._ring.get_node(exp_id), i)
+
+        for exp_id in exp_ids:
+            cand = self.conn.get_next_candidate(exp_id, timeout=10)
+            cand["result"] = 1
+            assert_equal(self.conn.update(exp_id, cand, timeout=10),
+                         "success")
+            assert_equal(len(self.conn.get_all_candidates(exp_id)["finished"]),
+                         1)
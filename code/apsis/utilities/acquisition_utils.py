@@ -1,12 +1,20 @@
 __author__ = 'Frederik Diehl'
 
-from apsis.optimizers.bayesian import acquisition_functions
+from apsis.utilities.import_utils import LazyRegistry
 import numpy as np
 
-AVAILABLE_ACQUISITIONS = {
-    "ExpectedImprovement": acquisition_functions.ExpectedImprovement,
-    "ProbabilityOfImprovement": acquisition_functions.ProbabilityOfImprovement
-}
+_FUNCTIONS = "apsis.optimizers.bayesian.acquisition_functions:"
+
+# Resolved on first use, so listing the acquisitions does not import scipy.
+AVAILABLE_ACQUISITIONS = LazyRegistry({
+    "ExpectedImprovement": _FUNCTIONS + "ExpectedImprovement",
+    "ProbabilityOfImprovement": _FUNCTIONS + "ProbabilityOfImprovement",
+    "ExpectedImprovementPerCost": _FUNCTIONS + "ExpectedImprovementPerCost",
+    "CostCooledExpectedImprovement":
+        _FUNCTIONS + "CostCooledExpectedImprovement",
+    "UpperConfidenceBound": _FUNCTIONS + "UpperConfidenceBound",
+    "ThompsonSampling": _FUNCTIONS + "ThompsonSampling"
+})
 
 
 def check_acquisition(acquisition, acquisition_params):
@@ -35,6 +43,7 @@ def check_acquisition(acquisition, acquisition_params):
         multiprocessing argument is not an acceptable value.
 
     """
+    from apsis.optimizers.bayesian import acquisition_functions
     if acquisition_params is None:
         acquisition_params = {}
 
@@ -42,12 +51,11 @@ def check_acquisition(acquisition, acquisition_params):
         return acquisition
 
     if isinstance(acquisition, basestring):
-        try:
-            acquisition = AVAILABLE_ACQUISITIONS[acquisition]
-        except:
+        if acquisition not in AVAILABLE_ACQUISITIONS:
             raise ValueError("No corresponding acquisition found for %s. "
                              "Acquisition must be in %s" %(
                 str(acquisition), AVAILABLE_ACQUISITIONS.keys()))
+        acquisition = AVAILABLE_ACQUISITIONS[acquisition]
 
     if not issubclass(acquisition, acquisition_functions.AcquisitionFunction):
         raise ValueError("%s is of type %s, not AcquisitionFunction type."
@@ -59,51 +67,109 @@ def check_acquisition(acquisition, acquisition_params):
 def create_cand_matrix_vector(experiment, failed_treat):
     """
     Creates the candidate matrix and result vector.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment whose finished candidates are used.
+    failed_treat : tuple
+        The treatment of failed candidates and its value, as in
+        Optimizer.treat_failed. Supported are
+            - "ignore": Failed candidates are left out.
+            - "fixed_value": Their result is the value.
+            - "worst_mult": Their result is
+                (worst_result - best_result) * value + worst_result, with
+                the worst and best results of the experiment. If no
+                candidate succeeded yet, it is 0.
+
+    Returns
+    -------
+    candidate_matrix : np.array
+        The (n, d) matrix of warped parameters.
+    results_vector : np.array
+        The (n, 1) vector of results.
+
+    Raises
+    ------
+    ValueError
+        If failed_treat is not supported.
+    """
+    treatment, value = failed_treat
+    if treatment not in ["ignore", "fixed_value", "worst_mult"]:
+        raise ValueError("failed_treat %s is not supported." %(failed_treat,))
+    candidates = experiment.candidates_finished
+    if treatment == "ignore":
+        candidates = [c for c in candidates if not c.failed]
+    failed = np.array([c.failed for c in candidates], dtype=bool)
+    results_vector = np.array([np.nan if c.failed else c.result
+                               for c in candidates], dtype=float)
+    if failed.any():
+        if treatment == "fixed_value":
+            failed_value = value
+        elif experiment.best_candidate is None:
+            failed_value = 0
+        else:
+            best_result = experiment.best_candidate.result
+            worst_result = experiment.worst_candidate.result
+            failed_value = (worst_result - best_result) * value + \
+                           worst_result
+        results_vector[failed] = failed_value
+    return create_param_matrix(experiment, candidates), \
+           results_vector.reshape(len(candidates), 1)
+
+
+def create_param_matrix(experiment, candidates):
     """
-    parameter_warped_size = 0
-    for p in experiment.parameter_definitions.values():
-        parameter_warped_size += p.warped_size()
-
-    if failed_treat[0] is "ignore":
-        treated_candidates = 0
-        for c in experiment.candidates_finished:
-            if not c.failed:
-                treated_candidates += 1
-    else:
-        treated_candidates = len(experiment.candidates_finished)
-
-    candidate_matrix = np.zeros((treated_candidates,
-                                 parameter_warped_size))
-    results_vector = np.zeros((treated_candidates, 1))
+    Creates the matrix of the warped parameters of candidates.
 
+    Returns
+    -------
+    candidate_matrix : np.array
+        The (n, d) matrix of warped parameters, one row per candidate in the
+        order of candidates.
+    """
     param_names = sorted(experiment.parameter_definitions.keys())
+    parameter_warped_size = sum(p.warped_size() for p in
+                                experiment.parameter_definitions.values())
+    candidate_matrix = np.zeros((len(candidates), parameter_warped_size))
+    for i, c in enumerate(candidates):
+        warped_in = experiment.warp_pt_in(c.params)
+        param_values = []
+        for pn in param_names:
+            param_values.extend(warped_in[pn])
+        candidate_matrix[i, :] = param_values
+    return candidate_matrix
+
 
-    best_candidate = experiment.candidates_finished[0]
-    worst_candidate = experiment.candidates_finished[0]
+def create_cost_matrix_vector(experiment):
+    """
+    Creates the candidate matrix and log-cost vector for a cost model.
+
+    All finished candidates with a positive cost are used, including failed
+    ones, since their evaluation took compute as well.
 
+    Returns
+    -------
+    candidate_matrix : np.array
+        The (n, d) matrix of warped parameters.
+    log_cost_vector : np.array
+        The (n, 1) vector of the logarithms of the costs.
+    """
+    param_names = sorted(experiment.parameter_definitions.keys())
+    rows = []
+    log_costs = []
     for c in experiment.candidates_finished:
-        if not c.failed:
-            if experiment.better_cand(c, best_candidate):
-                best_candidate = c
-            if experiment.better_cand(worst_candidate, c):
-                worst_candidate = c
-
-    if failed_treat[0] == "fixed_value":
-        failed_value = failed_treat[1]
-    elif failed_treat[0] == "worst_mult":
-        failed_value = (worst_candidate.result - best_candidate.result) * \
-                       failed_treat[1] + worst_candidate.result
-    else:
-        raise ValueError("failed_treat %s is not supported." %failed_treat)
-
-    for i, c in enumerate(experiment.candidates_finished):
+        if c.cost is None or not c.cost > 0:
+            continue
         warped_in = experiment.warp_pt_in(c.params)
         param_values = []
         for pn in param_names:
             param_values.extend(warped_in[pn])
-        candidate_matrix[i, :] = param_values
-        if c.failed:
-            results_vector[i] = failed_value
-        else:
-            results_vector[i] = c.result
-    return candidate_matrix, results_vector
\ No newline at end of file
+        rows.append(param_values)
+        log_costs.append([np.log(c.cost)])
+    parameter_warped_size = sum(p.warped_size() for p in
+                                experiment.parameter_definitions.values())
+    candidate_matrix = np.array(rows, dtype=float).reshape(
+        len(rows), parameter_warped_size)
+    log_cost_vector = np.array(log_costs, dtype=float).reshape(len(rows), 1)
+    return candidate_matrix, log_cost_vector
@@ -1,6 +1,7 @@
 import math
 from apsis.utilities.randomization import check_random_state
-from scipy.stats.distributions import norm
+from scipy import ndimage
+from collections import OrderedDict
 import numpy as np
 
 def branin_func(x, y, a=1, b=5.1/(4*math.pi**2), c=5/math.pi, r=6, s=10,
@@ -33,6 +34,132 @@ def branin_func(x, y, a=1, b=5.1/(4*math.pi**2), c=5/math.pi, r=6, s=10,
         return result
 
 
+# Parameters of the Hartmann functions, see
+# http://www.sfu.ca/~ssurjano/hart3.html and
+# http://www.sfu.ca/~ssurjano/hart6.html
+_HARTMANN_ALPHA = np.array([1.0, 1.2, 3.0, 3.2])
+_HARTMANN3_A = np.array([[3.0, 10, 30],
+                         [0.1, 10, 35],
+                         [3.0, 10, 30],
+                         [0.1, 10, 35]])
+_HARTMANN3_P = 1e-4 * np.array([[3689, 1170, 2673],
+                                [4699, 4387, 7470],
+                                [1091, 8732, 5547],
+                                [381, 5743, 8828]])
+_HARTMANN6_A = np.array([[10, 3, 17, 3.50, 1.7, 8],
+                         [0.05, 10, 17, 0.1, 8, 14],
+                         [3, 3.5, 1.7, 10, 17, 8],
+                         [17, 8, 0.05, 10, 0.1, 14]])
+_HARTMANN6_P = 1e-4 * np.array([[1312, 1696, 5569, 124, 8283, 5886],
+                                [2329, 4135, 8307, 3736, 1004, 9991],
+                                [2348, 1451, 3522, 2883, 3047, 6650],
+                                [4047, 8828, 8732, 5743, 1091, 381]])
+
+
+def hartmann3_func(x):
+    """
+    Three-dimensional Hartmann function.
+
+    This is the same function as in http://www.sfu.ca/~ssurjano/hart3.html.
+    It is usually evaluated on [0, 1]^3 and has its global minimum
+    f(x)=-3.86278 at (0.114614, 0.555649, 0.852547).
+
+    Parameters
+    ----------
+    x : list of three floats
+        The point to evaluate.
+
+    Returns
+    -------
+    result : float
+        A real valued float.
+    """
+    return _hartmann(x, _HARTMANN3_A, _HARTMANN3_P)
+
+
+def hartmann6_func(x):
+    """
+    Six-dimensional Hartmann function.
+
+    This is the same function as in http://www.sfu.ca/~ssurjano/hart6.html.
+    It is usually evaluated on [0, 1]^6 and has its global minimum
+    f(x)=-3.32237 at (0.20169, 0.150011, 0.476874, 0.275332, 0.311652,
+    0.6573).
+
+    Parameters
+    ----------
+    x : list of six floats
+        The point to evaluate.
+
+    Returns
+    -------
+    result : float
+        A real valued float.
+    """
+    return _hartmann(x, _HARTMANN6_A, _HARTMANN6_P)
+
+
+def _hartmann(x, a, p):
+    """
+    Evaluates the Hartmann function with the matrices a and p at x.
+    """
+    x = np.asarray(x, dtype=float)
+    inner = np.sum(a * (x - p)**2, axis=1)
+    return float(-np.sum(_HARTMANN_ALPHA * np.exp(-inner)))
+
+
+def rosenbrock_func(x, a=1, b=100):
+    """
+    Rosenbrock function of arbitrary dimension.
+
+    This is the same function as in http://www.sfu.ca/~ssurjano/rosen.html.
+    It is usually evaluated on [-5, 10]^d and has its global minimum
+    f(x)=0 at (1, ..., 1).
+
+    Parameters
+    ----------
+    x : list of floats
+        The point to evaluate. Has to have at least two entries.
+    a, b : floats, optional
+        Parameters for the shape of the function.
+
+    Returns
+    -------
+    result : float
+        A real valued float.
+    """
+    x = np.asarray(x, dtype=float)
+    return float(np.sum(b*(x[1:] - x[:-1]**2)**2 + (a - x[:-1])**2))
+
+
+def ackley_func(x, a=20, b=0.2, c=2*math.pi):
+    """
+    Ackley function of arbitrary dimension.
+
+    This is the same function as in http://www.sfu.ca/~ssurjano/ackley.html.
+    It is usually evaluated on [-32.768, 32.768]^d and has its global
+    minimum f(x)=0 at (0, ..., 0).
+
+    Parameters
+    ----------
+    x : list of floats
+        The point to evaluate.
+    a, b, c : floats, optional
+        Parameters for the shape of the function. Their default values are
+        according to the recommendations of the above website.
+
+    Returns
+    -------
+    result : float
+        A real valued float.
+    """
+    x = np.asarray(x, dtype=float)
+    d = len(x)
+    result = (-a * np.exp(-b * np.sqrt(np.sum(x**2) / d))
+              - np.exp(np.sum(np.cos(c * x)) / d) + a + math.e)
+    return float(result)
+
+
 def gen_noise(dims, points, random_state=None):
     """
     Generates an ndarray representing random noise.
@@ -70,6 +197,10 @@ def get_noise_value_at(x, variance, noise_gen, val_min=0, val_max=1):
     Note that the smoothing is hard-capped at a 3 sigma interval due to
     performance reasons.
 
+    Since the gaussian weights factorize over the dimensions, the weighted
+    sum over the grid points close to x is computed as one contraction of
+    the noise with a weight vector per dimension.
+
     Parameters
     ----------
     x : list of real values
@@ -88,51 +219,126 @@ def get_noise_value_at(x, variance, noise_gen, val_min=0, val_max=1):
     x_value : float
         The value of the function at the point x.
     """
-    x_value = 0
-    prob_sum = 0
-    gaussian = norm(scale=variance)
-    dims = len(noise_gen.shape)
-    points = len(noise_gen[0])
+    points = noise_gen.shape[0]
+    max_dist = _max_index_distance(variance, points)
 
     closest_idx = _gen_closest_index(x, points)
-    close_indices = _gen_close_indices(closest_idx, max(1, int(variance*3*points)),
-                                      dims, points)
-    for i in close_indices:
-        dist = _calc_distance_grid(x, i, points)
-        prob = gaussian.pdf(dist)
-        prob_sum += gaussian.pdf(dist)
-        x_value += prob * noise_gen[i]
-    x_value /= prob_sum
+    close_values = noise_gen[tuple(
+        slice(max(0, c - max_dist), min(points, c + max_dist + 1))
+        for c in closest_idx)]
+    x_value = close_values
+    prob_sum = 1.
+    for d, c in enumerate(closest_idx):
+        grid = np.arange(max(0, c - max_dist),
+                         min(points, c + max_dist + 1)) / float(points)
+        weights = np.exp(-0.5 * ((float(x[d]) - grid) / variance)**2)
+        # Always contracts the first remaining axis, which is dimension d.
+        x_value = np.tensordot(weights, x_value, axes=(0, 0))
+        prob_sum *= np.sum(weights)
+    x_value = float(x_value) / prob_sum
 
     x_value = (x_value - val_min)/(val_max- val_min)
 
     return x_value
 
 
-def _calc_distance_grid(x_coords, y_indices, points):
+def get_noise_values_at(x, variance, noise_gen, val_min=0, val_max=1):
     """
-    Calculates the euclidian distance between two points for a certain grid.
+    Returns the noise values for noise_gen for a given variance at many x.
+
+    The smoothed noise is computed once for all grid points (see
+    smooth_noise) and then linearly interpolated at the points x. This is
+    much faster than get_noise_value_at for many points, and at the grid
+    points identical to it.
 
     Parameters
     ----------
-    x_coords, y_indices : list
-        The points in a list format for which the distance should be
-        calculated. Note that x_coords is in [0, 1] coords, while y_indices is
-        in an index format, that is dependant on the number of points.
-        The entries x and y are indices of the grid, so their
-         final distance is dependant on the number of points.
-    points : int
-        The number of points per dimension on the grid.
+    x : array-like of real values
+        The points, in the shape (n, dims), or a single point of shape
+        (dims,). All values are in the [0, 1] hypercube.
+    variance : float
+        The variance of the normal distribution to smooth the noise.
+    noise_gen : ndarray
+        The array representing the generated noise.
+    val_min, val_max : float
+        Used to scale the values. See get_noise_value_at.
+
+    Returns
+    -------
+    x_values : ndarray
+        The values at the points x, of shape (n,), or a float if x was a
+        single point.
+    """
+    x = np.asarray(x, dtype=float)
+    single = x.ndim == 1
+    x = np.atleast_2d(x)
+    if x.shape[1] != noise_gen.ndim:
+        raise ValueError("x has %i dimensions, but the noise has %i."
+                         %(x.shape[1], noise_gen.ndim))
+    smoothed = smooth_noise(noise_gen, variance)
+    points = noise_gen.shape[0]
+    coordinates = np.clip(x * points, 0, points - 1).T
+    x_values = ndimage.map_coordinates(smoothed, coordinates, order=1,
+                                       mode="nearest")
+    x_values = (x_values - val_min)/(val_max - val_min)
+    if single:
+        return float(x_values[0])
+    return x_values
+
+
+def smooth_noise(noise_gen, variance):
+    """
+    Returns the smoothed noise at all grid points of noise_gen.
+
+    The noise is filtered with a gaussian capped at 3 sigma, and normalized
+    by the weights inside the grid, exactly as get_noise_value_at does for a
+    single point. Results are cached for the most recently used noise
+    arrays and variances.
+
+    Parameters
+    ----------
+    noise_gen : ndarray
+        The array representing the generated noise.
+    variance : float
+        The variance of the normal distribution to smooth the noise.
 
     Returns
     -------
-    distance : float
-        The distance between x and y.
+    smoothed : ndarray
+        The smoothed noise, of the same shape as noise_gen.
+    """
+    key = (id(noise_gen), variance)
+    cached = _smoothed_noise_cache.get(key)
+    if cached is not None and cached[0] is noise_gen:
+        return cached[1]
+    points = noise_gen.shape[0]
+    sigma = variance * points
+    truncate = _max_index_distance(variance, points) / sigma
+    smoothed = ndimage.gaussian_filter(noise_gen.astype(float), sigma,
+                                       mode="constant", truncate=truncate)
+    # Normalizes by the weights which lie inside the grid. These factorize
+    # over the dimensions, too.
+    weight_sums = ndimage.gaussian_filter1d(np.ones(points), sigma,
+                                            mode="constant", truncate=truncate)
+    for d in range(noise_gen.ndim):
+        shape = [1] * noise_gen.ndim
+        shape[d] = points
+        smoothed /= weight_sums.reshape(shape)
+    _smoothed_noise_cache[key] = (noise_gen, smoothed)
+    while len(_smoothed_noise_cache) > _SMOOTHED_NOISE_CACHE_SIZE:
+        _smoothed_noise_cache.popitem(last=False)
+    return smoothed
+
+
+_SMOOTHED_NOISE_CACHE_SIZE = 8
+_smoothed_noise_cache = OrderedDict()
+
+
+def _max_index_distance(variance, points):
+    """
+    Returns the maximum distance (in indices) considered for smoothing.
     """
-    distance = 0
-    for i in range(len(x_coords)):
-        distance += (float(x_coords[i]) - float(y_indices[i])/points)**2
-    return distance**0.5
+    return max(1, int(variance*3*points))
 
 
 def _gen_closest_index(x, points):
@@ -157,72 +363,3 @@ def _gen_closest_index(x, points):
     for i in range(len(x)):
         closest_index.append(int(x[i]*points))
     return tuple(closest_index)
-
-
-def _gen_close_indices(x_indices, max_dist, dims, points):
-    """
-    Generates a list of closest indices to consider for the noise smoothing.
-
-    Parameters
-    ----------
-    x_indices : list
-        The list of indices for each dimension around which to consider the
-        indices.
-    max_dist : int
-        The maximum distance (in indices) around x for which to consider items.
-    dims : int
-        The dimensions of x.
-    points : int
-        The number of points per dimension
-
-    Returns
-    -------
-    list_indices : list of tuples
-        A list of tuples as indices which are closest to x.
-    """
-    raw_list_indices = _gen_close_indices_rec(x_indices, max_dist, dims, points)
-    list_indices = []
-    for l in raw_list_indices:
-        acceptable = True
-        for d in range(dims):
-            if 0 > l[d] or l[d] >= points:
-                acceptable = False
-                break
-        if acceptable:
-            list_indices.append(tuple(l))
-    return list_indices
-
-
-def _gen_close_indices_rec(x, max_dist, dims, points):
-    """
-    Recursively generates a list of closest indices to consider for the noise smoothing.
-
-    Parameters
-    ----------
-    x_indices : list
-        The list of indices for each dimension around which to consider the
-        indices.
-    max_dist : int
-        The maximum distance (in indices) around x for which to consider items.
-    dims : int
-        The dimensions of x.
-    points : int
-        The number of points per dimension
-
-    Returns
-    -------
-    list_indices : list of tuples
-        A list of lists as indices which are closest to x.
-    """
-    list_indices = []
-    if len(x) == 1:
-        for i in range(-max_dist, max_dist+1):
-            list_indices.append([int(i + x[0])])
-    else:
-        list_prev_dim = _gen_close_indices_rec(x[1:], max_dist, dims-1, points)
-        for i in range(len(list_prev_dim)):
-            for j in range(-max_dist, max_dist+1):
-                to_append = [int(j + x[0])] + list_prev_dim[i][:]
-                #to_append = [int(j + x[0])] + list_prev_dim[i]
-                list_indices.append(to_append)
-    return list_indices
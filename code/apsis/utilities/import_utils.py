@@ -1,6 +1,10 @@
+import collections
+import importlib
 from apsis.utilities.logging_utils import get_logger
 
-logger = get_logger("apsis.utils.import_utils")
+# The logger is only looked up when used, since this module is imported
+# before logging is configured.
+_LOGGER_NAME = "apsis.utils.import_utils"
 
 
 def import_if_exists(module_name):
@@ -23,8 +27,103 @@ def import_if_exists(module_name):
     try:
         module = __import__(module_name)
     except ImportError:
-        logger.warning("Module " + str(module_name) +
+        get_logger(_LOGGER_NAME).warning("Module " + str(module_name) +
                         " could not be imported as it could not be found.")
         return False, None
     else:
-        return True, module
\ No newline at end of file
+        return True, module
+
+
+def import_object(path):
+    """
+    Imports the object described by path.
+
+    Parameters
+    ----------
+    path : string
+        The object as "module:attribute", for example
+        "apsis.optimizers.tpe:TPEOptimizer".
+
+    Returns
+    -------
+    obj : object
+        The attribute of the imported module.
+
+    Raises
+    ------
+    ValueError
+        If path is not of the form "module:attribute", or the module has no
+        such attribute.
+    """
+    module_name, sep, attribute = path.partition(":")
+    if not sep or not module_name or not attribute:
+        raise ValueError("%s is not of the form module:attribute." %path)
+    module = importlib.import_module(module_name)
+    try:
+        return getattr(module, attribute)
+    except AttributeError:
+        raise ValueError("Module %s has no attribute %s."
+                         %(module_name, attribute))
+
+
+class LazyRegistry(collections.MutableMapping):
+    """
+    A dict whose values are imported on first access.
+
+    Values can be given as "module:attribute" strings, which are imported
+    via import_object the first time they are looked up, and then cached.
+    All other values are stored unchanged. This allows registries like
+    AVAILABLE_OPTIMIZERS to list everything available without importing
+    heavy dependencies (GPy, scipy) that might never be used.
+
+    Listing the keys, or checking whether a key is contained, never imports
+    anything.
+    """
+    _entries = None
+
+    def __init__(self, entries=None):
+        """
+        Initializes the registry.
+
+        Parameters
+        ----------
+        entries : dict, optional
+            The initial entries, mapping keys to objects or to
+            "module:attribute" strings.
+        """
+        self._entries = {}
+        if entries is not None:
+            self.update(entries)
+
+    def __getitem__(self, key):
+        value = self._entries[key]
+        if isinstance(value, basestring):
+            get_logger(_LOGGER_NAME).debug("Resolving %s from %s.", key,
+                                           value)
+            value = import_object(value)
+            self._entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def is_resolved(self, key):
+        """
+        Returns whether the value of key has already been imported.
+        """
+        return not isinstance(self._entries[key], basestring)
+
+    def __repr__(self):
+        return "LazyRegistry(%r)" %self._entries
@@ -0,0 +1,454 @@
+"""
+Counters, gauges and histograms describing where the server spends time.
+
+All metrics are registered with a MetricsRegistry, by default the module's
+REGISTRY, and can be exported in the Prometheus text format via
+MetricsRegistry.expose. While the registry is disabled (the default), every
+recording call returns immediately, so instrumenting hot paths costs
+little. The REST server enables it on start and serves it on /metrics.
+
+Metrics are usually created once per module, for example
+    _fit_seconds = metrics.histogram("apsis_gp_fit_seconds",
+                                     "Duration of gp fits.", ["model"])
+and then recorded with
+    with _fit_seconds.time(model="objective"):
+        ...
+"""
+__author__ = 'Frederik Diehl'
+
+import math
+import threading
+import time
+
+
+class MetricsRegistry(object):
+    """
+    A registry of named metrics.
+
+    Attributes
+    ----------
+    enabled : bool
+        Whether metrics are recorded. If False, recording does nothing.
+    """
+    enabled = None
+
+    _metrics = None
+    _lock = None
+
+    def __init__(self, enabled=False):
+        """
+        Initializes the registry.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether metrics are recorded. Default is False.
+        """
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, label_names=()):
+        """
+        Returns the Counter called name, creating it if necessary.
+        """
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names=()):
+        """
+        Returns the Gauge called name, creating it if necessary.
+        """
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(),
+                  sub_buckets=16):
+        """
+        Returns the Histogram called name, creating it if necessary.
+        """
+        return self._get_or_create(Histogram, name, documentation,
+                                   label_names, sub_buckets=sub_buckets)
+
+    def _get_or_create(self, metric_class, name, documentation, label_names,
+                       **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name, None)
+            if metric is None:
+                metric = metric_class(self, name, documentation, label_names,
+                                      **kwargs)
+                self._metrics[name] = metric
+            elif (type(metric) is not metric_class or
+                    metric.label_names != tuple(label_names)):
+                raise ValueError("Metric %s is already registered as %s with "
+                                 "labels %s." %(name, type(metric).__name__,
+                                                metric.label_names))
+            return metric
+
+    def get(self, name):
+        """
+        Returns the metric called name, or None.
+        """
+        return self._metrics.get(name, None)
+
+    def reset(self):
+        """
+        Discards all recorded values, keeping the metrics registered.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def expose(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        text : string
+            The metrics, one sample per line.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append("# HELP %s %s" %(name, _escape(metric.documentation,
+                                                        quotes=False)))
+            lines.append("# TYPE %s %s" %(name, metric.metric_type))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Metric(object):
+    """
+    The base class of all metrics.
+
+    A metric holds one value per combination of label values. Labels are
+    given as keyword arguments to the recording methods, and missing labels
+    are recorded as empty strings.
+
+    Attributes
+    ----------
+    name : string
+        The name of the metric.
+    documentation : string
+        The help text of the metric.
+    label_names : tuple of strings
+        The names of the labels.
+    metric_type : string
+        The Prometheus type of the metric.
+    """
+    name = None
+    documentation = None
+    label_names = None
+    metric_type = "untyped"
+
+    _registry = None
+    _values = None
+    _lock = None
+
+    def __init__(self, registry, name, documentation, label_names=()):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Discards all recorded values.
+        """
+        with self._lock:
+            self._values = {}
+
+    def _key(self, labels):
+        """
+        Returns the tuple of label values identifying a value.
+        """
+        for n in labels:
+            if n not in self.label_names:
+                raise ValueError("Unknown label %s for metric %s."
+                                 %(n, self.name))
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def _format_labels(self, key, extra=None):
+        pairs = ['%s="%s"' %(n, _escape(v))
+                 for n, v in zip(self.label_names, key)]
+        if extra is not None:
+            pairs.append('%s="%s"' %extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(pairs) + "}"
+
+    def samples(self):
+        """
+        Returns the lines of all samples of this metric.
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return ["%s%s %s" %(self.name, self._format_labels(key),
+                            _format_value(value))
+                for key, value in values]
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing count, for example of requests.
+    """
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increases the counter by amount.
+        """
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """
+        Returns the current count.
+        """
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, for example a queue length.
+    """
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Sets the gauge to value.
+        """
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        """
+        Returns the current value, or None if it has never been set.
+        """
+        return self._values.get(self._key(labels), None)
+
+
+class Histogram(Metric):
+    """
+    A histogram of observed values, for example durations.
+
+    Like an HDR histogram, it uses log-linear buckets: every power of two is
+    split into sub_buckets equally wide buckets. The relative width of a
+    bucket is therefore at most 1/sub_buckets, independent of the magnitude
+    of the values, so microseconds and minutes are recorded equally well
+    without configuring bucket bounds. Only buckets that have been used are
+    stored and exported; values <= 0 share one bucket.
+
+    Attributes
+    ----------
+    sub_buckets : int
+        The number of buckets per power of two.
+    """
+    metric_type = "histogram"
+    sub_buckets = None
+
+    def __init__(self, registry, name, documentation, label_names=(),
+                 sub_buckets=16):
+        super(Histogram, self).__init__(registry, name, documentation,
+                                        label_names)
+        self.sub_buckets = sub_buckets
+
+    def observe(self, value, **labels):
+        """
+        Records value.
+        """
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        index = self._bucket_index(value)
+        with self._lock:
+            entry = self._values.get(key, None)
+            if entry is None:
+                entry = self._values[key] = [{}, 0, 0.]
+            entry[0][index] = entry[0].get(index, 0) + 1
+            entry[1] += 1
+            entry[2] += value
+
+    def time(self, **labels):
+        """
+        Returns a context manager observing the duration of its block.
+        """
+        if not self._registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        """
+        Returns the number of observed values.
+        """
+        entry = self._values.get(self._key(labels), None)
+        return 0 if entry is None else entry[1]
+
+    def sum(self, **labels):
+        """
+        Returns the sum of observed values.
+        """
+        entry = self._values.get(self._key(labels), None)
+        return 0. if entry is None else entry[2]
+
+    def quantile(self, q, **labels):
+        """
+        Returns an upper bound of the q-quantile of the observed values.
+
+        The bound is the upper edge of the bucket containing the quantile,
+        so it overestimates the quantile by at most 1/sub_buckets.
+
+        Parameters
+        ----------
+        q : float
+            The quantile, between 0 and 1.
+
+        Returns
+        -------
+        bound : float or None
+            The upper bound, or None if nothing has been observed.
+        """
+        with self._lock:
+            entry = self._values.get(self._key(labels), None)
+            if entry is None:
+                return None
+            buckets = sorted(entry[0].items())
+            total = entry[1]
+        rank = max(1, int(math.ceil(q * total)))
+        seen = 0
+        for index, count in buckets:
+            seen += count
+            if seen >= rank:
+                return self._upper_bound(index)
+        return self._upper_bound(buckets[-1][0])
+
+    def _bucket_index(self, value):
+        """
+        Returns the index of the bucket of value, or None for values <= 0.
+        """
+        if not value > 0:
+            return None
+        mantissa, exponent = math.frexp(value)
+        sub_bucket = int((mantissa - 0.5) * 2 * self.sub_buckets)
+        return exponent * self.sub_buckets + sub_bucket
+
+    def _upper_bound(self, index):
+        """
+        Returns the upper bound of the bucket with index.
+        """
+        if index is None:
+            return 0.
+        exponent, sub_bucket = divmod(index, self.sub_buckets)
+        return math.ldexp(0.5 + (sub_bucket + 1) / (2. * self.sub_buckets),
+                          exponent)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (dict(entry[0]), entry[1], entry[2]))
+                            for key, entry in self._values.items())
+        lines = []
+        for key, (buckets, count, total) in values:
+            cumulative = 0
+            # None (the bucket of values <= 0) sorts first in python 2.
+            for index in sorted(buckets):
+                cumulative += buckets[index]
+                lines.append("%s_bucket%s %s" %(
+                    self.name,
+                    self._format_labels(key, ("le", _format_value(
+                        self._upper_bound(index)))),
+                    cumulative))
+            lines.append("%s_bucket%s %s" %(
+                self.name, self._format_labels(key, ("le", "+Inf")), count))
+            lines.append("%s_sum%s %s" %(self.name, self._format_labels(key),
+                                         _format_value(total)))
+            lines.append("%s_count%s %s" %(self.name,
+                                           self._format_labels(key), count))
+        return lines
+
+
+class _Timer(object):
+    """
+    Observes the duration of a with block in a histogram.
+    """
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.time() - self._start, **self._labels)
+        return False
+
+
+class _NullTimer(object):
+    """
+    A timer doing nothing, used while the registry is disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _escape(value, quotes=True):
+    """
+    Escapes a label value or help text for the exposition format.
+    """
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    if quotes:
+        value = value.replace('"', '\\"')
+    return value
+
+
+def _format_value(value):
+    """
+    Formats a sample value for the exposition format.
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if isinstance(value, (int, long)):
+        return str(value)
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, label_names=()):
+    """
+    Returns the Counter called name of REGISTRY.
+    """
+    return REGISTRY.counter(name, documentation, label_names)
+
+
+def gauge(name, documentation, label_names=()):
+    """
+    Returns the Gauge called name of REGISTRY.
+    """
+    return REGISTRY.gauge(name, documentation, label_names)
+
+
+def histogram(name, documentation, label_names=(), sub_buckets=16):
+    """
+    Returns the Histogram called name of REGISTRY.
+    """
+    return REGISTRY.histogram(name, documentation, label_names, sub_buckets)
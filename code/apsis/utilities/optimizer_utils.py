@@ -2,13 +2,23 @@ __author__ = 'Frederik Diehl'
 
 from apsis.optimizers.random_search import RandomSearch
 from apsis.optimizers.optimizer import Optimizer, QueueBasedOptimizer
-from apsis.optimizers.bayesian_optimization import BayesianOptimizer
-import numpy as np
+from apsis.utilities.import_utils import LazyRegistry
 
-AVAILABLE_OPTIMIZERS = {"RandomSearch": RandomSearch,
-                        "BayOpt": BayesianOptimizer}
+# Optimizers other than RandomSearch are only imported once used, since they
+# pull in GPy or scipy, which slows down starting the server considerably.
+AVAILABLE_OPTIMIZERS = LazyRegistry({
+    "RandomSearch": RandomSearch,
+    "QuasiRandom": "apsis.optimizers.quasi_random:QuasiRandom",
+    "BayOpt": "apsis.optimizers.bayesian_optimization:BayesianOptimizer",
+    "TPE": "apsis.optimizers.tpe:TPEOptimizer",
+    "RandomForest":
+        "apsis.optimizers.random_forest_optimization:RandomForestOptimizer",
+    "ASHA": "apsis.optimizers.successive_halving:AsyncSuccessiveHalving",
+    "Hyperband": "apsis.optimizers.successive_halving:AsyncHyperband"
+})
 
-def check_optimizer(optimizer, experiment, optimizer_arguments=None):
+def check_optimizer(optimizer, experiment, optimizer_arguments=None,
+                    checkpoint=None):
     """
     Checks whether optimizer is an optimizer or builds one.
 
@@ -16,7 +26,8 @@ def check_optimizer(optimizer, experiment, optimizer_arguments=None):
     it is, it is returned unchanged, all other parameters are ignored. If
     it is a class of optimizer, it will initialize it with experiment and
     optimizer_arguments. If it is a basestring, it will be translated via
-    optimizer_utils.AVAILABLE_OPTIMIZERS, then initialized.
+    optimizer_utils.AVAILABLE_OPTIMIZERS, which imports the optimizer on
+    first use, then initialized.
 
     Parameters
     ----------
@@ -31,6 +42,9 @@ def check_optimizer(optimizer, experiment, optimizer_arguments=None):
         This class introduces an additional parameter, called multiprocessing.
         If "queue", the default, it will initialize the optimizer abstracted by
         a QueueBasedOptimizer. If "none", it will initialize it directly.
+    checkpoint : dict, optional
+        A checkpoint of the optimizer as returned by its get_checkpoint. If
+        given, it is restored after initializing the optimizer.
 
     Returns
     -------
@@ -52,21 +66,24 @@ def check_optimizer(optimizer, experiment, optimizer_arguments=None):
         return optimizer
 
     if isinstance(optimizer, basestring):
-        try:
-            optimizer = AVAILABLE_OPTIMIZERS[optimizer]
-        except:
+        if optimizer not in AVAILABLE_OPTIMIZERS:
             raise ValueError("No corresponding optimizer found for %s. "
                              "Optimizer must be in %s" %(
                 str(optimizer), AVAILABLE_OPTIMIZERS.keys()))
+        optimizer = AVAILABLE_OPTIMIZERS[optimizer]
 
     if not issubclass(optimizer, Optimizer):
         raise ValueError("%s is of type %s, not Optimizer type."
                          %(optimizer, type(optimizer)))
 
     if multi_architecture == "queue":
-        return QueueBasedOptimizer(optimizer, experiment, optimizer_arguments)
+        return QueueBasedOptimizer(optimizer, experiment, optimizer_arguments,
+                                   checkpoint)
     elif multi_architecture == "none":
-        return optimizer(experiment, optimizer_arguments)
+        optimizer = optimizer(experiment, optimizer_arguments)
+        if checkpoint is not None:
+            optimizer.restore_checkpoint(checkpoint)
+        return optimizer
     else:
         raise ValueError("%s is not supported as a multi-architecture "
                          "parameter. Currently supported are %s" %(
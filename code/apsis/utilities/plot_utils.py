@@ -3,7 +3,10 @@ import matplotlib.pyplot as plt
 plt.ioff()
 import random
 import os
+import io
 from matplotlib.colors import colorConverter
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 
 def plot_lists(to_plot_list, fig_options=None, ax=None, plot_min=None,
@@ -309,13 +312,68 @@ def create_figure(fig_options=None):
     fig : plt.figure
         A new figure with the options as specified in fig_options.
     """
+    fig, ax = plt.subplots()
+    _label_ax(ax, fig_options)
+    return fig, ax
+
+
+def render_plot_png(to_plot_list, fig_options=None, plot_min=None,
+                    plot_max=None):
+    """
+    Plots several functions and renders them to a png image.
+
+    In contrast to plot_lists, the figure is created without pyplot. It is
+    therefore never registered with pyplot's figure manager, does not need
+    to be closed and is freed as soon as this function returns. This also
+    makes it safe to use from worker threads or processes.
+
+    Parameters
+    ----------
+    to_plot_list : list of dicts
+        Defines the functions to plot. See plot_lists.
+    fig_options : dict, optional
+        Options used when creating the plot. See plot_lists and
+        create_figure.
+    plot_min : float, optional
+        Plot from this value.
+    plot_max : float, optional
+        Plot up to this value.
+
+    Returns
+    -------
+    png : string
+        The rendered png image.
+    """
+    if fig_options is None:
+        fig_options = {}
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    _label_ax(ax, fig_options)
+    plot_lists(to_plot_list, fig_options=fig_options, ax=ax,
+               plot_min=plot_min, plot_max=plot_max)
+    fig.autofmt_xdate()
+    png_output = io.BytesIO()
+    canvas.print_png(png_output)
+    return png_output.getvalue()
+
+
+def _label_ax(ax, fig_options=None):
+    """
+    Sets the labels and title of ax.
+
+    Parameters
+    ----------
+    ax : matplotlib.Axes
+        The ax to label.
+    fig_options : dict, optional
+        Options used when creating a new plot. See create_figure.
+    """
     if fig_options is None:
         fig_options = {}
-    fig, ax = plt.subplots()
     ax.set_xlabel(fig_options.get("x_label", ""))
     ax.set_ylabel(fig_options.get("y_label", ""))
     ax.set_title(fig_options.get("title", ""))
-    return fig, ax
 
 
 def _polish_figure(ax, fig_options=None):
@@ -0,0 +1,424 @@
+"""
+Opt-in profiling of the expensive calls of an experiment.
+
+A Profiler runs the calls it is given under a profiler, and keeps the
+profiles of the slowest ones. Profilers are attached to an experiment
+assistant via install_hooks, which wraps every method registered in
+HOOK_POINTS: by default the optimizer's update and get_next_candidates, the
+acquisition function's compute_proposals and the assistant's
+_write_state_to_file. Further methods can be added with register_hook_point.
+
+Profiles are written to a directory, usually write_dir/profiles of the
+experiment. CProfiler writes pstats files (readable with pstats or
+snakeviz), SamplingProfiler writes stacks in the collapsed format used by
+flame graph tools.
+"""
+__author__ = 'Frederik Diehl'
+
+from abc import ABCMeta, abstractmethod
+import cProfile
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from apsis.utilities.logging_utils import get_logger
+from apsis.utilities.file_utils import ensure_directory_exists
+
+
+class Profiler(object):
+    """
+    Profiles calls and keeps the profiles of the slowest of them.
+
+    Calls started while another call is profiled in the same thread, for
+    example compute_proposals within get_next_candidates, are only timed.
+    They are kept like any other call, but without a profile of their own;
+    their time is part of the enclosing profile.
+
+    Supported parameters are
+        "slowest" : int, optional
+            The number of slowest calls whose profiles are kept. Default is
+            5.
+        "min_duration" : float, optional
+            Calls faster than this many seconds are not kept. Default is 0.
+
+    Attributes
+    ----------
+    params : dict
+        The parameters of the profiler.
+    directory : string or None
+        The directory profiles are written to. If None, they are only kept
+        in memory.
+    """
+    __metaclass__ = ABCMeta
+
+    params = None
+    directory = None
+    file_extension = None
+
+    _slowest = None
+    _num_calls = None
+    _lock = None
+    _local = None
+    _logger = None
+
+    def __init__(self, params=None, directory=None):
+        """
+        Initializes the profiler.
+
+        Parameters
+        ----------
+        params : dict, optional
+            The parameters of the profiler.
+        directory : string, optional
+            The directory profiles are written to.
+        """
+        self._logger = get_logger(self)
+        if params is None:
+            params = {}
+        self.params = params
+        self.directory = directory
+        # A min-heap of (duration, call number, hook, start time, filename,
+        # profile), so the fastest kept call is evicted first.
+        self._slowest = []
+        self._num_calls = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def call(self, hook, func, *args, **kwargs):
+        """
+        Calls func with args and kwargs and profiles it.
+
+        Parameters
+        ----------
+        hook : string
+            The name of the profiled call site.
+        func : callable
+            The function to call.
+
+        Returns
+        -------
+        result
+            The result of func.
+        """
+        if getattr(self._local, "active", False):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(hook, start, time.time() - start, None)
+        self._local.active = True
+        start = time.time()
+        handle = self._start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile = self._stop(handle)
+            self._local.active = False
+            self._record(hook, start, time.time() - start, profile)
+
+    def slowest_calls(self):
+        """
+        Returns the kept calls, slowest first.
+
+        Returns
+        -------
+        calls : list of dicts
+            For each call, a dict with the keys hook, start_time, duration,
+            profiled (False for calls nested in a profiled call, which were
+            only timed) and file (the profile's file name, or None if not
+            written).
+        """
+        with self._lock:
+            kept = sorted(self._slowest, reverse=True)
+        return [{"hook": hook, "start_time": start, "duration": duration,
+                 "profiled": profile is not None, "file": filename}
+                for duration, number, hook, start, filename, profile in kept]
+
+    def _record(self, hook, start, duration, profile):
+        """
+        Keeps the profile of a call if it is among the slowest.
+
+        profile is None for calls which were only timed.
+        """
+        if duration < self.params.get("min_duration", 0):
+            return
+        with self._lock:
+            self._num_calls += 1
+            entry = [duration, self._num_calls, hook, start, None, profile]
+            if len(self._slowest) < self.params.get("slowest", 5):
+                heapq.heappush(self._slowest, entry)
+                evicted = None
+            elif duration > self._slowest[0][0]:
+                evicted = heapq.heapreplace(self._slowest, entry)
+            else:
+                return
+            if self.directory is not None and profile is not None:
+                entry[4] = self._write(entry)
+                if evicted is not None and evicted[4] is not None:
+                    self._remove(evicted[4])
+        self._logger.debug("Kept profile of %s, which took %ss.", hook,
+                           duration)
+
+    def _write(self, entry):
+        """
+        Writes the profile of entry to directory and returns the file name.
+        """
+        duration, number, hook, start, filename, profile = entry
+        ensure_directory_exists(self.directory)
+        filename = "%s_%i_%ims.%s" %(re.sub(r"[^\w.-]", "_", hook),
+                                     int(start * 1000), int(duration * 1000),
+                                     self.file_extension)
+        try:
+            self._write_profile(profile, os.path.join(self.directory,
+                                                      filename))
+        except (IOError, OSError) as e:
+            self._logger.warning("Could not write profile %s: %s", filename,
+                                 e)
+            return None
+        return filename
+
+    def _remove(self, filename):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except OSError:
+            pass
+
+    @abstractmethod
+    def _start(self):
+        """
+        Starts profiling the current thread and returns a handle.
+        """
+        pass
+
+    @abstractmethod
+    def _stop(self, handle):
+        """
+        Stops profiling and returns the profile.
+        """
+        pass
+
+    @abstractmethod
+    def _write_profile(self, profile, path):
+        """
+        Writes a profile returned by _stop to path.
+        """
+        pass
+
+
+class CProfiler(Profiler):
+    """
+    Profiles calls deterministically with cProfile.
+
+    This records every function call, which makes the profiled calls
+    noticeably slower. Profiles are written as pstats files.
+    """
+    file_extension = "prof"
+
+    def _start(self):
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _stop(self, handle):
+        handle.disable()
+        return handle
+
+    def _write_profile(self, profile, path):
+        profile.dump_stats(path)
+
+
+class SamplingProfiler(Profiler):
+    """
+    Profiles calls by regularly sampling the stack of the calling thread.
+
+    This barely slows down the profiled calls, but misses functions faster
+    than the sampling interval. Profiles are written in the collapsed stack
+    format, one "frame;frame;frame count" line per distinct stack.
+
+    Supported parameters, in addition to those of Profiler:
+        "interval" : float, optional
+            The time between two samples in seconds. Default is 0.005.
+    """
+    file_extension = "txt"
+
+    def _start(self):
+        stacks = {}
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.current_thread().ident, stacks, stop))
+        sampler.daemon = True
+        sampler.start()
+        return sampler, stacks, stop
+
+    def _stop(self, handle):
+        sampler, stacks, stop = handle
+        stop.set()
+        sampler.join()
+        return stacks
+
+    def _sample(self, thread_id, stacks, stop):
+        """
+        Counts the stacks of thread thread_id until stop is set.
+        """
+        interval = self.params.get("interval", 0.005)
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%i)" %(code.co_name,
+                                            os.path.basename(
+                                                code.co_filename),
+                                            code.co_firstlineno))
+                frame = frame.f_back
+            stack = ";".join(reversed(stack))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+    def _write_profile(self, profile, path):
+        with open(path, "w") as outfile:
+            for stack, count in sorted(profile.items()):
+                outfile.write("%s %i\n" %(stack, count))
+
+
+AVAILABLE_PROFILERS = {
+    "cprofile": CProfiler,
+    "sampling": SamplingProfiler
+}
+
+
+def check_profiler(profiler, profiler_params=None, directory=None):
+    """
+    Checks whether profiler is a Profiler or builds one.
+
+    Parameters
+    ----------
+    profiler : string, Profiler instance or class, or None
+        The profiler. If an instance or None, it is returned unchanged. If a
+        string, it is translated via AVAILABLE_PROFILERS.
+    profiler_params : dict, optional
+        The parameters of the profiler, if it has to be initialized.
+    directory : string, optional
+        The directory of the profiler, if it has to be initialized.
+
+    Returns
+    -------
+    profiler : Profiler instance or None
+        The initialized profiler.
+
+    Raises
+    ------
+    ValueError
+        If profiler is a string not in AVAILABLE_PROFILERS, or not a
+        Profiler.
+    """
+    if profiler is None or isinstance(profiler, Profiler):
+        return profiler
+    if isinstance(profiler, basestring):
+        if profiler not in AVAILABLE_PROFILERS:
+            raise ValueError("No profiler found for %s. Profiler must be in "
+                             "%s" %(profiler, AVAILABLE_PROFILERS.keys()))
+        profiler = AVAILABLE_PROFILERS[profiler]
+    if not (isinstance(profiler, type) and issubclass(profiler, Profiler)):
+        raise ValueError("%s is not a Profiler." %profiler)
+    return profiler(profiler_params, directory)
+
+
+def _get_assistant(experiment_assistant):
+    return experiment_assistant
+
+
+def _get_optimizer(experiment_assistant):
+    """
+    Returns the optimizer doing the work for an experiment assistant.
+
+    For a QueueBasedOptimizer, this is the optimizer in its backend.
+    """
+    optimizer = experiment_assistant._optimizer
+    return getattr(optimizer, "backend_optimizer", optimizer)
+
+
+def _get_acquisition_function(experiment_assistant):
+    return getattr(_get_optimizer(experiment_assistant),
+                   "acquisition_function", None)
+
+
+# The methods wrapped by install_hooks, as (hook name, method name, getter)
+# tuples. The getter returns the object owning the method from an
+# experiment assistant, or None if there is none.
+HOOK_POINTS = [
+    ("optimizer.update", "update", _get_optimizer),
+    ("optimizer.get_next_candidates", "get_next_candidates",
+     _get_optimizer),
+    ("acquisition.compute_proposals", "compute_proposals",
+     _get_acquisition_function),
+    ("experiment_assistant.write_state", "_write_state_to_file",
+     _get_assistant),
+]
+
+
+def register_hook_point(hook, method_name, getter):
+    """
+    Registers another method to be profiled by install_hooks.
+
+    Parameters
+    ----------
+    hook : string
+        The name of the hook, used in the names of the profiles.
+    method_name : string
+        The name of the method to wrap.
+    getter : callable
+        Called with the experiment assistant, has to return the object whose
+        method is wrapped, or None.
+    """
+    HOOK_POINTS.append((hook, method_name, getter))
+
+
+def install_hooks(experiment_assistant, profiler):
+    """
+    Wraps the methods of all HOOK_POINTS to be profiled by profiler.
+
+    The methods are only wrapped on the instances, by setting an instance
+    attribute shadowing the method. They are restored by remove_hooks.
+
+    Parameters
+    ----------
+    experiment_assistant : ExperimentAssistant
+        The experiment assistant whose methods are wrapped.
+    profiler : Profiler
+        The profiler to use.
+
+    Returns
+    -------
+    installed : list of tuples
+        The (object, method name) tuples of the wrapped methods, to be
+        passed to remove_hooks.
+    """
+    installed = []
+    for hook, method_name, getter in HOOK_POINTS:
+        target = getter(experiment_assistant)
+        if target is None or not hasattr(target, method_name):
+            continue
+        method = getattr(target, method_name)
+        setattr(target, method_name, _wrap(profiler, hook, method))
+        installed.append((target, method_name))
+    return installed
+
+
+def remove_hooks(installed):
+    """
+    Restores the methods wrapped by install_hooks.
+    """
+    for target, method_name in installed:
+        if method_name in vars(target):
+            delattr(target, method_name)
+
+
+def _wrap(profiler, hook, method):
+    def profiled(*args, **kwargs):
+        return profiler.call(hook, method, *args, **kwargs)
+    profiled.__name__ = method.__name__
+    profiled.__doc__ = method.__doc__
+    return profiled
@@ -22,3 +22,42 @@ def check_random_state(seed):
         return seed
     raise ValueError('%r cannot be used to seed a numpy.random.RandomState'
                      ' instance' % seed)
+
+
+def dump_random_state(random_state):
+    """
+    Returns the state of random_state in a json-serializable form.
+
+    Parameters
+    ----------
+    random_state : np.random.RandomState
+        The random state to dump.
+
+    Returns
+    -------
+    state : list or None
+        The state, as accepted by load_random_state. None for the RandomState
+        singleton used by np.random, which is shared by all optimizers and
+        reseeded by check_random_state anyway.
+    """
+    if (not isinstance(random_state, np.random.RandomState) or
+            random_state is np.random.mtrand._rand):
+        return None
+    name, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+    return [name, keys.tolist(), pos, has_gauss, cached_gaussian]
+
+
+def load_random_state(random_state, state):
+    """
+    Sets random_state to a state returned by dump_random_state.
+
+    Parameters
+    ----------
+    random_state : np.random.RandomState
+        The random state to set.
+    state : list
+        The state, as returned by dump_random_state.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = state
+    random_state.set_state((str(name), np.array(keys, dtype=np.uint32), pos,
+                            has_gauss, cached_gaussian))
@@ -0,0 +1,588 @@
+"""
+Space-filling designs in the [0, 1] hypercube.
+
+These are low-discrepancy sequences (Sobol, Halton) and Latin hypercube
+designs. Compared to i.i.d. uniform draws, they cover the hypercube more
+evenly, so fewer points are necessary to explore it.
+
+All designs are classes with a draw(n) function, which can be called
+repeatedly and continues the design. warp_design translates design points
+to the warped layout of parameter definitions, in which nominal parameters
+are one-hot encoded.
+"""
+__author__ = 'Frederik Diehl'
+
+from abc import ABCMeta, abstractmethod
+import numpy as np
+from scipy.spatial.distance import pdist
+from apsis.models.parameter_definition import NominalParamDef
+from apsis.utilities.randomization import check_random_state
+
+# The number of bits of the Sobol sequence; at most 2**_SOBOL_BITS points
+# can be drawn.
+_SOBOL_BITS = 30
+
+# Initial direction numbers for the dimensions 2 to 21 from Joe and Kuo,
+# "Constructing Sobol sequences with better two-dimensional projections",
+# 2008. Later dimensions use random (but fixed) valid direction numbers.
+_JOE_KUO_M = [
+    [1], [1, 3], [1, 3, 1], [1, 1, 1], [1, 1, 3, 3], [1, 3, 5, 13],
+    [1, 1, 5, 5, 17], [1, 1, 5, 5, 5], [1, 1, 7, 11, 19], [1, 1, 5, 1, 1],
+    [1, 1, 1, 3, 11], [1, 3, 5, 5, 31], [1, 3, 3, 9, 7, 49],
+    [1, 1, 1, 15, 21, 21], [1, 3, 1, 13, 27, 49], [1, 1, 1, 15, 7, 5],
+    [1, 3, 1, 15, 13, 25], [1, 1, 5, 5, 19, 61], [1, 3, 7, 11, 23, 15, 103],
+    [1, 3, 7, 13, 13, 15, 69]]
+
+_sobol_directions = []
+_primitive_polynomials = []
+
+
+class SpaceFillingDesign(object):
+    """
+    The base class of all space-filling designs.
+
+    Attributes
+    ----------
+    dims : int
+        The dimensionality of the design.
+    random_state : numpy RandomState
+        The random state used for scrambling.
+    """
+    __metaclass__ = ABCMeta
+
+    dims = None
+    random_state = None
+
+    def __init__(self, dims, random_state=None):
+        """
+        Initializes the design.
+
+        Parameters
+        ----------
+        dims : int
+            The dimensionality of the design.
+        random_state : numpy RandomState, int or None, optional
+            The random state. See randomization.check_random_state.
+
+        Raises
+        ------
+        ValueError :
+            Iff dims is smaller than 1.
+        """
+        if dims < 1:
+            raise ValueError("A design needs at least one dimension, has %s."
+                             %dims)
+        self.dims = dims
+        self.random_state = check_random_state(random_state)
+
+    @abstractmethod
+    def draw(self, n):
+        """
+        Returns the next n points of the design.
+
+        Parameters
+        ----------
+        n : int
+            The number of points.
+
+        Returns
+        -------
+        points : ndarray
+            The points, in shape (n, dims) and in [0, 1).
+        """
+        pass
+
+    def skip(self, n):
+        """
+        Skips the next n points of the design.
+        """
+        self.draw(n)
+
+
+class SobolDesign(SpaceFillingDesign):
+    """
+    A Sobol sequence, optionally scrambled.
+
+    Scrambling applies a random linear matrix scramble and a random digital
+    shift (Matousek, 1998), which keeps the sequence's net properties. The
+    first 2**k points therefore always place exactly one point into each
+    interval [i/2**k, (i+1)/2**k) of every dimension.
+    """
+    _directions = None
+    _shift = None
+    _index = None
+
+    def __init__(self, dims, random_state=None, scramble=True):
+        """
+        Initializes the Sobol sequence.
+
+        Parameters
+        ----------
+        dims : int
+            The dimensionality of the design.
+        random_state : numpy RandomState, int or None, optional
+            The random state used for scrambling.
+        scramble : bool, optional
+            Whether to scramble the sequence. Default is True.
+        """
+        super(SobolDesign, self).__init__(dims, random_state)
+        self._directions = _get_sobol_directions(dims)
+        self._shift = np.zeros(dims, dtype=np.int64)
+        if scramble:
+            self._directions = self._scramble_directions(self._directions)
+            self._shift = self.random_state.randint(
+                0, 2**_SOBOL_BITS, size=dims).astype(np.int64)
+        self._index = 0
+
+    def _scramble_directions(self, directions):
+        """
+        Multiplies the directions with a random lower-triangular binary
+        matrix (with ones on the diagonal) per dimension.
+        """
+        bit_values = 2**np.arange(_SOBOL_BITS - 1, -1, -1, dtype=np.int64)
+        scrambled = np.empty_like(directions)
+        for d in range(self.dims):
+            lower = np.tril(self.random_state.randint(
+                0, 2, size=(_SOBOL_BITS, _SOBOL_BITS)), -1)
+            lower += np.eye(_SOBOL_BITS, dtype=lower.dtype)
+            bits = (directions[d][:, None] // bit_values[None, :]) % 2
+            scrambled[d] = (bits.dot(lower.T) % 2).dot(bit_values)
+        return scrambled
+
+    def draw(self, n):
+        indices = np.arange(self._index, self._index + n, dtype=np.int64)
+        if n > 0 and indices[-1] >= 2**_SOBOL_BITS:
+            raise ValueError("Cannot draw more than 2**%i points from a "
+                             "Sobol sequence." %_SOBOL_BITS)
+        self._index += n
+        points = np.zeros((n, self.dims), dtype=np.int64)
+        for k in range(_SOBOL_BITS):
+            if n == 0 or (indices[-1] >> k) == 0:
+                break
+            has_bit = ((indices >> k) & 1).astype(bool)
+            points[has_bit] ^= self._directions[:, k]
+        points ^= self._shift
+        return points / float(2**_SOBOL_BITS)
+
+    def skip(self, n):
+        self._index += n
+
+
+class HaltonDesign(SpaceFillingDesign):
+    """
+    A Halton sequence, optionally scrambled.
+
+    The ith dimension is the radical inverse in the base of the ith prime.
+    Scrambling permutes the non-zero digits with a random permutation per
+    dimension and digit position (Braaten and Weller, 1979), which removes
+    the strong correlations between higher dimensions.
+    """
+    _bases = None
+    _permutations = None
+    _index = None
+    _scramble = None
+
+    def __init__(self, dims, random_state=None, scramble=True):
+        """
+        Initializes the Halton sequence.
+
+        Parameters
+        ----------
+        dims : int
+            The dimensionality of the design.
+        random_state : numpy RandomState, int or None, optional
+            The random state used for scrambling.
+        scramble : bool, optional
+            Whether to scramble the sequence. Default is True.
+        """
+        super(HaltonDesign, self).__init__(dims, random_state)
+        self._bases = _first_primes(dims)
+        self._permutations = [[] for d in range(dims)]
+        self._scramble = scramble
+        # The first point of the unscrambled sequence is 0 in all dimensions.
+        self._index = 1
+
+    def _get_permutation(self, d, level):
+        """
+        Returns the digit permutation of dimension d at digit position level.
+        """
+        while len(self._permutations[d]) <= level:
+            base = self._bases[d]
+            if self._scramble:
+                perm = np.concatenate(
+                    [[0], 1 + self.random_state.permutation(base - 1)])
+            else:
+                perm = np.arange(base)
+            self._permutations[d].append(perm)
+        return self._permutations[d][level]
+
+    def draw(self, n):
+        indices = np.arange(self._index, self._index + n, dtype=np.int64)
+        self._index += n
+        points = np.zeros((n, self.dims))
+        for d, base in enumerate(self._bases):
+            remaining = indices.copy()
+            factor = 1. / base
+            level = 0
+            while np.any(remaining > 0):
+                perm = self._get_permutation(d, level)
+                points[:, d] += perm[remaining % base] * factor
+                remaining //= base
+                factor /= base
+                level += 1
+        return points
+
+    def skip(self, n):
+        self._index += n
+
+
+class LatinHypercubeDesign(SpaceFillingDesign):
+    """
+    Latin hypercube designs optimized for the maximin criterion.
+
+    Each design of size points places exactly one point into each of the
+    size intervals of every dimension. Among those, a design whose minimum
+    distance between two points is large is searched by exchanging the
+    coordinates of two points in one dimension, keeping the exchange if the
+    minimum distance does not decrease.
+
+    Since Latin hypercubes are not extensible, draw takes the points from
+    designs of size points, generating a new one when the last is exhausted.
+    """
+    size = None
+    iterations = None
+
+    _block = None
+
+    def __init__(self, dims, random_state=None, size=None, iterations=100):
+        """
+        Initializes the Latin hypercube designs.
+
+        Parameters
+        ----------
+        dims : int
+            The dimensionality of the design.
+        random_state : numpy RandomState, int or None, optional
+            The random state.
+        size : int or None, optional
+            The number of points per Latin hypercube. If None, each call to
+            draw uses a new design of exactly the requested size.
+        iterations : int, optional
+            The number of coordinate exchanges tried for the maximin
+            optimization. Default is 100.
+        """
+        super(LatinHypercubeDesign, self).__init__(dims, random_state)
+        self.size = size
+        self.iterations = iterations
+        self._block = np.zeros((0, dims))
+
+    def draw(self, n):
+        points = [self._block[:n]]
+        missing = n - len(points[0])
+        self._block = self._block[n:]
+        while missing > 0:
+            block = latin_hypercube(max(self.size or missing, 1), self.dims,
+                                    self.random_state, self.iterations)
+            points.append(block[:missing])
+            self._block = block[missing:]
+            missing -= len(points[-1])
+        return np.concatenate(points)
+
+
+AVAILABLE_DESIGNS = {
+    "sobol": SobolDesign,
+    "halton": HaltonDesign,
+    "lhs": LatinHypercubeDesign
+}
+
+
+def check_design(design, dims, random_state=None, design_params=None):
+    """
+    Checks whether design is a SpaceFillingDesign or builds one.
+
+    Parameters
+    ----------
+    design : string or SpaceFillingDesign
+        The design. If a string, it has to be a key of AVAILABLE_DESIGNS.
+    dims : int
+        The dimensionality of the design.
+    random_state : numpy RandomState, int or None, optional
+        The random state of the design.
+    design_params : dict, optional
+        Further keyword arguments of the design class.
+
+    Returns
+    -------
+    design : SpaceFillingDesign
+        The design instance.
+
+    Raises
+    ------
+    ValueError :
+        Iff design is neither a SpaceFillingDesign nor in AVAILABLE_DESIGNS.
+    """
+    if isinstance(design, SpaceFillingDesign):
+        return design
+    if design not in AVAILABLE_DESIGNS:
+        raise ValueError("No corresponding design found for %s. Design must "
+                         "be in %s" %(design, AVAILABLE_DESIGNS.keys()))
+    return AVAILABLE_DESIGNS[design](dims, random_state=random_state,
+                                     **(design_params or {}))
+
+
+def latin_hypercube(n, dims, random_state=None, iterations=100):
+    """
+    Returns a maximin-optimized Latin hypercube design.
+
+    See LatinHypercubeDesign.
+
+    Parameters
+    ----------
+    n : int
+        The number of points.
+    dims : int
+        The dimensionality.
+    random_state : numpy RandomState, int or None, optional
+        The random state.
+    iterations : int, optional
+        The number of coordinate exchanges to try.
+
+    Returns
+    -------
+    points : ndarray
+        The points, in shape (n, dims).
+    """
+    random_state = check_random_state(random_state)
+    points = np.empty((n, dims))
+    for d in range(dims):
+        points[:, d] = ((random_state.permutation(n) +
+                         random_state.uniform(0, 1, n)) / n)
+    if n < 3:
+        return points
+    best_distance = np.min(pdist(points))
+    for i in range(iterations):
+        d = random_state.randint(dims)
+        a, b = random_state.choice(n, 2, replace=False)
+        points[[a, b], d] = points[[b, a], d]
+        distance = np.min(pdist(points))
+        if distance >= best_distance:
+            best_distance = distance
+        else:
+            points[[a, b], d] = points[[b, a], d]
+    return points
+
+
+def design_dimensions(param_defs):
+    """
+    Returns the number of design dimensions for param_defs.
+
+    Nominal parameters take a single design dimension, which is mapped to
+    one of their values, while all other parameters take one design
+    dimension per warped dimension.
+
+    Parameters
+    ----------
+    param_defs : dict of ParamDefs
+        The parameter definitions.
+
+    Returns
+    -------
+    dims : int
+        The number of design dimensions.
+    """
+    dims = 0
+    for param_def in param_defs.values():
+        if isinstance(param_def, NominalParamDef):
+            dims += 1
+        else:
+            dims += param_def.warped_size()
+    return dims
+
+
+def warp_design(points, param_defs, param_names=None):
+    """
+    Translates design points to warped parameter values.
+
+    The design dimensions are assigned to the parameters in the order of
+    param_names. Parameters with a warped size of one take the design
+    coordinate as their warped value. Nominal parameters with several values
+    are one-hot encoded, with the value chosen by which of the equally
+    sized intervals of [0, 1] the design coordinate falls into. This keeps
+    the design's stratification over the values.
+
+    Parameters
+    ----------
+    points : ndarray
+        The design points, in shape (n, design_dimensions(param_defs)).
+    param_defs : dict of ParamDefs
+        The parameter definitions.
+    param_names : list of strings, optional
+        The order of the parameters. Default is sorted by name.
+
+    Returns
+    -------
+    warped : dict of ndarrays
+        For each parameter name the warped values, in shape
+        (n, warped_size).
+
+    Raises
+    ------
+    ValueError :
+        Iff points has the wrong number of dimensions.
+    """
+    points = np.atleast_2d(points)
+    if param_names is None:
+        param_names = sorted(param_defs.keys())
+    if points.shape[1] != design_dimensions(param_defs):
+        raise ValueError("Design has %s dimensions, but the parameters need "
+                         "%s." %(points.shape[1],
+                                 design_dimensions(param_defs)))
+    warped = {}
+    column = 0
+    for name in param_names:
+        param_def = param_defs[name]
+        size = param_def.warped_size()
+        if isinstance(param_def, NominalParamDef) and size > 1:
+            chosen = np.minimum((points[:, column] * size).astype(int),
+                                size - 1)
+            one_hot = np.zeros((len(points), size))
+            one_hot[np.arange(len(points)), chosen] = 1
+            warped[name] = one_hot
+            column += 1
+        elif isinstance(param_def, NominalParamDef):
+            warped[name] = points[:, column:column+1]
+            column += 1
+        else:
+            warped[name] = points[:, column:column+size]
+            column += size
+    return warped
+
+
+def _first_primes(n):
+    """
+    Returns the first n primes.
+    """
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def _poly_mult_mod(a, b, mod, degree):
+    """
+    Multiplies the polynomials a and b over GF(2) modulo mod, all encoded as
+    integers.
+    """
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        b >>= 1
+        a <<= 1
+        if a >> degree & 1:
+            a ^= mod
+    return result
+
+
+def _is_primitive(poly, degree):
+    """
+    Tests whether poly (with the leading coefficient at bit degree) is a
+    primitive polynomial over GF(2), that is whether x has the order
+    2**degree - 1 modulo poly.
+    """
+    order = 2**degree - 1
+
+    def power_of_x(exponent):
+        result = 1
+        base = 2
+        if degree == 1:
+            base ^= poly
+        while exponent:
+            if exponent & 1:
+                result = _poly_mult_mod(result, base, poly, degree)
+            base = _poly_mult_mod(base, base, poly, degree)
+            exponent >>= 1
+        return result
+
+    if power_of_x(order) != 1:
+        return False
+    return all(power_of_x(order // q) != 1 for q in _prime_factors(order))
+
+
+def _prime_factors(n):
+    """
+    Returns the distinct prime factors of n.
+    """
+    factors = []
+    p = 2
+    while p * p <= n:
+        if n % p == 0:
+            factors.append(p)
+            while n % p == 0:
+                n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+def _get_primitive_polynomials(n):
+    """
+    Returns the first n primitive polynomials, ordered by degree and then
+    by their coefficients (the order used by Joe and Kuo).
+
+    Returns
+    -------
+    polynomials : list of tuples
+        Each tuple contains the degree s and the integer a encoding the
+        inner coefficients a_1 ... a_{s-1}, a_1 being the most significant.
+    """
+    if len(_primitive_polynomials) < n:
+        polynomials = []
+        degree = 1
+        while len(polynomials) < n:
+            for a in range(2**(degree - 1)):
+                if _is_primitive((1 << degree) | (a << 1) | 1, degree):
+                    polynomials.append((degree, a))
+            degree += 1
+        _primitive_polynomials[:] = polynomials
+    return _primitive_polynomials[:n]
+
+
+def _get_sobol_directions(dims):
+    """
+    Returns the direction numbers of the first dims dimensions.
+
+    Returns
+    -------
+    directions : ndarray
+        The direction numbers as integers, in shape (dims, _SOBOL_BITS).
+    """
+    polynomials = _get_primitive_polynomials(dims - 1)
+    while len(_sobol_directions) < dims:
+        d = len(_sobol_directions)
+        directions = np.zeros(_SOBOL_BITS, dtype=np.int64)
+        if d == 0:
+            m = [1] * _SOBOL_BITS
+        else:
+            degree, a = polynomials[d - 1]
+            if d - 1 < len(_JOE_KUO_M):
+                m = list(_JOE_KUO_M[d - 1])
+            else:
+                # Any odd m_k < 2**k is valid.
+                rs = np.random.RandomState(d)
+                m = [2 * rs.randint(0, 2**(k - 1)) + 1 if k > 1 else 1
+                     for k in range(1, degree + 1)]
+            for k in range(degree, _SOBOL_BITS):
+                new_m = m[k - degree] ^ (m[k - degree] << degree)
+                for i in range(1, degree):
+                    if (a >> (degree - 1 - i)) & 1:
+                        new_m ^= m[k - i] << i
+                m.append(new_m)
+        for k in range(_SOBOL_BITS):
+            directions[k] = m[k] << (_SOBOL_BITS - 1 - k)
+        _sobol_directions.append(directions)
+    return np.array(_sobol_directions[:dims])
@@ -1,22 +1,29 @@
 # Fix for TclError: no display name and no $DISPLAY environment variable if
-# directly starting from start_apsis.
-import matplotlib
-
-matplotlib.use('Agg')
+# directly starting from start_apsis. matplotlib is only imported once the
+# first plot is rendered, so select the backend via the environment.
+import os
+import sys
+if "matplotlib" in sys.modules:
+    sys.modules["matplotlib"].use('Agg')
+else:
+    os.environ["MPLBACKEND"] = "Agg"
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, g
 from apsis.assistants.lab_assistant import LabAssistant
 from apsis.models.candidate import from_dict
 from functools import wraps
 from apsis.utilities.param_def_utilities import dict_to_param_defs
-import sys
 import signal
 import time
-import urllib
-import StringIO
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+import threading
+import hashlib
+import datetime
+from werkzeug.http import is_resource_modified
+from werkzeug.serving import make_server
 from apsis.utilities import file_utils
 from apsis.utilities import logging_utils
+from apsis.utilities import metrics
+from apsis.webservice.plot_cache import PlotCache
 from tornado.wsgi import WSGIContainer
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
@@ -31,9 +38,23 @@ exited = False
 http_server = None
 
 lAss = None
+plot_cache = None
 
 should_fail_deadly = False
 
+# Serialized views, keyed by (view name, path). Each entry is a tuple of
+# (etag, body, mimetype); it is only reused while the etag, which is derived
+# from the experiment versions, stays the same.
+_view_cache = {}
+_view_cache_lock = threading.Lock()
+
+_request_seconds = metrics.histogram(
+    "apsis_request_seconds", "Duration of handling a REST request.",
+    ["route", "method"])
+_requests_total = metrics.counter(
+    "apsis_requests_total", "Number of handled REST requests.",
+    ["route", "method", "status"])
+
 
 def set_exit(_signo, _stack_frame):
     """
@@ -41,9 +62,12 @@ def set_exit(_signo, _stack_frame):
     """
     _logger.warning("Shutting down apsis server, due to signal %s with "
                     "stackframe %s" % (_signo, _stack_frame))
-    IOLoop.instance().stop()
+    if isinstance(http_server, HTTPServer):
+        IOLoop.instance().stop()
+        http_server.stop()
     lAss.set_exit()
-    http_server.stop()
+    if plot_cache is not None:
+        plot_cache.close()
     global exited
     exited = True
     sys.exit()
@@ -52,13 +76,30 @@ def set_exit(_signo, _stack_frame):
 signal.signal(signal.SIGINT, set_exit)
 
 
-def start_apsis(save_path, port=5000, fail_deadly=False):
+def start_apsis(save_path, port=5000, fail_deadly=False, plot_processes=1,
+                threaded=False, shard_index=None, num_shards=None,
+                collect_metrics=True):
     """
     Starts apsis.
 
-    Initializes logger, LabAssistant and the REST app.
+    Initializes logger, PlotCache, LabAssistant and the REST app.
+
+    plot_processes is the number of worker processes rendering the plots of
+    the web interface. If 0, plots are rendered in the request itself.
+
+    If threaded is False (default), the app is served by tornado, which
+    handles one request at a time. If True, it is served by a threaded
+    werkzeug server handling each request in its own thread, so requests
+    for different experiments are handled in parallel.
+
+    shard_index and num_shards start this server as one of several shards
+    sharing the experiments and save_path. See LabAssistant and
+    apsis_client.sharding.ShardedConnection.
+
+    If collect_metrics is True (default), the metrics of
+    apsis.utilities.metrics are recorded and served on /metrics.
     """
-    global lAss, _logger
+    global lAss, _logger, plot_cache
     file_utils.ensure_directory_exists(save_path)
     _logger = logging_utils.get_logger("webservice.REST_interface",
                                        save_path=save_path)
@@ -76,13 +117,23 @@ def start_apsis(save_path, port=5000, fail_deadly=False):
     global should_fail_deadly, http_server, exited
     should_fail_deadly = fail_deadly
     exited = False
-
-    lAss = LabAssistant(write_dir=write_dir)
-
-    http_server = HTTPServer(WSGIContainer(app))
-    http_server.listen(port)
-    _logger.info("Finished initialization. Starting tornado..")
-    IOLoop.instance().start()
+    metrics.REGISTRY.enabled = collect_metrics
+
+    # The plot workers are forked, so this has to happen before the
+    # LabAssistant starts any optimizer threads.
+    plot_cache = PlotCache(processes=plot_processes)
+    lAss = LabAssistant(write_dir=write_dir, shard_index=shard_index,
+                        num_shards=num_shards)
+
+    if threaded:
+        http_server = make_server("0.0.0.0", int(port), app, threaded=True)
+        _logger.info("Finished initialization. Starting threaded server..")
+        http_server.serve_forever()
+    else:
+        http_server = HTTPServer(WSGIContainer(app))
+        http_server.listen(port)
+        _logger.info("Finished initialization. Starting tornado..")
+        IOLoop.instance().start()
 
 
 def exception_handler(func):
@@ -91,7 +142,8 @@ def exception_handler(func):
 
     Specficially, it tries to jsonify the function, with the result being
     written to the "result" field. Any failure is catched and logged.
-    If failed, "result" is set to "failed".
+    If failed, "result" is set to "failed", and g.request_failed is set so
+    that cached_view does not cache the answer.
     """
 
     @wraps(func)
@@ -113,12 +165,125 @@ def exception_handler(func):
             elif exited:
                 raise SystemExit()
 
+            g.request_failed = True
             return jsonify(result="failed")
 
     return handle_exception
 
 
+def cached_view(get_versions):
+    """
+    This wrapper memoizes a view and supports conditional GET requests.
+
+    get_versions is called with the arguments of the view and has to return a
+    list of (exp_id, version) tuples, with version as returned by
+    LabAssistant.get_experiment_version. As long as these do not change, the
+    serialized view is reused. Every response carries an ETag and a
+    Last-Modified header, and requests with a matching If-None-Match header
+    are answered with 304 Not Modified. If-Modified-Since is ignored, since
+    Last-Modified only has a granularity of one second, while the experiment
+    may change several times within a second.
+
+    If get_versions fails (for example because the experiment does not
+    exist), the view is called without caching. Failed views, which return a
+    status other than 200 or were answered by exception_handler, are neither
+    cached nor tagged.
+    """
+    def decorator(func):
+        @wraps(func)
+        def handle_cached(*args, **kwargs):
+            try:
+                versions = get_versions(*args, **kwargs)
+            except Exception as e:
+                _logger.debug("Could not get versions for %s, not caching. "
+                              "Exception is %s", func.__name__, e)
+                return func(*args, **kwargs)
+            etag = hashlib.md5(repr((func.__name__, versions,
+                                     sorted(request.args.items())))
+                               ).hexdigest()
+            last_modified = None
+            if versions:
+                last_modified = datetime.datetime.utcfromtimestamp(
+                    int(max([v[1][1] for v in versions])))
+
+            if not is_resource_modified(request.environ, etag=etag):
+                _logger.log(5, "%s not modified, returning 304.",
+                            func.__name__)
+                response = app.response_class(status=304)
+            else:
+                key = (func.__name__, request.path)
+                with _view_cache_lock:
+                    cached = _view_cache.get(key, None)
+                if cached is not None and cached[0] == etag:
+                    _logger.log(5, "Returning cached view for %s", key)
+                    response = app.response_class(cached[1],
+                                                  mimetype=cached[2])
+                else:
+                    response = app.make_response(func(*args, **kwargs))
+                    if response.status_code != 200 or \
+                            getattr(g, "request_failed", False):
+                        _logger.debug("%s failed, not caching.",
+                                      func.__name__)
+                        return response
+                    with _view_cache_lock:
+                        _view_cache[key] = (etag, response.get_data(),
+                                            response.mimetype)
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+        return handle_cached
+    return decorator
+
+
+def _experiment_versions(experiment_id):
+    """
+    Returns the version list of a single experiment for cached_view.
+    """
+    return [(experiment_id, lAss.get_experiment_version(experiment_id))]
+
+
+def _all_experiment_versions():
+    """
+    Returns the version list of all experiments for cached_view.
+    """
+    return [(exp_id, lAss.get_experiment_version(exp_id))
+            for exp_id in sorted(lAss.get_ids())]
+
+
+@app.before_request
+def _start_request_timer():
+    if metrics.REGISTRY.enabled:
+        g.request_start_time = time.time()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    start = getattr(g, "request_start_time", None)
+    if start is not None:
+        route = "unmatched"
+        if request.url_rule is not None:
+            route = request.url_rule.rule
+        _request_seconds.observe(time.time() - start, route=route,
+                                 method=request.method)
+        _requests_total.inc(route=route, method=request.method,
+                            status=response.status_code)
+    return response
+
+
+@app.route(CONTEXT_ROOT + "/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+
+    Metrics are only recorded while collection is enabled, see start_apsis.
+    """
+    return app.response_class(metrics.REGISTRY.expose(),
+                              mimetype="text/plain; version=0.0.4")
+
+
 @app.route(CONTEXT_ROOT + "/", methods=["GET"])
+@cached_view(_all_experiment_versions)
 def overview_page():
     """
     This will, later, become an overview over the experiment.
@@ -196,18 +361,23 @@ def client_get_all_experiments():
 
 
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>", methods=["GET"])
+@cached_view(_experiment_versions)
 @exception_handler
 def client_get_experiment(experiment_id):
     """
     This will, later, return more details for a single experiment.
     """
     _logger.debug("Asked for experiment with id %s", experiment_id)
-    experiment_dict = lAss.get_experiment_as_dict(experiment_id)
+    since = request.args.get("since", None, type=int)
+    limit = request.args.get("limit", None, type=int)
+    experiment_dict = lAss.get_experiment_as_dict(experiment_id, since=since,
+                                                  limit=limit)
     _logger.debug("Returned exp_dict %s", experiment_dict)
     return experiment_dict
 
 
 @app.route(CONTEXT_ROOT + "/experiments/<experiment_id>", methods=["GET"])
+@cached_view(_experiment_versions)
 def get_experiment(experiment_id):
     """
     This will, later, return more details for a single experiment.
@@ -220,12 +390,6 @@ def get_experiment(experiment_id):
     pending_candidates_string = exp_dict["candidates_pending"]
     working_candidates_string = exp_dict["candidates_working"]
     best_candidate_string = exp_dict["best_candidate"]
-    fig = lAss.get_plot_result_per_step(experiment_id)
-    fig.autofmt_xdate()
-    canvas = FigureCanvas(fig)
-    png_output = StringIO.StringIO()
-    canvas.print_png(png_output)
-    png_output = png_output.getvalue().encode("base64")
 
     _logger.debug("Rendering template")
     templ = render_template("experiment.html",
@@ -237,13 +401,41 @@ def get_experiment(experiment_id):
                            finished_candidates_string=finished_candidates_string,
                            pending_candidates_string=pending_candidates_string,
                            working_candidates_string=working_candidates_string,
-                           result_per_step=urllib.quote(png_output.rstrip('\n')),
                            best_candidate_string=best_candidate_string
                            )
     _logger.log(5, "Returning template %s", templ)
     return templ
 
 
+@app.route(CONTEXT_ROOT + "/experiments/<experiment_id>/result_per_step.png",
+           methods=["GET"])
+def get_result_per_step_plot(experiment_id):
+    """
+    Returns the plot of the results per step as png.
+
+    Plots are rendered in the background by the plot cache. While a plot for
+    the current experiment version is rendered, the last rendered plot is
+    returned. If none exists yet, 503 is returned.
+    """
+    global plot_cache
+    _logger.debug("Asked for result per step plot of %s", experiment_id)
+    if plot_cache is None:
+        plot_cache = PlotCache(processes=0)
+    version = lAss.get_experiment_version(experiment_id)
+    png, plot_version = plot_cache.get_plot(
+        (experiment_id, "result_per_step"), version,
+        lambda: lAss.get_plot_args_result_per_step(experiment_id))
+    if png is None:
+        _logger.debug("No plot available yet for %s.", experiment_id)
+        return app.response_class("Plot is being rendered.", status=503,
+                                  mimetype="text/plain")
+    response = app.response_class(png, mimetype="image/png")
+    response.set_etag(hashlib.md5(repr((experiment_id, plot_version))
+                                  ).hexdigest())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>"
                           "/get_next_candidate", methods=["GET"])
 @exception_handler
@@ -276,6 +468,7 @@ def client_get_next_candidate(experiment_id):
 
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>"
                           "/get_best_candidate", methods=["GET"])
+@cached_view(_experiment_versions)
 @exception_handler
 def client_get_best_candidate(experiment_id):
     """
@@ -349,24 +542,81 @@ def client_update(experiment_id):
             reschedule the candidate to other workers if necessary.
             "pausing": Signals that this candidate has paused the execution,
             meaning that we are allowed to reschedule it to another worker.
+        "intermediate_results" : list of [step, value] lists, optional
+            Intermediate results of the evaluation, for example one per
+            training epoch. Steps already reported are ignored, so the whole
+            series may be sent with every update.
 
     Returns
     -------
     result : string
-        Returns "success" iff successful, "failed" otherwise.
+        Returns "stop" if the candidate is working and its evaluation should
+        be stopped early, "success" iff otherwise successful, "failed"
+        otherwise.
     """
     _logger.debug("Updating client. request is %s, json %s", request,
                   request.json)
     data_received = request.get_json()
     status = data_received["status"]
     candidate = from_dict(data_received["candidate"])
-    lAss.update(experiment_id, status=status, candidate=candidate)
+    stop = lAss.update(experiment_id, status=status, candidate=candidate,
+                       intermediate_results=data_received.get(
+                           "intermediate_results", None))
     _logger.debug("Updated lAss.")
+    if stop:
+        return "stop"
     return "success"
 
 
+@app.route(CONTEXT_ROOT + "/admin/experiments/<experiment_id>/profiling",
+           methods=["GET"])
+@exception_handler
+def admin_get_profiling(experiment_id):
+    """
+    Returns the profiling state of an experiment.
+
+    Returns
+    -------
+    result : dict or "failed"
+        A dict with the keys profiler, params and slowest_calls. See
+        ExperimentAssistant.get_profiling.
+    """
+    return lAss.get_profiling(experiment_id)
+
+
+@app.route(CONTEXT_ROOT + "/admin/experiments/<experiment_id>/profiling",
+           methods=["POST"])
+@exception_handler
+def admin_set_profiling(experiment_id):
+    """
+    Enables, replaces or disables profiling of an experiment.
+
+    Parameters
+    ----------
+    json : json dict
+        "profiler" : string or None
+            The profiler, one of profiling.AVAILABLE_PROFILERS. If None or
+            missing, profiling is disabled.
+        "profiler_params" : dict, optional
+            The parameters of the profiler, for example
+            {"slowest": 5, "min_duration": 0.1}.
+
+    Returns
+    -------
+    result : dict or "failed"
+        The new profiling state, see admin_get_profiling.
+    """
+    data_received = request.get_json() or {}
+    _logger.info("Setting profiling of %s to %s", experiment_id,
+                 data_received)
+    lAss.set_profiling(experiment_id, data_received.get("profiler", None),
+                       data_received.get("profiler_params", None))
+    return lAss.get_profiling(experiment_id)
+
+
 @app.route(CONTEXT_ROOT + "/c/experiments/<experiment_id>/candidates",
            methods=["GET"])
+@cached_view(_experiment_versions)
 @exception_handler
 def client_get_all_candidates(experiment_id):
     """
@@ -377,6 +627,10 @@ def client_get_all_candidates(experiment_id):
     exp_id : string
         The id of the experiment to return.
 
+    The optional query arguments since and limit restrict the result to the
+    candidates changed after update sequence number since, and to at most
+    limit candidates.
+
     Returns
     -------
     candidates : dict of lists
@@ -390,15 +644,22 @@ def client_get_all_candidates(experiment_id):
         working.
         "pending": The list of not-yet finished candidates on which no
         worker is currently working.
+        If since or limit have been given, it also contains "cursor", the
+        value to use as since for the next request, and "has_more".
         May return None or "failed" if failed.
     """
     _logger.debug("Ready to return all candidates for %s", experiment_id)
-    candidates = lAss.get_candidates(experiment_id)
+    since = request.args.get("since", None, type=int)
+    limit = request.args.get("limit", None, type=int)
+    candidates = lAss.get_candidates(experiment_id, since=since, limit=limit)
     result = {}
     for r in ["finished", "working", "pending"]:
         result[r] = []
         for i, x in enumerate(candidates[r]):
             result[r].append(x.to_dict())
+    for k in ["cursor", "has_more"]:
+        if k in candidates:
+            result[k] = candidates[k]
     _logger.debug("Returning all candidates %s", result)
     return result
 
@@ -1,20 +1,27 @@
 __author__ = 'Frederik Diehl'
 
-# Fix for TclError: no display name and no $DISPLAY environment variable
-import matplotlib
-matplotlib.use('Agg')
-
-
+# Fix for TclError: no display name and no $DISPLAY environment variable.
+# The backend is selected by REST_interface without importing matplotlib.
 import REST_interface
 import argparse
 
 
-def start_rest(save_path, port=5000, fail_deadly=False):
+def start_rest(save_path, port=5000, fail_deadly=False, plot_processes=1,
+               threaded=False, shard_index=None, num_shards=None,
+               collect_metrics=True):
     print("Initialized apsis on port %s" %port)
     print("Save_path is set to %s" %save_path)
     print("Fail_deadly is %s" %fail_deadly)
+    print("Threaded is %s" %threaded)
+    if shard_index is not None:
+        print("Running as shard %s of %s" %(shard_index, num_shards))
     REST_interface.start_apsis(save_path, port,
-                               fail_deadly=fail_deadly)
+                               fail_deadly=fail_deadly,
+                               plot_processes=plot_processes,
+                               threaded=threaded,
+                               shard_index=shard_index,
+                               num_shards=num_shards,
+                               collect_metrics=collect_metrics)
 
 
 if __name__ == "__main__":
@@ -26,6 +33,25 @@ if __name__ == "__main__":
                                               "instead of catching them. "
                                               "Warning! Dangerous. Do not use "
                                               "unless you know what you do.")
+    parser.add_argument("--plot_processes", help="Number of processes "
+                                                 "rendering the plots of the "
+                                                 "web interface. Default is "
+                                                 "1. If 0, plots are rendered "
+                                                 "in the request itself.")
+    parser.add_argument("--threaded", help="Handles each request in its own "
+                                           "thread instead of using tornado.",
+                        action="store_true")
+    parser.add_argument("--shard_index", help="Index of this server if the "
+                                              "experiments are sharded "
+                                              "across several servers. "
+                                              "Requires --num_shards.")
+    parser.add_argument("--num_shards", help="Total number of servers the "
+                                             "experiments are sharded "
+                                             "across. All shards can use the "
+                                             "same save_path.")
+    parser.add_argument("--no_metrics", help="Does not record the metrics "
+                                             "served on /metrics.",
+                        action="store_true")
     args = parser.parse_args()
     print(args)
     port = 5000
@@ -38,4 +64,14 @@ if __name__ == "__main__":
     save_path = args.save_path
     if args.fail_deadly:
         fail_deadly = True
-    start_rest(save_path, port, fail_deadly)
+    plot_processes = 1
+    if args.plot_processes:
+        plot_processes = int(args.plot_processes)
+    shard_index = None
+    num_shards = None
+    if args.shard_index is not None:
+        shard_index = int(args.shard_index)
+    if args.num_shards is not None:
+        num_shards = int(args.num_shards)
+    start_rest(save_path, port, fail_deadly, plot_processes, args.threaded,
+               shard_index, num_shards, not args.no_metrics)
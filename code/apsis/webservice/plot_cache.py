@@ -0,0 +1,150 @@
+__author__ = 'Frederik Diehl'
+
+import multiprocessing
+import signal
+import threading
+from apsis.utilities.logging_utils import get_logger
+
+
+def _init_worker():
+    """
+    Initializes a plot worker process.
+
+    The worker ignores SIGINT; shutting down is handled by the main process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _render(plot_args):
+    """
+    Renders plot_args to png. Called in the worker processes.
+
+    plot_utils is imported here, so that matplotlib is only loaded once the
+    first plot is rendered.
+    """
+    from apsis.utilities.plot_utils import render_plot_png
+    return render_plot_png(**plot_args)
+
+
+class PlotCache(object):
+    """
+    Caches rendered plots and renders new ones in the background.
+
+    Each plot is identified by a key and a version. If the cached plot for a
+    key is of an older version than the requested one, a new plot is
+    rendered in a pool of worker processes, and the old plot is returned
+    until the new one is done. At most one plot is rendered per key at the
+    same time.
+
+    Attributes
+    ----------
+    wait_first : float
+        The maximum time in seconds to wait for a plot if no older plot
+        exists for a key.
+    """
+    wait_first = None
+
+    _pool = None
+    _plots = None
+    _rendering = None
+    _lock = None
+    _logger = None
+
+    def __init__(self, processes=1, wait_first=10):
+        """
+        Initializes the plot cache.
+
+        Since this forks the worker processes, it should be created before
+        any threads are started.
+
+        Parameters
+        ----------
+        processes : int, optional
+            The number of worker processes. If 0, plots are rendered
+            synchronously in the calling thread. Default is 1.
+        wait_first : float, optional
+            The maximum time in seconds to wait for a plot if no older plot
+            exists for a key. Default is 10.
+        """
+        self._logger = get_logger(self)
+        self._logger.debug("Initializing plot cache with %s processes.",
+                           processes)
+        if processes > 0:
+            self._pool = multiprocessing.Pool(processes,
+                                              initializer=_init_worker)
+        self.wait_first = wait_first
+        self._plots = {}
+        self._rendering = {}
+        self._lock = threading.Lock()
+
+    def get_plot(self, key, version, get_plot_args):
+        """
+        Returns the newest plot for key.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the plot, for example the exp_id and plot type.
+        version : hashable
+            The current version of the data the plot is made from.
+        get_plot_args : callable
+            Returns the keyword arguments for plot_utils.render_plot_png.
+            Only called if a new plot has to be rendered.
+
+        Returns
+        -------
+        png : string or None
+            The newest available png for key. May be of an older version if
+            the current one is still rendering. None if no plot is available.
+        plot_version : hashable or None
+            The version of the returned plot.
+        """
+        with self._lock:
+            self._collect(key)
+            plot = self._plots.get(key, None)
+            if plot is not None and plot[0] == version:
+                return plot[1], plot[0]
+            if key not in self._rendering:
+                self._logger.debug("Rendering plot %s for version %s",
+                                   key, version)
+                plot_args = get_plot_args()
+                if self._pool is None:
+                    self._plots[key] = (version, _render(plot_args))
+                    return self._plots[key][1], version
+                self._rendering[key] = (
+                    version, self._pool.apply_async(_render, (plot_args,)))
+            rendering = self._rendering[key][1]
+
+        if plot is None:
+            rendering.wait(self.wait_first)
+            with self._lock:
+                self._collect(key)
+                plot = self._plots.get(key, None)
+        if plot is None:
+            return None, None
+        return plot[1], plot[0]
+
+    def _collect(self, key):
+        """
+        Moves a finished rendering for key to the plots. Requires the lock.
+        """
+        if key not in self._rendering:
+            return
+        version, rendering = self._rendering[key]
+        if not rendering.ready():
+            return
+        del self._rendering[key]
+        try:
+            self._plots[key] = (version, rendering.get())
+        except Exception as e:
+            self._logger.exception("Rendering plot %s for version %s failed. "
+                                   "Exception is %s", key, version, e)
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        self._logger.debug("Closing plot cache.")
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
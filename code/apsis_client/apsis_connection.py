@@ -2,6 +2,8 @@ __author__ = 'Frederik Diehl'
 
 import requests
 import time
+import copy
+import urllib
 
 
 class Connection(object):
@@ -41,6 +43,8 @@ class Connection(object):
     server_address = None
     repeat_time = None
 
+    _etag_cache = None
+
     def __init__(self, server_address, repeat_time=1):
         """
         Initializes the apsis connection.
@@ -57,6 +61,7 @@ class Connection(object):
         """
         self.server_address = server_address
         self.repeat_time = repeat_time
+        self._etag_cache = {}
 
     def _request(self, request, url, json=None, blocking=True, timeout=None):
         """
@@ -69,6 +74,11 @@ class Connection(object):
         Otherwise, or if the connection was successful, the json "result" field
         is returned.
 
+        For GET requests, the ETag of each answer is remembered. Later
+        requests to the same url send it along, and if the server answers
+        that nothing has changed, the previous result is returned without
+        transferring it again.
+
         Parameters
         ----------
         request : requests.request
@@ -91,15 +101,30 @@ class Connection(object):
         """
         start_time = time.time()
         while timeout is None or timeout <= 0 or time.time()-start_time < timeout:
+            headers = {}
+            cached = None
+            if request is requests.get:
+                cached = self._etag_cache.get(url, None)
+                if cached is not None:
+                    headers["If-None-Match"] = '"%s"' %cached[0]
             if json is None:
-                r = request(url=url, timeout=timeout)
+                r = request(url=url, timeout=timeout, headers=headers)
+            else:
+                r = request(url=url, json=json, timeout=timeout,
+                            headers=headers)
+            if r.status_code == 304 and cached is not None:
+                result = copy.deepcopy(cached[1])
             else:
-                r = request(url=url, json=json, timeout=timeout)
+                result = r.json()["result"]
+                etag = r.headers.get("ETag", None)
+                if request is requests.get and etag is not None:
+                    self._etag_cache[url] = (etag.strip('"'),
+                                             copy.deepcopy(result))
             if blocking:
-                if r.json()["result"] is None or r.json()["result"] == "failed":
+                if result is None or result == "failed":
                     time.sleep(self.repeat_time)
                     continue
-            return r.json()["result"]
+            return result
 
     def init_experiment(self, name, optimizer, param_defs, optimizer_arguments=None,
                         exp_id=None, notes=None, minimization=True, blocking=False,
@@ -242,7 +267,8 @@ class Connection(object):
         url = self.server_address + "/c/experiments/%s/get_next_candidate" %exp_id
         return self._request(requests.get, url=url, blocking=blocking, timeout=timeout)
 
-    def update(self, exp_id, candidate, status="finished", blocking=True, timeout=None):
+    def update(self, exp_id, candidate, status="finished", blocking=True,
+               timeout=None, intermediate_results=None):
         """
         Updates the result of the candidate.
 
@@ -292,17 +318,27 @@ class Connection(object):
             The maximum time to retry the connection. If it is <= 0 or None, this
             is interpreted as a an infinitely long wait.
              Default is None.
+        intermediate_results : list of (step, value) tuples, optional
+            Intermediate results of the evaluation, for example the
+            validation error after each epoch. Steps already reported are
+            ignored, so the whole series may be sent with every update.
 
         Returns
         -------
         result : string
-            Returns "success" iff successful, "failed" otherwise.
+            Returns "stop" if status is "working" and the evaluation should be
+            stopped early, "success" iff otherwise successful, "failed"
+            otherwise. After "stop", the candidate should be updated as
+            finished with its current result.
         """
         url = self.server_address + "/c/experiments/%s/update" %exp_id
         msg = {
             "status": status,
             "candidate": candidate
         }
+        if intermediate_results is not None:
+            msg["intermediate_results"] = [list(r) for r in
+                                           intermediate_results]
         return self._request(requests.post, url, json=msg, blocking=blocking,
                             timeout=timeout)
 
@@ -335,7 +371,8 @@ class Connection(object):
         url = self.server_address + "/c/experiments/%s/get_best_candidate" %exp_id
         return self._request(requests.get, url, blocking=blocking, timeout=timeout)
 
-    def get_all_candidates(self, exp_id, blocking=True, timeout=None):
+    def get_all_candidates(self, exp_id, blocking=True, timeout=None,
+                           since=None, limit=None):
         """
         Returns the candidates for an experiment.
 
@@ -352,6 +389,14 @@ class Connection(object):
             The maximum time to retry the connection. If it is <= 0 or None, this
             is interpreted as a an infinitely long wait.
              Default is None.
+        since : int, optional
+            If given, only candidates changed after this update sequence
+            number are returned. Use the cursor returned by a previous call
+            to only fetch what has changed since.
+        limit : int, optional
+            If given, at most limit candidates are returned. If more have
+            changed, has_more is True and the next page can be fetched by
+            using the returned cursor as since.
 
         Returns
         -------
@@ -366,8 +411,17 @@ class Connection(object):
             working.
             "pending": The list of not-yet finished candidates on which no
             worker is currently working.
+            If since or limit are given, the dictionary additionally contains
+            "cursor" and "has_more".
             If blocking is True and timeout > 0, this may return None or
             "Failed".
         """
         url = self.server_address + "/c/experiments/%s/candidates" %exp_id
+        params = {}
+        if since is not None:
+            params["since"] = since
+        if limit is not None:
+            params["limit"] = limit
+        if params:
+            url += "?" + urllib.urlencode(params)
         return self._request(requests.get, url, blocking=blocking, timeout=timeout)
\ No newline at end of file
@@ -0,0 +1,200 @@
+__author__ = 'Frederik Diehl'
+
+import bisect
+import hashlib
+import uuid
+from apsis_client.apsis_connection import Connection
+
+
+class ConsistentHashRing(object):
+    """
+    A consistent hash ring mapping keys (usually exp_ids) to nodes.
+
+    Each node is placed on the ring several times (its replicas). A key
+    belongs to the first node following the key's hash on the ring. Adding or
+    removing a node therefore only moves the keys of that node.
+
+    This only depends on the standard library, so that the apsis server and
+    apsis_client compute exactly the same mapping.
+
+    Attributes
+    ----------
+    nodes : list
+        The nodes of this ring.
+    replicas : int
+        The number of points on the ring per node.
+    """
+    nodes = None
+    replicas = None
+
+    _hashes = None
+    _hash_nodes = None
+
+    def __init__(self, nodes, replicas=100):
+        """
+        Initializes the ring.
+
+        Parameters
+        ----------
+        nodes : list
+            The nodes. Their string representations are used for hashing and
+            must be unique.
+        replicas : int, optional
+            The number of points on the ring per node. More points distribute
+            the keys more evenly. Default is 100.
+
+        Raises
+        ------
+        ValueError :
+            Iff nodes is empty or replicas is smaller than 1.
+        """
+        nodes = list(nodes)
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node.")
+        if replicas < 1:
+            raise ValueError("replicas has to be at least 1, is %s."
+                             %replicas)
+        self.nodes = nodes
+        self.replicas = replicas
+        points = []
+        for node in nodes:
+            for i in range(replicas):
+                points.append((self._hash("%s-%i" %(node, i)), node))
+        points.sort(key=lambda p: p[0])
+        self._hashes = [p[0] for p in points]
+        self._hash_nodes = [p[1] for p in points]
+
+    def get_node(self, key):
+        """
+        Returns the node owning key.
+
+        Parameters
+        ----------
+        key : string
+            The key, for example an exp_id.
+
+        Returns
+        -------
+        node :
+            The node owning key.
+        """
+        i = bisect.bisect(self._hashes, self._hash(key))
+        if i == len(self._hashes):
+            i = 0
+        return self._hash_nodes[i]
+
+    def _hash(self, key):
+        """
+        Hashes key to an integer.
+        """
+        return int(hashlib.md5(str(key).encode("utf-8")).hexdigest(), 16)
+
+
+class ShardedConnection(object):
+    """
+    A connection to several apsis servers sharing the experiments.
+
+    Each experiment is owned by exactly one of the servers (shards), as
+    determined by consistent hashing of its exp_id. All functions are sent to
+    the owning shard, and otherwise behave like the functions of Connection.
+    The servers have to be started with the same number of shards, with the
+    shard index corresponding to their position in server_addresses.
+
+    Attributes
+    ----------
+    server_addresses : list of strings
+        The addresses (including port) of the shards, in order of their shard
+        index.
+    """
+    server_addresses = None
+
+    _connections = None
+    _ring = None
+
+    def __init__(self, server_addresses, repeat_time=1):
+        """
+        Initializes the sharded connection.
+
+        Parameters
+        ----------
+        server_addresses : list of strings
+            The addresses (including port) of the shards, in order of their
+            shard index.
+        repeat_time : float, optional
+            The minimum time in seconds between repeat attempts to retry a
+            failed request. See Connection.
+        """
+        self.server_addresses = list(server_addresses)
+        self._connections = [Connection(a, repeat_time=repeat_time)
+                             for a in self.server_addresses]
+        self._ring = ConsistentHashRing(range(len(self._connections)))
+
+    def get_connection(self, exp_id):
+        """
+        Returns the Connection to the shard owning exp_id.
+        """
+        return self._connections[self._ring.get_node(exp_id)]
+
+    def init_experiment(self, name, optimizer, param_defs,
+                        optimizer_arguments=None, exp_id=None, notes=None,
+                        minimization=True, blocking=False, timeout=None):
+        """
+        Initializes an experiment on the owning shard.
+
+        If exp_id is None, a new one is generated here, since it determines
+        the shard. See Connection.init_experiment for the parameters.
+        """
+        if exp_id is None:
+            exp_id = uuid.uuid4().hex
+        return self.get_connection(exp_id).init_experiment(
+            name, optimizer, param_defs,
+            optimizer_arguments=optimizer_arguments, exp_id=exp_id,
+            notes=notes, minimization=minimization, blocking=blocking,
+            timeout=timeout)
+
+    def get_all_experiment_ids(self, blocking=True, timeout=None):
+        """
+        Returns the ids of the experiments of all shards.
+
+        See Connection.get_all_experiment_ids.
+        """
+        exp_ids = []
+        for c in self._connections:
+            shard_ids = c.get_all_experiment_ids(blocking=blocking,
+                                                 timeout=timeout)
+            if shard_ids is None or shard_ids == "failed":
+                return shard_ids
+            exp_ids.extend(shard_ids)
+        return exp_ids
+
+    def get_next_candidate(self, exp_id, blocking=True, timeout=None):
+        """
+        See Connection.get_next_candidate.
+        """
+        return self.get_connection(exp_id).get_next_candidate(
+            exp_id, blocking=blocking, timeout=timeout)
+
+    def update(self, exp_id, candidate, status="finished", blocking=True,
+               timeout=None, intermediate_results=None):
+        """
+        See Connection.update.
+        """
+        return self.get_connection(exp_id).update(
+            exp_id, candidate, status=status, blocking=blocking,
+            timeout=timeout, intermediate_results=intermediate_results)
+
+    def get_best_candidate(self, exp_id, blocking=True, timeout=None):
+        """
+        See Connection.get_best_candidate.
+        """
+        return self.get_connection(exp_id).get_best_candidate(
+            exp_id, blocking=blocking, timeout=timeout)
+
+    def get_all_candidates(self, exp_id, blocking=True, timeout=None,
+                           since=None, limit=None):
+        """
+        See Connection.get_all_candidates.
+        """
+        return self.get_connection(exp_id).get_all_candidates(
+            exp_id, since=since, limit=limit, blocking=blocking,
+            timeout=timeout)